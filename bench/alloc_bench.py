@@ -0,0 +1,199 @@
+"""
+Heap bytes allocated per call by the components of the flight loop: ibus.IBus.read() (on a fake UART that hands over one frame per read), the toolkit codecs, toolkit.TelemetryWriter.add(), the float and fixed point control paths and blackbox.Blackbox.record().
+Meant for the MicroPython unix port (micropython bench/alloc_bench.py), where every call is counted exactly: the automatic collector is turned off and the allocation counter (micropython.mem_total(), or gc.mem_alloc()) is read before and after. tools/allocations.py runs it with --micropython and checks the results against its baseline.
+On a regular computer there is no allocation counter: it only reports that (tools/allocations.py measures the same components there).
+"""
+
+import sys
+import gc
+import array
+
+# make src/ importable
+try:
+    here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+except NameError:
+    here = "."
+sys.path.append(here + "/../src")
+
+CALLS = 1000
+
+# the allocation counter: only ever goes up while the collector is off
+try:
+    import micropython
+    allocated = micropython.mem_total
+except (ImportError, AttributeError):
+    allocated = getattr(gc, "mem_alloc", None)
+
+class FakeUART:
+    """Stands in for machine.UART (the unix port has none): every any()/readinto() pair hands over the next frame of a repeating iBUS stream, without allocating."""
+
+    def __init__(self, id, baudrate = 115200):
+        frame = bytearray(32)
+        frame[0] = 0x20
+        frame[1] = 0x40
+        for c in range(14):
+            v = 1000 + (c * 70)
+            frame[2 + (c * 2)] = v & 0xFF
+            frame[3 + (c * 2)] = v >> 8
+        checksum = 0xFFFF
+        for i in range(30):
+            checksum = checksum - frame[i]
+        frame[30] = checksum & 0xFF
+        frame[31] = checksum >> 8
+        self.frame = frame
+        self.pos = 0 # next byte of the frame to hand over
+        self.waiting = 0 # bytes "received" and not read yet
+
+    def any(self):
+        if self.waiting == 0:
+            self.waiting = 32
+        return self.waiting
+
+    def readinto(self, buf, nbytes):
+        n = min(nbytes, self.waiting)
+        frame = self.frame
+        pos = self.pos
+        i = 0
+        while i < n:
+            buf[i] = frame[pos]
+            pos = (pos + 1) & 31
+            i += 1
+        self.pos = pos
+        self.waiting = self.waiting - n
+        return n
+
+class machine:
+    UART = FakeUART
+sys.modules["machine"] = machine
+
+import ibus
+import toolkit
+import mpu6050
+import pid
+import mixer
+import fixedpoint
+import blackbox
+
+def measure(call, calls):
+    """Bytes allocated per call(), with the collector off."""
+    for i in range(10): # first calls (caches, lazily created buffers) are not what the flight loop sees
+        call()
+    gc.collect()
+    gc.disable()
+    before = allocated()
+    for i in range(calls):
+        call()
+    used = allocated() - before
+    gc.enable()
+    return used / calls
+
+def make_parts():
+    imu = mpu6050.MPU6050(None, gyro_flip = (-1, 1, -1))
+    imu.gyro_range = 1
+    imu.set_gyro_bias(0.5, -1.0, 0.25)
+    pids = pid.PIDBank(250.0, 150.0)
+    pids.set_gains(pid.ROLL, 0.00043714285, 0.00255, 0.00002571429)
+    pids.set_gains(pid.PITCH, 0.00043714285, 0.00255, 0.00002571429)
+    pids.set_gains(pid.YAW, 0.001714287, 0.003428571, 0.0)
+    motor_mixer = mixer.Mixer("quad-x")
+    return (imu, pids, motor_mixer)
+
+def case_ibus_read():
+    rc = ibus.IBus(1)
+    return rc.read
+
+def case_codec(name):
+    buf = bytearray(64)
+    if name == "control":
+        c = toolkit.ControlCommand()
+        c.frame, c.throttle, c.roll, c.pitch, c.yaw = 1234567, 0.5, -0.25, 0.125, 0.75
+        d = toolkit.ControlCommand()
+        def call():
+            c.pack_into(buf, 0)
+            d.unpack_from(buf, 0)
+    elif name == "pid":
+        c = toolkit.PIDCommand()
+        c.axis, c.kp, c.ki, c.kd = 1, 0.00043714285, 0.00255, 0.00002571429
+        d = toolkit.PIDCommand()
+        def call():
+            c.pack_into(buf, 0)
+            d.unpack_from(buf, 0)
+    else:
+        c = toolkit.TelemetryFrame()
+        d = toolkit.TelemetryFrame()
+        imu_data = [0.01, -0.02, 0.98, 25.0, 1.5, -2.5, 0.25]
+        angles = [1.25, -0.5, 0.0]
+        def call():
+            c.fill(1234567, imu_data, angles)
+            c.pack_into(buf, 0)
+            d.unpack_from(buf, 0)
+    return call
+
+def case_telemetry_writer(path):
+    writer = toolkit.TelemetryWriter(toolkit.telemetry_fields(4), 250.0, path, 8192) # a block is written to flash now and then, as in flight
+    values = [0.01, -0.02, 0.98, 1.5, -2.5, 0.25, 1.25, -0.5, 1200.0, 1210.0, 1190.0, 1205.0]
+    t = array.array("i", [0])
+    def call():
+        t[0] = t[0] + 4000
+        writer.add(t[0], values)
+    return (call, writer)
+
+def case_control_float():
+    imu, pids, motor_mixer = make_parts()
+    buf = bytearray(14)
+    buf[8] = 0x03
+    buf[11] = 0x80
+    decode = mpu6050._decode
+    gain = imu._gain
+    offset = imu._offset
+    data = imu.data
+    update = pids.update
+    output = pids.output
+    mix = motor_mixer.mix
+    def call():
+        decode(buf, gain, offset, data)
+        update(10.0 - data[4], -5.0 - data[5], 2.5 - data[6])
+        mix(0.3, output[0], output[1], output[2])
+    return call
+
+def case_control_fixed():
+    imu, pids, motor_mixer = make_parts()
+    import sticks
+    controller = fixedpoint.FixedController(imu, pids, motor_mixer, sticks.StickMap(30.0, 30.0, 50.0), 0.14, 0.08)
+    controller.sticks([1, 1550, 1480, 1400, 1520, 2000, 1000])
+    imu.buf[8] = 0x03
+    imu.buf[11] = 0x80
+    return controller.step
+
+def case_blackbox_record(path):
+    imu, pids, motor_mixer = make_parts()
+    box = blackbox.Blackbox(pids, motor_mixer, 250.0, path = path)
+    t = array.array("i", [0])
+    def call():
+        t[0] = t[0] + 4000
+        box.record(t[0], 812, 1.5, -2.5, 0.25, 10.0, -5.0, 2.5, 0.3)
+    return call
+
+def main():
+    print("Heap bytes allocated per call (" + sys.implementation.name + ")")
+    if allocated is None:
+        print("No allocation counter on this interpreter: run it on the MicroPython unix port (micropython bench/alloc_bench.py).")
+        return
+    path = "alloc_bench.tmp"
+    calls = [("ibus_read", case_ibus_read()), ("codec_control", case_codec("control")), ("codec_pid", case_codec("pid")), ("codec_telemetry", case_codec("telemetry"))]
+    call, writer = case_telemetry_writer(path)
+    calls.append(("telemetry_writer", call))
+    calls.append(("control_float", case_control_float()))
+    calls.append(("control_fixed", case_control_fixed()))
+    calls.append(("blackbox_record", case_blackbox_record(path)))
+    for name, call in calls:
+        print(name + ": " + str(measure(call, CALLS)) + " bytes per call (" + str(CALLS) + " calls)")
+    writer.close()
+    try:
+        import os
+        os.remove(path)
+    except (ImportError, OSError):
+        pass
+
+if __name__ == "__main__":
+    main()
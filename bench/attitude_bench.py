@@ -0,0 +1,65 @@
+"""
+Per-cycle cost of the attitude estimator (attitude.AttitudeEstimator): update() alone (rate mode), and update() + euler() (angle mode, which needs the angles every cycle), against the cycle budget.
+Runs on a regular computer (python bench/attitude_bench.py) and on the MicroPython unix port (micropython bench/attitude_bench.py). On MicroPython, update() runs as native code.
+"""
+
+import sys
+import time
+import math
+
+# make src/ importable
+try:
+    here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+except NameError:
+    here = "."
+sys.path.append(here + "/../src")
+import attitude
+
+CYCLES = 20000
+
+if hasattr(time, "ticks_us"):
+    def now_us():
+        return time.ticks_us()
+    def elapsed_us(began):
+        return time.ticks_diff(time.ticks_us(), began)
+else:
+    def now_us():
+        return time.perf_counter()
+    def elapsed_us(began):
+        return (time.perf_counter() - began) * 1000000.0
+
+def make_samples(n):
+    """A repeatable set of (gyro x, y, z (deg/s), accel x, y, z (g)) readings: gentle rotation, with the accelerometer near 1 g (so every update also does the accelerometer correction)."""
+    ToReturn = []
+    for i in range(n):
+        roll = 0.3 * math.sin(i * 0.003)
+        pitch = 0.2 * math.sin(i * 0.002)
+        ToReturn.append((20.0 * math.sin(i * 0.01), 15.0 * math.sin(i * 0.013), 30.0 * math.sin(i * 0.007), math.sin(pitch), -math.sin(roll) * math.cos(pitch), -math.cos(roll) * math.cos(pitch)))
+    return ToReturn
+
+def bench(samples, cycle_hz, angles):
+    estimator = attitude.AttitudeEstimator(cycle_hz, 0.25, 0.01)
+    update = estimator.update
+    euler = estimator.euler
+    began = now_us()
+    if angles:
+        for s in samples:
+            update(s[0], s[1], s[2], s[3], s[4], s[5])
+            euler()
+    else:
+        for s in samples:
+            update(s[0], s[1], s[2], s[3], s[4], s[5])
+    return elapsed_us(began)
+
+def main():
+    samples = make_samples(CYCLES)
+    print("Attitude estimator cost per cycle (" + str(CYCLES) + " cycles, " + sys.implementation.name + ")")
+    print("rate (hz) | budget (us) | update (us) | update + euler (us) | update % of budget | update + euler % of budget")
+    for hz in (250, 500, 1000):
+        budget = 1000000.0 / hz
+        per_update = bench(samples, hz, False) / CYCLES
+        per_both = bench(samples, hz, True) / CYCLES
+        print(str(hz) + " | " + str(round(budget, 1)) + " | " + str(round(per_update, 3)) + " | " + str(round(per_both, 3)) + " | " + str(round(100.0 * per_update / budget, 3)) + "% | " + str(round(100.0 * per_both / budget, 3)) + "%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Frames per second of the toolkit codecs (ControlCommand, PIDCommand, TelemetryFrame): the original byte-at-a-time implementation vs the struct based one in toolkit.py.
+Runs on a regular computer (python bench/codec_bench.py) and on the MicroPython unix port (micropython bench/codec_bench.py).
+"""
+
+import sys
+import time
+import struct
+import math
+
+# make src/ importable
+try:
+    here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+except NameError:
+    here = "."
+sys.path.append(here + "/../src")
+import toolkit
+
+FRAMES = 2000 # per single-object test
+BATCH = 500 # telemetry frames per encode_frames/decode_frames call
+BATCHES = 10
+
+if hasattr(time, "ticks_us"):
+    def now_us():
+        return time.ticks_us()
+    def elapsed_us(began):
+        return time.ticks_diff(time.ticks_us(), began)
+else:
+    def now_us():
+        return time.perf_counter()
+    def elapsed_us(began):
+        return (time.perf_counter() - began) * 1000000.0
+
+
+##### the original implementation (as it was in toolkit.py) #####
+# the only change: int.to_bytes/from_bytes take the byte order positionally ("big"), so it runs on every platform the same way.
+
+def float_to_bytes(f):
+    return struct.pack("f", f)
+
+def bytes_to_float(bs):
+    return struct.unpack("f", bs)[0]
+
+class OldControlCommand:
+
+    def __init__(self):
+        self.frame = 0
+        self.throttle = 0.0
+        self.roll = 0.0
+        self.pitch = 0.0
+        self.yaw = 0.0
+        self.checksum = 0.0
+
+    def calculate_checksum(self):
+        ToReturn = 0.0
+        ToReturn = ToReturn + float(self.frame)
+        ToReturn = ToReturn + self.throttle
+        ToReturn = ToReturn + self.roll
+        ToReturn = ToReturn + self.pitch
+        ToReturn = ToReturn + self.yaw
+        return ToReturn
+
+    def encode(self):
+        ToReturn = bytearray()
+        frame_bytes = self.frame.to_bytes(4, "big")
+        for b in frame_bytes:
+            ToReturn.append(b)
+        ToReturn.extend(float_to_bytes(self.throttle))
+        ToReturn.extend(float_to_bytes(self.roll))
+        ToReturn.extend(float_to_bytes(self.pitch))
+        ToReturn.extend(float_to_bytes(self.yaw))
+        ToReturn.extend(float_to_bytes(self.calculate_checksum()))
+        return bytes(ToReturn)
+
+    def decode(self, bs):
+        self.frame = int.from_bytes(bs[0:4], "big")
+        self.throttle = bytes_to_float(bs[4:8])
+        self.roll = bytes_to_float(bs[8:12])
+        self.pitch = bytes_to_float(bs[12:16])
+        self.yaw = bytes_to_float(bs[16:20])
+        self.checksum = bytes_to_float(bs[20:24])
+
+class OldPIDCommand:
+
+    def __init__(self):
+        self.axis = 0
+        self.kp = 0.0
+        self.ki = 0.0
+        self.kd = 0.0
+
+    def encode(self):
+        ToReturn = bytearray()
+        ToReturn.append(self.axis)
+        ToReturn.extend(float_to_bytes(self.kp))
+        ToReturn.extend(float_to_bytes(self.ki))
+        ToReturn.extend(float_to_bytes(self.kd))
+        return bytes(ToReturn)
+
+    def decode(self, bs):
+        self.axis = bs[0]
+        self.kp = bytes_to_float(bs[1:5])
+        self.ki = bytes_to_float(bs[5:9])
+        self.kd = bytes_to_float(bs[9:13])
+
+class OldTelemetryFrame:
+
+    def __init__(self):
+        self.time = 0
+        self.accel_x = 0.0
+        self.accel_y = 0.0
+        self.accel_z = 0.0
+        self.gyro_x = 0.0
+        self.gyro_y = 0.0
+        self.gyro_z = 0.0
+        self.pitch_angle = 0.0
+        self.roll_angle = 0.0
+
+    def encode(self):
+        ToReturn = bytearray()
+        for b in self.time.to_bytes(4, "big"):
+            ToReturn.append(b)
+        ToReturn.extend(float_to_bytes(self.accel_x))
+        ToReturn.extend(float_to_bytes(self.accel_y))
+        ToReturn.extend(float_to_bytes(self.accel_z))
+        ToReturn.extend(float_to_bytes(self.gyro_x))
+        ToReturn.extend(float_to_bytes(self.gyro_y))
+        ToReturn.extend(float_to_bytes(self.gyro_z))
+        ToReturn.extend(float_to_bytes(self.pitch_angle))
+        ToReturn.extend(float_to_bytes(self.roll_angle))
+        return bytes(ToReturn)
+
+    def decode(self, data):
+        if len(data) != len(self.encode()):
+            raise Exception("Unable to decode: the input data was not correct.")
+        self.time = int.from_bytes(data[0:4], "big")
+        self.accel_x = bytes_to_float(data[4:8])
+        self.accel_y = bytes_to_float(data[8:12])
+        self.accel_z = bytes_to_float(data[12:16])
+        self.gyro_x = bytes_to_float(data[16:20])
+        self.gyro_y = bytes_to_float(data[20:24])
+        self.gyro_z = bytes_to_float(data[24:28])
+        self.pitch_angle = bytes_to_float(data[28:32])
+        self.roll_angle = bytes_to_float(data[32:36])
+
+    @staticmethod
+    def encode_frames(frames):
+        ToReturn = bytearray()
+        for frame in frames:
+            for b in frame.encode():
+                ToReturn.append(b)
+        return bytes(ToReturn)
+
+    @staticmethod
+    def decode_frames(data):
+        frame_length = len(OldTelemetryFrame().encode())
+        begin = 0
+        end = frame_length
+        ToReturn = []
+        while end <= len(data):
+            tf = OldTelemetryFrame()
+            tf.decode(data[begin:end])
+            ToReturn.append(tf)
+            begin = begin + frame_length
+            end = end + frame_length
+        return ToReturn
+
+
+##### test data #####
+
+def fill_control(c, i):
+    c.frame = i
+    c.throttle = 0.5 + 0.4 * math.sin(i * 0.01)
+    c.roll = math.sin(i * 0.013)
+    c.pitch = math.cos(i * 0.017)
+    c.yaw = 0.2 * math.sin(i * 0.007)
+
+def fill_pid(c, i):
+    c.axis = i % 3
+    c.kp = 0.0004 + i * 1e-7
+    c.ki = 0.0025
+    c.kd = 0.00002
+
+def fill_telemetry(t, i):
+    t.time = i * 4
+    t.accel_x = 0.01 * math.sin(i * 0.1)
+    t.accel_y = 0.02 * math.cos(i * 0.1)
+    t.accel_z = 1.0
+    t.gyro_x = 20.0 * math.sin(i * 0.01)
+    t.gyro_y = 15.0 * math.sin(i * 0.013)
+    t.gyro_z = 30.0 * math.sin(i * 0.007)
+    t.pitch_angle = 5.0 * math.sin(i * 0.003)
+    t.roll_angle = 4.0 * math.cos(i * 0.003)
+
+def make(cls, fill, n):
+    ToReturn = []
+    for i in range(n):
+        o = cls()
+        fill(o, i)
+        ToReturn.append(o)
+    return ToReturn
+
+
+##### benchmarks #####
+
+def bench_encode(objects):
+    began = now_us()
+    for o in objects:
+        o.encode()
+    return elapsed_us(began)
+
+def bench_decode(cls, encoded):
+    o = cls()
+    began = now_us()
+    for e in encoded:
+        o.decode(e)
+    return elapsed_us(began)
+
+def bench_pack_into(objects, size):
+    buf = bytearray(size)
+    began = now_us()
+    for o in objects:
+        o.pack_into(buf, 0)
+    return elapsed_us(began)
+
+def bench_unpack_from(cls, encoded):
+    o = cls()
+    began = now_us()
+    for e in encoded:
+        o.unpack_from(e, 0)
+    return elapsed_us(began)
+
+def fps(frames, us):
+    return str(int(frames * 1000000.0 / us)) if us > 0 else "-"
+
+def report(name, frames, old_us, new_us):
+    print(name + " | " + fps(frames, old_us) + " | " + fps(frames, new_us) + " | " + str(round(old_us / new_us, 2)) + "x")
+
+def main():
+    print("Codec throughput, frames per second (" + sys.implementation.name + ")")
+    print("test | original | toolkit | speedup")
+    ok = True
+
+    for label, old_cls, new_cls, fill in (("ControlCommand", OldControlCommand, toolkit.ControlCommand, fill_control), ("PIDCommand", OldPIDCommand, toolkit.PIDCommand, fill_pid), ("TelemetryFrame", OldTelemetryFrame, toolkit.TelemetryFrame, fill_telemetry)):
+        old_objects = make(old_cls, fill, FRAMES)
+        new_objects = make(new_cls, fill, FRAMES)
+        encoded = [o.encode() for o in old_objects]
+
+        # the new codec must produce (and read back) exactly the same bytes
+        for i in range(FRAMES):
+            if new_objects[i].encode() != encoded[i]:
+                print("  MISMATCH: " + label + " " + str(i) + " encodes differently")
+                ok = False
+                break
+
+        report(label + ".encode", FRAMES, bench_encode(old_objects), bench_encode(new_objects))
+        report(label + ".decode", FRAMES, bench_decode(old_cls, encoded), bench_decode(new_cls, encoded))
+        report(label + ".pack_into (vs encode)", FRAMES, bench_encode(old_objects), bench_pack_into(new_objects, new_cls.SIZE))
+        report(label + ".unpack_from (vs decode)", FRAMES, bench_decode(old_cls, encoded), bench_unpack_from(new_cls, encoded))
+
+    # batches
+    old_frames = make(OldTelemetryFrame, fill_telemetry, BATCH)
+    new_frames = make(toolkit.TelemetryFrame, fill_telemetry, BATCH)
+    data = OldTelemetryFrame.encode_frames(old_frames)
+    if toolkit.TelemetryFrame.encode_frames(new_frames) != data:
+        print("  MISMATCH: TelemetryFrame.encode_frames")
+        ok = False
+    decoded = toolkit.TelemetryFrame.decode_frames(data)
+    if len(decoded) != BATCH or decoded[BATCH - 1].encode() != old_frames[BATCH - 1].encode():
+        print("  MISMATCH: TelemetryFrame.decode_frames")
+        ok = False
+
+    began = now_us()
+    for b in range(BATCHES):
+        OldTelemetryFrame.encode_frames(old_frames)
+    old_us = elapsed_us(began)
+    began = now_us()
+    for b in range(BATCHES):
+        toolkit.TelemetryFrame.encode_frames(new_frames)
+    new_us = elapsed_us(began)
+    report("TelemetryFrame.encode_frames", BATCH * BATCHES, old_us, new_us)
+
+    buf = bytearray(BATCH * toolkit.TelemetryFrame.SIZE)
+    began = now_us()
+    for b in range(BATCHES):
+        toolkit.TelemetryFrame.encode_frames(new_frames, buf)
+    new_us = elapsed_us(began)
+    report("TelemetryFrame.encode_frames (into a buffer)", BATCH * BATCHES, old_us, new_us)
+
+    began = now_us()
+    for b in range(BATCHES):
+        OldTelemetryFrame.decode_frames(data)
+    old_us = elapsed_us(began)
+    began = now_us()
+    for b in range(BATCHES):
+        toolkit.TelemetryFrame.decode_frames(data)
+    new_us = elapsed_us(began)
+    report("TelemetryFrame.decode_frames", BATCH * BATCHES, old_us, new_us)
+
+    reuse = []
+    began = now_us()
+    for b in range(BATCHES):
+        toolkit.TelemetryFrame.decode_frames(data, reuse)
+    new_us = elapsed_us(began)
+    report("TelemetryFrame.decode_frames (reusing frames)", BATCH * BATCHES, old_us, new_us)
+
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Gyro filtering (filters.GyroFilter and the D term low pass of pid.PIDBank): per-cycle cost against the cycle budget, and what each filter chain does to the gyro: how much it lets through and how late, at a few frequencies.
+The delay of the MPU-6050's own DLPF settings (mpu6050.GYRO_DLPF_DELAY_MS) is printed alongside, to compare a wide open DLPF plus software filters with the DLPF alone.
+Runs on a regular computer (python bench/filter_bench.py) and on the MicroPython unix port (micropython bench/filter_bench.py). On MicroPython, the filters run as native code.
+"""
+
+import sys
+import time
+import math
+import array
+
+# make src/ importable
+try:
+    here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+except NameError:
+    here = "."
+sys.path.append(here + "/../src")
+import filters
+import mpu6050
+import pid
+
+CYCLES = 20000
+
+# (name, low pass hz, low pass stages, notch hz) per chain, at the 250 hz loop rate
+CHAINS = (
+    ("none", 0.0, 1, 0.0),
+    ("lpf 80", 80.0, 1, 0.0),
+    ("lpf 80 x2", 80.0, 2, 0.0),
+    ("lpf 80 x2 + notch 110", 80.0, 2, 110.0),
+    ("lpf 50", 50.0, 1, 0.0),
+)
+
+if hasattr(time, "ticks_us"):
+    def now_us():
+        return time.ticks_us()
+    def elapsed_us(began):
+        return time.ticks_diff(time.ticks_us(), began)
+else:
+    def now_us():
+        return time.perf_counter()
+    def elapsed_us(began):
+        return (time.perf_counter() - began) * 1000000.0
+
+def make_readings(n):
+    """A repeatable set of gyro x, y, z readings (deg/s): slow maneuvering plus motor vibration."""
+    ToReturn = []
+    for i in range(n):
+        ToReturn.append((20.0 * math.sin(i * 0.01) + 3.0 * math.sin(i * 2.1), 15.0 * math.sin(i * 0.013) + 3.0 * math.sin(i * 2.3), 30.0 * math.sin(i * 0.007) + 2.0 * math.sin(i * 1.9)))
+    return ToReturn
+
+def bench_gyro(readings, cycle_hz, lpf_hz, stages, notch_hz):
+    f = filters.GyroFilter(cycle_hz, lpf_hz, stages, notch_hz)
+    apply = f.apply
+    data = array.array("f", [0.0] * 7)
+    began = now_us()
+    for r in readings:
+        data[4] = r[0]
+        data[5] = r[1]
+        data[6] = r[2]
+        apply(data)
+    return elapsed_us(began)
+
+def bench_pid(readings, cycle_hz, d_lpf_hz):
+    pids = pid.PIDBank(cycle_hz, 150.0, d_lpf_hz)
+    for axis in range(3):
+        pids.set_gains(axis, 0.0004, 0.0025, 0.00003)
+    update = pids.update
+    began = now_us()
+    for r in readings:
+        update(r[0], r[1], r[2])
+    return elapsed_us(began)
+
+def main():
+    readings = make_readings(CYCLES)
+    hz = 250.0
+    budget = 1000000.0 / hz
+    print("Gyro filter cost per cycle (" + str(CYCLES) + " cycles @ " + str(hz) + " hz, budget " + str(budget) + " us, " + sys.implementation.name + ")")
+    print("chain | biquads | cost (us) | % of budget | delay at 20 hz (ms) | gain at 20 / 60 / 110 hz")
+    for name, lpf_hz, stages, notch_hz in CHAINS:
+        f = filters.GyroFilter(hz, lpf_hz, stages, notch_hz)
+        took = bench_gyro(readings, hz, lpf_hz, stages, notch_hz) / CYCLES
+        delay = f.delay_ms(20.0) if f.stages > 0 else 0.0
+        gains = [filters.response(f.coefficients, hz, x)[0] for x in (20.0, 60.0, 110.0)]
+        print(name + " | " + str(f.stages) + " | " + str(round(took, 3)) + " | " + str(round(100.0 * took / budget, 3)) + "% | " + str(round(delay, 2)) + " | " + " / ".join([str(round(g, 3)) for g in gains]))
+
+    plain = bench_pid(readings, hz, 0.0) / CYCLES
+    filtered = bench_pid(readings, hz, 40.0) / CYCLES
+    print("PID step: " + str(round(plain, 3)) + " us, with the D term low pass at 40 hz " + str(round(filtered, 3)) + " us")
+
+    print("MPU-6050 DLPF setting | bandwidth (hz) | delay (ms)")
+    for i in range(len(mpu6050.GYRO_DLPF_DELAY_MS)):
+        print(str(i) + " | " + str(mpu6050.GYRO_DLPF_BANDWIDTH_HZ[i]) + " | " + str(mpu6050.GYRO_DLPF_DELAY_MS[i]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Per-cycle cost of the control path: the float path (decode the gyro, pid.PIDBank.update(), mixer.Mixer.mix()) against fixedpoint.FixedController.step(), which does the same from the raw gyro counts in integer arithmetic.
+Runs on a regular computer (python bench/fixedpoint_bench.py) and on the MicroPython unix port (micropython bench/fixedpoint_bench.py). Only on MicroPython does the fixed point step run as viper code (and the float path as native code); on a regular computer both are plain Python, so only the MicroPython numbers mean anything.
+"""
+
+import sys
+import time
+import math
+import array
+
+# make src/ importable
+try:
+    here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+except NameError:
+    here = "."
+sys.path.append(here + "/../src")
+import mpu6050
+import pid
+import mixer
+import sticks
+import fixedpoint
+
+CYCLES = 20000
+
+if hasattr(time, "ticks_us"):
+    def now_us():
+        return time.ticks_us()
+    def elapsed_us(began):
+        return time.ticks_diff(time.ticks_us(), began)
+else:
+    def now_us():
+        return time.perf_counter()
+    def elapsed_us(began):
+        return (time.perf_counter() - began) * 1000000.0
+
+def make_bursts(n):
+    """A repeatable set of raw 14-byte MPU-6050 bursts (only the gyro bytes are filled in): slow maneuvering plus motor vibration."""
+    ToReturn = []
+    for i in range(n):
+        buf = bytearray(14)
+        for axis in range(3):
+            v = int(65.5 * ((20.0 * math.sin(i * (0.01 + 0.003 * axis))) + (3.0 * math.sin(i * 2.1)))) & 0xFFFF
+            buf[8 + (axis * 2)] = v >> 8
+            buf[9 + (axis * 2)] = v & 0xFF
+        ToReturn.append(buf)
+    return ToReturn
+
+def make_parts():
+    imu = mpu6050.MPU6050(None, gyro_flip = (-1, 1, -1))
+    imu.gyro_range = 1
+    imu.set_gyro_bias(0.5, -1.0, 0.25)
+    pids = pid.PIDBank(250.0, 150.0)
+    pids.set_gains(pid.ROLL, 0.00043714285, 0.00255, 0.00002571429)
+    pids.set_gains(pid.PITCH, 0.00043714285, 0.00255, 0.00002571429)
+    pids.set_gains(pid.YAW, 0.001714287, 0.003428571, 0.0)
+    motor_mixer = mixer.Mixer("quad-x")
+    stick_map = sticks.StickMap(30.0, 30.0, 50.0)
+    return (imu, pids, motor_mixer, stick_map)
+
+def bench_float(bursts):
+    imu, pids, motor_mixer, stick_map = make_parts()
+    command = array.array("f", [0.0] * sticks.COMMAND_SIZE)
+    stick_map.process([1, 1550, 1480, 1400, 1520, 2000, 1000], command)
+    decode = mpu6050._decode
+    gain = imu._gain
+    offset = imu._offset
+    data = imu.data
+    update = pids.update
+    output = pids.output
+    mix = motor_mixer.mix
+    began = now_us()
+    for buf in bursts:
+        decode(buf, gain, offset, data)
+        throttle = 0.14 + (0.08 * command[0])
+        update(command[1] - data[4], command[2] - data[5], command[3] - data[6])
+        mix(throttle, output[0], output[1], output[2])
+    return elapsed_us(began)
+
+def bench_fixed(bursts):
+    imu, pids, motor_mixer, stick_map = make_parts()
+    controller = fixedpoint.FixedController(imu, pids, motor_mixer, stick_map, 0.14, 0.08)
+    controller.sticks([1, 1550, 1480, 1400, 1520, 2000, 1000])
+    step = fixedpoint._step # what controller.step() calls, on each burst in turn instead of imu.buf
+    state = controller.state
+    command = controller.command
+    duty = controller.duty
+    began = now_us()
+    for burst in bursts:
+        step(state, burst, command, duty)
+    return elapsed_us(began)
+
+def main():
+    bursts = make_bursts(CYCLES)
+    print("Control path cost per cycle (" + str(CYCLES) + " cycles, " + sys.implementation.name + ")")
+    print("float (decode + PIDBank.update + Mixer.mix): " + str(round(bench_float(bursts) / CYCLES, 3)) + " us")
+    print("fixed point (FixedController.step): " + str(round(bench_fixed(bursts) / CYCLES, 3)) + " us")
+
+if __name__ == "__main__":
+    main()
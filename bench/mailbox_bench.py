@@ -0,0 +1,110 @@
+"""
+Stress test and latency of the dual-core handoff (dualcore.Mailbox), with two free-running host threads.
+The writer publishes messages whose items all hold the message number; the reader checks every message it accepts is whole (all items equal) and never older than the one before.
+Switching between the threads is forced to be very frequent, so the reader is often interrupted in the middle of a copy, which is exactly what the sequence check has to catch.
+Runs on a regular computer only (python bench/mailbox_bench.py), as it uses the SITL's time module for ticks_us().
+"""
+
+import array
+import os
+import sys
+import tempfile
+import threading
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+import sitl
+
+MESSAGES = 50000
+SIZE = 22 # the size of a quad's blackbox state
+
+def run(mailbox_module, messages, size):
+    mb = mailbox_module.Mailbox(size)
+    done = [False]
+
+    def writer():
+        for k in range(1, messages + 1):
+            buf = mb.back()
+            for i in range(size):
+                buf[i] = k
+            mb.publish(sitl_clock.ticks_us())
+            time.sleep(0) # let the reader run, as the control core's cycle would
+        done[0] = True
+
+    dest = array.array(mb.typecode, [0] * size)
+    accepted = 0
+    torn = 0
+    out_of_order = 0
+    last = 0
+    t = threading.Thread(target = writer)
+    t.start()
+    while True:
+        if not mb.read_into(dest):
+            if done[0] and mb._ctrl[1] == mb._last_seq:
+                break
+            continue
+        accepted = accepted + 1
+        first = dest[0]
+        for i in range(1, size):
+            if dest[i] != first:
+                torn = torn + 1
+                break
+        if first < last:
+            out_of_order = out_of_order + 1
+        last = first
+    t.join()
+    return mb, accepted, torn, out_of_order
+
+def run_unchecked(messages, size, mailbox_module):
+    """The same handoff without the sequence check (copy the front buffer and keep it), to show how often a copy really is interrupted."""
+    mb = mailbox_module.Mailbox(size)
+    done = [False]
+
+    def writer():
+        for k in range(1, messages + 1):
+            buf = mb.back()
+            for i in range(size):
+                buf[i] = k
+            mb.publish(0)
+            time.sleep(0)
+        done[0] = True
+
+    dest = array.array(mb.typecode, [0] * size)
+    copies = 0
+    torn = 0
+    t = threading.Thread(target = writer)
+    t.start()
+    while not done[0]:
+        mailbox_module._copy(mb._buffers[mb._ctrl[0]], dest, size)
+        copies = copies + 1
+        for i in range(1, size):
+            if dest[i] != dest[0]:
+                torn = torn + 1
+                break
+    t.join()
+    return copies, torn
+
+if __name__ == "__main__":
+    sys.setswitchinterval(1e-6) # switch threads as often as the interpreter allows
+
+    board = sitl.Board(sitl.SimClock("host"), tempfile.mkdtemp(prefix = "scout_bench_"))
+    sitl_clock = board.clock
+    with sitl.Firmware(board):
+        import dualcore
+
+        began = time.perf_counter()
+        mb, accepted, torn, out_of_order = run(dualcore, MESSAGES, SIZE)
+        took = time.perf_counter() - began
+        print("Checked handoff: " + str(MESSAGES) + " messages of " + str(SIZE) + " items in " + str(round(took, 2)) + " s")
+        print("  accepted " + str(accepted) + " (the rest were replaced by a newer message before being read), " + str(mb.retries) + " retries")
+        print("  torn messages accepted: " + str(torn) + ", out of order: " + str(out_of_order))
+        print("  latency (us): mean " + str(round(mb.latency_total_us / max(1, mb.received), 1)) + ", max " + str(mb.latency_max_us))
+
+        copies, unchecked_torn = run_unchecked(MESSAGES, SIZE, dualcore)
+        print("Unchecked handoff: " + str(unchecked_torn) + " of " + str(copies) + " copies were torn")
+
+    if torn > 0 or out_of_order > 0:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
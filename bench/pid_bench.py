@@ -0,0 +1,130 @@
+"""
+Per-cycle cost of the PID step: the original inline code from main.run() vs pid.PIDBank.
+Runs on a regular computer (python bench/pid_bench.py) and on the MicroPython unix port (micropython bench/pid_bench.py).
+
+PIDBank is not faster than the inline code. On CPython 3.11 (x86-64 desktop) it is slower, in us per cycle, inline vs PIDBank:
+    250 hz: 1.51 vs 1.85 (0.81x)    500 hz: 1.26 vs 2.00 (0.63x)    1000 hz: 2.01 vs 2.35 (0.86x)
+A later run gave 0.92x, 0.93x and 0.94x. It adds a method call and a function call per step, and its state lives in array('f'), so every read converts a float32 back to a Python float.
+There are no MicroPython numbers: no MicroPython build was at hand, so PIDBank's speed on the board (where its step is compiled with the native emitter, and the inline code is bytecode) has not been measured. Run this bench with the unix port, or on the board, before claiming a speedup there.
+What PIDBank does buy:
+- The step costs under 0.3% of the cycle budget at every rate either way.
+- The state is in arrays that the blackbox, the fixed point path and tools/replay.py read directly, rather than six loose locals in main.run().
+"""
+
+import sys
+import time
+import math
+
+# make src/ importable
+try:
+    here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+except NameError:
+    here = "."
+sys.path.append(here + "/../src")
+import pid
+
+# gains from main.py
+pid_roll_kp = 0.00043714285
+pid_roll_ki = 0.00255
+pid_roll_kd = 0.00002571429
+pid_pitch_kp = pid_roll_kp
+pid_pitch_ki = pid_roll_ki
+pid_pitch_kd = pid_roll_kd
+pid_yaw_kp = 0.001714287
+pid_yaw_ki = 0.003428571
+pid_yaw_kd = 0.0
+i_limit = 150.0
+
+CYCLES = 20000
+
+if hasattr(time, "ticks_us"):
+    def now_us():
+        return time.ticks_us()
+    def elapsed_us(began):
+        return time.ticks_diff(time.ticks_us(), began)
+else:
+    def now_us():
+        return time.perf_counter()
+    def elapsed_us(began):
+        return (time.perf_counter() - began) * 1000000.0
+
+def make_errors(n):
+    """A repeatable set of (roll, pitch, yaw) rate errors, in degrees per second."""
+    ToReturn = []
+    for i in range(n):
+        ToReturn.append((20.0 * math.sin(i * 0.01), 15.0 * math.sin(i * 0.013), 30.0 * math.sin(i * 0.007)))
+    return ToReturn
+
+def bench_inline(errors, cycle_time_seconds):
+    """The PID code exactly as it was written inline in main.run(), with its six loose state variables."""
+    roll_last_integral = 0.0
+    roll_last_error = 0.0
+    pitch_last_integral = 0.0
+    pitch_last_error = 0.0
+    yaw_last_integral = 0.0
+    yaw_last_error = 0.0
+    began = now_us()
+    for e in errors:
+        error_rate_roll = e[0]
+        error_rate_pitch = e[1]
+        error_rate_yaw = e[2]
+
+        roll_p = error_rate_roll * pid_roll_kp
+        roll_i = roll_last_integral + (error_rate_roll * pid_roll_ki * cycle_time_seconds)
+        roll_i = max(min(roll_i, i_limit), -i_limit)
+        roll_d = pid_roll_kd * (error_rate_roll - roll_last_error) / cycle_time_seconds
+        pid_roll = roll_p + roll_i + roll_d
+
+        pitch_p = error_rate_pitch * pid_pitch_kp
+        pitch_i = pitch_last_integral + (error_rate_pitch * pid_pitch_ki * cycle_time_seconds)
+        pitch_i = max(min(pitch_i, i_limit), -i_limit)
+        pitch_d = pid_pitch_kd * (error_rate_pitch - pitch_last_error) / cycle_time_seconds
+        pid_pitch = pitch_p + pitch_i + pitch_d
+
+        yaw_p = error_rate_yaw * pid_yaw_kp
+        yaw_i = yaw_last_integral + (error_rate_yaw * pid_yaw_ki * cycle_time_seconds)
+        yaw_i = max(min(yaw_i, i_limit), -i_limit)
+        yaw_d = pid_yaw_kd * (error_rate_yaw - yaw_last_error) / cycle_time_seconds
+        pid_yaw = yaw_p + yaw_i + yaw_d
+
+        roll_last_error = error_rate_roll
+        pitch_last_error = error_rate_pitch
+        yaw_last_error = error_rate_yaw
+        roll_last_integral = roll_i
+        pitch_last_integral = pitch_i
+        yaw_last_integral = yaw_i
+    return elapsed_us(began), (pid_roll, pid_pitch, pid_yaw)
+
+def bench_bank(errors, cycle_hz):
+    pids = pid.PIDBank(cycle_hz, i_limit)
+    pids.set_gains(pid.ROLL, pid_roll_kp, pid_roll_ki, pid_roll_kd)
+    pids.set_gains(pid.PITCH, pid_pitch_kp, pid_pitch_ki, pid_pitch_kd)
+    pids.set_gains(pid.YAW, pid_yaw_kp, pid_yaw_ki, pid_yaw_kd)
+    pid_update = pids.update
+    pid_output = pids.output
+    began = now_us()
+    for e in errors:
+        pid_update(e[0], e[1], e[2])
+        pid_roll = pid_output[0]
+        pid_pitch = pid_output[1]
+        pid_yaw = pid_output[2]
+    return elapsed_us(began), (pid_roll, pid_pitch, pid_yaw)
+
+def main():
+    errors = make_errors(CYCLES)
+    print("PID step cost per cycle (" + str(CYCLES) + " cycles, " + sys.implementation.name + ")")
+    print("rate (hz) | budget (us) | inline (us) | PIDBank (us) | speedup | inline % of budget | PIDBank % of budget")
+    for hz in (250, 500, 1000):
+        budget = 1000000.0 / hz
+        t_inline, out_inline = bench_inline(errors, 1.0 / hz)
+        t_bank, out_bank = bench_bank(errors, hz)
+        per_inline = t_inline / CYCLES
+        per_bank = t_bank / CYCLES
+        print(str(hz) + " | " + str(round(budget, 1)) + " | " + str(round(per_inline, 3)) + " | " + str(round(per_bank, 3)) + " | " + str(round(per_inline / per_bank, 2)) + "x | " + str(round(100.0 * per_inline / budget, 3)) + "% | " + str(round(100.0 * per_bank / budget, 3)) + "%")
+        # both must agree (PIDBank keeps its state in float32, so allow for rounding)
+        for a in range(3):
+            if abs(out_inline[a] - out_bank[a]) > 1e-4 * max(1.0, abs(out_inline[a])):
+                print("  WARNING: outputs differ on axis " + str(a) + ": " + str(out_inline[a]) + " vs " + str(out_bank[a]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Per-cycle cost of turning the RC receiver's channels into setpoints: the original normalize() x 4 (then scaled by the max rates), toolkit.NonlinearTransformer on the three sticks, and sticks.StickMap's lookup tables (linear, and with expo).
+Also prints how far StickMap's interpolated tables are from the exact expo curve, for a few table sizes.
+Runs on a regular computer (python bench/stick_bench.py) and on the MicroPython unix port (micropython bench/stick_bench.py). On MicroPython, StickMap.process() runs as native code.
+"""
+
+import sys
+import time
+import math
+
+# make src/ importable
+try:
+    here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+except NameError:
+    here = "."
+sys.path.append(here + "/../src")
+import sticks
+import toolkit
+
+CYCLES = 20000
+MAX_RATES = (30.0, 30.0, 50.0) # main.py's max_rate_roll, max_rate_pitch, max_rate_yaw
+EXPO = 2.0
+DEAD_ZONE = 0.05
+
+if hasattr(time, "ticks_us"):
+    def now_us():
+        return time.ticks_us()
+    def elapsed_us(began):
+        return time.ticks_diff(time.ticks_us(), began)
+else:
+    def now_us():
+        return time.perf_counter()
+    def elapsed_us(began):
+        return (time.perf_counter() - began) * 1000000.0
+
+def make_frames(n):
+    """A repeatable set of receiver readings, [status, channel 1 to 6], with the sticks moving around."""
+    ToReturn = []
+    for i in range(n):
+        ToReturn.append([1, int(1500 + 480 * math.sin(i * 0.01)), int(1500 + 450 * math.sin(i * 0.013)), int(1300 + 200 * math.sin(i * 0.002)), int(1500 + 400 * math.sin(i * 0.007)), 2000, 1000])
+    return ToReturn
+
+def normalize(value, original_min, original_max, new_min, new_max):
+    return new_min + ((new_max - new_min) * ((value - original_min) / (original_max - original_min)))
+
+def bench_normalize(frames):
+    command = [0.0] * 5
+    began = now_us()
+    for rc_data in frames:
+        command[0] = normalize(rc_data[3], 1000.0, 2000.0, 0.0, 1.0)
+        command[1] = normalize(rc_data[1], 1000.0, 2000.0, -1.0, 1.0) * MAX_RATES[0]
+        command[2] = normalize(rc_data[2], 1000.0, 2000.0, -1.0, 1.0) * -1 * MAX_RATES[1]
+        command[3] = normalize(rc_data[4], 1000.0, 2000.0, -1.0, 1.0) * MAX_RATES[2]
+        command[4] = rc_data[5]
+    return elapsed_us(began)
+
+def bench_transformer(frames):
+    curve = toolkit.NonlinearTransformer(EXPO, DEAD_ZONE)
+    transform = curve.transform
+    command = [0.0] * 5
+    began = now_us()
+    for rc_data in frames:
+        command[0] = normalize(rc_data[3], 1000.0, 2000.0, 0.0, 1.0)
+        command[1] = transform(normalize(rc_data[1], 1000.0, 2000.0, -1.0, 1.0)) * MAX_RATES[0]
+        command[2] = transform(normalize(rc_data[2], 1000.0, 2000.0, -1.0, 1.0)) * -1 * MAX_RATES[1]
+        command[3] = transform(normalize(rc_data[4], 1000.0, 2000.0, -1.0, 1.0)) * MAX_RATES[2]
+        command[4] = rc_data[5]
+    return elapsed_us(began)
+
+def bench_map(frames, stick_map):
+    process = stick_map.process
+    command = [0.0] * 5
+    began = now_us()
+    for rc_data in frames:
+        process(rc_data, command)
+    return elapsed_us(began)
+
+def main():
+    frames = make_frames(CYCLES)
+    print("Stick processing cost per call (" + str(CYCLES) + " calls, " + sys.implementation.name + ")")
+    print("normalize x 4: " + str(round(bench_normalize(frames) / CYCLES, 3)) + " us")
+    print("normalize x 4 + NonlinearTransformer x 3: " + str(round(bench_transformer(frames) / CYCLES, 3)) + " us")
+    linear = sticks.StickMap(MAX_RATES[0], MAX_RATES[1], MAX_RATES[2])
+    print("StickMap, linear: " + str(round(bench_map(frames, linear) / CYCLES, 3)) + " us")
+    expo = sticks.StickMap(MAX_RATES[0], MAX_RATES[1], MAX_RATES[2], DEAD_ZONE, EXPO, EXPO, EXPO)
+    print("StickMap, expo " + str(EXPO) + ", dead zone " + str(DEAD_ZONE) + ": " + str(round(bench_map(frames, expo) / CYCLES, 3)) + " us")
+
+    print("table points | largest difference from the exact expo curve (deg/s, roll)")
+    curve = toolkit.NonlinearTransformer(EXPO, DEAD_ZONE)
+    for points in (17, 33, 65, 129):
+        m = sticks.StickMap(MAX_RATES[0], MAX_RATES[1], MAX_RATES[2], DEAD_ZONE, EXPO, EXPO, EXPO, points)
+        worst = 0.0
+        for value in range(1000, 2001):
+            worst = max(worst, abs(m.lookup(1, value) - (curve.transform((value - 1500) / 500.0) * MAX_RATES[0])))
+        print(str(points) + " | " + str(round(worst, 4)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""
+Software-in-the-loop (SITL) simulation for the Scout Flight Controller.
+Runs the unmodified firmware in src/ on a regular computer against simulated hardware (MPU-6050, iBUS receiver, ESC PWM outputs) and a controllable clock.
+"""
+
+from .clock import SimClock, SimulationComplete
+from .board import Board
+from .stats import CycleStats
+from .harness import Firmware, Simulation, SimulationResult, run
@@ -0,0 +1,40 @@
+import argparse
+import json
+import sys
+from .harness import Simulation
+from .physics import Multirotor
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m sitl", description = "Run the Scout flight controller (src/main.py) against simulated hardware and report per-cycle timing.")
+    parser.add_argument("--cycles", type = int, default = 2500, help = "number of flight loop cycles to time")
+    parser.add_argument("--mode", choices = ["host", "lockstep"], default = "host", help = "clock mode (see sitl.clock.SimClock)")
+    parser.add_argument("--cpu-scale", type = float, default = 1.0, help = "how many times slower the Pico is than this computer (host mode)")
+    parser.add_argument("--start-us", type = int, default = 0, help = "initial tick value, e.g. 1073000000 to cross the 2^30 ticks wraparound")
+    parser.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE", help = "override a main.py setting, e.g. --set target_cycle_hz=500")
+    parser.add_argument("--physics", action = "store_true", help = "fly a rigid-body model of the craft closed loop (sitl.physics.Multirotor) instead of sitting still")
+    parser.add_argument("--fs-root", default = None, metavar = "DIR", help = "host directory to use as the Pico's filesystem, kept between runs (e.g. to boot with the last run's gyro calibration). A new temporary directory by default")
+    parser.add_argument("--verbose", action = "store_true", help = "show the flight controller's console output")
+    parser.add_argument("--json", action = "store_true", help = "print the statistics as JSON")
+    parser.add_argument("--min-speed", type = float, default = None, metavar = "FACTOR", help = "exit with status 1 if the flight loop ran slower than FACTOR times real time (the \"Flight loop\" line; only meaningful in lockstep mode), e.g. 50 with --mode lockstep --physics")
+    args = parser.parse_args()
+
+    overrides:dict = {}
+    for kv in args.set:
+        name, value = kv.split("=", 1)
+        overrides[name] = json.loads(value)
+
+    vehicle:Multirotor = Multirotor() if args.physics else None
+    sim:Simulation = Simulation(max_cycles = args.cycles, clock_mode = args.mode, cpu_scale = args.cpu_scale, start_us = args.start_us, overrides = overrides, quiet = not args.verbose, fs_root = args.fs_root, vehicle = vehicle)
+    result = sim.run()
+    if args.json:
+        print(json.dumps({"fatal": result.fatal, "virtual_time_s": result.virtual_time_s, "host_time_s": result.host_time_s, "loop_virtual_s": result.loop_virtual_s, "loop_host_s": result.loop_host_s, "stats": result.stats.summary(), "handoff": result.handoff, "vehicle": vehicle.summary() if vehicle is not None else None}, indent = 2))
+    else:
+        print(result.format())
+    if args.min_speed is not None:
+        speed:float = result.loop_virtual_s / result.loop_host_s if result.loop_host_s > 0.0 else 0.0
+        if speed < args.min_speed:
+            print("FAIL: the flight loop ran at " + str(round(speed, 1)) + "x real time, below --min-speed " + str(args.min_speed), file = sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
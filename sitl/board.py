@@ -0,0 +1,114 @@
+import os
+import time as _host_time
+from .clock import SimClock, SimulationComplete
+from .devices import MPU6050, IBusTransmitter, FlightScript
+
+class SandboxFS:
+    """Maps the Pico's flash filesystem paths ("/logs", "telemetry", ...) into a directory on the host."""
+
+    def __init__(self, root:str) -> None:
+        self.root:str = root
+
+    def path(self, p:str) -> str:
+        return os.path.join(self.root, p.lstrip("/"))
+
+    def open(self, p:str, mode:str = "r", *args, **kwargs):
+        return open(self.path(p), mode, *args, **kwargs)
+
+    def read(self, p:str) -> bytes:
+        fp:str = self.path(p)
+        if not os.path.exists(fp):
+            return None
+        with open(fp, "rb") as f:
+            return f.read()
+
+
+class Board:
+    """
+    A simulated Raspberry Pi Pico wired up like Scout: an MPU-6050 on I2C 0, a FlySky receiver on an iBUS UART and four ESC PWM outputs.
+    The fake `machine` module routes every peripheral call here.
+    """
+
+    def __init__(self, clock:SimClock, fs_root:str, rc_uart:int = 1, motion = None, channels = None, bus_timing:bool = True) -> None:
+        """
+        :param clock: the simulated time source.
+        :param fs_root: host directory used as the Pico's flash filesystem.
+        :param rc_uart: the UART the receiver is wired to (main.rc_uart).
+        :param motion: the MPU-6050's motion source (see devices.StaticMotion). Defaults to sitting still.
+        :param channels: callable(t_seconds) -> 14 iBUS channel values. Defaults to devices.FlightScript.
+        :param bus_timing: if True, I2C transfers consume virtual time according to bus speed.
+        """
+        self.clock:SimClock = clock
+        self.fs:SandboxFS = SandboxFS(fs_root)
+        self.bus_timing:bool = bus_timing
+        self.cpu_freq_hz:int = 125000000
+        self.pin_values:dict = {}
+        self.pwm_channels:dict = {}
+        self.duty_ns:dict = {} # gpio -> last duty written
+        self.loop_started_at_us:float = None # virtual time of the first ESC command, i.e. when the flight loop began
+        self.loop_started_host_s:float = None # host time (perf_counter) at the same moment
+        self.loop_gate = None # callable() -> bool. If set, only an ESC command while it returns True marks the start of the flight loop (e.g. not the ones written while the loop rate is benchmarked at boot)
+        self.loop_listeners:list = [] # called as listener() when the flight loop starts
+        self._last_pwm_us:float = None # virtual time of the last ESC command since the IMU was last read
+
+        self.imu:MPU6050 = MPU6050(clock, motion)
+        self.i2c_devices:dict = {(0, self.imu.address): self.imu}
+
+        if channels is None:
+            channels = FlightScript(self).channels
+        self.receiver:IBusTransmitter = IBusTransmitter(clock, channels)
+        self.uart_peers:dict = {rc_uart: self.receiver}
+
+        # optional timing statistics (sitl.stats.CycleStats); attached by the harness
+        self.stats = None
+        self.max_cycles:int = None
+        self.imu.on_data_read.append(self._imu_sampled)
+
+        # extra listeners, called as listener(gpio, duty_ns) on every PWM write
+        self.pwm_listeners:list = []
+
+        # threads started through the _thread stand-in (the second core)
+        self.threads:list = []
+
+    def bus_wait(self, us:float) -> None:
+        if self.bus_timing:
+            self.clock.advance(us)
+
+    def set_pin(self, pin, value:int) -> None:
+        self.pin_values[pin] = value
+
+    def pwm_written(self, gpio:int, duty_ns:int) -> None:
+        clock:SimClock = self.clock
+        if clock.lockstep and self.loop_started_at_us is not None:
+            # the common case, as this runs on every motor write: the flight loop is running, and host execution time never counts in lockstep mode, so there is nothing to pause
+            self.duty_ns[gpio] = duty_ns
+            self._last_pwm_us = clock._offset_us # now_us(), which in lockstep mode is just this
+            for listener in self.pwm_listeners:
+                listener(gpio, duty_ns)
+            return
+        if not clock.lockstep:
+            clock.pause()
+        try:
+            now:float = clock.now_us()
+            if self.loop_started_at_us is None and (self.loop_gate is None or self.loop_gate()):
+                self.loop_started_at_us = now
+                self.loop_started_host_s = _host_time.perf_counter()
+                for listener in self.loop_listeners:
+                    listener()
+            self.duty_ns[gpio] = duty_ns
+            self._last_pwm_us = now # only the cycle's last write counts, so the statistics get it once, when the next cycle starts
+            for listener in self.pwm_listeners:
+                listener(gpio, duty_ns)
+        finally:
+            if not clock.lockstep:
+                clock.resume()
+
+    def _imu_sampled(self) -> None:
+        last_pwm_us:float = self._last_pwm_us
+        self._last_pwm_us = None
+        stats = self.stats
+        if self.loop_started_at_us is None or stats is None:
+            return
+        stats.cycle_started(self.clock.now_us(), last_pwm_us)
+        if self.max_cycles is not None and stats.cycles >= self.max_cycles:
+            raise SimulationComplete("Cycle limit reached")
@@ -0,0 +1,338 @@
+import threading as _threading
+import time as _host_time
+import types
+
+_INFINITY:float = float("inf")
+
+# MicroPython's ticks_ms()/ticks_us() wrap around at 2^30 on the rp2 port
+TICKS_PERIOD:int = 1 << 30
+TICKS_MAX:int = TICKS_PERIOD - 1
+TICKS_HALFPERIOD:int = TICKS_PERIOD // 2
+
+# what module() takes from the clock
+_TIME_API:tuple = ("ticks_us", "ticks_ms", "ticks_cpu", "ticks_add", "ticks_diff", "sleep", "sleep_ms", "sleep_us", "time", "time_ns")
+
+class SimulationComplete(BaseException):
+    """Raised from inside the simulated hardware to stop the flight loop. Derives from BaseException so the `except Exception` in main.run() does not swallow it."""
+    pass
+
+class SimClock:
+    """
+    A stand-in for MicroPython's `time` module. Installed (as module()) as sys.modules["time"] while the flight controller runs on the host.
+
+    Two modes are supported:
+    - "host": virtual time advances with the real (host) time spent executing the flight controller code, multiplied by cpu_scale. Sleeps are NOT actually slept; they are added to virtual time instantly. Use this to measure loop cost.
+    - "lockstep": virtual time ONLY advances when the code sleeps (or blocks on simulated I/O). Code execution is free. Use this for deterministic, faster-than-real-time simulation.
+
+    In lockstep mode, the clock also schedules simulated threads (the second core, see sitl.thread): only one thread runs at a time, and when it sleeps or blocks, the thread with the earliest wake time runs next.
+    So two cores that each spend their time sleeping or waiting on I/O progress in parallel in virtual time, deterministically.
+
+    The clock also raises timer interrupts (see sitl.machine.Timer): whenever virtual time passes a timer's due time (in a sleep, a wait on simulated I/O or a ticks_*() call), the code that was running is interrupted and the timer's handler runs, at the due time.
+    Handlers run one at a time: an interrupt that falls due while a handler runs, or while interrupts are disabled (disable_irq()), is taken as soon as that ends, late. Single-threaded only (not together with simulated threads).
+    """
+
+    def __init__(self, mode:str = "host", cpu_scale:float = 1.0, start_us:int = 0, tick_cost_us:float = 0.0) -> None:
+        """
+        Creates a new SimClock.
+        :param mode: "host" or "lockstep" (see class description).
+        :param cpu_scale: host mode only. Multiplier applied to host execution time to approximate the (much slower) microcontroller.
+        :param start_us: the virtual time, in microseconds, the clock starts at. Set this close to TICKS_PERIOD to exercise tick wraparound.
+        :param tick_cost_us: lockstep mode only. Virtual time consumed by every ticks_*() call, so busy-wait loops still make progress.
+        """
+        if mode != "host" and mode != "lockstep":
+            raise ValueError("Clock mode must be 'host' or 'lockstep', not '" + str(mode) + "'")
+        self.mode:str = mode
+        self.lockstep:bool = mode == "lockstep" # checked on every pause(), resume() and ticks_*() call
+        self.cpu_scale:float = cpu_scale
+        self.tick_cost_us:float = tick_cost_us
+        self._stop_at_us:float = None
+        self._alarm_us:float = _INFINITY # the earliest of stop_at_us and the next timer interrupt: the one check ticks_us() makes in the common case
+
+        self._offset_us:float = float(start_us) # virtual time that did not come from host execution (sleeps, blocking I/O, start offset)
+        self._host_origin_ns:int = _host_time.perf_counter_ns()
+        self._paused_ns:int = 0 # host time spent inside the simulator itself, which is excluded from virtual time
+        self._pause_began_ns:int = 0
+        self._pause_depth:int = 0
+
+        # simulated threads (lockstep only). None until a second thread is started; then thread token -> wake time (virtual us), or None for the one running thread
+        self._threads:dict = None
+        self._running = None
+        self._shutdown:bool = False
+        self._cond = _threading.Condition()
+        self._local = _threading.local()
+
+        # timer interrupts: every running timer (sitl.machine.Timer), the earliest due time among them (None if there are none), and > 0 while interrupts can't be taken (disabled, or a handler is running)
+        self._timers:list = []
+        self._irq_us:float = None
+        self._irq_disabled:int = 0
+        self._in_irq:int = 0
+
+    @property
+    def stop_at_us(self) -> float:
+        """If set, SimulationComplete is raised once virtual time passes this point."""
+        return self._stop_at_us
+
+    @stop_at_us.setter
+    def stop_at_us(self, value:float) -> None:
+        self._stop_at_us = value
+        self._set_alarm()
+
+    def _set_alarm(self) -> None:
+        self._alarm_us = min(self._stop_at_us if self._stop_at_us is not None else _INFINITY, self._irq_us if self._irq_us is not None else _INFINITY)
+
+    ##### virtual time #####
+
+    def now_us(self) -> float:
+        """The current virtual time, in microseconds (not wrapped)."""
+        if self.lockstep:
+            return self._offset_us
+        if self._pause_depth > 0:
+            host_ns:int = self._pause_began_ns - self._host_origin_ns - self._paused_ns
+        else:
+            host_ns:int = _host_time.perf_counter_ns() - self._host_origin_ns - self._paused_ns
+        return self._offset_us + (host_ns / 1000.0) * self.cpu_scale
+
+    def advance(self, us:float) -> None:
+        """Moves virtual time forward by a number of microseconds (sleeping, or waiting on a simulated bus)."""
+        if self._threads is not None:
+            if us > 0:
+                self._sleep_until(self._offset_us + us)
+            self._check_stop()
+            return
+        if us > 0:
+            if self._irq_us is None:
+                self._offset_us = self._offset_us + us
+                if self.lockstep: # the common case (sleeps and bus transfers): only the one alarm compare, as in ticks_us()
+                    if self._offset_us >= self._alarm_us:
+                        self._check_stop()
+                    return
+            else:
+                # interrupts that fall due on the way run at their due time, and take their share of the wait
+                end_us:float = self.now_us() + us
+                while self._irq_us is not None and self._irq_us <= end_us and self._irq_disabled == 0 and self._in_irq == 0:
+                    now:float = self.now_us()
+                    if self._irq_us > now:
+                        self._offset_us = self._offset_us + (self._irq_us - now)
+                    self._interrupt()
+                now:float = self.now_us()
+                if end_us > now:
+                    self._offset_us = self._offset_us + (end_us - now)
+        self._check_stop()
+
+    def pause(self) -> None:
+        """Stops host execution time from counting toward virtual time. Used by simulated devices so the simulator's own overhead is not billed to the flight controller."""
+        if self.lockstep:
+            return # host execution time never counts in lockstep mode
+        if self._pause_depth == 0:
+            self._pause_began_ns = _host_time.perf_counter_ns()
+        self._pause_depth = self._pause_depth + 1
+
+    def resume(self) -> None:
+        """Reverses a previous call to pause()."""
+        if self.lockstep:
+            return
+        self._pause_depth = self._pause_depth - 1
+        if self._pause_depth == 0:
+            self._paused_ns = self._paused_ns + (_host_time.perf_counter_ns() - self._pause_began_ns)
+
+    def _check_stop(self) -> None:
+        if self._stop_at_us is not None and self.now_us() >= self._stop_at_us:
+            raise SimulationComplete("Simulated time limit reached")
+
+    ##### simulated threads #####
+
+    def spawn(self) -> object:
+        """Registers a new thread (runnable from now) and returns its token. Called by the thread that starts it, before it starts."""
+        if self.mode != "lockstep":
+            raise RuntimeError("Simulated threads need the lockstep clock (--mode lockstep). In host mode, both threads' execution and sleeps would be billed to one clock.")
+        if len(self._timers) > 0:
+            raise RuntimeError("Timer interrupts and simulated threads can't be combined")
+        with self._cond:
+            if self._threads is None:
+                # the calling thread becomes the first participant, and is the one running
+                self._local.token = object()
+                self._threads = {self._local.token: None}
+                self._running = self._local.token
+            token:object = object()
+            self._threads[token] = self._offset_us
+            return token
+
+    def enter(self, token:object) -> None:
+        """Called first thing by a newly started thread: blocks until it is scheduled."""
+        self._local.token = token
+        with self._cond:
+            self._wait_turn(token)
+
+    def leave(self) -> None:
+        """Called last thing by a thread: removes it from scheduling and runs the next thread."""
+        with self._cond:
+            token:object = self._local.token
+            self._threads.pop(token, None)
+            if self._running is token:
+                self._schedule()
+
+    def shutdown(self) -> None:
+        """Ends the simulation for every thread: threads waiting for their turn raise SimulationComplete."""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def _sleep_until(self, wake_us:float) -> None:
+        with self._cond:
+            token:object = self._local.token
+            self._threads[token] = wake_us
+            self._schedule()
+            self._wait_turn(token)
+
+    def _schedule(self) -> None:
+        # run the thread with the earliest wake time (on a tie, the one registered first, as dicts keep insertion order). Must hold _cond.
+        best:object = None
+        best_us:float = 0.0
+        for token, wake_us in self._threads.items():
+            if wake_us is not None and (best is None or wake_us < best_us):
+                best = token
+                best_us = wake_us
+        self._running = best
+        if best is not None:
+            self._threads[best] = None
+            if best_us > self._offset_us:
+                self._offset_us = best_us
+        self._cond.notify_all()
+
+    def _wait_turn(self, token:object) -> None:
+        # must hold _cond
+        while self._running is not token:
+            if self._shutdown:
+                raise SimulationComplete("Simulation stopped")
+            self._cond.wait()
+
+    ##### timer interrupts #####
+
+    def add_timer(self, timer) -> None:
+        """Starts raising a timer's interrupts: timer.fire() at virtual time timer.due_us (see sitl.machine.Timer)."""
+        if self._threads is not None:
+            raise RuntimeError("Timer interrupts and simulated threads can't be combined")
+        if timer not in self._timers:
+            self._timers.append(timer)
+        self._next_irq()
+
+    def remove_timer(self, timer) -> None:
+        if timer in self._timers:
+            self._timers.remove(timer)
+        self._next_irq()
+
+    def _next_irq(self) -> None:
+        self._irq_us = min([t.due_us for t in self._timers]) if len(self._timers) > 0 else None
+        self._set_alarm()
+
+    def _interrupt(self) -> None:
+        """Runs the handler of the timer due first (ties: the one started first). It is rescheduled before its handler runs, so the handler may stop or restart it."""
+        timer = None
+        for t in self._timers:
+            if timer is None or t.due_us < timer.due_us:
+                timer = t
+        timer.due_us = timer.due_us + timer.period_us # periodic timers keep to an absolute schedule: after a late one, the next is due just as early
+        if timer.period_us <= 0:
+            self._timers.remove(timer)
+        self._next_irq()
+        self._in_irq = self._in_irq + 1
+        try:
+            timer.fire()
+        finally:
+            self._in_irq = self._in_irq - 1
+
+    def interrupts(self) -> None:
+        """Takes the interrupts that are due (and can be taken) now."""
+        while self._irq_us is not None and self._irq_us <= self.now_us() and self._irq_disabled == 0 and self._in_irq == 0:
+            self._interrupt()
+
+    def next_interrupt_us(self) -> float:
+        """The virtual time the next timer interrupt falls due at, None if no timer is running."""
+        return self._irq_us
+
+    def until_interrupt_us(self, limit_us:float) -> float:
+        """Microseconds until the next timer interrupt falls due, at most limit_us."""
+        if self._irq_us is None:
+            return limit_us
+        return max(0.0, min(limit_us, self._irq_us - self.now_us()))
+
+    def disable_irq(self) -> int:
+        """machine.disable_irq(): holds interrupts back until enable_irq(). Returns the previous state, for enable_irq()."""
+        state:int = self._irq_disabled
+        self._irq_disabled = 1
+        return state
+
+    def enable_irq(self, state:int = 0) -> None:
+        """machine.enable_irq(): restores the state disable_irq() returned. Interrupts that fell due in between are taken now."""
+        self._irq_disabled = state
+        if state == 0:
+            self.interrupts()
+
+    ##### MicroPython time API #####
+
+    def ticks_us(self) -> int:
+        if self.lockstep and self._threads is None:
+            # the common case, inlined (the flight loop calls this several times per cycle)
+            now:float = self._offset_us + self.tick_cost_us
+            self._offset_us = now
+            if now >= self._alarm_us: # the time limit passed, or an interrupt fell due (it runs right after this read)
+                self._check_stop()
+                self.interrupts()
+            return int(now) & TICKS_MAX
+        if self.tick_cost_us > 0 and self.lockstep:
+            self._offset_us = self._offset_us + self.tick_cost_us
+        self._check_stop()
+        now:float = self.now_us()
+        if self._irq_us is not None:
+            self.interrupts()
+        return int(now) & TICKS_MAX
+
+    def ticks_ms(self) -> int:
+        if self.tick_cost_us > 0 and self.lockstep:
+            self._offset_us = self._offset_us + self.tick_cost_us
+        self._check_stop()
+        now:float = self.now_us()
+        if self._irq_us is not None:
+            self.interrupts()
+        return int(now // 1000) & TICKS_MAX
+
+    def ticks_cpu(self) -> int:
+        return self.ticks_us()
+
+    def ticks_add(self, ticks:int, delta:int) -> int:
+        return (ticks + delta) & TICKS_MAX
+
+    def ticks_diff(self, ticks1:int, ticks2:int) -> int:
+        return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+    def sleep(self, seconds:float) -> None:
+        self.advance(seconds * 1000000.0)
+
+    def sleep_ms(self, ms:int) -> None:
+        self.advance(ms * 1000.0)
+
+    def sleep_us(self, us:int) -> None:
+        if self.lockstep and self._irq_us is None and self._threads is None and us > 0:
+            # the common case, inlined as in advance() (the flight loop sleeps out the rest of every cycle)
+            self._offset_us = self._offset_us + us
+            if self._offset_us >= self._alarm_us:
+                self._check_stop()
+            return
+        self.advance(float(us))
+
+    def time(self) -> int:
+        return int(self.now_us() // 1000000)
+
+    def time_ns(self) -> int:
+        return int(self.now_us() * 1000)
+
+    def module(self) -> types.ModuleType:
+        """
+        This clock as a `time` module, to install as sys.modules["time"]: MicroPython's time API, bound to this clock, and everything else (perf_counter, monotonic, strftime, ...) from the host's time module, so stdlib code that imports time lazily keeps working.
+        A module rather than the clock itself, as a __getattr__ fallback on the clock would put every attribute lookup on it (every ticks_us() call, and every attribute ticks_us() reads) on CPython's slow path.
+        """
+        ToReturn:types.ModuleType = types.ModuleType("time")
+        ToReturn.__dict__.update({name: value for name, value in vars(_host_time).items() if not name.startswith("__")})
+        for name in _TIME_API:
+            setattr(ToReturn, name, getattr(self, name))
+        return ToReturn
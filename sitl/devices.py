@@ -0,0 +1,358 @@
+import math
+import random
+import struct
+
+# MPU-6050 register addresses used by the simulation
+MPU6050_SMPLRT_DIV:int = 0x19
+MPU6050_CONFIG:int = 0x1A
+MPU6050_GYRO_CONFIG:int = 0x1B
+MPU6050_ACCEL_CONFIG:int = 0x1C
+MPU6050_FIFO_EN:int = 0x23
+MPU6050_INT_STATUS:int = 0x3A
+MPU6050_ACCEL_XOUT_H:int = 0x3B
+MPU6050_TEMP_OUT_H:int = 0x41
+MPU6050_GYRO_XOUT_H:int = 0x43
+MPU6050_GYRO_ZOUT_L:int = 0x48
+MPU6050_USER_CTRL:int = 0x6A
+MPU6050_PWR_MGMT_1:int = 0x6B
+MPU6050_FIFO_COUNT_H:int = 0x72
+MPU6050_FIFO_COUNT_L:int = 0x73
+MPU6050_FIFO_R_W:int = 0x74
+MPU6050_WHO_AM_I:int = 0x75
+MPU6050_FIFO_SIZE:int = 1024
+
+_SAMPLE = struct.Struct(">7h") # accel x, y, z, temperature, gyro x, y, z registers (big-endian)
+_IBUS_CHANNELS = struct.Struct("<2B14H") # iBUS header, then 14 channels
+
+GYRO_LSB_PER_DPS:tuple = (131.0, 65.5, 32.8, 16.4) # indexed by FS_SEL
+ACCEL_LSB_PER_G:tuple = (16384.0, 8192.0, 4096.0, 2048.0) # indexed by AFS_SEL
+
+class StaticMotion:
+    """A motion source for a craft sitting still and level on the ground: a constant gyro bias plus gaussian noise."""
+
+    def __init__(self, gyro_bias_dps:tuple = (-1.2, 0.8, 0.35), gyro_noise_dps:float = 0.05, accel_noise_g:float = 0.002, temperature_c:float = 25.0, seed:int = 1) -> None:
+        self.gyro_bias_dps:tuple = gyro_bias_dps
+        self.gyro_noise_dps:float = gyro_noise_dps
+        self.accel_noise_g:float = accel_noise_g
+        self.temperature_c:float = temperature_c
+        self.random = random.Random(seed)
+
+    def sample(self, t:float) -> tuple:
+        """Returns (accel_x, accel_y, accel_z, temperature, gyro_x, gyro_y, gyro_z) at time t (seconds). Accel in g, temperature in celsius, gyro in degrees per second, all in the sensor's own frame."""
+        g = self.random.gauss
+        gb = self.gyro_bias_dps
+        gn:float = self.gyro_noise_dps
+        an:float = self.accel_noise_g
+        return (g(0.0, an), g(0.0, an), 1.0 + g(0.0, an), self.temperature_c, gb[0] + g(0.0, gn), gb[1] + g(0.0, gn), gb[2] + g(0.0, gn))
+
+
+class MPU6050:
+    """
+    Register-level model of an MPU-6050 attached to a simulated I2C bus.
+    Samples are produced on the sensor's own clock (gyro output rate / (1 + SMPLRT_DIV)). The data registers hold the latest sample, and when enabled (USER_CTRL / FIFO_EN) every sample is also queued in a 1024-byte FIFO that drops its oldest bytes on overflow, like the real part.
+    """
+
+    def __init__(self, clock, motion = None, address:int = 0x68) -> None:
+        self.clock = clock
+        self.motion = motion if motion is not None else StaticMotion()
+        self.address:int = address
+        self.regs:bytearray = bytearray(128)
+        self.reset()
+
+        # listeners that are told every time the data (sample) registers are read
+        self.on_data_read:list = []
+
+        self._latched_sample_index:int = -1
+        self.fifo:bytearray = bytearray()
+        self.fifo_overflowed:bool = False
+        self._fifo_next_index:int = None # the next sample index to push into the FIFO
+
+    def reset(self) -> None:
+        """Puts the register map back to its power-on state."""
+        for i in range(len(self.regs)):
+            self.regs[i] = 0
+        self.regs[MPU6050_PWR_MGMT_1] = 0x40 # SLEEP bit set at power on
+        self.regs[MPU6050_WHO_AM_I] = 0x68
+        self._latched_sample_index = -1
+        self.fifo = bytearray()
+        self.fifo_overflowed = False
+        self._fifo_next_index = None
+        self._configure()
+
+    ##### configuration derived from the register map #####
+
+    def _configure(self) -> None:
+        """Works out the sample rate and scales from the register map once, rather than on every read. Called whenever the registers change (write() and reset())."""
+        self._rate_hz:float = self.sample_rate_hz()
+        self._accel_scale:float = ACCEL_LSB_PER_G[(self.regs[MPU6050_ACCEL_CONFIG] >> 3) & 0x03]
+        self._gyro_scale:float = GYRO_LSB_PER_DPS[(self.regs[MPU6050_GYRO_CONFIG] >> 3) & 0x03]
+
+    def gyro_output_rate_hz(self) -> float:
+        """The gyroscope output rate is 8 kHz with the DLPF disabled (DLPF_CFG 0 or 7), otherwise 1 kHz."""
+        dlpf:int = self.regs[MPU6050_CONFIG] & 0x07
+        if dlpf == 0 or dlpf == 7:
+            return 8000.0
+        return 1000.0
+
+    def sample_rate_hz(self) -> float:
+        return self.gyro_output_rate_hz() / (1 + self.regs[MPU6050_SMPLRT_DIV])
+
+    def sleeping(self) -> bool:
+        return (self.regs[MPU6050_PWR_MGMT_1] & 0x40) != 0
+
+    def fifo_enabled(self) -> bool:
+        return (self.regs[MPU6050_USER_CTRL] & 0x40) != 0
+
+    def _sample_index(self) -> int:
+        return int(self.clock.now_us() * self._rate_hz / 1000000.0)
+
+    ##### bus interface #####
+
+    def write(self, reg:int, data) -> None:
+        self._fill_fifo()
+        for b in data:
+            if reg == MPU6050_PWR_MGMT_1 and (b & 0x80):
+                self.reset() # DEVICE_RESET
+            elif reg == MPU6050_USER_CTRL:
+                if b & 0x04: # FIFO_RESET (self clearing)
+                    self.fifo = bytearray()
+                    self.fifo_overflowed = False
+                    b = b & ~0x04
+                was_enabled:bool = self.fifo_enabled()
+                self.regs[reg] = b
+                if self.fifo_enabled() and not was_enabled:
+                    self._fifo_next_index = self._sample_index() + 1
+            elif reg == MPU6050_SMPLRT_DIV or reg == MPU6050_CONFIG:
+                self.regs[reg] = b
+                self._fifo_next_index = self._sample_index() + 1 # new sample clock
+            elif reg != MPU6050_WHO_AM_I and reg != MPU6050_FIFO_R_W:
+                self.regs[reg] = b
+            if reg != MPU6050_FIFO_R_W:
+                reg = (reg + 1) & 0x7F
+        self._configure()
+
+    def read(self, reg:int, n:int) -> bytes:
+        ToReturn:bytearray = bytearray(n)
+        self.read_into(reg, ToReturn)
+        return bytes(ToReturn)
+
+    def read_into(self, reg:int, buf) -> None:
+        if reg == MPU6050_FIFO_R_W:
+            # burst reads of FIFO_R_W keep popping the FIFO rather than moving on to the next register
+            self._fill_fifo()
+            n:int = min(len(buf), len(self.fifo))
+            buf[0:n] = self.fifo[0:n]
+            del self.fifo[0:n]
+            for i in range(n, len(buf)):
+                buf[i] = 0
+            for listener in self.on_data_read:
+                listener()
+            return
+        end:int = reg + len(buf)
+        if reg == MPU6050_ACCEL_XOUT_H and end == MPU6050_GYRO_ZOUT_L + 1:
+            # the burst the flight controller makes every cycle (the data registers, and nothing else)
+            self._latch()
+            for listener in self.on_data_read:
+                listener()
+            buf[0:14] = self.regs[MPU6050_ACCEL_XOUT_H:end]
+            return
+        if reg <= MPU6050_GYRO_ZOUT_L and end > MPU6050_ACCEL_XOUT_H:
+            self._latch()
+            for listener in self.on_data_read:
+                listener()
+        if reg <= MPU6050_FIFO_COUNT_L and end > MPU6050_FIFO_COUNT_H:
+            self._fill_fifo()
+            self.regs[MPU6050_FIFO_COUNT_H] = len(self.fifo) >> 8
+            self.regs[MPU6050_FIFO_COUNT_L] = len(self.fifo) & 0xFF
+        if reg <= MPU6050_INT_STATUS and end > MPU6050_INT_STATUS:
+            self._fill_fifo()
+            self.regs[MPU6050_INT_STATUS] = (0x10 if self.fifo_overflowed else 0x00) | (0x01 if self._sample_index() != self._latched_sample_index else 0x00)
+            self.fifo_overflowed = False # cleared on read
+        if end <= 128:
+            buf[0:len(buf)] = self.regs[reg:end]
+        else: # the register address wraps around
+            for i in range(len(buf)):
+                buf[i] = self.regs[(reg + i) & 0x7F]
+
+    ##### sampling #####
+
+    def _latch(self) -> None:
+        """Loads the most recent sample (quantized to the configured sample rate) into the data registers."""
+        rate:float = self._rate_hz
+        index:int = int(self.clock.now_us() * rate / 1000000.0)
+        if index == self._latched_sample_index:
+            return
+        self._latched_sample_index = index
+        if self.regs[MPU6050_PWR_MGMT_1] & 0x40: # sleeping
+            for r in range(MPU6050_ACCEL_XOUT_H, MPU6050_GYRO_ZOUT_L + 1):
+                self.regs[r] = 0
+            return
+        self._encode_sample(self.motion.sample(index / rate), self.regs, MPU6050_ACCEL_XOUT_H)
+
+    def _fill_fifo(self) -> None:
+        """Pushes every sample produced since the last call into the FIFO (accel, temp, gyro x, y, z as enabled in FIFO_EN, in that order)."""
+        if not self.fifo_enabled() or self.sleeping() or self._fifo_next_index is None:
+            return
+        enabled:int = self.regs[MPU6050_FIFO_EN]
+        now_index:int = self._sample_index()
+        if now_index < self._fifo_next_index:
+            return
+        # anything older than a full FIFO's worth of samples would have been pushed out anyway
+        first:int = max(self._fifo_next_index, now_index - (MPU6050_FIFO_SIZE // 2) + 1)
+        if first > self._fifo_next_index:
+            self.fifo_overflowed = True
+        rate:float = self._rate_hz
+        block:bytearray = bytearray(14)
+        for index in range(first, now_index + 1):
+            self._encode_sample(self.motion.sample(index / rate), block, 0)
+            if enabled & 0x08:
+                self.fifo.extend(block[0:6]) # accel
+            if enabled & 0x80:
+                self.fifo.extend(block[6:8]) # temperature
+            if enabled & 0x40:
+                self.fifo.extend(block[8:10]) # gyro x
+            if enabled & 0x20:
+                self.fifo.extend(block[10:12]) # gyro y
+            if enabled & 0x10:
+                self.fifo.extend(block[12:14]) # gyro z
+        if len(self.fifo) > MPU6050_FIFO_SIZE:
+            del self.fifo[0:len(self.fifo) - MPU6050_FIFO_SIZE] # the oldest data is lost
+            self.fifo_overflowed = True
+        self._fifo_next_index = now_index + 1
+
+    def _encode_sample(self, sample:tuple, buf, offset:int) -> None:
+        """Writes a 14-byte accel/temp/gyro block, in the sensor's big-endian register layout, to buf at offset."""
+        accel_scale:float = self._accel_scale
+        gyro_scale:float = self._gyro_scale
+        raws:tuple = (sample[0] * accel_scale, sample[1] * accel_scale, sample[2] * accel_scale, (sample[3] - 36.53) * 340.0, sample[4] * gyro_scale, sample[5] * gyro_scale, sample[6] * gyro_scale)
+        try:
+            _SAMPLE.pack_into(buf, offset, *map(round, raws))
+        except struct.error: # out of range: the sensor saturates
+            _SAMPLE.pack_into(buf, offset, *[max(-32768, min(32767, round(v))) for v in raws])
+
+
+class FlightScript:
+    """
+    Default pilot for the simulated transmitter. Timing is relative to when the flight loop begins (the board's loop_started_at_us):
+    - standby (channel 5 = 1000) until arm_after_s
+    - flight mode with throttle at 0% for throttle_after_s
+    - then throttle at cruise_throttle with gentle sine-wave stick movement on roll, pitch and yaw
+    """
+
+    def __init__(self, board, arm_after_s:float = 0.25, throttle_after_s:float = 0.25, cruise_throttle:float = 0.5, stick_amplitude:float = 0.3) -> None:
+        self.board = board
+        self.arm_after_s:float = arm_after_s
+        self.throttle_after_s:float = throttle_after_s
+        self.cruise_throttle:float = cruise_throttle
+        self.stick_amplitude:float = stick_amplitude
+
+    def channels(self, t:float) -> list[int]:
+        """Returns the 14 iBUS channel values (1000-2000) at time t (seconds)."""
+        ToReturn:list[int] = [1500] * 14
+        ToReturn[2] = 1000 # throttle (channel 3) down
+        ToReturn[4] = 1000 # mode switch (channel 5) in standby
+        ToReturn[5] = 1000
+
+        started:float = self.board.loop_started_at_us
+        if started is None:
+            return ToReturn
+        since:float = t - (started / 1000000.0)
+        if since < self.arm_after_s:
+            return ToReturn
+        ToReturn[4] = 2000 # flight mode
+        since = since - self.arm_after_s
+        if since < self.throttle_after_s:
+            return ToReturn
+
+        a:float = self.stick_amplitude * 500.0
+        ToReturn[0] = int(1500 + a * math.sin(since * 2.1)) # roll
+        ToReturn[1] = int(1500 + a * math.sin(since * 1.7)) # pitch
+        ToReturn[2] = int(1000 + self.cruise_throttle * 1000.0) # throttle
+        ToReturn[3] = int(1500 + a * math.sin(since * 0.9)) # yaw
+        return ToReturn
+
+
+class IBusTransmitter:
+    """
+    Models a FlySky receiver streaming iBUS frames into a UART: 32-byte frames every period_us, each byte arriving at the baud rate.
+    Bytes accumulate in an RX FIFO of rx_buffer_size bytes; bytes that arrive while it is full are dropped, as on the RP2040.
+    """
+
+    def __init__(self, clock, channels = None, baud:int = 115200, period_us:float = 7000.0, rx_buffer_size:int = 256) -> None:
+        self.clock = clock
+        self.channels = channels # callable(t_seconds) -> list of 14 channel values
+        self.byte_time_us:float = 10.0 * 1000000.0 / baud # 8N1 = 10 bits per byte
+        self.period_us:float = period_us
+        self.rx_buffer_size:int = rx_buffer_size
+        self.rx:bytearray = bytearray()
+        self.dropped:int = 0
+        self.frames_sent:int = 0
+        self._frame:bytearray = bytearray(32)
+        self._next_frame_index:int = None
+        self._next_byte:int = 32 # position within _frame of the next byte to arrive (32 = frame complete)
+        self._frame_start_us:float = 0.0
+        self._arrival_us:float = None # next_arrival_us(), kept from one pump() to the next
+
+    @staticmethod
+    def encode_frame(channels:list[int], buf:bytearray = None) -> bytearray:
+        """Builds a 32-byte iBUS frame (header 0x20 0x40, 14 little-endian channels, little-endian checksum)."""
+        if buf is None:
+            buf = bytearray(32)
+        if len(channels) < 14:
+            channels = list(channels) + ([1500] * (14 - len(channels)))
+        try:
+            _IBUS_CHANNELS.pack_into(buf, 0, 0x20, 0x40, *channels[0:14])
+        except struct.error: # out of the 16 bit range: only the low 16 bits are sent
+            _IBUS_CHANNELS.pack_into(buf, 0, 0x20, 0x40, *[v & 0xFFFF for v in channels[0:14]])
+        checksum:int = (0xFFFF - sum(buf[0:30])) & 0xFFFF
+        buf[30] = checksum & 0xFF
+        buf[31] = checksum >> 8
+        return buf
+
+    def _start_frame(self, index:int) -> None:
+        self._frame_start_us = index * self.period_us
+        chs:list[int] = self.channels(self._frame_start_us / 1000000.0) if self.channels is not None else [1500] * 14
+        IBusTransmitter.encode_frame(chs, self._frame)
+        self._next_byte = 0
+        self.frames_sent = self.frames_sent + 1
+
+    def next_arrival_us(self) -> float:
+        """The virtual time at which the next byte will land in the RX FIFO."""
+        if self._next_frame_index is None:
+            self._next_frame_index = int(self.clock.now_us() // self.period_us) + 1
+        if self._next_byte >= 32:
+            return (self._next_frame_index * self.period_us) + self.byte_time_us
+        return self._frame_start_us + ((self._next_byte + 1) * self.byte_time_us)
+
+    def pump(self) -> None:
+        """Moves every byte that has arrived by now into the RX FIFO."""
+        now:float = self.clock.now_us()
+        arrival:float = self._arrival_us
+        if arrival is None:
+            arrival = self.next_arrival_us()
+        if arrival > now:
+            return # nothing has arrived since the last call (the common case: between frames)
+        while arrival <= now:
+            first:int = self._next_byte
+            if first >= 32:
+                self._start_frame(self._next_frame_index)
+                self._next_frame_index = self._next_frame_index + 1
+                first = 0
+            # every byte of this frame that has landed by now, in one go
+            arrived:int = int((now - self._frame_start_us) / self.byte_time_us)
+            if arrived > 32:
+                arrived = 32
+            elif arrived <= first:
+                arrived = first + 1 # next_arrival_us() said at least one has
+            n:int = arrived - first
+            room:int = self.rx_buffer_size - len(self.rx)
+            if n <= room:
+                self.rx.extend(self._frame[first:arrived])
+            else:
+                if room > 0:
+                    self.rx.extend(self._frame[first:first + room])
+                    n = n - room
+                self.dropped = self.dropped + n
+            self._next_byte = arrived
+            arrival = self.next_arrival_us()
+        self._arrival_us = arrival
@@ -0,0 +1,240 @@
+import ast
+import contextlib
+import importlib.abc
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+import types
+from .clock import SimClock, SimulationComplete
+from .board import Board
+from .stats import CycleStats
+from . import machine as sim_machine
+from . import thread as sim_thread
+from . import uasyncio as sim_uasyncio
+
+SRC_DIR:str = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# modules that are swapped for host stand-ins while the firmware runs
+_STAND_INS:tuple = ("machine", "time", "utime", "_thread", "uasyncio", "micropython") # the micropython stand-in comes from src/emit.py
+
+
+class _SourceLoader(importlib.abc.Loader):
+    """Loads a firmware module from src/ and points its `open` at the sandbox filesystem."""
+
+    def __init__(self, path:str, fs) -> None:
+        self.path:str = path
+        self.fs = fs
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module) -> None:
+        module.__dict__["open"] = self.fs.open
+        with open(self.path, "r") as f:
+            source:str = f.read()
+        exec(compile(source, self.path, "exec"), module.__dict__)
+
+
+class _SourceFinder(importlib.abc.MetaPathFinder):
+    """Resolves top-level imports (ibus, toolkit, ...) to the firmware files in src/, ahead of anything else on sys.path."""
+
+    def __init__(self, src_dir:str, fs) -> None:
+        self.src_dir:str = src_dir
+        self.fs = fs
+
+    def find_spec(self, fullname:str, path, target = None):
+        if "." in fullname:
+            return None
+        fp:str = os.path.join(self.src_dir, fullname + ".py")
+        if not os.path.exists(fp):
+            return None
+        return importlib.util.spec_from_file_location(fullname, fp, loader = _SourceLoader(fp, self.fs))
+
+
+def _strip_entry_point(tree:ast.Module) -> ast.Module:
+    """Removes module level `run()` calls so main.py can be loaded (and its settings overridden) before the flight controller starts."""
+    body:list = []
+    for node in tree.body:
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name) and node.value.func.id == "run":
+            continue
+        body.append(node)
+    tree.body = body
+    return tree
+
+
+class Firmware:
+    """
+    Context manager that installs the host stand-ins (machine, time, _thread, uasyncio) and makes the modules in src/ importable, then restores sys.modules on exit.
+    Inside the context, load_main() returns the unmodified main.py module with its settings available (and overridable) as module globals.
+    """
+
+    def __init__(self, board:Board, src_dir:str = SRC_DIR) -> None:
+        self.board:Board = board
+        self.src_dir:str = src_dir
+        self._finder:_SourceFinder = _SourceFinder(src_dir, board.fs)
+        self._saved:dict = {}
+        self._firmware_modules:list[str] = [f[:-3] for f in os.listdir(src_dir) if f.endswith(".py")]
+
+    def __enter__(self) -> "Firmware":
+        for name in _STAND_INS + tuple(self._firmware_modules):
+            self._saved[name] = sys.modules.pop(name, None)
+        sim_machine.install(self.board)
+        sys.modules["machine"] = sim_machine
+        sys.modules["time"] = self.board.clock.module()
+        sys.modules["utime"] = sys.modules["time"]
+        sys.modules["_thread"] = sim_thread
+        sys.modules["uasyncio"] = sim_uasyncio
+        sys.meta_path.insert(0, self._finder)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # stop any threads the firmware started (second core) before their modules go away
+        self.board.clock.shutdown()
+        for t in self.board.threads:
+            t.join(1.0)
+        sys.meta_path.remove(self._finder)
+        for name, module in self._saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        sim_machine.install(None)
+
+    def load_main(self, overrides:dict = None) -> types.ModuleType:
+        fp:str = os.path.join(self.src_dir, "main.py")
+        with open(fp, "r") as f:
+            tree:ast.Module = _strip_entry_point(ast.parse(f.read(), fp))
+        module:types.ModuleType = types.ModuleType("main")
+        module.__file__ = fp
+        module.__dict__["open"] = self.board.fs.open
+        sys.modules["main"] = module
+        exec(compile(tree, fp, "exec"), module.__dict__)
+        if overrides is not None:
+            for k, v in overrides.items():
+                if k not in module.__dict__:
+                    raise KeyError("main.py has no setting named '" + k + "'")
+                setattr(module, k, v)
+        return module
+
+
+class SimulationResult:
+
+    def __init__(self, stats:CycleStats, console:str, fatal:str, virtual_time_s:float, host_time_s:float, board:Board, handoff:dict = None, vehicle = None) -> None:
+        self.stats:CycleStats = stats
+        self.console:str = console # everything the flight controller printed
+        self.fatal:str = fatal # the FATAL_ERROR message written to /logs, if any
+        self.virtual_time_s:float = virtual_time_s
+        self.host_time_s:float = host_time_s
+        self.board:Board = board
+        self.handoff:dict = handoff if handoff is not None else {} # dual-core mode: mailbox name -> statistics of the handoff between the cores
+        self.vehicle = vehicle # the physics model that was flown (sitl.physics.Multirotor), if any
+        self.loop_virtual_s:float = 0.0 # the part of virtual_time_s / host_time_s spent in the flight loop (after boot and calibration)
+        self.loop_host_s:float = 0.0
+
+    def format(self) -> str:
+        lines:list[str] = []
+        lines.append("Simulated " + str(round(self.virtual_time_s, 3)) + " s in " + str(round(self.host_time_s, 3)) + " s of host time (" + str(round(self.virtual_time_s / max(self.host_time_s, 1e-9), 1)) + "x real time)")
+        if self.loop_virtual_s > 0.0:
+            lines.append("Boot: " + str(round(self.virtual_time_s - self.loop_virtual_s, 3)) + " s from power on to the first flight loop cycle")
+            lines.append("Flight loop: " + str(round(self.loop_virtual_s, 3)) + " s in " + str(round(self.loop_host_s, 3)) + " s of host time (" + str(round(self.loop_virtual_s / max(self.loop_host_s, 1e-9), 1)) + "x real time)")
+        if self.fatal is not None:
+            lines.append("FATAL: " + self.fatal.strip())
+        lines.append(self.stats.format())
+        for name, h in self.handoff.items():
+            lines.append("Handoff " + name + ": " + str(h["received"]) + " of " + str(h["published"]) + " messages read, " + str(h["retries"]) + " retries, latency (us) mean " + str(round(h["latency_mean_us"], 1)) + ", max " + str(h["latency_max_us"]))
+        if self.vehicle is not None:
+            lines.append(self.vehicle.format())
+        return "\n".join(lines)
+
+
+class Simulation:
+    """Runs main.run() unmodified against a simulated board and records per-cycle timing."""
+
+    def __init__(self, max_cycles:int = 2500, duration_s:float = 60.0, clock_mode:str = "host", cpu_scale:float = 1.0, start_us:int = 0, motion = None, channels = None, bus_timing:bool = True, overrides:dict = None, quiet:bool = True, fs_root:str = None, src_dir:str = SRC_DIR, vehicle = None, setup = None) -> None:
+        """
+        :param max_cycles: stop after this many flight loop cycles have been timed.
+        :param duration_s: hard stop after this much virtual time (covers FATAL_ERROR, which never returns).
+        :param clock_mode: "host" to bill real execution time (times cpu_scale) to the loop, "lockstep" for deterministic time that only advances on sleeps and I/O.
+        :param cpu_scale: how many times slower the Pico is than this host (host mode only).
+        :param start_us: initial virtual clock value (use near 2^30 to test ticks wraparound).
+        :param motion: MPU-6050 motion source; defaults to sitting still.
+        :param channels: callable(t_seconds) -> 14 iBUS channels; defaults to devices.FlightScript.
+        :param bus_timing: charge I2C transfers to virtual time.
+        :param overrides: main.py SETTINGS to replace, e.g. {"target_cycle_hz": 500.0}.
+        :param quiet: capture the flight controller's console output instead of printing it.
+        :param fs_root: host directory to use as the Pico filesystem (a temporary directory by default).
+        :param vehicle: a physics model (sitl.physics.Multirotor) to fly closed loop. It replaces motion as the MPU-6050's motion source and is driven by the ESC PWM outputs.
+        :param setup: called as setup(main, board) once main.py is loaded (with its settings overridden), right before main.run(). E.g. to wrap firmware functions (see tools/jitter.py).
+        """
+        self.max_cycles:int = max_cycles
+        self.overrides:dict = overrides
+        self.quiet:bool = quiet
+        self.src_dir:str = src_dir
+        self.clock:SimClock = SimClock(clock_mode, cpu_scale = cpu_scale, start_us = start_us, tick_cost_us = 1.0 if clock_mode == "lockstep" else 0.0)
+        self.clock.stop_at_us = start_us + (duration_s * 1000000.0)
+        if fs_root is None:
+            fs_root = tempfile.mkdtemp(prefix = "scout_sitl_")
+        self.vehicle = vehicle
+        self.setup = setup
+        if vehicle is not None:
+            motion = vehicle
+        self.board:Board = Board(self.clock, fs_root, motion = motion, channels = channels, bus_timing = bus_timing)
+        self.main = None
+
+    def run(self) -> SimulationResult:
+        console:io.StringIO = io.StringIO()
+        host_began:float = time.perf_counter() # the real time module; the stand-in is only installed inside Firmware
+        start_us:float = self.clock.now_us()
+        with Firmware(self.board, self.src_dir) as fw:
+            self.main = fw.load_main(self.overrides)
+            self.board.stats = CycleStats(self.main.target_cycle_hz)
+            self.board.loop_gate = self._loop_running
+            self.board.loop_listeners.append(self._loop_started)
+            self.board.uart_peers = {self.main.rc_uart: self.board.receiver}
+            self.board.max_cycles = self.max_cycles
+            if self.vehicle is not None:
+                self.vehicle.attach(self.board, self.main)
+            if self.setup is not None:
+                self.setup(self.main, self.board)
+            redirect = contextlib.redirect_stdout(console) if self.quiet else contextlib.nullcontext()
+            with redirect:
+                try:
+                    self.main.run()
+                except SimulationComplete:
+                    pass
+        host_ended:float = time.perf_counter()
+        host_s:float = host_ended - host_began
+        logs:bytes = self.board.fs.read("/logs")
+        fatal:str = logs.decode() if logs is not None else None
+        result:SimulationResult = SimulationResult(self.board.stats, console.getvalue(), fatal, (self.clock.now_us() - start_us) / 1000000.0, host_s, self.board, self._handoff(), self.vehicle)
+        if self.board.loop_started_at_us is not None:
+            result.loop_virtual_s = (self.clock.now_us() - self.board.loop_started_at_us) / 1000000.0
+            result.loop_host_s = host_ended - self.board.loop_started_host_s
+        return result
+
+    def _loop_running(self) -> bool:
+        """True once main.run() has started its flight loop (the scheduler has started a cycle)."""
+        return self.main.loop_scheduler is not None and self.main.loop_scheduler.cycles > 0
+
+    def _loop_started(self) -> None:
+        # with adaptive_loop_rate, the loop rate is only known now
+        if self.main.target_cycle_hz != self.board.stats.target_cycle_hz:
+            self.board.stats = CycleStats(self.main.target_cycle_hz)
+
+    def _handoff(self) -> dict:
+        """Statistics of the dual-core mailboxes in main.py (empty when dual-core mode is off)."""
+        handoff:dict = {}
+        for name in ("rc_mailbox", "state_mailbox"):
+            mb = getattr(self.main, name, None)
+            if mb is None:
+                continue
+            handoff[name] = {"published": mb.published, "received": mb.received, "retries": mb.retries, "latency_mean_us": mb.latency_total_us / max(1, mb.received), "latency_max_us": mb.latency_max_us}
+        return handoff
+
+
+def run(**kwargs) -> SimulationResult:
+    """Convenience wrapper: Simulation(**kwargs).run()"""
+    return Simulation(**kwargs).run()
@@ -0,0 +1,332 @@
+"""
+Host stand-in for MicroPython's `machine` module (the subset Scout uses on the Raspberry Pi Pico).
+Installed as sys.modules["machine"] by the SITL harness. Every peripheral talks to the active Board (see board.py), which owns the simulated clock and devices.
+"""
+
+import sys
+import traceback
+
+_board = None # the active sitl.board.Board, set by install()
+
+def install(board) -> None:
+    global _board
+    _board = board
+
+def _active():
+    if _board is None:
+        raise RuntimeError("No simulated board is installed. Use sitl.board.Board(...) with the SITL harness.")
+    return _board
+
+def freq(hz:int = None) -> int:
+    b = _active()
+    if hz is not None:
+        b.cpu_freq_hz = hz
+    return b.cpu_freq_hz
+
+def reset() -> None:
+    raise SystemExit("machine.reset() called")
+
+def unique_id() -> bytes:
+    return b"SCOUTSIM"
+
+def disable_irq() -> int:
+    return _active().clock.disable_irq()
+
+def enable_irq(state:int = 0) -> None:
+    _active().clock.enable_irq(state)
+
+def idle() -> None:
+    # waits for the next interrupt: a timer's, or at the latest the next 1 ms system tick
+    clock = _active().clock
+    clock.advance(max(1.0, clock.until_interrupt_us(1000.0)))
+
+
+class Pin:
+
+    IN:int = 0
+    OUT:int = 1
+    OPEN_DRAIN:int = 2
+    PULL_UP:int = 1
+    PULL_DOWN:int = 2
+    IRQ_FALLING:int = 4
+    IRQ_RISING:int = 8
+
+    def __init__(self, id, mode:int = -1, pull:int = -1, value:int = None) -> None:
+        self.id = id
+        self.mode:int = mode
+        self.pull:int = pull
+        self._board = _active()
+        if value is not None:
+            self.value(value)
+
+    def value(self, v:int = None):
+        if v is None:
+            return self._board.pin_values.get(self.id, 0)
+        self._board.set_pin(self.id, 1 if v else 0)
+
+    def on(self) -> None:
+        self.value(1)
+
+    def off(self) -> None:
+        self.value(0)
+
+    def high(self) -> None:
+        self.value(1)
+
+    def low(self) -> None:
+        self.value(0)
+
+    def toggle(self) -> None:
+        self.value(0 if self.value() else 1)
+
+    def __call__(self, v:int = None):
+        return self.value(v)
+
+
+class I2C:
+
+    def __init__(self, id:int, scl:Pin = None, sda:Pin = None, freq:int = 400000, timeout:int = 50000) -> None:
+        self.id:int = id
+        self.freq:int = freq
+        self._board = _active()
+
+    def _device(self, addr:int):
+        dev = self._board.i2c_devices.get((self.id, addr))
+        if dev is None:
+            raise OSError(5) # EIO, what MicroPython raises when nothing ACKs
+        return dev
+
+    def _bus_time(self, nbytes:int, read:bool) -> None:
+        # start + address + register byte (+ repeated start + address for reads) + data, 9 clocks per byte
+        overhead:int = 4 if read else 2
+        self._board.bus_wait(((nbytes + overhead) * 9 * 1000000.0) / self.freq)
+
+    def scan(self) -> list[int]:
+        return sorted([addr for (bus, addr) in self._board.i2c_devices if bus == self.id])
+
+    def writeto_mem(self, addr:int, memaddr:int, buf, addrsize:int = 8) -> None:
+        self._board.clock.pause()
+        try:
+            dev = self._device(addr)
+            dev.write(memaddr, buf)
+        finally:
+            self._board.clock.resume()
+        self._bus_time(len(buf), False)
+
+    def readfrom_mem(self, addr:int, memaddr:int, nbytes:int, addrsize:int = 8) -> bytes:
+        self._board.clock.pause()
+        try:
+            data = self._device(addr).read(memaddr, nbytes)
+        finally:
+            self._board.clock.resume()
+        self._bus_time(nbytes, True)
+        return data
+
+    def readfrom_mem_into(self, addr:int, memaddr:int, buf, addrsize:int = 8) -> None:
+        board = self._board
+        clock = board.clock
+        if clock.lockstep:
+            # the common case, inlined (this runs on every IMU read): nothing to pause, as host execution time never counts in lockstep mode
+            dev = board.i2c_devices.get((self.id, addr))
+            if dev is None:
+                raise OSError(5)
+            dev.read_into(memaddr, buf)
+            if board.bus_timing:
+                clock.advance(((len(buf) + 4) * 9 * 1000000.0) / self.freq) # as _bus_time()
+            return
+        clock.pause()
+        try:
+            self._device(addr).read_into(memaddr, buf)
+        finally:
+            clock.resume()
+        self._bus_time(len(buf), True)
+
+
+class UART:
+
+    def __init__(self, id:int, baudrate:int = 115200, bits:int = 8, parity = None, stop:int = 1, tx:Pin = None, rx:Pin = None, timeout:int = 0, timeout_char:int = 0, rxbuf:int = 256, **kwargs) -> None:
+        self.id:int = id
+        self._board = _active()
+        self.init(baudrate, timeout = timeout, timeout_char = timeout_char)
+
+    def init(self, baudrate:int = 115200, bits:int = 8, parity = None, stop:int = 1, timeout:int = 0, timeout_char:int = 0, **kwargs) -> None:
+        self.baudrate:int = baudrate
+        self.timeout_ms:int = timeout
+        # as on the rp2 port, timeout_char is never shorter than 13 bit-times
+        self.timeout_char_us:float = max(timeout_char * 1000.0, 13 * 1000000.0 / baudrate)
+
+    def deinit(self) -> None:
+        pass
+
+    def any(self) -> int:
+        peer = self._board.uart_peers.get(self.id)
+        if peer is None:
+            return 0
+        clock = self._board.clock
+        if clock.lockstep: # nothing to pause (host execution time never counts in lockstep mode); the flight loop calls this every cycle
+            peer.pump()
+            return len(peer.rx)
+        clock.pause()
+        try:
+            peer.pump()
+            return len(peer.rx)
+        finally:
+            clock.resume()
+
+    def _pump(self, peer) -> None:
+        clock = self._board.clock
+        if clock.lockstep:
+            peer.pump()
+            return
+        clock.pause()
+        try:
+            peer.pump()
+        finally:
+            clock.resume()
+
+    def _wait_for_byte(self, peer, timeout_us:float) -> bool:
+        """Blocks (in virtual time) until a byte is in the RX FIFO, or timeout_us passes. Returns True if a byte is available."""
+        self._pump(peer)
+        if len(peer.rx) > 0:
+            return True
+        clock = self._board.clock
+        clock.pause()
+        try:
+            arrival:float = peer.next_arrival_us()
+            now:float = clock.now_us()
+        finally:
+            clock.resume()
+        if arrival - now <= timeout_us:
+            clock.advance(arrival - now)
+            self._pump(peer)
+            return len(peer.rx) > 0
+        clock.advance(timeout_us)
+        return False
+
+    def readinto(self, buf, nbytes:int = None) -> int:
+        peer = self._board.uart_peers.get(self.id)
+        if peer is None:
+            return None
+        if nbytes is None:
+            nbytes = len(buf)
+        rx:bytearray = peer.rx
+        if len(rx) >= nbytes:
+            # the common case (the flight loop asks for what any() just said was there): no waiting, and nothing to pump
+            buf[0:nbytes] = rx[0:nbytes]
+            del rx[0:nbytes]
+            return nbytes if nbytes > 0 else None
+        count:int = 0
+        while count < nbytes:
+            timeout_us:float = (self.timeout_ms * 1000.0) if count == 0 else self.timeout_char_us
+            if not self._wait_for_byte(peer, timeout_us):
+                break
+            # everything already in the RX FIFO is taken at once; waiting only happens for bytes still on the wire
+            n:int = min(nbytes - count, len(peer.rx))
+            buf[count:count + n] = peer.rx[0:n]
+            del peer.rx[0:n]
+            count = count + n
+        if count == 0:
+            return None
+        return count
+
+    def read(self, nbytes:int = None) -> bytes:
+        if nbytes is None:
+            nbytes = self.any()
+            if nbytes == 0:
+                return None
+        buf:bytearray = bytearray(nbytes)
+        count:int = self.readinto(buf)
+        if count is None:
+            return None
+        return bytes(buf[0:count])
+
+    def write(self, buf) -> int:
+        return len(buf)
+
+
+class PWM:
+
+    def __init__(self, dest:Pin, freq:int = None, duty_u16:int = None, duty_ns:int = None) -> None:
+        self.pin:Pin = dest
+        self._board = _active()
+        self._gpio = dest.id
+        self._written = self._board.pwm_written # called on every motor write, so bound once
+        self._freq:int = 0
+        self._duty_ns:int = 0
+        self._board.pwm_channels[dest.id] = self
+        if freq is not None:
+            self.freq(freq)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+        if duty_ns is not None:
+            self.duty_ns(duty_ns)
+
+    def freq(self, value:int = None) -> int:
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_ns(self, value:int = None) -> int:
+        if value is None:
+            return self._duty_ns
+        value = int(value)
+        self._duty_ns = value
+        self._written(self._gpio, value)
+
+    def duty_u16(self, value:int = None) -> int:
+        period_ns:float = (1000000000.0 / self._freq) if self._freq > 0 else 0.0
+        if value is None:
+            if period_ns == 0.0:
+                return 0
+            return int(self._duty_ns * 65535 / period_ns)
+        self.duty_ns(int(period_ns * value / 65535))
+
+    def deinit(self) -> None:
+        self._board.pwm_channels.pop(self.pin.id, None)
+
+
+class Timer:
+    """
+    A timer interrupt, raised by the board's SimClock in virtual time: callback(timer) runs at every due time, interrupting whatever was running (see SimClock).
+    As on the rp2 port, a periodic timer keeps to an absolute schedule, freq sets the period to whole microseconds, and an exception in the callback is printed and stops the timer.
+    """
+
+    ONE_SHOT:int = 0
+    PERIODIC:int = 1
+
+    def __init__(self, id:int = -1, **kwargs) -> None:
+        self.id:int = id
+        self._board = _active()
+        self.callback = None
+        self.hard:bool = False
+        self.period_us:float = 0.0 # 0 for a one shot timer
+        self.due_us:float = 0.0
+        if len(kwargs) > 0:
+            self.init(**kwargs)
+
+    def init(self, mode:int = PERIODIC, freq:float = None, period:int = -1, tick_hz:int = 1000, callback = None, hard:bool = False) -> None:
+        self.deinit()
+        if freq is not None:
+            delta_us:float = float(int(1000000.0 / freq))
+        else:
+            delta_us:float = period * 1000000.0 / tick_hz
+        if delta_us <= 0:
+            raise ValueError("period too small")
+        self.callback = callback
+        self.hard = hard
+        self.period_us = delta_us if mode == Timer.PERIODIC else 0.0
+        self.due_us = self._board.clock.now_us() + delta_us
+        self._board.clock.add_timer(self)
+
+    def deinit(self) -> None:
+        self._board.clock.remove_timer(self)
+
+    def fire(self) -> None:
+        if self.callback is None:
+            return
+        try:
+            self.callback(self)
+        except Exception:
+            print("Uncaught exception in IRQ callback handler", file = sys.stdout)
+            traceback.print_exc(file = sys.stdout)
+            self.deinit()
@@ -0,0 +1,356 @@
+import math
+import random
+from math import sqrt
+
+GRAVITY:float = 9.80665 # m/s^2
+_DEG_PER_RAD:float = 180.0 / math.pi # what math.degrees() multiplies by, without the call (sample() runs on every IMU read)
+
+class Multirotor:
+    """
+    Rigid-body (6 degrees of freedom) model of the craft, for flying the flight controller closed loop.
+    It is a motion source for the simulated MPU-6050 (see devices.StaticMotion) and listens to the ESC PWM outputs, so the unmodified main.run() flies it: the duty cycles it writes spin up the motors, and the gyro and accelerometer report what the body does in response.
+
+    Frames: the body frame is x forward, y right, z down and the world frame is north, east, down (z = 0 is the ground). Positive body rates are Scout's positive roll (right side down), pitch (nose up) and yaw (nose right) rates.
+    The MPU-6050 is mounted the way main.py expects (gyro_flip = (-1, 1, -1)): its x axis points backward, y right and z up.
+
+    Each motor follows its ESC command (duty cycle, 1-2 ms) with a first order lag on its speed, and makes thrust along a curve between linear and quadratic in speed. Its yaw reaction torque is proportional to its thrust.
+    Integration is fixed-step (semi-implicit Euler, quaternion attitude) and lazy: the model only steps forward when a sample is asked for, to the time of that sample. In lockstep clock mode a flight is exactly repeatable.
+    """
+
+    def __init__(self, mass_kg:float = 1.0, arm_m:float = 0.225, inertia:tuple = (0.011, 0.011, 0.020), hover_command:float = 0.155, thrust_expo:float = 0.7, torque_per_thrust_m:float = 0.016, motor_tau_s:float = 0.035, esc_floor_ns:int = 1000000, esc_ceiling_ns:int = 2000000, drag:float = 0.25, rotational_drag:float = 0.002, step_s:float = 0.004, gyro_bias_dps:tuple = (-1.2, 0.8, 0.35), gyro_noise_dps:float = 0.05, accel_noise_g:float = 0.002, temperature_c:float = 25.0, seed:int = 1) -> None:
+        """
+        :param mass_kg: all-up weight.
+        :param arm_m: distance from the center to each motor.
+        :param inertia: moments of inertia about the body x, y and z axes (kg m^2).
+        :param hover_command: ESC command (0.0 = 1 ms, 1.0 = 2 ms) at which the motors together just hold the craft's weight. Sets the maximum thrust of each motor.
+        :param thrust_expo: shape of the thrust curve, thrust = max * ((1 - expo) * speed + expo * speed^2), speed being 0.0-1.0. 1.0 is an ideal propeller.
+        :param torque_per_thrust_m: yaw reaction torque of a motor per newton of its thrust.
+        :param motor_tau_s: time constant of the motor speed following the ESC command.
+        :param drag: linear air drag (N per m/s).
+        :param rotational_drag: rotational damping (N m per rad/s).
+        :param step_s: longest integration step. The model steps to each IMU sample in equal steps of at most this: one per sample at a 250 Hz loop, which flies the same as shorter steps to well within the sensor noise.
+        """
+        self.mass_kg:float = mass_kg
+        self.arm_m:float = arm_m
+        self.inertia:tuple = inertia
+        self.thrust_expo:float = thrust_expo
+        self.torque_per_thrust_m:float = torque_per_thrust_m
+        self.motor_tau_s:float = motor_tau_s
+        self.esc_floor_ns:int = esc_floor_ns
+        self.esc_ceiling_ns:int = esc_ceiling_ns
+        self.drag:float = drag
+        self.rotational_drag:float = rotational_drag
+        self.step_s:float = step_s
+        self.gyro_bias_dps:tuple = gyro_bias_dps
+        self.gyro_noise_dps:float = gyro_noise_dps
+        self.accel_noise_g:float = accel_noise_g
+        self.temperature_c:float = temperature_c
+        rng = random.Random(seed)
+        self._noise:list[float] = [rng.gauss(0.0, 1.0) for i in range(4099)] # standard normal samples, drawn once and cycled through (drawing 6 per IMU sample would cost more than the physics)
+        self._noise_index:int = 0
+        curve_at_hover:float = ((1.0 - thrust_expo) * hover_command) + (thrust_expo * hover_command * hover_command)
+        self.hover_command:float = hover_command
+        self.max_thrust_n:float = None # per motor; set by set_layout()
+        self._curve_at_hover:float = curve_at_hover
+        self._inv_mass:float = 1.0 / mass_kg
+        self._inv_inertia:tuple = (1.0 / inertia[0], 1.0 / inertia[1], 1.0 / inertia[2])
+        self._gyroscopic:tuple = (inertia[2] - inertia[1], inertia[0] - inertia[2], inertia[1] - inertia[0]) # (Izz - Iyy, Ixx - Izz, Iyy - Ixx), for Euler's equations
+        self._thrust_a:float = 0.0 # thrust = a * speed + b * speed^2 (set_layout())
+        self._thrust_b:float = 0.0
+
+        # motors (set_layout())
+        self.motors:int = 0
+        self._mx:list[float] = [] # position, body x (m)
+        self._my:list[float] = [] # position, body y (m)
+        self._spin:list[float] = [] # 1 = clockwise (seen from above), -1 = counter clockwise
+        self._torque:list[tuple] = [] # (roll, pitch, yaw) torque per newton of each motor's thrust
+        self.command:list[float] = [] # ESC command of every motor, 0.0-1.0
+        self.speed:list[float] = [] # motor speed, 0.0-1.0
+        self._gpios:list[int] = [] # PWM GPIO of every motor
+        self._gpio_index:dict = {} # gpio -> motor index
+        self._esc_outputs:dict = None # gpio -> duty cycle (ns) of the board's PWM outputs, once attached
+
+        # state
+        self.time_s:float = 0.0
+        self.position:list[float] = [0.0, 0.0, 0.0] # world (m); z is down, so altitude is -z
+        self.velocity:list[float] = [0.0, 0.0, 0.0] # world (m/s)
+        self.attitude:list[float] = [1.0, 0.0, 0.0, 0.0] # quaternion w, x, y, z, body to world
+        self.rates:list[float] = [0.0, 0.0, 0.0] # body (rad/s)
+        self.specific_force:list[float] = [0.0, 0.0, -GRAVITY] # body (m/s^2), what an accelerometer measures
+        self.on_ground:bool = True
+        self.external_torque:list[float] = [0.0, 0.0, 0.0] # body (N m), e.g. a gust; set by a test scenario
+
+        # flight statistics
+        self.steps:int = 0
+        self.max_altitude_m:float = 0.0
+        self._min_r22:float = 1.0 # smallest cos(tilt) so far
+        self._max_rate:float = 0.0 # rad/s
+        self.landings:int = 0
+        self.crashed_at_s:float = None # first ground contact faster than crash_speed_mps, or with the craft on its side
+        self.crash_speed_mps:float = 3.0
+
+        self.set_layout(((315.0, 1), (45.0, -1), (225.0, -1), (135.0, 1))) # Scout's quad-x (mixer.LAYOUTS["quad-x"])
+
+    ##### wiring #####
+
+    def set_layout(self, layout:tuple, gpios:list[int] = None) -> None:
+        """
+        Places the motors: layout is an (angle clockwise from the nose in degrees, spin) pair per motor, in motor order, as in mixer.LAYOUTS.
+        gpios is the PWM GPIO of every motor, in the same order (main.gpio_motors).
+        """
+        self.motors = len(layout)
+        self._mx = [self.arm_m * math.cos(math.radians(a)) for a, s in layout]
+        self._my = [self.arm_m * math.sin(math.radians(a)) for a, s in layout]
+        self._spin = [float(s) for a, s in layout]
+        self.command = [0.0] * self.motors
+        self.speed = [0.0] * self.motors
+        self.max_thrust_n = self.mass_kg * GRAVITY / (self.motors * self._curve_at_hover)
+        self._thrust_a = self.max_thrust_n * (1.0 - self.thrust_expo)
+        self._thrust_b = self.max_thrust_n * self.thrust_expo
+        # thrust points up (-z), so r x F = (-y F, x F, 0). A clockwise propeller turns the body counter clockwise.
+        self._torque = [(-self._my[i], self._mx[i], -self._spin[i] * self.torque_per_thrust_m) for i in range(self.motors)]
+        self._gpios = list(gpios) if gpios is not None else []
+        self._gpio_index = {}
+        for i, gpio in enumerate(self._gpios):
+            self._gpio_index[gpio] = i
+
+    def attach(self, board, main) -> None:
+        """
+        Wires the model to a simulated board running main.py: motor layout and GPIO's from main's settings, ESC commands from the board's PWM outputs.
+        The model only steps when a sample is asked for, so it reads the outputs then (the last duty cycle written to each is what the motors have been following), rather than on every write.
+        """
+        self.set_layout(main.mixer.LAYOUTS[main.frame_layout], list(main.gpio_motors))
+        self._esc_outputs = board.duty_ns
+
+    def pwm_written(self, gpio:int, duty_ns:int) -> None:
+        """An ESC PWM output changed (for driving the model without a board; see attach())."""
+        i:int = self._gpio_index.get(gpio, -1)
+        if i < 0:
+            return
+        u:float = (duty_ns - self.esc_floor_ns) / (self.esc_ceiling_ns - self.esc_floor_ns)
+        self.command[i] = 0.0 if u < 0.0 else (1.0 if u > 1.0 else u)
+
+    def _read_escs(self) -> None:
+        """Takes every motor's ESC command from the board's PWM outputs (see attach())."""
+        outputs:dict = self._esc_outputs
+        command:list[float] = self.command
+        floor:int = self.esc_floor_ns
+        span:int = self.esc_ceiling_ns - self.esc_floor_ns
+        for i, duty_ns in enumerate(map(outputs.get, self._gpios)):
+            if duty_ns is not None:
+                u:float = (duty_ns - floor) / span
+                command[i] = 0.0 if u < 0.0 else (1.0 if u > 1.0 else u)
+
+    ##### motion source #####
+
+    def sample(self, t:float) -> tuple:
+        """Returns (accel_x, accel_y, accel_z, temperature, gyro_x, gyro_y, gyro_z) at time t (seconds), in the sensor's frame and units (g, celsius, degrees per second), after stepping the model to t."""
+        self.advance_to(t)
+        noise:list[float] = self._noise
+        k:int = self._noise_index
+        if k + 6 > len(noise):
+            k = 0
+        self._noise_index = k + 6
+        gb = self.gyro_bias_dps
+        gn:float = self.gyro_noise_dps
+        an:float = self.accel_noise_g
+        f = self.specific_force
+        w = self.rates
+        return (
+            (-f[0] / GRAVITY) + (an * noise[k]),
+            (f[1] / GRAVITY) + (an * noise[k + 1]),
+            (-f[2] / GRAVITY) + (an * noise[k + 2]),
+            self.temperature_c,
+            (-w[0] * _DEG_PER_RAD) + gb[0] + (gn * noise[k + 3]),
+            (w[1] * _DEG_PER_RAD) + gb[1] + (gn * noise[k + 4]),
+            (-w[2] * _DEG_PER_RAD) + gb[2] + (gn * noise[k + 5]),
+        )
+
+    ##### dynamics #####
+
+    def advance_to(self, t:float) -> None:
+        """Steps the model forward to time t (seconds), in equal steps of at most step_s. Earlier times are ignored (the model cannot go back)."""
+        if t <= self.time_s:
+            return
+        if self._esc_outputs is not None:
+            self._read_escs()
+        if self.on_ground and max(self.command) <= 0.0 and max(self.speed) <= 0.0:
+            self.time_s = t # sitting still with the motors stopped: nothing changes, so skip ahead (e.g. while the flight controller boots and calibrates)
+            return
+        elapsed:float = t - self.time_s
+        step_s:float = self.step_s
+        n:int = int((elapsed / step_s) + 0.999) if elapsed > step_s else 1 # a sample period of step_s (give or take rounding) is one step
+        self.step(n, elapsed / n)
+        self.time_s = t
+
+    def step(self, n:int = 1, dt:float = None) -> None:
+        """
+        n integration steps of dt seconds (step_s if not given). The state is held in locals for the whole run, as this is where nearly all of the model's time goes.
+        Translation is worked out in the world frame, where the drag is simply against the velocity, so each step only needs the direction the thrust points in (the attitude's third column). The specific force the accelerometer measures is worked out once, after the last step.
+        """
+        if dt is None:
+            dt = self.step_s
+        inv_m:float = self._inv_mass
+        inv_ixx, inv_iyy, inv_izz = self._inv_inertia
+        izz_iyy, ixx_izz, iyy_ixx = self._gyroscopic
+        lag:float = 1.0 - math.exp(-dt / self.motor_tau_s) # fraction of the way to its command a motor gets in one step
+        ta:float = self._thrust_a
+        tb:float = self._thrust_b
+        cd:float = self.drag
+        cr:float = self.rotational_drag
+        h:float = 0.5 * dt
+        command:list[float] = self.command
+        speed:list[float] = self.speed
+        torque:list[tuple] = self._torque
+        motors = range(self.motors)
+        px, py, pz = self.position
+        vx, vy, vz = self.velocity
+        qw, qx, qy, qz = self.attitude
+        p, q, r = self.rates
+        ex, ey, ez = self.external_torque
+        on_ground:bool = self.on_ground
+        resting:bool = False # the last step sat on the ground
+        thrust:float = 0.0
+        time_s:float = self.time_s
+
+        for k in range(n):
+            time_s = time_s + dt
+
+            # motors: speed lags the command, thrust and torques follow the speed
+            thrust = 0.0
+            tx:float = ex - (cr * p)
+            ty:float = ey - (cr * q)
+            tz:float = ez - (cr * r)
+            for i in motors:
+                s:float = speed[i]
+                s = s + ((command[i] - s) * lag)
+                speed[i] = s
+                f:float = s * (ta + (tb * s))
+                thrust = thrust + f
+                kx, ky, kz = torque[i]
+                tx = tx + (kx * f)
+                ty = ty + (ky * f)
+                tz = tz + (kz * f)
+
+            # where the thrust (body -z) points in the world frame: the third column of the body to world rotation. r22 is also the cosine of the tilt.
+            r02:float = 2.0 * (qx * qz + qw * qy)
+            r12:float = 2.0 * (qy * qz - qw * qx)
+            r22:float = 1.0 - 2.0 * (qx * qx + qy * qy)
+
+            # translation (world): thrust, drag against the velocity, gravity
+            az:float = (((-thrust * r22) - (cd * vz)) * inv_m) + GRAVITY
+            if on_ground:
+                if az >= 0.0:
+                    resting = True # the ground holds the weight the thrust doesn't, and the craft sits still
+                    continue
+                on_ground = False
+            resting = False
+            vx = vx + ((((-thrust * r02) - (cd * vx)) * inv_m) * dt)
+            vy = vy + ((((-thrust * r12) - (cd * vy)) * inv_m) * dt)
+            vz = vz + (az * dt)
+            px = px + (vx * dt)
+            py = py + (vy * dt)
+            pz = pz + (vz * dt)
+
+            # rotation (body): Euler's equations
+            p = p + ((tx - (izz_iyy * q * r)) * inv_ixx * dt)
+            q = q + ((ty - (ixx_izz * p * r)) * inv_iyy * dt)
+            r = r + ((tz - (iyy_ixx * p * q)) * inv_izz * dt)
+
+            # attitude: q' = q + 0.5 * q * (0, p, q, r) * dt, renormalized
+            nw:float = qw + h * (-qx * p - qy * q - qz * r)
+            nx:float = qx + h * (qw * p + qy * r - qz * q)
+            ny:float = qy + h * (qw * q - qx * r + qz * p)
+            nz:float = qz + h * (qw * r + qx * q - qy * p)
+            norm:float = 1.0 / sqrt(nw * nw + nx * nx + ny * ny + nz * nz)
+            qw = nw * norm
+            qx = nx * norm
+            qy = ny * norm
+            qz = nz * norm
+
+            # ground contact: the craft stops, and settles level (keeping its heading)
+            if pz >= 0.0:
+                impact:float = sqrt(vx * vx + vy * vy + vz * vz)
+                if self.crashed_at_s is None and (impact > self.crash_speed_mps or r22 < 0.5): # harder than crash_speed_mps, or tilted more than 60 degrees
+                    self.crashed_at_s = time_s
+                self.landings = self.landings + 1
+                on_ground = True
+                pz = 0.0
+                vx, vy, vz = 0.0, 0.0, 0.0
+                p, q, r = 0.0, 0.0, 0.0
+                heading:float = math.atan2(2.0 * (qw * qz + qx * qy), 1.0 - 2.0 * (qy * qy + qz * qz))
+                qw, qx, qy, qz = math.cos(heading / 2.0), 0.0, 0.0, math.sin(heading / 2.0)
+
+        # statistics, once per call (every IMU sample) rather than on every step. Tilt and rate are kept cheaply here, and converted to degrees by summary().
+        r22:float = 1.0 - 2.0 * (qx * qx + qy * qy)
+        if pz < -self.max_altitude_m:
+            self.max_altitude_m = -pz
+        if r22 < self._min_r22:
+            self._min_r22 = r22
+        max_rate:float = self._max_rate
+        if p > max_rate or q > max_rate or r > max_rate or p < -max_rate or q < -max_rate or r < -max_rate:
+            self._max_rate = max(abs(p), abs(q), abs(r))
+
+        # what the accelerometer measures (body): thrust and drag (R^T of the drag), or at rest, the ground holding up the weight (R^T (0, 0, -g))
+        r20:float = 2.0 * (qx * qz - qw * qy)
+        r21:float = 2.0 * (qy * qz + qw * qx)
+        if resting:
+            self.specific_force = [r20 * -GRAVITY, r21 * -GRAVITY, r22 * -GRAVITY]
+        else:
+            r00:float = 1.0 - 2.0 * (qy * qy + qz * qz)
+            r01:float = 2.0 * (qx * qy - qw * qz)
+            r02:float = 2.0 * (qx * qz + qw * qy)
+            r10:float = 2.0 * (qx * qy + qw * qz)
+            r11:float = 1.0 - 2.0 * (qx * qx + qz * qz)
+            r12:float = 2.0 * (qy * qz - qw * qx)
+            self.specific_force = [-cd * (r00 * vx + r10 * vy + r20 * vz) * inv_m, -cd * (r01 * vx + r11 * vy + r21 * vz) * inv_m, (-thrust - (cd * (r02 * vx + r12 * vy + r22 * vz))) * inv_m]
+
+        self.position = [px, py, pz]
+        self.velocity = [vx, vy, vz]
+        self.attitude = [qw, qx, qy, qz]
+        self.rates = [p, q, r]
+        self.on_ground = on_ground
+        self.time_s = time_s
+        self.steps = self.steps + n
+
+    ##### readouts #####
+
+    @property
+    def thrust_n(self) -> list[float]:
+        """Thrust of every motor (N), from its speed."""
+        return [s * (self._thrust_a + (self._thrust_b * s)) for s in self.speed]
+
+    def euler_deg(self) -> tuple:
+        """(roll, pitch, yaw) in degrees, from the attitude quaternion (Tait-Bryan, z-y-x)."""
+        qw, qx, qy, qz = self.attitude
+        roll:float = math.atan2(2.0 * (qw * qx + qy * qz), 1.0 - 2.0 * (qx * qx + qy * qy))
+        pitch:float = math.asin(max(-1.0, min(1.0, 2.0 * (qw * qy - qz * qx))))
+        yaw:float = math.atan2(2.0 * (qw * qz + qx * qy), 1.0 - 2.0 * (qy * qy + qz * qz))
+        return (math.degrees(roll), math.degrees(pitch), math.degrees(yaw))
+
+    def summary(self) -> dict:
+        roll, pitch, yaw = self.euler_deg()
+        return {
+            "time_s": self.time_s,
+            "position_m": list(self.position),
+            "altitude_m": -self.position[2],
+            "attitude_deg": [roll, pitch, yaw],
+            "rates_dps": [math.degrees(w) for w in self.rates],
+            "motor_thrust_n": self.thrust_n,
+            "max_altitude_m": self.max_altitude_m,
+            "max_tilt_deg": math.degrees(math.acos(max(-1.0, min(1.0, self._min_r22)))),
+            "max_rate_dps": math.degrees(self._max_rate),
+            "on_ground": self.on_ground,
+            "crashed_at_s": self.crashed_at_s,
+            "steps": self.steps,
+        }
+
+    def format(self) -> str:
+        s:dict = self.summary()
+        lines:list[str] = []
+        lines.append("Physics: " + str(s["steps"]) + " steps of up to " + str(self.step_s * 1000.0) + " ms over " + str(round(s["time_s"], 3)) + " s")
+        lines.append("  now: altitude " + str(round(s["altitude_m"], 2)) + " m, attitude (deg) roll " + str(round(s["attitude_deg"][0], 1)) + ", pitch " + str(round(s["attitude_deg"][1], 1)) + ", yaw " + str(round(s["attitude_deg"][2], 1)) + (", on the ground" if s["on_ground"] else ""))
+        lines.append("  max: altitude " + str(round(s["max_altitude_m"], 2)) + " m, tilt " + str(round(s["max_tilt_deg"], 1)) + " deg, rate " + str(round(s["max_rate_dps"], 1)) + " deg/s")
+        if s["crashed_at_s"] is not None:
+            lines.append("  CRASHED at " + str(round(s["crashed_at_s"], 3)) + " s")
+        return "\n".join(lines)
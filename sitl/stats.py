@@ -0,0 +1,118 @@
+import math
+
+class CycleStats:
+    """
+    Per-cycle timing statistics for the flight control loop, measured against target_cycle_hz.
+    A cycle begins every time the IMU sample registers are read and its latency is the time from that read until the last motor PWM write that follows it.
+    """
+
+    def __init__(self, target_cycle_hz:float, overrun_tolerance:float = 0.02, histogram_bin_fraction:float = 0.05, histogram_max_fraction:float = 3.0) -> None:
+        """
+        :param target_cycle_hz: the loop rate the flight controller is trying to hold.
+        :param overrun_tolerance: a cycle counts as an overrun when its period is longer than the target period by more than this fraction.
+        :param histogram_bin_fraction: width of each histogram bin, as a fraction of the target period.
+        :param histogram_max_fraction: the histogram covers 0 to this multiple of the target period; anything longer lands in the overflow bin.
+        """
+        self.target_cycle_hz:float = target_cycle_hz
+        self.target_period_us:float = 1000000.0 / target_cycle_hz
+        self.overrun_tolerance:float = overrun_tolerance
+        self.bin_width_us:float = self.target_period_us * histogram_bin_fraction
+        self.bin_count:int = int(math.ceil(histogram_max_fraction / histogram_bin_fraction))
+
+        self.periods_us:list[float] = [] # start-to-start time of each completed cycle
+        self.latencies_us:list[float] = [] # IMU read to last PWM write, for cycles that wrote PWM
+        self.histogram:list[int] = [0] * (self.bin_count + 1) # the final bin is overflow
+        self.overruns:int = 0
+
+        self._cycle_start_us:float = None
+        self._last_pwm_us:float = None
+
+    def cycle_started(self, now_us:float, last_pwm_us:float = None) -> None:
+        """:param last_pwm_us: the time of the ending cycle's last PWM write, if it wasn't passed to pwm_written()."""
+        if self._cycle_start_us is not None:
+            if last_pwm_us is not None:
+                self._last_pwm_us = last_pwm_us
+            self._close(now_us)
+        self._cycle_start_us = now_us
+        self._last_pwm_us = None
+
+    def pwm_written(self, now_us:float) -> None:
+        if self._cycle_start_us is not None:
+            self._last_pwm_us = now_us
+
+    def _close(self, now_us:float) -> None:
+        period:float = now_us - self._cycle_start_us
+        self.periods_us.append(period)
+        if self._last_pwm_us is not None:
+            self.latencies_us.append(self._last_pwm_us - self._cycle_start_us)
+        if period > self.target_period_us * (1.0 + self.overrun_tolerance):
+            self.overruns = self.overruns + 1
+        index:int = int(period / self.bin_width_us)
+        self.histogram[min(index, self.bin_count)] += 1
+
+    @property
+    def cycles(self) -> int:
+        return len(self.periods_us)
+
+    ##### summaries #####
+
+    @staticmethod
+    def _percentile(ordered:list[float], p:float) -> float:
+        if len(ordered) == 0:
+            return 0.0
+        k:int = min(len(ordered) - 1, max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1))
+        return ordered[k]
+
+    @staticmethod
+    def _distribution(values:list[float]) -> dict:
+        if len(values) == 0:
+            return {"min": 0.0, "mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        ordered:list[float] = sorted(values)
+        return {
+            "min": ordered[0],
+            "mean": sum(ordered) / len(ordered),
+            "p50": CycleStats._percentile(ordered, 50.0),
+            "p99": CycleStats._percentile(ordered, 99.0),
+            "max": ordered[-1],
+        }
+
+    def summary(self) -> dict:
+        """Returns the statistics as a plain dictionary (JSON friendly)."""
+        deviations:list[float] = [p - self.target_period_us for p in self.periods_us]
+        jitter_rms:float = math.sqrt(sum([d * d for d in deviations]) / len(deviations)) if len(deviations) > 0 else 0.0
+        jitter_peak:float = max([abs(d) for d in deviations]) if len(deviations) > 0 else 0.0
+        achieved_hz:float = (1000000.0 * len(self.periods_us) / sum(self.periods_us)) if len(self.periods_us) > 0 else 0.0
+        bins:list = []
+        for i in range(self.bin_count + 1):
+            lo:float = i * self.bin_width_us
+            hi:float = (i + 1) * self.bin_width_us if i < self.bin_count else None
+            bins.append({"lo_us": lo, "hi_us": hi, "count": self.histogram[i]})
+        return {
+            "target_cycle_hz": self.target_cycle_hz,
+            "achieved_cycle_hz": achieved_hz,
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "period_us": CycleStats._distribution(self.periods_us),
+            "latency_us": CycleStats._distribution(self.latencies_us),
+            "jitter_rms_us": jitter_rms,
+            "jitter_peak_us": jitter_peak,
+            "histogram": bins,
+        }
+
+    def format(self) -> str:
+        """A human readable report, including an ASCII histogram of cycle periods."""
+        s:dict = self.summary()
+        lines:list[str] = []
+        lines.append("Target: " + str(round(self.target_cycle_hz, 1)) + " hz (" + str(round(self.target_period_us, 1)) + " us). Achieved: " + str(round(s["achieved_cycle_hz"], 1)) + " hz over " + str(s["cycles"]) + " cycles")
+        lines.append("Overruns: " + str(s["overruns"]) + " (" + str(round(100.0 * s["overruns"] / max(1, s["cycles"]), 2)) + "%)")
+        lines.append("Jitter: " + str(round(s["jitter_rms_us"], 1)) + " us rms, " + str(round(s["jitter_peak_us"], 1)) + " us peak")
+        for name in ("period_us", "latency_us"):
+            d:dict = s[name]
+            lines.append(name.replace("_us", "").capitalize() + " (us): min " + str(round(d["min"], 1)) + ", mean " + str(round(d["mean"], 1)) + ", p50 " + str(round(d["p50"], 1)) + ", p99 " + str(round(d["p99"], 1)) + ", max " + str(round(d["max"], 1)))
+        biggest:int = max(1, max(self.histogram))
+        for b in s["histogram"]:
+            if b["count"] == 0:
+                continue
+            label:str = (str(int(b["lo_us"])) + "-" + str(int(b["hi_us"]))) if b["hi_us"] is not None else (">" + str(int(b["lo_us"])))
+            lines.append("  " + label.rjust(11) + " us | " + ("#" * max(1, int(40 * b["count"] / biggest))) + " " + str(b["count"]))
+        return "\n".join(lines)
@@ -0,0 +1,44 @@
+"""
+Host stand-in for MicroPython's `_thread` module (the subset used to run code on the Pico's second core).
+Installed as sys.modules["_thread"] by the SITL harness. Threads are real host threads, scheduled one at a time in virtual time by the active Board's SimClock (lockstep mode).
+"""
+
+import sys
+import threading
+import traceback
+from .clock import SimulationComplete
+from . import machine as sim_machine
+
+def start_new_thread(function, args:tuple, kwargs:dict = None) -> int:
+    board = sim_machine._active()
+    clock = board.clock
+    token:object = clock.spawn()
+
+    def body() -> None:
+        try:
+            clock.enter(token)
+            function(*args, **(kwargs or {}))
+        except SimulationComplete:
+            pass
+        except BaseException:
+            # MicroPython prints the exception and ends the thread; the rest of the program keeps running
+            print("Unhandled exception in thread started by " + repr(function), file = sys.stdout)
+            traceback.print_exc(file = sys.stdout)
+        finally:
+            clock.leave()
+
+    t:threading.Thread = threading.Thread(target = body, daemon = True)
+    board.threads.append(t)
+    t.start()
+    return t.ident
+
+def get_ident() -> int:
+    return threading.get_ident()
+
+def stack_size(size:int = None) -> int:
+    return 0
+
+def allocate_lock():
+    return threading.Lock()
+
+LockType = type(threading.Lock())
@@ -0,0 +1,171 @@
+"""
+Host stand-in for MicroPython's `uasyncio` (asyncio) module: the subset Scout uses, run in virtual time.
+Installed as sys.modules["uasyncio"] by the SITL harness. Tasks take turns on the active Board's SimClock. When none of them is ready to run, the clock moves on to the earliest wake time, taking timer interrupts on the way (see sitl.machine.Timer), and a ThreadSafeFlag an interrupt handler sets wakes the task waiting on it as soon as the handler returns.
+As in MicroPython, an exception in a task nobody awaits is printed and ends only that task, and run() returns (or raises) once its task is done.
+"""
+
+import sys
+import traceback
+from . import machine as sim_machine
+
+class CancelledError(BaseException):
+    pass
+
+class _Sleep:
+    """Awaited by sleep() and sleep_ms(): the task is ready again us microseconds from now."""
+
+    def __init__(self, us:float) -> None:
+        self.us:float = us
+
+    def __await__(self):
+        yield self
+
+class _FlagWait:
+    """Awaited by ThreadSafeFlag.wait(): the task is ready once the flag is set."""
+
+    def __init__(self, flag) -> None:
+        self.flag = flag
+
+    def __await__(self):
+        yield self
+
+class _Join:
+    """Awaited by gather() and by awaiting a task: ready once every task is done, or one of them has failed."""
+
+    def __init__(self, tasks:list) -> None:
+        self.tasks:list = tasks
+
+    def __await__(self):
+        yield self
+
+class Task:
+
+    def __init__(self, coro) -> None:
+        self.coro = coro
+        self.done:bool = False
+        self.result = None
+        self.error:BaseException = None
+        self.waiting = None # what the task waits for: None (ready), _Sleep (with wake_us), _FlagWait or _Join
+        self.wake_us:float = 0.0
+        self.awaited:bool = False # someone awaits this task, so its exception is theirs to handle
+
+    def __await__(self):
+        self.awaited = True
+        yield _Join([self])
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def cancel(self) -> bool:
+        if self.done:
+            return False
+        self.done = True
+        self.error = CancelledError()
+        self.coro.close()
+        return True
+
+    def _ready(self, now_us:float) -> bool:
+        w = self.waiting
+        if w is None:
+            return True
+        if isinstance(w, _Sleep):
+            return now_us >= self.wake_us
+        if isinstance(w, _FlagWait):
+            return w.flag._set
+        return all(t.done for t in w.tasks) or any(t.error is not None for t in w.tasks)
+
+class ThreadSafeFlag:
+    """A flag an interrupt handler (or another thread) sets, and one task waits on. wait() clears it."""
+
+    def __init__(self) -> None:
+        self._set:bool = False
+
+    def set(self) -> None:
+        self._set = True
+
+    def clear(self) -> None:
+        self._set = False
+
+    async def wait(self) -> None:
+        if not self._set:
+            await _FlagWait(self)
+        self._set = False
+
+_tasks:list = [] # every task not done yet, in the order they were created
+
+def sleep(seconds:float) -> _Sleep:
+    return _Sleep(seconds * 1000000.0)
+
+def sleep_ms(ms:int) -> _Sleep:
+    return _Sleep(ms * 1000.0)
+
+def create_task(coro) -> Task:
+    task:Task = Task(coro)
+    _tasks.append(task)
+    return task
+
+async def gather(*awaitables, return_exceptions:bool = False) -> list:
+    tasks:list = [a if isinstance(a, Task) else create_task(a) for a in awaitables]
+    for t in tasks:
+        t.awaited = True
+    await _Join(tasks)
+    if not return_exceptions:
+        for t in tasks:
+            if t.error is not None:
+                raise t.error
+    return [t.error if t.error is not None else t.result for t in tasks]
+
+def _step(task:Task, clock) -> None:
+    task.waiting = None
+    try:
+        w = task.coro.send(None)
+    except StopIteration as e:
+        task.done = True
+        task.result = e.value
+        return
+    except Exception as e:
+        task.done = True
+        task.error = e
+        if not task.awaited:
+            print("Task exception wasn't retrieved", file = sys.stdout)
+            traceback.print_exc(file = sys.stdout)
+        return
+    if isinstance(w, _Sleep):
+        task.wake_us = clock.now_us() + w.us # from when it went to sleep: the step itself may have taken time (I/O)
+    elif not isinstance(w, (_FlagWait, _Join)):
+        raise RuntimeError("A task awaited something the SITL uasyncio does not support: " + repr(w))
+    task.waiting = w
+
+def run(coro):
+    """Runs coro as a task, along with every task it creates, until it is done. Returns its result, or raises its exception."""
+    clock = sim_machine._active().clock
+    main:Task = create_task(coro)
+    main.awaited = True
+    try:
+        while not main.done:
+            ran:bool = False
+            for task in list(_tasks):
+                if not task.done and task._ready(clock.now_us()):
+                    _step(task, clock)
+                    ran = True
+                if task.done:
+                    _tasks.remove(task)
+                if main.done:
+                    break
+            if ran or main.done:
+                continue
+
+            # nothing is ready: wait for the earliest sleeper, or until an interrupt may have set a flag
+            wake_us:float = None
+            for task in _tasks:
+                if isinstance(task.waiting, _Sleep) and (wake_us is None or task.wake_us < wake_us):
+                    wake_us = task.wake_us
+            if wake_us is None and clock.next_interrupt_us() is None:
+                raise RuntimeError("Every task is waiting, and nothing (no sleep, no timer interrupt) can wake any of them")
+            limit_us:float = (wake_us - clock.now_us()) if wake_us is not None else 1000000.0
+            clock.advance(max(1.0, clock.until_interrupt_us(limit_us)))
+    finally:
+        _tasks.clear()
+    if main.error is not None:
+        raise main.error
+    return main.result
@@ -0,0 +1,157 @@
+import array
+import math
+import emit
+import micropython
+
+ROLL:int = 0
+PITCH:int = 1
+YAW:int = 2
+
+@micropython.native
+def _update(q, integral, k, gx, gy, gz, ax, ay, az):
+    """
+    One Mahony step: gyro rates (deg/s) and accelerometer (g), both in the body frame (x forward, y right, z down).
+    k is [kp, ki * dt, dt / 2, (1 - accel_window_g) ** 2, (1 + accel_window_g) ** 2]. Unrolled and branch-light, so every call costs about the same.
+    """
+    q0 = q[0]
+    q1 = q[1]
+    q2 = q[2]
+    q3 = q[3]
+    gx = gx * 0.017453292
+    gy = gy * 0.017453292
+    gz = gz * 0.017453292
+
+    # correct the rates toward the accelerometer's "down", but only while it measures (about) 1 g. Otherwise, the craft is accelerating and the accelerometer is not seeing gravity alone.
+    n2 = (ax * ax) + (ay * ay) + (az * az)
+    if n2 > k[3] and n2 < k[4]:
+        r = -1.0 / math.sqrt(n2) # at rest, the accelerometer measures the reaction to gravity: "up". Flip it to "down".
+        mx = ax * r
+        my = ay * r
+        mz = az * r
+
+        # "down" as the current attitude estimate sees it (the third row of the body to world rotation)
+        vx = 2.0 * ((q1 * q3) - (q0 * q2))
+        vy = 2.0 * ((q0 * q1) + (q2 * q3))
+        vz = (q0 * q0) - (q1 * q1) - (q2 * q2) + (q3 * q3)
+
+        # error: the rotation from the estimated to the measured "down" (cross product)
+        ex = (my * vz) - (mz * vy)
+        ey = (mz * vx) - (mx * vz)
+        ez = (mx * vy) - (my * vx)
+        ix = integral[0] + (ex * k[1])
+        iy = integral[1] + (ey * k[1])
+        iz = integral[2] + (ez * k[1])
+        integral[0] = ix
+        integral[1] = iy
+        integral[2] = iz
+        kp = k[0]
+        gx = gx + (kp * ex) + ix
+        gy = gy + (kp * ey) + iy
+        gz = gz + (kp * ez) + iz
+    else:
+        gx = gx + integral[0]
+        gy = gy + integral[1]
+        gz = gz + integral[2]
+
+    # integrate the rates: q' = q + (dt / 2) * q * (0, gx, gy, gz)
+    h = k[2]
+    gx = gx * h
+    gy = gy * h
+    gz = gz * h
+    n0 = q0 - (q1 * gx) - (q2 * gy) - (q3 * gz)
+    n1 = q1 + (q0 * gx) + (q2 * gz) - (q3 * gy)
+    n2 = q2 + (q0 * gy) - (q1 * gz) + (q3 * gx)
+    n3 = q3 + (q0 * gz) + (q1 * gy) - (q2 * gx)
+
+    # back to unit length
+    r = 1.0 / math.sqrt((n0 * n0) + (n1 * n1) + (n2 * n2) + (n3 * n3))
+    q[0] = n0 * r
+    q[1] = n1 * r
+    q[2] = n2 * r
+    q[3] = n3 * r
+
+@micropython.native
+def _euler(q, angles):
+    """Roll, pitch and yaw (degrees, Tait-Bryan z-y-x) of the quaternion q into angles."""
+    q0 = q[0]
+    q1 = q[1]
+    q2 = q[2]
+    q3 = q[3]
+    s = 2.0 * ((q0 * q2) - (q3 * q1))
+    if s > 1.0:
+        s = 1.0
+    elif s < -1.0:
+        s = -1.0
+    angles[0] = math.atan2(2.0 * ((q0 * q1) + (q2 * q3)), 1.0 - (2.0 * ((q1 * q1) + (q2 * q2)))) * 57.29578
+    angles[1] = math.asin(s) * 57.29578
+    angles[2] = math.atan2(2.0 * ((q0 * q3) + (q1 * q2)), 1.0 - (2.0 * ((q2 * q2) + (q3 * q3)))) * 57.29578
+
+class AttitudeEstimator:
+    """
+    Fuses the gyro and accelerometer of the same burst read into an attitude estimate (a Mahony complementary filter).
+    The gyro rates are integrated into a quaternion every update(). The accelerometer's measurement of "down" slowly pulls the estimate back, so gyro drift cannot build up in roll and pitch: the P gain sets how fast, the I gain learns a residual gyro bias.
+    Yaw has nothing to correct it (there is no magnetometer), so it drifts and is only good for short term use.
+    State, gains and results live in array('f') storage and update() is a native-emitter function with a fixed amount of work, so nothing is allocated per update beyond the floats themselves.
+    Axes are the body frame: x forward, y right, z down. Roll right, pitch up and yaw right are positive, as for the rates (the MPU-6050's gyro_flip and accel_flip must map the sensor to this frame).
+    """
+
+    def __init__(self, cycle_hz:float, kp:float = 0.25, ki:float = 0.0, accel_window_g:float = 0.25) -> None:
+        """
+        :param cycle_hz: the rate update() will be called at.
+        :param kp: how strongly (rad/s per unit of error) the accelerometer corrects the estimate. Higher converges faster but lets more vibration and acceleration through.
+        :param ki: how fast a constant gyro bias is learned. 0.0 to rely on the gyro bias calibration alone.
+        :param accel_window_g: the accelerometer only corrects the estimate while it measures within this much of 1 g.
+        """
+        self.cycle_hz:float = cycle_hz
+        self.q = array.array("f", [1.0, 0.0, 0.0, 0.0]) # w, x, y, z, body to world
+        self.integral = array.array("f", [0.0, 0.0, 0.0]) # learned rate correction (rad/s)
+        self.angles = array.array("f", [0.0, 0.0, 0.0]) # roll, pitch, yaw in degrees, written by euler()
+        self._k = array.array("f", [0.0] * 5)
+        self.set_gains(kp, ki, accel_window_g)
+
+    def set_gains(self, kp:float, ki:float, accel_window_g:float = 0.25) -> None:
+        self.kp:float = kp
+        self.ki:float = ki
+        self.accel_window_g:float = accel_window_g
+        dt:float = 1.0 / self.cycle_hz
+        self._k[0] = kp
+        self._k[1] = ki * dt
+        self._k[2] = dt / 2.0
+        self._k[3] = max(0.0, 1.0 - accel_window_g) ** 2
+        self._k[4] = (1.0 + accel_window_g) ** 2
+
+    def set_rate(self, cycle_hz:float) -> None:
+        """Changes the rate update() is called at. The estimate carries on from where it is."""
+        self.cycle_hz = cycle_hz
+        self.set_gains(self.kp, self.ki, self.accel_window_g)
+
+    def update(self, gyro_x:float, gyro_y:float, gyro_z:float, accel_x:float, accel_y:float, accel_z:float) -> None:
+        """One step: gyro rates in degrees per second, accelerometer in g (body frame)."""
+        _update(self.q, self.integral, self._k, gyro_x, gyro_y, gyro_z, accel_x, accel_y, accel_z)
+
+    def euler(self) -> None:
+        """Writes the estimate's roll, pitch and yaw (degrees) to angles."""
+        _euler(self.q, self.angles)
+
+    def level(self, accel_x:float, accel_y:float, accel_z:float) -> None:
+        """Sets the estimate straight to the attitude the accelerometer measures (yaw 0), e.g. from the mean of the readings taken while calibrating on the ground. Saves waiting for the filter to converge."""
+        x:float = -accel_x
+        y:float = -accel_y
+        z:float = -accel_z
+        roll:float = math.atan2(y, z) / 2.0
+        pitch:float = math.atan2(-x, math.sqrt((y * y) + (z * z))) / 2.0
+        self.q[0] = math.cos(roll) * math.cos(pitch)
+        self.q[1] = math.sin(roll) * math.cos(pitch)
+        self.q[2] = math.cos(roll) * math.sin(pitch)
+        self.q[3] = -math.sin(roll) * math.sin(pitch)
+        self.euler()
+
+    def reset(self) -> None:
+        """Back to level, and forgets the learned bias."""
+        self.q[0] = 1.0
+        self.q[1] = 0.0
+        self.q[2] = 0.0
+        self.q[3] = 0.0
+        for i in range(3):
+            self.integral[i] = 0.0
+            self.angles[i] = 0.0
@@ -0,0 +1,219 @@
+import struct
+import time
+
+# Blackbox file format
+# header:
+#   magic "SCBB" (4 bytes), version (1 byte), record size (2 bytes), motor count (1 byte),
+#   struct format of one record (1 byte length + ascii), comma separated field names (2 byte length + ascii)
+# followed by fixed-size records, oldest first. Everything is little endian.
+MAGIC:bytes = b"SCBB"
+VERSION:int = 2 # 2 added alloc_bytes and gc_us. decode() reads both.
+
+# one record: time (us ticks), loop time (us), flags, gyro x/y/z (deg/s), setpoint roll/pitch/yaw (deg/s), P/I/D roll/pitch/yaw, throttle, bytes allocated and us spent collecting garbage in the cycle (see heap.py), then one duty cycle (us) per motor
+_BASE_FORMAT:str = "<IHB3f3f3f3f3ffHH"
+_BASE_FIELDS:str = "time_us,loop_us,flags,gyro_x,gyro_y,gyro_z,setpoint_roll,setpoint_pitch,setpoint_yaw,p_roll,p_pitch,p_yaw,i_roll,i_pitch,i_yaw,d_roll,d_pitch,d_yaw,throttle,alloc_bytes,gc_us"
+
+FLAG_SATURATED:int = 0x01 # the mixer had to scale the PID outputs down to keep motors from clipping
+FLAG_FLYING:int = 0x02 # the cycle ran in flight mode
+
+# A "state" is one record's values, except time_us, as an array('f') in record order: loop_us, flags, gyro x/y/z, setpoints, P, I, D, throttle, alloc_bytes, gc_us, then the motor duty cycles (us).
+# It is how a record travels from the control core to the I/O core (see dualcore.py), which does the packing and the flash writes.
+STATE_BASE_SIZE:int = 20
+
+class Blackbox:
+    """
+    Flight data recorder. Every record() packs one fixed-size record into a preallocated bytearray ring (struct.pack_into, no allocation), holding the most recent `seconds` of flight.
+    Records are copied to flash in blocks, but only when there is time for it: service() writes one block if it fits in the cycle's slack time, or everything in standby.
+    dump() writes the whole ring (e.g. the last seconds before a fatal error) to its own file.
+    """
+
+    def __init__(self, pids, motor_mixer, cycle_hz:float, seconds:float = 2.0, path:str = "blackbox", block_size:int = 512, heap_counts = None) -> None:
+        """
+        :param pids: the pid.PIDBank whose P, I and D terms are recorded.
+        :param motor_mixer: the mixer.Mixer whose duty cycles are recorded.
+        :param cycle_hz: how often record() will be called (sizes the ring).
+        :param seconds: how much flight the ring holds.
+        :param path: flash file the records are appended to.
+        :param block_size: approximate bytes per flash write (rounded down to whole records).
+        :param heap_counts: the heap.Heap counts ([bytes allocated, us spent collecting] in the last cycle) that are recorded. None records 0's.
+        """
+        self.pids = pids
+        self.mixer = motor_mixer
+        self.heap_counts = heap_counts if heap_counts is not None else [0, 0]
+        self.path:str = path
+        self.motors:int = motor_mixer.motors
+        self.format:str = _BASE_FORMAT + ("H" * self.motors)
+        self.fields:str = _BASE_FIELDS + "".join([",motor" + str(m + 1) + "_us" for m in range(self.motors)])
+        self.record_size:int = struct.calcsize(self.format)
+        self._base_size:int = struct.calcsize(_BASE_FORMAT)
+
+        self.capacity:int = max(1, int(seconds * cycle_hz)) # records
+        self.buf:bytearray = bytearray(self.capacity * self.record_size)
+        self._mv:memoryview = memoryview(self.buf)
+        self._head:int = 0 # slot the next record goes in
+        self.count:int = 0 # valid records in the ring
+        self.pending:int = 0 # records not yet written to flash
+        self.records_per_block:int = max(1, block_size // self.record_size)
+
+        # statistics
+        self.recorded:int = 0
+        self.dropped:int = 0 # records overwritten before they reached flash
+        self.block_write_us:int = 3000 # how long a block write is expected to take (the longest seen so far); a block is only written if this fits in the slack time
+
+        self._file = None
+        self.state_size:int = STATE_BASE_SIZE + self.motors
+
+    def header(self) -> bytes:
+        fmt:bytes = self.format.encode()
+        names:bytes = self.fields.encode()
+        return MAGIC + struct.pack("<BHBB", VERSION, self.record_size, self.motors, len(fmt)) + fmt + struct.pack("<H", len(names)) + names
+
+    def record(self, time_us:int, loop_us:int, gyro_x:float, gyro_y:float, gyro_z:float, setpoint_roll:float, setpoint_pitch:float, setpoint_yaw:float, throttle:float) -> None:
+        """Adds one record to the ring. P/I/D terms, motor duty cycles and heap counts are taken from the PIDBank, Mixer and Heap."""
+        p = self.pids.p
+        i = self.pids.integral
+        d = self.pids.d
+        h = self.heap_counts
+        offset:int = self._head * self.record_size
+        flags:int = (FLAG_SATURATED | FLAG_FLYING) if self.mixer.scale[0] < 1.0 else FLAG_FLYING
+        struct.pack_into(_BASE_FORMAT, self.buf, offset, time_us, min(loop_us, 65535), flags, gyro_x, gyro_y, gyro_z, setpoint_roll, setpoint_pitch, setpoint_yaw, p[0], p[1], p[2], i[0], i[1], i[2], d[0], d[1], d[2], throttle, min(h[0], 65535), min(h[1], 65535))
+        offset = offset + self._base_size
+        duty = self.mixer.duty
+        for m in range(self.motors):
+            struct.pack_into("<H", self.buf, offset + (m * 2), duty[m] // 1000)
+        self._advance()
+
+    def capture(self, state, flying:bool, loop_us:int, gyro_x:float, gyro_y:float, gyro_z:float, setpoint_roll:float, setpoint_pitch:float, setpoint_yaw:float, throttle:float) -> None:
+        """Fills a state array (see STATE_BASE_SIZE) with what record() would record. P/I/D terms, motor duty cycles and heap counts are taken from the PIDBank, Mixer and Heap."""
+        p = self.pids.p
+        i = self.pids.integral
+        d = self.pids.d
+        h = self.heap_counts
+        flags:int = FLAG_FLYING if flying else 0
+        if self.mixer.scale[0] < 1.0:
+            flags = flags | FLAG_SATURATED
+        state[0] = loop_us
+        state[1] = flags
+        state[2] = gyro_x
+        state[3] = gyro_y
+        state[4] = gyro_z
+        state[5] = setpoint_roll
+        state[6] = setpoint_pitch
+        state[7] = setpoint_yaw
+        state[8] = p[0]
+        state[9] = p[1]
+        state[10] = p[2]
+        state[11] = i[0]
+        state[12] = i[1]
+        state[13] = i[2]
+        state[14] = d[0]
+        state[15] = d[1]
+        state[16] = d[2]
+        state[17] = throttle
+        state[18] = min(h[0], 65535)
+        state[19] = min(h[1], 65535)
+        duty = self.mixer.duty
+        for m in range(self.motors):
+            state[STATE_BASE_SIZE + m] = duty[m] // 1000
+
+    def record_state(self, time_us:int, state) -> None:
+        """Adds one record to the ring from a state array filled by capture()."""
+        s = state
+        offset:int = self._head * self.record_size
+        struct.pack_into(_BASE_FORMAT, self.buf, offset, time_us, min(int(s[0]), 65535), int(s[1]), s[2], s[3], s[4], s[5], s[6], s[7], s[8], s[9], s[10], s[11], s[12], s[13], s[14], s[15], s[16], s[17], int(s[18]), int(s[19]))
+        offset = offset + self._base_size
+        for m in range(self.motors):
+            struct.pack_into("<H", self.buf, offset + (m * 2), int(s[STATE_BASE_SIZE + m]))
+        self._advance()
+
+    def _advance(self) -> None:
+        self._head = self._head + 1
+        if self._head == self.capacity:
+            self._head = 0
+        if self.count < self.capacity:
+            self.count = self.count + 1
+        if self.pending < self.capacity:
+            self.pending = self.pending + 1
+        else:
+            self.dropped = self.dropped + 1 # the oldest unwritten record was just overwritten
+        self.recorded = self.recorded + 1
+
+    def service(self, slack_us:int, flying:bool) -> None:
+        """
+        Call once per cycle, after the cycle's work is done.
+        :param slack_us: how much of this cycle is left. In flight, one block is written only if the expected write time fits in it.
+        :param flying: False in standby, where everything pending is written.
+        """
+        if self.pending == 0:
+            return
+        if flying:
+            if self.pending >= self.records_per_block and slack_us > self.block_write_us:
+                self._write_block()
+        else:
+            while self.pending > 0:
+                self._write_block()
+
+    def _write_block(self) -> None:
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            self._file.write(self.header()) # every power cycle starts a new section, in case the settings (e.g. motor count) changed
+        began:int = time.ticks_us()
+        start:int = (self._head - self.pending) % self.capacity
+        n:int = min(self.pending, self.capacity - start, self.records_per_block)
+        self._file.write(self._mv[start * self.record_size:(start + n) * self.record_size])
+        self._file.flush()
+        self.pending = self.pending - n
+        took:int = time.ticks_diff(time.ticks_us(), began)
+        if took > self.block_write_us:
+            self.block_write_us = took
+
+    def close(self) -> None:
+        """Writes everything pending and closes the flash file."""
+        self.service(0, False)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def dump(self, path:str = "blackbox_crash") -> None:
+        """Writes every record in the ring (the most recent `seconds` of flight), oldest first, to its own file. Used on a fatal error."""
+        f = open(path, "wb")
+        f.write(self.header())
+        oldest:int = (self._head - self.count) % self.capacity
+        if oldest + self.count <= self.capacity:
+            f.write(self._mv[oldest * self.record_size:(oldest + self.count) * self.record_size])
+        else:
+            f.write(self._mv[oldest * self.record_size:])
+            f.write(self._mv[0:self._head * self.record_size])
+        f.close()
+
+
+def decode(data:bytes) -> tuple:
+    """
+    Decodes the contents of a blackbox file (one or more header + records sections, as appended across power cycles).
+    :returns: (field names, list of record tuples)
+    """
+    fields:list[str] = None
+    records:list = []
+    offset:int = 0
+    fmt:str = None
+    size:int = 0
+    while offset < len(data):
+        if data[offset:offset + 4] == MAGIC:
+            version, size, motors, fmt_len = struct.unpack_from("<BHBB", data, offset + 4)
+            if version < 1 or version > VERSION:
+                raise Exception("Unsupported blackbox version " + str(version))
+            offset = offset + 9
+            fmt = bytes(data[offset:offset + fmt_len]).decode()
+            offset = offset + fmt_len
+            names_len:int = struct.unpack_from("<H", data, offset)[0]
+            offset = offset + 2
+            fields = bytes(data[offset:offset + names_len]).decode().split(",")
+            offset = offset + names_len
+            continue
+        if fmt is None:
+            raise Exception("Unable to decode: blackbox data does not begin with a header.")
+        if offset + size > len(data):
+            break # partial record at the end
+        records.append(struct.unpack_from(fmt, data, offset))
+        offset = offset + size
+    return (fields, records)
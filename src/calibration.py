@@ -0,0 +1,101 @@
+import json
+import math
+
+# Calibration cache format (JSON, in the "calibration" flash file)
+#   {"version": 1, "gyro_bias": [x, y, z], "gyro_std": [x, y, z], "temperature": celsius, "samples": n, "lpf": DLPF setting, "gyro_range": range setting}
+VERSION:int = 1
+
+class GyroCalibration:
+    """
+    Streaming gyro bias estimate: the running mean and variance of every gyro axis (Welford's algorithm), plus the mean of the accelerometer, one sample at a time and without keeping the samples.
+    A sample further than motion_dps from the running mean on any axis means the craft was moved or bumped, and the estimate starts over. The estimate is done once it has at least min_samples and the standard error of every axis' mean is below noise_dps (or max_samples, whichever comes first).
+    """
+
+    def __init__(self, motion_dps:float = 2.0, noise_dps:float = 0.02, min_samples:int = 200, max_samples:int = 2000) -> None:
+        """
+        :param motion_dps: a sample this far (deg/s) from the running mean restarts the estimate.
+        :param noise_dps: done once the standard error of the mean is below this (deg/s) on every axis.
+        :param min_samples: never done with fewer samples than this (the time they span is what averages out slow wander).
+        :param max_samples: done at this many samples, however noisy.
+        """
+        self.motion_dps:float = motion_dps
+        self.noise_dps:float = noise_dps
+        self.min_samples:int = min_samples
+        self.max_samples:int = max_samples
+        self.restarts:int = 0 # times motion was detected
+        self.reset()
+
+    def reset(self) -> None:
+        """Starts the estimate over."""
+        self.n:int = 0
+        self.mean:list[float] = [0.0, 0.0, 0.0] # gyro x, y, z (deg/s)
+        self._m2:list[float] = [0.0, 0.0, 0.0] # sum of squared differences from the mean
+        self.accel:list[float] = [0.0, 0.0, 0.0] # accelerometer mean (g)
+        self.temperature:float = 0.0 # mean temperature (celsius)
+
+    def add(self, data) -> bool:
+        """
+        Adds one reading and returns True once the estimate is done.
+        :param data: [accel x, y, z, temperature, gyro x, y, z], e.g. mpu6050.MPU6050.data.
+        """
+        mean = self.mean
+        if self.n >= 10: # the mean means something
+            limit:float = self.motion_dps
+            if abs(data[4] - mean[0]) > limit or abs(data[5] - mean[1]) > limit or abs(data[6] - mean[2]) > limit:
+                self.restarts = self.restarts + 1
+                self.reset()
+                mean = self.mean
+        n:int = self.n + 1
+        self.n = n
+        m2 = self._m2
+        for axis in range(3):
+            x:float = data[4 + axis]
+            delta:float = x - mean[axis]
+            mean[axis] = mean[axis] + (delta / n)
+            m2[axis] = m2[axis] + (delta * (x - mean[axis]))
+            self.accel[axis] = self.accel[axis] + ((data[axis] - self.accel[axis]) / n)
+        self.temperature = self.temperature + ((data[3] - self.temperature) / n)
+        return self.done()
+
+    def std(self) -> list[float]:
+        """Standard deviation of the samples, per axis (deg/s)."""
+        if self.n < 2:
+            return [0.0, 0.0, 0.0]
+        return [math.sqrt(m / (self.n - 1)) for m in self._m2]
+
+    def done(self) -> bool:
+        if self.n >= self.max_samples:
+            return True
+        if self.n < self.min_samples:
+            return False
+        limit:float = self.noise_dps * self.noise_dps * self.n # standard error below noise_dps: variance / n < noise_dps^2
+        for m in self._m2:
+            if m / (self.n - 1) >= limit:
+                return False
+        return True
+
+    def agrees(self, bias:list[float], tolerance_dps:float) -> bool:
+        """True if the estimate so far is within tolerance_dps of bias on every axis, e.g. to check a cached calibration."""
+        for axis in range(3):
+            if abs(self.mean[axis] - bias[axis]) > tolerance_dps:
+                return False
+        return True
+
+
+def load(path:str, lpf:int, gyro_range:int) -> dict:
+    """The calibration cached in path, or None if there is none (or it was taken with other sensor settings)."""
+    try:
+        f = open(path, "r")
+        cached:dict = json.loads(f.read())
+        f.close()
+    except Exception: # no file (first boot) or a damaged one
+        return None
+    if cached.get("version") != VERSION or cached.get("lpf") != lpf or cached.get("gyro_range") != gyro_range:
+        return None
+    return cached
+
+def save(path:str, calibration:GyroCalibration, lpf:int, gyro_range:int) -> None:
+    """Caches a finished calibration to path, replacing the last one."""
+    f = open(path, "w")
+    f.write(json.dumps({"version": VERSION, "gyro_bias": calibration.mean, "gyro_std": calibration.std(), "temperature": calibration.temperature, "samples": calibration.n, "lpf": lpf, "gyro_range": gyro_range}))
+    f.close()
@@ -0,0 +1,118 @@
+import array
+import time
+import machine
+
+# room for the exception a hard interrupt handler raises (it can't allocate one), so it can be reported
+try:
+    import micropython
+    micropython.alloc_emergency_exception_buf(100)
+except (ImportError, AttributeError):
+    pass
+
+# ControlTimer.state layout
+STEP_START:int = 0 # ticks_us the last step started at
+STEP_US:int = 1 # how long the last step took
+CYCLES:int = 2 # steps run (wraps at 2^30)
+LATE:int = 3 # steps that started more than late_us after their time
+MAX_DELAY_US:int = 4 # the latest a step has started after its time
+MAX_STEP_US:int = 5 # the longest a step has taken
+DUE:int = 6 # ticks_us the next step is due at
+STATE_SIZE:int = 7
+
+class ControlTimer:
+    """
+    Runs the control step from a machine.Timer interrupt at a fixed rate, so every step starts on time, whatever the main context is doing (see timer_control in main.py).
+    The handler allocates nothing (a hard interrupt can't): it times every step into state, an array('i') the main context reads (see the layout above), and sets flag (e.g. a uasyncio.ThreadSafeFlag) so a task can follow every step.
+    If the step raises, the timer stops, safe() is called (e.g. to turn the motors off) and error keeps the exception, for the main context to report.
+    """
+
+    def __init__(self, hz:float, step, safe, flag = None, late_us:int = 50, hard:bool = True) -> None:
+        """
+        :param hz: the rate step() runs at.
+        :param step: the control step, a function (no arguments). With hard = True, it must not allocate.
+        :param safe: a function (no arguments) that makes the outputs safe, called when the timer stops (e.g. duty cycle 0 on every motor).
+        :param flag: if not None, flag.set() is called after every step.
+        :param late_us: a step that starts more than this after its time counts as late.
+        :param hard: run step() in a hard interrupt (as soon as the timer fires, but nothing may allocate) rather than a soft one (scheduled, so only once the code running at the time gets to a point where it can be interrupted).
+        """
+        self.step = step
+        self.safe = safe
+        self.flag = flag
+        self.late_us:int = late_us
+        self.hard:bool = hard
+        self.state = array.array("i", [0] * STATE_SIZE)
+        self.error:Exception = None
+        self.running:bool = False
+        self._timer = machine.Timer(-1)
+        self.set_rate(hz)
+
+    def set_rate(self, hz:float) -> None:
+        """Changes the rate step() runs at (restarting the timer, if it is running)."""
+        self.hz:float = hz
+        self.period_us:int = int(1000000 / hz) # as the timer rounds it
+        if self.running:
+            self.start()
+
+    def start(self) -> None:
+        """Starts running step(), the first time a period from now."""
+        self._timer.deinit()
+        self.state[DUE] = time.ticks_add(time.ticks_us(), self.period_us)
+        self.running = True
+        self._timer.init(mode = machine.Timer.PERIODIC, freq = self.hz, callback = self._tick, hard = self.hard)
+
+    def stop(self) -> None:
+        """Stops running step(), and calls safe()."""
+        self._timer.deinit()
+        self.running = False
+        self.safe()
+
+    def cycles(self) -> int:
+        """Steps run so far."""
+        return self.state[CYCLES]
+
+    def late(self) -> int:
+        """Steps that started late so far."""
+        return self.state[LATE]
+
+    def slack_us(self) -> int:
+        """Microseconds until the next step is due (negative if it is overdue)."""
+        return time.ticks_diff(self.state[DUE], time.ticks_us())
+
+    def _tick(self, timer) -> None:
+        # the interrupt handler: nothing here may allocate
+        began:int = time.ticks_us()
+        s = self.state
+        delay:int = time.ticks_diff(began, s[DUE])
+        s[DUE] = time.ticks_add(s[DUE], self.period_us)
+        if delay > self.late_us:
+            s[LATE] = s[LATE] + 1
+        if delay > s[MAX_DELAY_US]:
+            s[MAX_DELAY_US] = delay
+        try:
+            self.step()
+        except Exception as e:
+            self._timer.deinit()
+            self.running = False
+            self.safe()
+            self.error = e
+            return
+        took:int = time.ticks_diff(time.ticks_us(), began)
+        s[STEP_START] = began
+        s[STEP_US] = took
+        if took > s[MAX_STEP_US]:
+            s[MAX_STEP_US] = took
+        s[CYCLES] = (s[CYCLES] + 1) & 0x3FFFFFFF
+        if self.flag is not None:
+            self.flag.set()
+
+    def reset(self) -> None:
+        """Clears the statistics (late steps, the largest delay and step time)."""
+        s = self.state
+        s[LATE] = 0
+        s[MAX_DELAY_US] = 0
+        s[MAX_STEP_US] = 0
+
+    def report(self) -> str:
+        """How the steps kept to their schedule."""
+        s = self.state
+        return "Control timer: " + str(s[CYCLES]) + " steps @ " + str(round(1000000.0 / self.period_us, 1)) + " hz (" + ("hard" if self.hard else "soft") + " interrupt), " + str(s[LATE]) + " started over " + str(self.late_us) + " us late, latest start " + str(s[MAX_DELAY_US]) + " us after its time, longest step " + str(s[MAX_STEP_US]) + " us"
@@ -0,0 +1,89 @@
+import array
+import time
+from emit import ptr32
+import micropython
+
+@micropython.viper
+def _copy(src, dst, n:int):
+    """Copies n 4-byte items (array 'f', 'i' or 'I') without creating a float object per item."""
+    s = ptr32(src)
+    d = ptr32(dst)
+    i = 0
+    while i < n:
+        d[i] = s[i]
+        i += 1
+
+class Mailbox:
+    """
+    Hands the latest message from one core to the other without locks: one writer, one reader, two preallocated buffers.
+    The writer fills back(), then publish() makes it the front buffer and bumps the sequence number (two single-word writes, so the reader never sees a half-published message).
+    The reader copies the front buffer out with read_into(), and only keeps the copy if the sequence number did not change while it was copying (if it did, the writer may have started reusing that buffer, so it tries again).
+    A message that is not read before the next one is published is simply replaced: the reader always gets the latest.
+    """
+
+    def __init__(self, size:int, typecode:str = "f") -> None:
+        """
+        :param size: items per message.
+        :param typecode: the array typecode of the items. Must be a 4-byte type ('f', 'i' or 'I').
+        """
+        if typecode not in ("f", "i", "I"):
+            raise ValueError("Mailbox items must be 4 bytes ('f', 'i' or 'I'), not '" + str(typecode) + "'")
+        self.size:int = size
+        self.typecode:str = typecode
+        self._buffers:list = [array.array(typecode, [0] * size), array.array(typecode, [0] * size)]
+        self._stamps = array.array("i", [0, 0]) # ticks_us each buffer's message was published with
+        self._ctrl = array.array("i", [0, 0]) # [front buffer, sequence number]. Only the writer changes these.
+        self._back:int = 1 # writer only
+
+        # writer statistics
+        self.published:int = 0
+
+        # reader state and statistics
+        self._last_seq:int = 0
+        self.stamp_us:int = 0 # publish time of the message most recently read
+        self.received:int = 0
+        self.retries:int = 0 # reads that had to be repeated because a new message was published during the copy
+        self.latency_us:int = 0 # publish to read, of the message most recently read
+        self.latency_max_us:int = 0
+        self.latency_total_us:int = 0 # for the mean (latency_total_us / received)
+
+    ##### writer (one core) #####
+
+    def back(self):
+        """The buffer to write the next message into. Only valid until publish()."""
+        return self._buffers[self._back]
+
+    def publish(self, stamp_us:int) -> None:
+        """Makes the message written to back() the latest. stamp_us (a ticks_us value) travels with it, e.g. when its data was sampled."""
+        b:int = self._back
+        self._stamps[b] = stamp_us
+        self._ctrl[0] = b
+        self._ctrl[1] = (self._ctrl[1] + 1) & 0x3FFFFFFF
+        self._back = 1 - b
+        self.published += 1
+
+    ##### reader (the other core) #####
+
+    def read_into(self, dest, attempts:int = 3) -> bool:
+        """Copies the latest message into dest (an array of the same typecode). Returns False, leaving dest as is, if there is nothing new since the last read."""
+        ctrl = self._ctrl
+        while attempts > 0:
+            seq:int = ctrl[1]
+            if seq == self._last_seq:
+                return False
+            front:int = ctrl[0]
+            _copy(self._buffers[front], dest, self.size)
+            stamp:int = self._stamps[front]
+            if ctrl[1] == seq:
+                self._last_seq = seq
+                self.stamp_us = stamp
+                self.received += 1
+                latency:int = time.ticks_diff(time.ticks_us(), stamp)
+                self.latency_us = latency
+                self.latency_total_us += latency
+                if latency > self.latency_max_us:
+                    self.latency_max_us = latency
+                return True
+            self.retries += 1
+            attempts -= 1
+        return False
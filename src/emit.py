@@ -0,0 +1,24 @@
+# Code emitters: on MicroPython, @micropython.native compiles a function to machine code, and @micropython.viper to machine code that works on machine words (with ptr8/ptr32 pointers into buffers).
+# The compiler only recognizes them written out in full, as decorators. There is no micropython.native or micropython.viper at run time to alias (an alias leaves the function as bytecode), so a module that uses them imports this module, then micropython, and decorates with @micropython.native or @micropython.viper.
+# On a regular computer (SITL, host tools, benchmarks) there is no micropython module. Importing this one puts a stand-in in its place, whose native, viper and const leave the code as plain Python.
+try:
+    import micropython
+except ImportError:
+    import sys
+    import types
+
+    def _unchanged(f):
+        return f
+
+    micropython = types.ModuleType("micropython")
+    micropython.native = _unchanged
+    micropython.viper = _unchanged
+    micropython.const = _unchanged
+    sys.modules["micropython"] = micropython
+
+# viper's pointer casts. Inside a viper function the compiler handles them itself. On a regular computer, where the same code runs as plain Python, a "pointer" is just the buffer itself.
+def ptr8(buf):
+    return buf
+
+def ptr32(buf):
+    return buf
@@ -0,0 +1,141 @@
+import array
+import math
+import emit
+import micropython
+
+@micropython.native
+def _apply(c, s, n, data, first):
+    """
+    Runs the three values data[first] to data[first + 2] through n cascaded biquads, in place (transposed direct form II).
+    c is [b0, b1, b2, a1, a2] per stage (a0 normalized to 1). s is [s1, s2] per stage per axis.
+    """
+    for axis in range(3):
+        x = data[first + axis]
+        k = 0
+        j = axis * 2
+        for stage in range(n):
+            b0 = c[k]
+            b1 = c[k + 1]
+            b2 = c[k + 2]
+            a1 = c[k + 3]
+            a2 = c[k + 4]
+            y = (b0 * x) + s[j]
+            s[j] = (b1 * x) - (a1 * y) + s[j + 1]
+            s[j + 1] = (b2 * x) - (a2 * y)
+            x = y
+            k = k + 5
+            j = j + 6
+        data[first + axis] = x
+
+def lowpass(cycle_hz:float, cutoff_hz:float, q:float = 0.7071) -> tuple:
+    """Biquad low pass coefficients (b0, b1, b2, a1, a2), from the RBJ audio EQ cookbook. q = 1 / sqrt(2) is a Butterworth response (flat, no peaking)."""
+    w0:float = 2.0 * math.pi * cutoff_hz / cycle_hz
+    cs:float = math.cos(w0)
+    alpha:float = math.sin(w0) / (2.0 * q)
+    a0:float = 1.0 + alpha
+    b1:float = (1.0 - cs) / a0
+    return (b1 / 2.0, b1, b1 / 2.0, (-2.0 * cs) / a0, (1.0 - alpha) / a0)
+
+def notch(cycle_hz:float, center_hz:float, q:float = 3.0) -> tuple:
+    """Biquad notch coefficients (b0, b1, b2, a1, a2), from the RBJ audio EQ cookbook. Higher q is a narrower notch: q = center frequency / width of the notch."""
+    w0:float = 2.0 * math.pi * center_hz / cycle_hz
+    cs:float = math.cos(w0)
+    alpha:float = math.sin(w0) / (2.0 * q)
+    a0:float = 1.0 + alpha
+    return (1.0 / a0, (-2.0 * cs) / a0, 1.0 / a0, (-2.0 * cs) / a0, (1.0 - alpha) / a0)
+
+def pt1_gain(cycle_hz:float, cutoff_hz:float) -> float:
+    """The gain k of a first order (PT1) low pass, y = y + k * (x - y), run at cycle_hz. 1.0 (no filtering) for a cutoff of 0."""
+    if cutoff_hz <= 0.0:
+        return 1.0
+    rc:float = 1.0 / (2.0 * math.pi * cutoff_hz)
+    dt:float = 1.0 / cycle_hz
+    return dt / (rc + dt)
+
+def response(coefficients:list, cycle_hz:float, hz:float) -> tuple:
+    """(gain, delay in ms) of a cascade of biquads (a list of (b0, b1, b2, a1, a2)) at hz (above 0). The delay is the phase delay: how far behind a sine wave of this frequency comes out."""
+    w:float = 2.0 * math.pi * hz / cycle_hz
+    re:float = 1.0
+    im:float = 0.0
+    for b0, b1, b2, a1, a2 in coefficients:
+        # H(z) = (b0 + b1 z^-1 + b2 z^-2) / (1 + a1 z^-1 + a2 z^-2) at z = e^jw
+        nr:float = b0 + (b1 * math.cos(w)) + (b2 * math.cos(2.0 * w))
+        ni:float = -(b1 * math.sin(w)) - (b2 * math.sin(2.0 * w))
+        dr:float = 1.0 + (a1 * math.cos(w)) + (a2 * math.cos(2.0 * w))
+        di:float = -(a1 * math.sin(w)) - (a2 * math.sin(2.0 * w))
+        d:float = (dr * dr) + (di * di)
+        hr:float = ((nr * dr) + (ni * di)) / d
+        hi:float = ((ni * dr) - (nr * di)) / d
+        re, im = (re * hr) - (im * hi), (re * hi) + (im * hr)
+    phase:float = math.atan2(im, re)
+    if phase > 0.0:
+        phase = phase - (2.0 * math.pi)
+    return (math.sqrt((re * re) + (im * im)), -phase / (2.0 * math.pi * hz) * 1000.0)
+
+class GyroFilter:
+    """
+    A cascade of biquad low pass and notch filters over the three gyro axes, run once per flight loop cycle.
+    Coefficients are worked out once, from the loop rate and the cutoffs, when the filter is built (and again by set_rate(), if the loop rate changes). Coefficients and state live in array('f') storage and apply() is a native-emitter function, so nothing is allocated per cycle beyond the floats themselves.
+    With no stages, apply() returns right away and the gyro goes through untouched.
+    """
+
+    def __init__(self, cycle_hz:float, lpf_hz:float = 0.0, lpf_stages:int = 1, notch_hz:float = 0.0, notch_q:float = 3.0) -> None:
+        """
+        :param cycle_hz: the rate apply() will be called at.
+        :param lpf_hz: low pass cutoff, 0.0 for none. Must be below half of cycle_hz.
+        :param lpf_stages: how many identical low pass biquads to cascade (each one adds 12 dB/octave of roll off, and delay).
+        :param notch_hz: notch center (e.g. a frame resonance), 0.0 for none. Must be below half of cycle_hz.
+        :param notch_q: notch sharpness: center frequency / width.
+        """
+        self.lpf_hz:float = lpf_hz
+        self.lpf_stages:int = lpf_stages
+        self.notch_hz:float = notch_hz
+        self.notch_q:float = notch_q
+        self._design(cycle_hz)
+        self.stages:int = len(self.coefficients)
+        self._c = array.array("f", [v for stage in self.coefficients for v in stage])
+        self._s = array.array("f", [0.0] * (self.stages * 6))
+
+    def _design(self, cycle_hz:float) -> None:
+        """Works out every stage's coefficients for cycle_hz (into self.coefficients)."""
+        coefficients:list[tuple] = []
+        nyquist:float = cycle_hz / 2.0
+        if self.notch_hz > 0.0:
+            if self.notch_hz >= nyquist:
+                raise Exception("Gyro notch at " + str(self.notch_hz) + " hz must be below half the loop rate (" + str(nyquist) + " hz)")
+            coefficients.append(notch(cycle_hz, self.notch_hz, self.notch_q))
+        if self.lpf_hz > 0.0:
+            if self.lpf_hz >= nyquist:
+                raise Exception("Gyro low pass at " + str(self.lpf_hz) + " hz must be below half the loop rate (" + str(nyquist) + " hz)")
+            for i in range(self.lpf_stages):
+                coefficients.append(lowpass(cycle_hz, self.lpf_hz))
+        self.cycle_hz:float = cycle_hz
+        self.coefficients:list[tuple] = coefficients
+
+    def supports(self, cycle_hz:float) -> bool:
+        """True if every cutoff is below half of cycle_hz, i.e. the filter can run at that rate."""
+        nyquist:float = cycle_hz / 2.0
+        return (self.notch_hz <= 0.0 or self.notch_hz < nyquist) and (self.lpf_hz <= 0.0 or self.lpf_hz < nyquist)
+
+    def set_rate(self, cycle_hz:float) -> None:
+        """Changes the rate apply() is called at: the coefficients are worked out again, in place. The filters' history is kept."""
+        self._design(cycle_hz)
+        k:int = 0
+        for stage in self.coefficients:
+            for v in stage:
+                self._c[k] = v
+                k = k + 1
+
+    def apply(self, data, first:int = 4) -> None:
+        """Filters data[first] to data[first + 2] in place, e.g. the gyro x, y, z of mpu6050.MPU6050.data (the default)."""
+        if self.stages > 0:
+            _apply(self._c, self._s, self.stages, data, first)
+
+    def reset(self) -> None:
+        """Forgets the filters' history."""
+        for i in range(len(self._s)):
+            self._s[i] = 0.0
+
+    def delay_ms(self, hz:float = 20.0) -> float:
+        """How far behind (ms) the filtered gyro is at hz, i.e. the delay the control loop sees at the frequencies it has to act on."""
+        return response(self.coefficients, self.cycle_hz, hz)[1]
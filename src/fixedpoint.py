@@ -0,0 +1,406 @@
+import array
+import mpu6050
+from emit import ptr8, ptr32
+import micropython
+from micropython import const
+
+# Number formats. Every value on the control path is a 32-bit integer, and every intermediate result is kept below 2^31 (see the notes in _step):
+#   rates (gyro, setpoints, errors):  gyro counts * 64 (Q6 of the MPU-6050's LSB, about 0.00024 deg/s at +/- 500 deg/s), errors clamped to +/- 2^22
+#   throttle, PID terms and outputs:  throttle fraction * 2^20 (Q20, about 1 ns of ESC duty cycle), D terms and outputs clamped to +/- 4 (2^22)
+#   I term state:                     throttle fraction * 2^28 (Q28), so small increments every cycle are not lost. Limited to +/- I_LIMIT_MAX
+#   mixing factors, D filter:         Q16
+#   saturation scale:                 Q20
+#   coefficients (gains):             a mantissa m (|m| < 2^15) and a shift s (10 <= s <= 29): x * gain = x * m / 2^s, see coefficient()
+RATE_BITS:int = 6
+ONE:int = 1 << 20 # throttle 1.0
+I_SHIFT:int = 8 # Q28 -> Q20
+I_LIMIT_MAX:float = 3.99 # largest I term the Q28 state can hold while staying a MicroPython small int (below 2^30)
+
+# state layout (an array('i'))
+S_FLIP = const(0) # gyro axis flips (+1 or -1), x, y, z
+S_BIAS = const(3) # gyro bias, Q6 counts, after the flips
+S_SETPOINT = const(6) # roll, pitch, yaw setpoints, Q6 counts
+S_THROTTLE = const(9) # adjusted throttle, Q20
+S_KP_M = const(10) # P gain mantissa (per axis), then shift
+S_KP_S = const(13)
+S_KI_M = const(16) # I gain * dt
+S_KI_S = const(19)
+S_KD_M = const(22) # D gain / dt
+S_KD_S = const(25)
+S_I_LIMIT = const(28) # Q28
+S_D_K = const(29) # D term low pass gain, Q16 (65536 = none)
+S_INTEGRAL = const(30) # Q28
+S_LAST_ERROR = const(33) # Q6 counts
+S_P = const(36) # Q20
+S_D = const(39) # Q20, also the D low pass state
+S_OUTPUT = const(42) # Q20
+S_GYRO = const(45) # Q6 counts, as decoded in the last step
+S_LO = const(48) # throttle range that does not clip, Q20
+S_HI = const(49)
+S_SCALING = const(50) # 1 = saturation scaling on
+S_A_HI = const(51) # duty cycle line: ns per throttle (1.0), split as (A_HI << 10) + A_LO
+S_A_LO = const(52)
+S_B = const(53) # ns at throttle 0
+S_DMIN = const(54)
+S_DMAX = const(55)
+S_SCALE = const(56) # how much the PID contributions were scaled to avoid clipping, Q20
+S_MOTORS = const(57)
+S_MIX = const(58) # roll, pitch, yaw factors (Q16) of every motor
+S_MOTOR_OUTPUT = const(82) # every motor's throttle, Q20 (up to 8 motors)
+STATE_SIZE:int = 90
+MAX_MOTORS:int = 8
+
+# stick parameters layout (an array('i'), see _sticks)
+K_STEP = const(0) # table index per iBUS unit above 1000, Q20
+K_POINTS = const(1)
+K_IDLE = const(2) # throttle_idle, Q20
+K_RANGE = const(3) # throttle range (governor - idle), Q20
+
+def coefficient(value:float) -> tuple:
+    """
+    A real number as (m, s) with value = m / 2^s, m below 2^15 in magnitude and s from 10 to 29, as precise as that allows.
+    x * value is then computed without overflow for any |x| below 2^24 (see _step).
+    """
+    s:int = 29
+    while s > 10 and abs(value) * (1 << s) >= 32767.5:
+        s = s - 1
+    m:int = int(round(value * (1 << s)))
+    if abs(m) >= 32768:
+        raise ValueError("Coefficient " + str(value) + " is too large for the fixed point control path")
+    return (m, s)
+
+@micropython.viper
+def _sticks(tables:ptr32, params:ptr32, raw:ptr32, command:ptr32):
+    """
+    The fixed point version of sticks.StickMap.process(): raw is the throttle, roll, pitch, yaw and mode switch channels (1000 to 2000), command gets
+    [stick throttle (Q20), roll, pitch, yaw setpoints (Q6 counts), mode switch, adjusted throttle (Q20)].
+    Integer table lookups with linear interpolation (Q12), no division.
+    """
+    step = params[K_STEP]
+    points = params[K_POINTS]
+    last = points - 1
+    base = 0
+    k = 0
+    while k < 4:
+        v = raw[k] - 1000
+        if v < 0:
+            v = 0
+        elif v > 1000:
+            v = 1000
+        x = ((v * step) + 128) >> 8 # Q12 table index, rounded (v * step is the Q20 index, below 2^27 up to 129 points)
+        i = x >> 12
+        if i >= last:
+            r = tables[base + last]
+        else:
+            lo = tables[base + i]
+            r = lo + ((((tables[base + i + 1] - lo) * (x & 4095)) + 2048) >> 12)
+        command[k] = r
+        base = base + points
+        k = k + 1
+    command[4] = raw[4]
+
+    # adjusted throttle = idle + range * stick throttle (both at most 2^20, so the stick is split at 10 bits to keep the products below 2^31)
+    t = command[0]
+    rng = params[K_RANGE]
+    command[5] = params[K_IDLE] + (((t >> 10) * rng) >> 10) + (((t & 1023) * rng) >> 20)
+
+@micropython.viper
+def _step(s:ptr32, buf:ptr8, command:ptr32, duty:ptr32):
+    """
+    One control step, from the raw gyro counts of the last MPU-6050 burst read (buf) and the latest stick command (see _sticks) to every motor's duty cycle in nanoseconds (duty). Integer arithmetic only.
+    x * (m / 2^s) is computed as ((x >> 10) * m) / 2^(s - 10) + ((x & 1023) * m) / 2^s, which is below 2^31 for |x| < 2^24 and |m| < 2^15 (see coefficient()).
+    The I term's increment is rounded to nearest, exactly, as it accumulates every cycle. Everything else is truncated (at most 1 unit of its format off).
+    """
+    # gyro: sign extend the big-endian 16 bit counts, flip, scale to Q6 (RATE_BITS) and remove the bias
+    # (int() makes the bytes signed machine words: viper loads them from a ptr8 as unsigned)
+    g0 = (((((int(buf[8]) << 8) | int(buf[9])) ^ 0x8000) - 0x8000) * s[S_FLIP] << 6) - s[S_BIAS]
+    g1 = (((((int(buf[10]) << 8) | int(buf[11])) ^ 0x8000) - 0x8000) * s[S_FLIP + 1] << 6) - s[S_BIAS + 1]
+    g2 = (((((int(buf[12]) << 8) | int(buf[13])) ^ 0x8000) - 0x8000) * s[S_FLIP + 2] << 6) - s[S_BIAS + 2]
+    s[S_GYRO] = g0
+    s[S_GYRO + 1] = g1
+    s[S_GYRO + 2] = g2
+
+    # the command this step flies (kept in the state, for export())
+    s[S_SETPOINT] = command[1]
+    s[S_SETPOINT + 1] = command[2]
+    s[S_SETPOINT + 2] = command[3]
+    s[S_THROTTLE] = command[5]
+
+    lim = s[S_I_LIMIT]
+    dk = s[S_D_K]
+    axis = 0
+    while axis < 3:
+        if axis == 0:
+            g = g0
+        elif axis == 1:
+            g = g1
+        else:
+            g = g2
+
+        # error, Q6 counts, clamped to +/- 2^22
+        e = s[S_SETPOINT + axis] - g
+        if e > 4194303:
+            e = 4194303
+        elif e < -4194303:
+            e = -4194303
+
+        # P (Q20)
+        m = s[S_KP_M + axis]
+        sh = s[S_KP_S + axis]
+        p = (((e >> 10) * m) >> (sh - 10)) + (((e & 1023) * m) >> sh)
+
+        # I (Q28): increment = round(e * m / 2^s), exactly: the high part's remainder is carried into the low part
+        m = s[S_KI_M + axis]
+        sh = s[S_KI_S + axis]
+        hi = (e >> 10) * m
+        hq = hi >> (sh - 10)
+        lo = ((hi - (hq << (sh - 10))) << 10) + ((e & 1023) * m) + (1 << (sh - 1))
+        i = s[S_INTEGRAL + axis] + hq + (lo >> sh)
+        if i > lim:
+            i = lim
+        elif i < -lim:
+            i = -lim
+
+        # D (Q20): the change in error (below 2^23), then the first order low pass
+        de = e - s[S_LAST_ERROR + axis]
+        m = s[S_KD_M + axis]
+        sh = s[S_KD_S + axis]
+        raw_d = (((de >> 10) * m) >> (sh - 10)) + (((de & 1023) * m) >> sh)
+        if raw_d > 4194303:
+            raw_d = 4194303
+        elif raw_d < -4194303:
+            raw_d = -4194303
+        d = s[S_D + axis]
+        x = raw_d - d # below 2^23
+        d = d + (((x >> 10) * dk) >> 6) + (((x & 1023) * dk) >> 16)
+
+        out = p + (i >> 8) + d # I_SHIFT
+        if out > 4194304:
+            out = 4194304
+        elif out < -4194304:
+            out = -4194304
+
+        s[S_INTEGRAL + axis] = i
+        s[S_LAST_ERROR + axis] = e
+        s[S_P + axis] = p
+        s[S_D + axis] = d
+        s[S_OUTPUT + axis] = out
+        axis = axis + 1
+
+    # mix: every motor's PID contribution (Q20) and the extremes
+    r = s[S_OUTPUT]
+    pt = s[S_OUTPUT + 1]
+    y = s[S_OUTPUT + 2]
+    n = s[S_MOTORS]
+    throttle = s[S_THROTTLE]
+    cmax = 0
+    cmin = 0
+    k = 0
+    while k < n:
+        f = S_MIX + (k * 3)
+        fr = s[f]
+        fp = s[f + 1]
+        fy = s[f + 2]
+        c = ((((r >> 10) * fr) >> 6) + (((r & 1023) * fr) >> 16)) + ((((pt >> 10) * fp) >> 6) + (((pt & 1023) * fp) >> 16)) + ((((y >> 10) * fy) >> 6) + (((y & 1023) * fy) >> 16))
+        s[S_MOTOR_OUTPUT + k] = c
+        if c > cmax:
+            cmax = c
+        if c < cmin:
+            cmin = c
+        k = k + 1
+
+    # saturation scaling: the largest scale (Q20) that keeps every motor within lo..hi, by long division (no division instruction needed)
+    scale = 1048576
+    if s[S_SCALING]:
+        lo_t = s[S_LO]
+        hi_t = s[S_HI]
+        if cmax > 0 and throttle + cmax > hi_t:
+            num = hi_t - throttle
+            if num <= 0:
+                scale = 0
+            else:
+                q = 0
+                rem = num
+                bit = 0
+                while bit < 20:
+                    rem = rem << 1
+                    q = q << 1
+                    if rem >= cmax:
+                        rem = rem - cmax
+                        q = q | 1
+                    bit = bit + 1
+                scale = q
+        if cmin < 0 and throttle + cmin < lo_t:
+            num = throttle - lo_t
+            den = 0 - cmin
+            if num <= 0:
+                q = 0
+            else:
+                q = 0
+                rem = num
+                bit = 0
+                while bit < 20:
+                    rem = rem << 1
+                    q = q << 1
+                    if rem >= den:
+                        rem = rem - den
+                        q = q | 1
+                    bit = bit + 1
+            if q < scale:
+                scale = q
+    s[S_SCALE] = scale
+
+    # every motor's throttle, then its duty cycle: b + a * t (a split as (a_hi << 10) + a_lo, t clamped to 0..1 so both products stay below 2^31), clamped to dmin..dmax
+    a_hi = s[S_A_HI]
+    a_lo = s[S_A_LO]
+    b = s[S_B]
+    dmin = s[S_DMIN]
+    dmax = s[S_DMAX]
+    k = 0
+    while k < n:
+        c = s[S_MOTOR_OUTPUT + k]
+        if scale < 1048576: # |c * scale| is at most 2^40 (scale is what brings the largest contribution down to lo..hi), so c * scale / 2^20 is split at 10 bits
+            c = (((c >> 10) * scale) >> 10) + (((c & 1023) * scale) >> 20)
+        t = throttle + c
+        s[S_MOTOR_OUTPUT + k] = t
+        if t < 0:
+            t = 0
+        elif t > 1048576:
+            t = 1048576
+        dt = b + ((t * a_hi) >> 10) + ((t * a_lo) >> 20)
+        if dt < dmin:
+            dt = dmin
+        elif dt > dmax:
+            dt = dmax
+        duty[k] = dt
+        k = k + 1
+
+class FixedController:
+    """
+    The flight loop's control path (gyro -> rate PIDs -> mixer -> duty cycles) in integer fixed point arithmetic, running as viper code, so a control step creates no float objects at all.
+    Built from the float path's objects (their gains, bias, mixing table and stick tables are converted once), so both are configured the same way and can be compared (see tools/fixedpoint.py).
+    Rate mode only, and without the software gyro filters: angle mode needs the (float) attitude estimator.
+    """
+
+    def __init__(self, imu, pids, motor_mixer, stick_map, throttle_idle:float, throttle_range:float) -> None:
+        """
+        :param imu: mpu6050.MPU6050, after set_gyro_bias(). step() decodes the gyro from its burst buffer (imu.buf), so the loop only calls imu.read_raw().
+        :param pids: pid.PIDBank, with its gains set.
+        :param motor_mixer: mixer.Mixer. step() writes the duty cycles into its duty array.
+        :param stick_map: sticks.StickMap (rate mode).
+        :param throttle_idle: throttle at the bottom of the throttle stick.
+        :param throttle_range: throttle added at the top of the throttle stick (governor - idle).
+        """
+        if motor_mixer.motors > MAX_MOTORS:
+            raise ValueError("The fixed point control path supports up to " + str(MAX_MOTORS) + " motors")
+        self.imu = imu
+        self.pids = pids
+        self.mixer = motor_mixer
+        self.state = array.array("i", [0] * STATE_SIZE)
+        self.duty = motor_mixer.duty
+        self.buf = imu.buf
+        self.i_limit:float = 0.0 # the I term limit in effect here: the PIDBank's, or I_LIMIT_MAX if that is lower (see set_gains)
+        self.counts_per_dps:float = (1 << RATE_BITS) * mpu6050.GYRO_LSB_PER_DPS[imu.gyro_range]
+        s = self.state
+
+        # gyro
+        for axis in range(3):
+            s[S_FLIP + axis] = imu.gyro_flip[axis]
+            s[S_BIAS + axis] = int(round(imu._gyro_bias[axis] * self.counts_per_dps))
+
+        # PIDs: gains per Q6 count, out in Q20 (I in Q28)
+        self.set_gains()
+
+        # mixer
+        s[S_MOTORS] = motor_mixer.motors
+        for k in range(motor_mixer.motors):
+            s[S_MIX + (k * 3)] = int(round(motor_mixer._roll[k] * 65536))
+            s[S_MIX + (k * 3) + 1] = int(round(motor_mixer._pitch[k] * 65536))
+            s[S_MIX + (k * 3) + 2] = int(round(motor_mixer._yaw[k] * 65536))
+        s[S_LO] = int(round(motor_mixer._lo * ONE))
+        s[S_HI] = int(round(motor_mixer._hi * ONE))
+        s[S_SCALING] = 1 if motor_mixer.saturation_scaling else 0
+        a:int = int(round(motor_mixer._a))
+        if a >= (1 << 21):
+            raise ValueError("The ESC duty cycle range is too wide for the fixed point control path")
+        s[S_A_HI] = a >> 10
+        s[S_A_LO] = a & 1023
+        s[S_B] = int(round(motor_mixer._b))
+        s[S_DMIN] = motor_mixer._dmin
+        s[S_DMAX] = motor_mixer._dmax
+        s[S_SCALE] = ONE
+
+        # sticks: the float tables, converted (setpoints to Q6 counts, throttle to Q20)
+        points:int = stick_map.points
+        self.tables = array.array("i", [0] * (4 * points))
+        for i in range(points):
+            self.tables[i] = int(round(stick_map.tables[i] * ONE))
+            for k in range(1, 4):
+                self.tables[(k * points) + i] = int(round(stick_map.tables[(k * points) + i] * self.counts_per_dps))
+        for k in range(1, 4):
+            for i in range(points - 1):
+                if abs(self.tables[(k * points) + i + 1] - self.tables[(k * points) + i]) >= (1 << 19): # keeps _sticks' interpolation below 2^31
+                    raise ValueError("The stick tables are too coarse for the fixed point control path, use more points")
+        self.params = array.array("i", [int(round((points - 1) * 1048576 / 1000.0)), points, int(round(throttle_idle * ONE)), int(round(throttle_range * ONE))])
+        self.raw = array.array("i", [1000, 1500, 1500, 1500, 1000]) # throttle, roll, pitch, yaw, mode switch channels
+        self.command = array.array("i", [0, 0, 0, 0, 1000, int(round(throttle_idle * ONE))]) # see _sticks
+
+    def set_gains(self) -> None:
+        """Converts the PIDBank's current gains (and I limit and D term low pass)."""
+        pids = self.pids
+        s = self.state
+        per_count:float = ONE / self.counts_per_dps # Q20 out per Q6 count in, for a gain of 1
+        for axis in range(3):
+            s[S_KP_M + axis], s[S_KP_S + axis] = coefficient(pids.kp[axis] * per_count)
+            s[S_KI_M + axis], s[S_KI_S + axis] = coefficient(pids._ki_dt[axis] * per_count * (1 << I_SHIFT))
+            s[S_KD_M + axis], s[S_KD_S + axis] = coefficient(pids._kd_dt[axis] * per_count)
+        self.i_limit = min(pids._i_limit[0], I_LIMIT_MAX) # the Q28 I term can't hold more (see i_limit_clamped())
+        s[S_I_LIMIT] = int(self.i_limit * (ONE << I_SHIFT))
+        s[S_D_K] = int(round(pids._d_k[0] * 65536))
+
+    def i_limit_clamped(self) -> bool:
+        """True if the PIDBank's I term limit is above what the fixed point path can hold, so it is held to I_LIMIT_MAX here instead."""
+        return self.pids._i_limit[0] > self.i_limit
+
+    def sticks(self, rc_data) -> None:
+        """Converts the receiver's latest channels (ibus.IBus.read()) into command (see _sticks)."""
+        raw = self.raw
+        raw[0] = rc_data[3]
+        raw[1] = rc_data[1]
+        raw[2] = rc_data[2]
+        raw[3] = rc_data[4]
+        raw[4] = rc_data[5]
+        _sticks(self.tables, self.params, raw, self.command)
+
+    def step(self) -> None:
+        """One control step on the last imu.read_raw(): the duty cycles land in the mixer's duty array."""
+        _step(self.state, self.buf, self.command, self.duty)
+
+    def reset(self) -> None:
+        """Clears the I term, the last error and the D term's filter (e.g. when switching into standby)."""
+        s = self.state
+        for axis in range(3):
+            s[S_INTEGRAL + axis] = 0
+            s[S_LAST_ERROR + axis] = 0
+            s[S_D + axis] = 0
+
+    def export(self, data, flight_state, state = None) -> None:
+        """
+        Copies the last step, as floats, to where the blackbox reads the float path's: the PIDBank's p, integral, d and output, the mixer's output and scale, the gyro rates into data[4] to [6] (the IMU's data layout) and flight_state ([setpoint roll, pitch, yaw, throttle]).
+        This allocates (floats), so it belongs in a rate group, not on the control path.
+        :param state: the controller state to copy from, self.state if None. E.g. a copy of it taken with interrupts disabled, when step() runs from a timer interrupt (see controltimer.py), so all of it is from the same step.
+        """
+        s = self.state if state is None else state
+        pids = self.pids
+        per_dps:float = 1.0 / self.counts_per_dps
+        for axis in range(3):
+            pids.p[axis] = s[S_P + axis] / ONE
+            pids.integral[axis] = s[S_INTEGRAL + axis] / (ONE << I_SHIFT)
+            pids.d[axis] = s[S_D + axis] / ONE
+            pids.output[axis] = s[S_OUTPUT + axis] / ONE
+            data[4 + axis] = s[S_GYRO + axis] * per_dps
+            flight_state[axis] = s[S_SETPOINT + axis] * per_dps
+        flight_state[3] = s[S_THROTTLE] / ONE
+        for k in range(self.mixer.motors):
+            self.mixer.output[k] = s[S_MOTOR_OUTPUT + k] / ONE
+        self.mixer.scale[0] = s[S_SCALE] / ONE
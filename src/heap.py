@@ -0,0 +1,167 @@
+import array
+import gc
+import time
+
+# Allocation counter: a number that only ever goes up, by the bytes every allocation takes from the heap.
+# With MICROPY_MEM_STATS (e.g. the unix port's debug builds), micropython.mem_total() is exactly that, and costs next to nothing.
+# Otherwise (the rp2 port), it is gc.mem_alloc() plus everything collections have freed since: with the automatic collector off, nothing is freed between collections, so the two add up to the same thing. gc.mem_alloc() walks the heap's allocation table, so it costs more (see Heap.count_us).
+# On a regular computer (SITL) there is no heap to count: every count is 0.
+try:
+    import micropython
+    _mem_total = micropython.mem_total
+except (ImportError, AttributeError):
+    _mem_total = None
+_mem_alloc = getattr(gc, "mem_alloc", None)
+_mem_free = getattr(gc, "mem_free", None)
+
+class Heap:
+    """
+    Flight mode memory policy. MicroPython runs a garbage collection (milliseconds, with everything else stopped) whenever an allocation doesn't fit, so a stray allocation in the flight loop can stall any cycle. Instead:
+    - arm() (entering flight mode) collects, then turns the automatic collector off. From then on, nothing is collected unless this class collects it.
+    - service() (a low priority scheduler task) collects only once less than free_reserve bytes are left, and only if a collection (as long as the longest seen so far) fits in the cycle's time to spare. Below free_critical bytes, it collects regardless: a late cycle is better than a MemoryError.
+    - disarm() (back to standby) collects and turns the automatic collector back on.
+    cycle() closes every cycle's accounting: counts = [bytes allocated, us spent collecting] since the previous cycle(). Nothing here allocates in flight, except report().
+    """
+
+    def __init__(self, free_reserve:int = 32768, free_critical:int = 8192, tracking:bool = True) -> None:
+        """
+        :param free_reserve: in flight, collect in a cycle's time to spare once fewer bytes than this are free.
+        :param free_critical: in flight, collect right away once fewer bytes than this are free.
+        :param tracking: count every cycle's allocations (costs count_us per cycle). If False, counts[0] stays 0 and free memory is only checked in service().
+        """
+        self.free_reserve:int = free_reserve
+        self.free_critical:int = free_critical
+        self.counting:bool = _mem_total is not None or _mem_alloc is not None # False on a regular computer
+        self.tracking:bool = tracking and self.counting
+        self.armed:bool = False
+        self.counts = array.array("i", [0, 0]) # [bytes allocated, us spent collecting] over the last cycle (see cycle())
+
+        # the allocation counter (see _allocated()) and free memory as of the last collection
+        self._freed:int = 0 # bytes every collection so far has freed (only used with gc.mem_alloc())
+        self._mark:int = 0 # the counter at the end of the last cycle
+        self._gc_us:int = 0 # time spent collecting since the end of the last cycle
+        self._collected_at:int = 0 # the counter right after the last collection
+        self._free_after:int = 0 # bytes free right after the last collection
+
+        # how long a collection is expected to take: the longest seen so far (starting with one now, on a heap that only holds what startup left)
+        self.collect_us:int = 0
+        self.collect()
+        self._gc_us = 0
+
+        # how long reading the counter takes, i.e. what tracking costs every cycle
+        began:int = time.ticks_us()
+        for i in range(10):
+            self._allocated()
+        self.count_us:int = time.ticks_diff(time.ticks_us(), began) // 10
+        self.reset()
+
+    def _allocated(self) -> int:
+        """Bytes allocated since power on (0 on a regular computer)."""
+        if _mem_total is not None:
+            return _mem_total()
+        if _mem_alloc is not None:
+            return self._freed + _mem_alloc()
+        return 0
+
+    def free(self) -> int:
+        """Bytes left on the heap. Between collections, worked out from the allocation counter rather than by walking the heap."""
+        if not self.counting:
+            return 1 << 30
+        return self._free_after - (self._allocated() - self._collected_at)
+
+    def reset(self) -> None:
+        """Clears the flight statistics (see report())."""
+        self.cycles:int = 0 # cycles counted since arm()
+        self.allocating:int = 0 # of which, cycles that allocated
+        self.total_bytes:int = 0
+        self.max_bytes:int = 0 # the most bytes allocated in one cycle
+        self.collections:int = 0 # collections in flight (by service())
+        self.forced:int = 0 # of which, collections that could not wait for time to spare
+        self.max_gc_us:int = 0
+        self.min_free:int = self.free()
+
+    def collect(self) -> int:
+        """Runs a garbage collection now and returns how long it took (us)."""
+        before:int = self._allocated()
+        began:int = time.ticks_us()
+        gc.collect()
+        took:int = time.ticks_diff(time.ticks_us(), began)
+        if _mem_total is None and _mem_alloc is not None:
+            self._freed = before - _mem_alloc() # the counter carries on from where it was before the collection
+        self._collected_at = self._allocated()
+        self._free_after = _mem_free() if _mem_free is not None else 0
+        self._gc_us = self._gc_us + took
+        if took > self.collect_us:
+            self.collect_us = took
+        return took
+
+    def arm(self) -> None:
+        """Entering flight mode: collect, then turn the automatic collector off."""
+        self.collect()
+        gc.disable()
+        self.armed = True
+        self.reset()
+        self._mark = self._allocated() # the arming collection's time stays in the first flight cycle's count
+
+    def disarm(self) -> None:
+        """Back in standby: collect, and turn the automatic collector back on."""
+        self.armed = False
+        self.collect()
+        gc.enable()
+
+    def cycle(self) -> None:
+        """Closes the accounting of the cycle that just ended (call once per cycle): counts = [bytes allocated, us spent collecting] since the last call."""
+        counts = self.counts
+        gc_us:int = self._gc_us
+        self._gc_us = 0
+        counts[1] = gc_us
+        if self.armed:
+            self.cycles = self.cycles + 1
+            if gc_us > self.max_gc_us:
+                self.max_gc_us = gc_us
+        if not self.tracking:
+            return
+        now:int = self._allocated()
+        allocated:int = now - self._mark
+        self._mark = now
+        if allocated < 0: # a block given back without a collection (e.g. a shrinking reallocation)
+            allocated = 0
+        counts[0] = allocated
+        if self.armed:
+            if allocated > 0:
+                self.allocating = self.allocating + 1
+                self.total_bytes = self.total_bytes + allocated
+                if allocated > self.max_bytes:
+                    self.max_bytes = allocated
+            free:int = self._free_after - (now - self._collected_at)
+            if free < self.min_free:
+                self.min_free = free
+
+    def service(self, slack_us:int) -> None:
+        """
+        In flight, collects if the heap is running low (see the class description). Call once per cycle, after the cycle's work is done.
+        :param slack_us: how much of this cycle is left.
+        """
+        if not self.armed or not self.counting:
+            return
+        free:int = self.free()
+        if free >= self.free_reserve:
+            return
+        if slack_us > self.collect_us:
+            self.collect()
+        elif free < self.free_critical:
+            self.collect()
+            self.forced = self.forced + 1
+        else:
+            return
+        self.collections = self.collections + 1
+
+    def report(self) -> str:
+        """A summary of the last flight's allocations and collections."""
+        ToReturn:str = "Heap: "
+        if self.tracking:
+            mean:float = self.total_bytes / self.cycles if self.cycles > 0 else 0.0
+            ToReturn = ToReturn + str(self.allocating) + " of " + str(self.cycles) + " cycles allocated, mean " + str(round(mean, 1)) + " / max " + str(self.max_bytes) + " bytes per cycle, min free " + str(self.min_free) + " bytes; "
+        else:
+            ToReturn = ToReturn + "allocations not counted" + ("" if self.counting else " (no allocation counter on this port)") + "; "
+        return ToReturn + str(self.collections) + " collections in flight (" + str(self.forced) + " forced), max " + str(self.max_gc_us) + " us per cycle (a collection is expected to take " + str(self.collect_us) + " us)"
@@ -1,10 +1,15 @@
 from machine import UART
+import time
+import emit
+import micropython
 
-# Works by connecting to uart, transferring data and then disconnecting
-# Allows ibus to be polled regularly without creating a block
+# Non-blocking, incremental iBUS parser
+# Every read() takes whatever bytes the UART has already received (never waits for more), appends them to a preallocated
+# ring buffer and parses every complete frame in it. The latest checksum-valid frame wins. A frame that is only partially
+# received stays in the ring and is completed on a later read(), so the flight loop is never stalled by the receiver.
 
 # returns raw values
-# To make meaningful there is a normalize static method 
+# To make meaningful there is a normalize static method
 # approx (-100 to +100) for default (standard) controls
 # 0 is centre. The zero point can be adjusted on the controller
 # actual value of min and maximum may differ
@@ -13,67 +18,134 @@ from machine import UART
 
 # Select appropriate uart pin (following are defaults)
 # For ibus receive then only RX pin needs to be connected
-# UART 0: TX pin 0 GP0 RX pin 1 GP1 
-# UART 1: TX pin 6 GP4 RX pin 7 GP5 
+# UART 0: TX pin 0 GP0 RX pin 1 GP1
+# UART 1: TX pin 6 GP4 RX pin 7 GP5
 # Connect appropriate RX pin to rightmost pin on FS-iA6B
 
 # returns list of channel values. First value (pseudo channel 0) is status
 # 0 = initial values
 # 1 = new values
-# -1 = failed to receive data old values sent
-# -2 = checksum error
+# -1 = no new frame since the last read, old values sent
+# -2 = checksum error (and no valid frame since the last read), old values sent
 
+# iBUS frame: 0x20 0x40, 14 channels (little endian, 2 bytes each), checksum (little endian, 0xFFFF - sum of the first 30 bytes)
+FRAME_LENGTH:int = 32
+RING_SIZE:int = 128 # must be a power of 2
+RING_MASK:int = RING_SIZE - 1
+
+@micropython.native
+def _extract_frame(ring, tail, frame):
+    """Copies the 32 bytes starting at tail out of the ring buffer into frame and returns True if the checksum is correct."""
+    checksum = 0xFFFF
+    i = 0
+    while i < 30:
+        b = ring[(tail + i) & 127]
+        frame[i] = b
+        checksum -= b
+        i += 1
+    frame[30] = ring[(tail + 30) & 127]
+    frame[31] = ring[(tail + 31) & 127]
+    return checksum == (frame[30] | (frame[31] << 8))
+
+@micropython.native
+def _unpack_channels(frame, ch, n):
+    """Writes the first n channels of a frame (little endian, 2 bytes each, after the header) into ch[1] to ch[n], without the tuple struct.unpack_from would allocate."""
+    i = 0
+    while i < n:
+        ch[i + 1] = frame[2 + (i * 2)] | (frame[3 + (i * 2)] << 8)
+        i += 1
 
 class IBus ():
-    
-    # Number of channels (FS-iA6B has 6)
+
+    # Number of channels (FS-iA6B has 6, an iBUS frame always carries 14)
     def __init__ (self, uart_num, baud=115200, num_channels=6):
         self.uart_num = uart_num
         self.baud = baud
         self.uart = UART(self.uart_num, self.baud)
-        self.num_channels = num_channels
+        self.num_channels = min(num_channels, 14)
         # ch is channel value
-        self.ch = []
-        # Set channel values to 0
-        for i in range (self.num_channels+1):
-            self.ch.append(0)
-            
-            
-    # Returns list with raw data
+        self.ch = [0] * (self.num_channels + 1)
+
+        # ring buffer (preallocated, along with a memoryview starting at every position, so reading into it never allocates)
+        self._ring = bytearray(RING_SIZE)
+        mv = memoryview(self._ring)
+        self._views = [mv[i:] for i in range(RING_SIZE)]
+        self._head = 0 # where the next received byte goes
+        self._tail = 0 # the oldest unparsed byte
+        self._count = 0 # unparsed bytes in the ring
+        self._frame = bytearray(FRAME_LENGTH) # the most recent frame, copied out of the ring
+        self._synced = False # False while hunting for a frame header
+
+        # time (ticks_us) the latest valid frame finished arriving
+        self._byte_us = (10 * 1000000) // baud # 8N1 = 10 bits per byte
+        self.frame_ticks_us = time.ticks_us()
+
+        # counters
+        self.frames = 0 # valid frames received
+        self.checksum_errors = 0 # frames that had a header but a bad checksum
+        self.sync_errors = 0 # times the stream lost frame alignment and bytes had to be skipped to find the next header
+
+
+    # Takes in whatever has been received and returns the list of the latest values (never waits on the UART)
     def read(self):
-        # Max 10 attempts to read
-        for z in range(10):
-            buffer = bytearray (31)
-            char = self.uart.read(1)
-            # check for 0x20
-            if char == b'\x20':
-                # read reset of string into buffer
-                self.uart.readinto(buffer)
-                checksum = 0xffdf # 0xffff - 0x20
-                # check checksum
-                for i in range(29):
-                    checksum -= buffer[i]
-                if checksum == (buffer[30] << 8) | buffer[29]:
-                    # buffer[0] = 0x40
-                    self.ch[0] = 1 # status 1 = success
-                    for i in range (1, self.num_channels + 1):
-                        self.ch[i] = (buffer[(i*2)-1] + (buffer[i*2] << 8))                    
-                    return self.ch
-                else:
-                    # Checksum error
-                    self.ch[0] = -2
+        self._receive()
+        status = -1
+        ring = self._ring
+        while self._count >= 2:
+            t = self._tail
+            if ring[t] != 0x20 or ring[(t + 1) & RING_MASK] != 0x40:
+                # not at a frame header, skip a byte
+                if self._synced:
+                    self._synced = False
+                    self.sync_errors += 1
+                self._tail = (t + 1) & RING_MASK
+                self._count -= 1
+                continue
+            if self._count < FRAME_LENGTH:
+                break # the rest of this frame hasn't arrived yet
+            if _extract_frame(ring, t, self._frame):
+                _unpack_channels(self._frame, self.ch, self.num_channels)
+                status = 1
+                self.frames += 1
+                self._synced = True
+                self._tail = (t + FRAME_LENGTH) & RING_MASK
+                self._count -= FRAME_LENGTH
+                # the frame ended when the bytes still in the ring started arriving
+                self.frame_ticks_us = time.ticks_add(self._received_ticks_us, -self._count * self._byte_us)
             else:
-                self.ch[0] = -1
-                
-        # Reach here then timed out
-        self.ch[0] = -1
+                # checksum error. Only skip the header byte, as a real frame may start inside this one
+                self.checksum_errors += 1
+                if status != 1:
+                    status = -2
+                self._synced = False
+                self._tail = (t + 1) & RING_MASK
+                self._count -= 1
+        self.ch[0] = status
         return self.ch
-    
-    
+
+    def _receive(self):
+        """Moves every byte the UART has already received into the ring buffer (as much as fits)."""
+        uart = self.uart
+        available = uart.any()
+        self._received_ticks_us = time.ticks_us()
+        while available > 0 and self._count < RING_SIZE:
+            n = min(available, RING_SIZE - self._count, RING_SIZE - self._head) # contiguous space
+            got = uart.readinto(self._views[self._head], n)
+            if not got:
+                break
+            self._head = (self._head + got) & RING_MASK
+            self._count += got
+            available -= got
+
+    # Microseconds since the latest valid frame finished arriving
+    def frame_age_us(self):
+        return time.ticks_diff(time.ticks_us(), self.frame_ticks_us)
+
+
     # Convert to meaningful values - eg. -100 to 100
     # Typical use for FS-iA6B
     # channel 1 to 4 use type="default" provides result from -100 to +100 (0 in centre)
-    # channel 5 & 6 are dials type="dial" provides result from 0 to 100 
+    # channel 5 & 6 are dials type="dial" provides result from 0 to 100
     # Note approx depends upon calibration etc.
     @staticmethod
     def normalize (value, type="default"):
@@ -81,5 +153,5 @@ class IBus ():
             return ((value - 1000) / 10)
         else:
             return ((value - 1500) / 5)
-        
-    
+
+
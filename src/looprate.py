@@ -0,0 +1,88 @@
+import array
+
+class LoopRate:
+    """
+    Picks the flight loop's rate from what the hardware sustains, and steps it down in flight if cycles start running late.
+    At boot, the critical path is timed a number of times (add() every measured cycle) and choose() returns the highest of the candidate rates whose period the slowest 1% of those cycles fill no more than `load` of. The rest of every cycle is left for the rate groups (RC, blackbox, flash writes, etc., see scheduler.py) and for jitter.
+    In flight, watch() is given the scheduler's count of late cycles once per cycle. If more than max_late of any `window` cycles started late, it returns True, and step_down() returns the next lower rate to run at instead. Nothing here allocates in flight.
+    """
+
+    def __init__(self, rates:list, load:float = 0.5, samples:int = 500, window:int = 250, max_late:int = 10) -> None:
+        """
+        :param rates: the candidate rates (hz), in any order.
+        :param load: the most of a cycle the measured critical path may take (0.0 to 1.0).
+        :param samples: how many cycles to time at boot.
+        :param window: how many flight cycles the late ones are counted over.
+        :param max_late: step down once more cycles than this, out of a window, started late.
+        """
+        if len(rates) == 0:
+            raise Exception("No loop rate to choose from")
+        self.rates:list[float] = sorted(rates, reverse = True) # fastest first
+        self.load:float = load
+        self.window:int = window
+        self.max_late:int = max_late
+        self.hz:float = self.rates[-1] # the rate the loop runs at (see choose() and step_down())
+
+        # the boot benchmark: every timed cycle's length (us)
+        self.samples = array.array("i", [0] * max(1, samples))
+        self.n:int = 0
+        self.p99_us:int = 0 # the slowest 1% of the timed cycles took at least this long (see choose())
+
+        # in flight: the late cycle count at the start of the current window, and how far into it the loop is
+        self._late_mark:int = 0
+        self._cycles:int = 0
+        self.step_downs:int = 0
+
+    def measuring(self) -> bool:
+        """True until every sample has been taken."""
+        return self.n < len(self.samples)
+
+    def add(self, us:int) -> None:
+        """Adds the length (us) of one timed cycle of the critical path."""
+        if self.n < len(self.samples):
+            self.samples[self.n] = us
+            self.n = self.n + 1
+
+    def choose(self) -> float:
+        """Returns (and switches to) the highest rate the timed cycles fit, or the lowest rate if none of them does."""
+        if self.n > 0:
+            ordered:list[int] = sorted(self.samples[0:self.n])
+            self.p99_us = ordered[min(self.n - 1, (self.n * 99) // 100)]
+        ToReturn:float = self.rates[-1]
+        for hz in self.rates:
+            if self.p99_us <= self.load * 1000000.0 / hz:
+                ToReturn = hz
+                break
+        self.hz = ToReturn
+        self.restart()
+        return ToReturn
+
+    def restart(self, late:int = 0) -> None:
+        """Starts a new window (e.g. when flight mode is entered), from the scheduler's current count of late cycles."""
+        self._late_mark = late
+        self._cycles = 0
+
+    def watch(self, late:int) -> bool:
+        """
+        Call once per flight cycle with the scheduler's count of late cycles (scheduler.Scheduler.overruns). Returns True if the loop should step down (see step_down()).
+        """
+        self._cycles = self._cycles + 1
+        if self._cycles < self.window:
+            if late - self._late_mark > self.max_late: # no need to wait for the end of the window
+                self.restart(late)
+                return self.hz != self.rates[-1]
+            return False
+        self.restart(late)
+        return False
+
+    def step_down(self) -> float:
+        """Switches to the next lower rate (if there is one) and returns it."""
+        i:int = self.rates.index(self.hz)
+        if i < len(self.rates) - 1:
+            self.hz = self.rates[i + 1]
+            self.step_downs = self.step_downs + 1
+        return self.hz
+
+    def report(self) -> str:
+        """What was measured at boot and what it chose."""
+        return "Loop rate: " + str(self.hz) + " hz of " + str(self.rates) + " (critical path p99 " + str(self.p99_us) + " us over " + str(self.n) + " cycles, at most " + str(int(self.load * 100)) + "% of a cycle)" + ((", stepped down " + str(self.step_downs) + " times in flight") if self.step_downs > 0 else "")
@@ -19,6 +19,12 @@ gpio_motor2 = 28 # front right, counter clockwise
 gpio_motor3 = 15 # rear left, counter clockwise
 gpio_motor4 = 16 # rear right, clockwise
 
+# Frame layout - how the motors are arranged (see LAYOUTS in mixer.py): "quad-x" (Scout), "quad-+", "hex-x" or "octo-x"
+# gpio_motors is the GPIO of every motor, in the layout's motor order. For a hex or octo, add the GPIO's of the additional motors here.
+frame_layout:str = "quad-x"
+gpio_motors:list[int] = [gpio_motor1, gpio_motor2, gpio_motor3, gpio_motor4]
+motor_saturation_scaling:bool = True # when a motor would clip (at idle or at full throttle), scale all PID outputs down together instead of letting that one motor clip. Keeps the correction pointed in the right direction.
+
 # i2c pins used for MPU-6050
 gpio_i2c_sda = 12
 gpio_i2c_scl = 13
@@ -36,10 +42,73 @@ max_rate_roll:float = 30.0 # roll
 max_rate_pitch:float = 30.0 # pitch
 max_rate_yaw:float = 50.0 # yaw
 
+# Stick response (see sticks.py)
+# stick_dead_zone is the fraction of each half of the roll, pitch and yaw sticks' travel, around center, that is ignored (0.0 to 1.0).
+# stick_expo_* softens a stick around center, for finer control there while keeping the full max rate at full stick: 0.0 = linear, 1.5-2.5 = noticeably softer (the nonlinearity strength of toolkit.NonlinearTransformer).
+# every stick's response is worked out once at boot, into a table of stick_table_points points across its travel.
+stick_dead_zone:float = 0.0
+stick_expo_roll:float = 0.0
+stick_expo_pitch:float = 0.0
+stick_expo_yaw:float = 0.0
+stick_table_points:int = 65
+
+# Flight mode
+# False = rate (acro) mode: the sticks command roll, pitch and yaw rates (see above).
+# True = angle (self-level) mode: the roll and pitch sticks command an angle of up to max_angle degrees, and the craft levels itself when they are centered. The rate it turns at to get there is angle_gain (deg/s) per degree it is off, up to the max rates above. Yaw stays a rate.
+angle_mode:bool = False
+max_angle:float = 30.0
+angle_gain:float = 4.0
+
+# Attitude estimator (see attitude.py)
+# in angle mode, fuses the gyro and accelerometer into roll and pitch angles every cycle (in rate mode, nothing uses them, so the estimate is left out of the loop). attitude_kp sets how strongly the accelerometer corrects gyro drift; attitude_ki how fast a leftover gyro bias is learned (0.0 = rely on the gyro bias calibration).
+attitude_kp:float = 0.25
+attitude_ki:float = 0.0
+
 # Desired Flight Controller Cycle time
 # This is the number of times per second the flight controller will perform an adjustment loop (PID loop)
 target_cycle_hz:float = 250.0
 
+# Adaptive loop rate (see looprate.py)
+# True = target_cycle_hz is chosen at boot instead: the critical path (IMU read, RC read, gyro filters, attitude estimate, PIDs, mixer and PWM writes, with the motors held off) is timed loop_rate_benchmark_cycles times, and the loop runs at the highest of loop_rates that the slowest 1% of those cycles fill no more than loop_rate_load of (the rest of every cycle is left for the rate groups). The PIDs, gyro filters, attitude estimator and rate groups are all set up for the chosen rate, which is printed at boot (tools/replay.py needs it, as --hz, to replay the blackbox).
+# In flight, if more than loop_rate_max_late of loop_rate_window cycles start late, the loop steps down to the next lower rate, between two cycles.
+# Only rates that every gyro filter cutoff is below half of are considered (and in FIFO mode, rates that take a whole number of samples from imu_sample_hz, up to 16). The ESCs' PWM stays at 250 hz, whatever the loop rate.
+adaptive_loop_rate:bool = False
+loop_rates:list[float] = [250.0, 500.0, 1000.0]
+loop_rate_load:float = 0.5
+loop_rate_benchmark_cycles:int = 500
+loop_rate_window:int = 250
+loop_rate_max_late:int = 10
+
+# Rate groups (see scheduler.py)
+# the IMU -> PID -> mixer -> PWM path runs every cycle, at target_cycle_hz. Everything else runs in the time each cycle leaves over, at its own rate (rounded up to a divisor of target_cycle_hz), and is skipped for a cycle (in order of least importance) when it does not fit.
+rc_hz:float = 143.0 # RC receiver parsing (single-core mode). The FS-iA6B sends an iBUS frame every 7 ms.
+blackbox_hz:float = 250.0 # blackbox records (single-core mode; in dual-core mode, every cycle is recorded). tools/replay.py expects every cycle to be recorded, so keep this at or above target_cycle_hz if you want to replay the flight.
+status_hz:float = 10.0 # onboard LED: solid in flight mode, blinking in standby
+scheduler_margin_us:int = 100 # time kept free at the end of every cycle. Lower priority groups only run if they are expected to finish before it.
+
+# Profiler
+# times every stage of the flight loop (see profiler.STAGES) over the last profiler_cycles cycles of flight. On every return to standby, the min/mean/p99/max of each stage is printed and the cycles are saved to the "profile" file. In standby, sending "p" over USB serial prints them again.
+# tools/looptrace.py turns the file (or a copy of the console output) into a Chrome/Perfetto trace. Costs one time.ticks_us() call per stage while enabled.
+profiler_enabled:bool = False
+profiler_cycles:int = 250
+
+# IMU sampling mode
+# False = the gyro is read once per cycle and the loop paces itself with time.sleep_us
+# True = the MPU-6050 samples on its own clock at imu_sample_hz and queues every sample in its FIFO. Each cycle drains the FIFO with one bulk read (the mean of all drained samples is used) and the loop is paced by the sensor's clock, so sample time and control time cannot drift apart. imu_sample_hz should be a multiple of target_cycle_hz, and a divisor of the gyro output rate: 1,000 with imu_dlpf at 1-6, 8,000 at 0.
+imu_fifo_mode:bool = False
+imu_sample_hz:float = 1000.0
+
+# Gyro filtering (see filters.py)
+# imu_dlpf is the MPU-6050's own digital low pass filter (0-6). The less it lets through, the more it delays the gyro: 0 = 256 hz (1 ms of delay), 1 = 188 hz (2 ms), 2 = 98 hz (3 ms), 3 = 42 hz (5 ms), 4 = 20 hz (8 ms), 5 = 10 hz (13 ms), 6 = 5 hz (19 ms).
+# To cut that delay, open the DLPF up (0-2) and filter in software instead, at cutoffs of your choosing: gyro_lpf_hz is a biquad low pass on the gyro (cascaded gyro_lpf_stages times), gyro_notch_hz a notch on a known vibration (e.g. a frame resonance, gyro_notch_q is how narrow), dterm_lpf_hz a first order low pass on the PID D term. 0.0 turns each of them off. All must be below half of target_cycle_hz.
+# With a wide open DLPF, use FIFO mode (above) or a high target_cycle_hz: otherwise the gyro is sampled once per cycle and vibration above half of target_cycle_hz folds back (aliases) into the range the filters let through.
+imu_dlpf:int = 5
+gyro_lpf_hz:float = 0.0
+gyro_lpf_stages:int = 1
+gyro_notch_hz:float = 0.0
+gyro_notch_q:float = 3.0
+dterm_lpf_hz:float = 0.0
+
 # PID Controller values
 pid_roll_kp:float = 0.00043714285
 pid_roll_ki:float = 0.00255
@@ -51,31 +120,116 @@ pid_yaw_kp:float = 0.001714287
 pid_yaw_ki:float = 0.003428571
 pid_yaw_kd:float = 0.0
 
+# Blackbox (flight data recorder)
+# while in flight mode, every cycle's gyro rates, setpoints, P/I/D terms, throttle, motor duty cycles and loop time are recorded into a RAM buffer that holds the last blackbox_seconds of flight.
+# the buffer is copied to the "blackbox" file in flash only when a cycle has time to spare, or in standby. On a fatal error, the buffer is dumped to the "blackbox_crash" file.
+blackbox_enabled:bool = True
+blackbox_seconds:float = 2.0
+
+# Dual-core mode
+# False = everything runs in one loop on core 0.
+# True = core 0 runs only the IMU -> PID -> mixer -> PWM path. Core 1 (started with _thread) parses the RC receiver's iBUS stream, packs blackbox records and writes them to flash, and prints console messages.
+# The cores hand each other the latest stick command and the latest cycle's state through lock-free, double-buffered mailboxes (see dualcore.py).
+dual_core:bool = False
+io_core_poll_us:int = 250 # how long core 1 sleeps between checks of the receiver and the control core
+
+# Fixed point control (see fixedpoint.py)
+# False = the gyro -> PID -> mixer path is float arithmetic (every float it computes is a heap object on MicroPython).
+# True = the same path in 32-bit integer fixed point arithmetic, compiled by the viper emitter: from the gyro's raw counts to every motor's duty cycle (ns) without creating a single float. The sticks are mapped to integer setpoints in the same way. tools/fixedpoint.py checks how closely it tracks the float path.
+# Rate mode only, single-core, and without FIFO mode or the software gyro filters (the accelerometer is not decoded, so there is no attitude estimate either). The I term is limited to +/- fixedpoint.I_LIMIT_MAX (3.99) at most, whatever i_limit is (a warning is printed at boot if i_limit is above it).
+fixed_point_control:bool = False
+
+# Timer control (see controltimer.py)
+# False = one loop runs everything: the control path, then the rate groups in the time each cycle leaves over (see scheduler.py). Anything that runs long in there (a console message, a collection, a slow receiver) makes the next cycle start late.
+# True = the control path (IMU read -> PIDs -> mixer -> PWM) runs in a hard interrupt of a machine.Timer at target_cycle_hz, so every step starts on time, interrupting whatever else is running. Everything else runs as uasyncio tasks in the main context, in between: the rate groups (RC, blackbox, flash writes, garbage collection) after every control step, the arming and safety checks (and their console messages) at rc_hz, the LED at status_hz.
+# The interrupt and the tasks share nothing but preallocated arrays (the stick command, flight mode, the step's timing and the controller's state), which the tasks only touch with interrupts disabled, and briefly.
+# A hard interrupt can't allocate, so this needs the fixed point control path (fixed_point_control, with its limits) and no profiler. Flash writes still hold the interrupt up (the rp2 port disables interrupts while it writes to flash), so they still only happen in the time to spare before the next step.
+timer_control:bool = False
+timer_late_us:int = 50 # a control step that starts more than this after its time counts as late
+
+# Memory (see heap.py)
+# MicroPython collects garbage (milliseconds, with everything else stopped) whenever an allocation doesn't fit. So that this never lands in the middle of a cycle, the automatic collector is turned off in flight mode: the heap is collected as flight mode is entered and left, and in flight only in a cycle's time to spare, once fewer than gc_free_reserve bytes are free (or right away below gc_free_critical, as running out would be fatal).
+# gc_count_allocations counts the bytes allocated in every cycle. They and the time spent collecting are recorded in the blackbox (alloc_bytes, gc_us) and summed up on every return to standby. Costs a walk of the heap's allocation table every cycle on the rp2 port (the time is printed at boot).
+gc_flight_policy:bool = True
+gc_free_reserve:int = 32768
+gc_free_critical:int = 8192
+gc_count_allocations:bool = True
+
+# Startup checks
+# the mode switch check (the switch must be in standby at power on) and the gyro calibration don't depend on each other, so they run together.
+# the mode switch has to read standby in boot_rc_frames consecutive iBUS frames (or for boot_rc_timeout_ms, if the receiver is not sending yet).
+boot_rc_frames:int = 10
+boot_rc_timeout_ms:int = 1500
+
+# Gyro calibration (see calibration.py)
+# the gyro's bias is the running mean of a sample every 5 ms while the craft sits still, until it is known to within calibration_noise_dps (standard error) on every axis, from at least calibration_min_samples samples. A sample more than calibration_motion_dps off the mean (the craft was picked up or bumped) starts it over.
+# the result is cached in flash (the "calibration" file) along with the sensor's temperature. A boot within calibration_max_temperature_delta degrees of that temperature only checks the cache: if calibration_check_samples samples agree with it to within calibration_check_dps, it is used. Otherwise the calibration carries on as above.
+calibration_motion_dps:float = 2.0
+calibration_noise_dps:float = 0.02
+calibration_min_samples:int = 200
+calibration_max_samples:int = 2000
+calibration_check_samples:int = 50
+calibration_check_dps:float = 0.3
+calibration_max_temperature_delta:float = 5.0
+
 ########################################
 ########################################
 ########################################
 
 import machine
 import time
+import array
 import ibus
 import toolkit
+import mpu6050
+import pid
+import mixer
+import blackbox
+import dualcore
+import scheduler
+import profiler
+import attitude
+import filters
+import calibration
+import sticks
+import fixedpoint
+import heap
+import looprate
+import controltimer
+
+# the active flight data recorder (set in run()), so FATAL_ERROR can dump it
+recorder:blackbox.Blackbox = None
+
+# the flight loop's scheduler (set in run()), so FATAL_ERROR can report its overruns
+loop_scheduler:scheduler.Scheduler = None
+
+# the flight loop's profiler (set in run() if profiler_enabled), so FATAL_ERROR can save it
+loop_profiler:profiler.Profiler = None
+
+# the heap's flight mode policy and allocation counters (set in run()), so FATAL_ERROR can turn the garbage collector back on
+loop_heap:heap.Heap = None
+
+# the timer that runs the control step (set in run() if timer_control), so FATAL_ERROR can stop it
+control_timer:controltimer.ControlTimer = None
+
+# dual-core mode: the mailboxes between the cores, and the I/O core's (core 1) status
+COMMAND_SIZE:int = sticks.COMMAND_SIZE # a command is [throttle, roll, pitch, yaw, mode switch], see sticks.StickMap
+rc_mailbox:dualcore.Mailbox = None # core 1 -> core 0: the latest command
+state_mailbox:dualcore.Mailbox = None # core 0 -> core 1: the latest cycle's blackbox state (see blackbox.STATE_BASE_SIZE)
+io_core_running:bool = False # core 0 sets this to False to stop core 1
+io_core_stopped:bool = True # core 1 sets this to True when it has stopped
+io_core_error:str = None # set by core 1 if it fails
 
 # THE FLIGHT CONTROL LOOP
 def run() -> None:
+    global target_cycle_hz, recorder, loop_scheduler, loop_profiler, loop_heap, control_timer, rc_mailbox, state_mailbox, io_core_running, io_core_stopped
     
+    boot_began_ms:int = time.ticks_ms()
     print("Hello from Scout!")
 
-    # flash the LED a few times to show the microcontroller has received power and the program is active
+    # turn the LED on to show the microcontroller has received power and the program is active (it flashes fast during the startup checks)
     led = machine.Pin(25, machine.Pin.OUT) # the onboard LED of the Raspberry Pi Pico
-    for x in range(8):
-        led.on()
-        time.sleep(0.1)
-        led.off()
-        time.sleep(0.1)
-
-    # wait a few seconds for the IMU to settle
-    print("Waiting 3 seconds for the IMU to settle...")
-    time.sleep(3)
+    led.on()
 
     # overclock
     machine.freq(250000000)
@@ -85,31 +239,23 @@ def run() -> None:
     rc:ibus.IBus = ibus.IBus(rc_uart)
     print("RC receiver set up")
 
-    # check that flight mode is not on when we are first starting - it needs to be set into standby mode
-    # this is a safety check. Prevents from the drone taking off (at least spinning props) as soon as power is plugged in
-    print("Validating that mode switch is not in flight position...")
-    for x in range(0, 60):
-        rc_data = rc.read()
-        if rc_data[5] == 2000: # flight mode on
-            FATAL_ERROR("Flight mode detected as on (from RC transmitter) as soon as power was received. As a safety precaution, mode switch needs to be in standby mode when system is powered up.")
-        time.sleep(0.025)
-
     # Print settings that are important
     print("Roll PID: " + str(pid_roll_kp) + ", " + str(pid_roll_ki) + ", " + str(pid_roll_kd))
     print("Pitch PID: " + str(pid_pitch_kp) + ", " + str(pid_pitch_ki) + ", " + str(pid_pitch_kd))
     print("Yaw PID: " + str(pid_yaw_kp) + ", " + str(pid_yaw_ki) + ", " + str(pid_yaw_kd))
 
     # Set up IMU (MPU-6050)
+    # the gyro X and Z axes are flipped because of the way I have it mounted on the quadcopter. I want a "roll to the right" and "yaw to the right" to be positive.
+    # the accelerometer's axes are the same as the gyro's, so they are flipped the same way (x forward, y right, z down, see attitude.py)
     i2c = machine.I2C(0, sda = machine.Pin(gpio_i2c_sda), scl = machine.Pin(gpio_i2c_scl))
-    mpu6050_address:int = 0x68
-    i2c.writeto_mem(mpu6050_address, 0x6B, bytes([0x01])) # wake it up
-    i2c.writeto_mem(mpu6050_address, 0x1A, bytes([0x05])) # set low pass filter to 5 (0-6)
-    i2c.writeto_mem(mpu6050_address, 0x1B, bytes([0x08])) # set gyro scale to 1 (0-3)
+    imu:mpu6050.MPU6050 = mpu6050.MPU6050(i2c, gyro_flip = (-1, 1, -1), accel_flip = (-1, 1, -1))
+    imu.configure(lpf = imu_dlpf, gyro_range = 1) # low pass filter to imu_dlpf (0-6), gyro scale to 1 (0-3, +/- 500 deg/s)
+    imu.set_sample_rate(8000.0) # as fast as the DLPF setting allows (it is kept over a soft reset, so set it either way), so every burst read gets a fresh sample, whatever the loop rate. FIFO mode sets imu_sample_hz instead, later.
 
     # confirm IMU is set up
-    whoami:int = i2c.readfrom_mem(mpu6050_address, 0x75, 1)[0]
-    lpf:int = i2c.readfrom_mem(mpu6050_address, 0x1A, 1)[0]
-    gs:int = i2c.readfrom_mem(mpu6050_address, 0x1B, 1)[0]
+    whoami:int = imu.read_register(mpu6050.REG_WHO_AM_I)
+    lpf:int = imu.read_register(mpu6050.REG_CONFIG)
+    gs:int = imu.read_register(mpu6050.REG_GYRO_CONFIG)
     
     # did who am I work?
     if whoami == 104: #0x68
@@ -118,7 +264,7 @@ def run() -> None:
         FATAL_ERROR("ERROR! MPU-6050 WHOAMI failed! '" + str(whoami) + "' returned.")
 
     # did lpf get set?
-    if lpf == 0x05:
+    if lpf == imu_dlpf:
         print("MPU-6050 LPF set to " + str(lpf) + " correctly.")
     else:
         FATAL_ERROR("ERROR! MPU-6050 LPF did not set correctly. Set to '" + str(lpf) + "'")
@@ -129,36 +275,87 @@ def run() -> None:
     else:
         FATAL_ERROR("ERROR! MPU-6050 gyro scale did not set correctly. " + str(gs) + " returned.")
 
-    # measure gyro bias
-    print("Measuring gyro bias...")
-    gxs:list[float] = []
-    gys:list[float] = []
-    gzs:list[float] = []
-    started_at_ticks_ms:int = time.ticks_ms()
-    while ((time.ticks_ms() - started_at_ticks_ms) / 1000) < 3.0:
-        gyro_data = i2c.readfrom_mem(mpu6050_address, 0x43, 6) # read 6 bytes (2 for each axis)
-        gyro_x = (translate_pair(gyro_data[0], gyro_data[1]) / 65.5)
-        gyro_y = (translate_pair(gyro_data[2], gyro_data[3]) / 65.5)
-        gyro_z = (translate_pair(gyro_data[4], gyro_data[5]) / 65.5) * -1 # multiply by -1 because of the way I have it mounted on the quadcopter - it may be upside down. I want a "yaw to the right" to be positive and a "yaw to the left" to be negative.
-        gxs.append(gyro_x)
-        gys.append(gyro_y)
-        gzs.append(gyro_z)
-        time.sleep(0.025)
-    gyro_bias_x = sum(gxs) / len(gxs)
-    gyro_bias_y = sum(gys) / len(gys)
-    gyro_bias_z = sum(gzs) / len(gzs)
-    print("Gyro bias: " + str((gyro_bias_x, gyro_bias_y, gyro_bias_z)))
+    # Startup checks, together in one loop: a gyro sample every 5 ms, the RC receiver polled in between, the LED flashing
+    # 1. the mode switch must not be in the flight position. This is a safety check. Prevents from the drone taking off (at least spinning props) as soon as power is plugged in
+    # 2. the gyro bias: from the cached calibration if it checks out, otherwise measured (see calibration settings)
+    print("Validating that mode switch is not in flight position...")
+    imu_data = imu.data # [accel x, y, z, temperature, gyro x, y, z], refreshed in place by every imu.read()
+    imu.read()
+    cached:dict = calibration.load("calibration", imu_dlpf, imu.gyro_range)
+    if cached is not None and abs(imu_data[3] - cached["temperature"]) > calibration_max_temperature_delta:
+        print("Cached gyro calibration is from " + str(round(cached["temperature"], 1)) + " C, now " + str(round(imu_data[3], 1)) + " C: calibrating again")
+        cached = None
+    print("Checking cached gyro calibration..." if cached is not None else "Measuring gyro bias (keep still)...")
+    gyro_calibration:calibration.GyroCalibration = calibration.GyroCalibration(calibration_motion_dps, calibration_noise_dps, calibration_min_samples, calibration_max_samples)
+    rc_frames:int = 0 # consecutive frames with the mode switch in standby
+    rc_checked:bool = False
+    gyro_bias:list[float] = None
+    checks_began_ms:int = time.ticks_ms()
+    while gyro_bias is None or not rc_checked:
+        now_ms:int = time.ticks_diff(time.ticks_ms(), checks_began_ms)
+        if not rc_checked:
+            rc_data = rc.read()
+            if rc_data[5] == 2000: # flight mode on
+                FATAL_ERROR("Flight mode detected as on (from RC transmitter) as soon as power was received. As a safety precaution, mode switch needs to be in standby mode when system is powered up.")
+            if rc_data[0] == 1: # a new frame
+                rc_frames = rc_frames + 1
+            if rc_frames >= boot_rc_frames or now_ms >= boot_rc_timeout_ms:
+                rc_checked = True
+                print("Mode switch in standby (" + str(rc_frames) + " RC frames, " + str(now_ms) + " ms)")
+        if gyro_bias is None:
+            imu.read()
+            finished:bool = gyro_calibration.add(imu_data)
+            if cached is not None and gyro_calibration.n >= calibration_check_samples:
+                if gyro_calibration.agrees(cached["gyro_bias"], calibration_check_dps):
+                    gyro_bias = cached["gyro_bias"]
+                    print("Cached gyro calibration checks out (" + str(gyro_calibration.n) + " samples, " + str(now_ms) + " ms)")
+                else:
+                    print("Cached gyro calibration is off by more than " + str(calibration_check_dps) + " deg/s: calibrating again")
+                    cached = None
+            elif finished:
+                gyro_bias = gyro_calibration.mean
+                print("Gyro bias measured from " + str(gyro_calibration.n) + " samples in " + str(now_ms) + " ms (noise " + str([round(x, 3) for x in gyro_calibration.std()]) + " deg/s, restarted " + str(gyro_calibration.restarts) + " times for motion)")
+                calibration.save("calibration", gyro_calibration, imu_dlpf, imu.gyro_range)
+        led.value((now_ms // 50) % 2)
+        time.sleep_ms(5)
+    imu.set_gyro_bias(gyro_bias[0], gyro_bias[1], gyro_bias[2]) # from now on, the bias is subtracted as part of every imu.read()
+    print("Gyro bias: " + str((gyro_bias[0], gyro_bias[1], gyro_bias[2])))
+    checks_ms:int = time.ticks_diff(time.ticks_ms(), checks_began_ms)
+
+    # the loop rates to choose from (see adaptive_loop_rate): every gyro filter has to be able to run at them, and in FIFO mode, every cycle has to take a whole number of samples. Everything below is set up for the lowest of them, until the benchmark has chosen.
+    if adaptive_loop_rate:
+        rates:list[float] = []
+        for hz in loop_rates:
+            if (gyro_lpf_hz > 0.0 and gyro_lpf_hz >= hz / 2.0) or (gyro_notch_hz > 0.0 and gyro_notch_hz >= hz / 2.0):
+                continue
+            if imu_fifo_mode and (imu_sample_hz < hz or imu_sample_hz / hz > 16 or abs((imu_sample_hz / hz) - round(imu_sample_hz / hz)) > 0.001):
+                continue
+            rates.append(hz)
+        if len(rates) == 0:
+            FATAL_ERROR("None of the loop rates " + str(loop_rates) + " can run the gyro filters" + (" or take a whole number of samples at imu_sample_hz" if imu_fifo_mode else "") + ".")
+        target_cycle_hz = min(rates)
+
+    # Attitude estimator, starting from the attitude the accelerometer measured while the gyro bias was calibrated
+    estimator:attitude.AttitudeEstimator = attitude.AttitudeEstimator(target_cycle_hz, attitude_kp, attitude_ki)
+    estimator.level(gyro_calibration.accel[0], gyro_calibration.accel[1], gyro_calibration.accel[2])
+    estimate = estimator.update # bound methods, save an attribute lookup every loop
+    estimate_angles = estimator.euler
+    attitude_angles = estimator.angles # [roll, pitch, yaw] in degrees, written by every estimate_angles()
+    print("Attitude: roll " + str(round(attitude_angles[0], 1)) + ", pitch " + str(round(attitude_angles[1], 1)) + " degrees" + (" (angle mode)" if angle_mode else ""))
 
     # Set up PWM's
-    M1:machine.PWM = machine.PWM(machine.Pin(gpio_motor1))
-    M2:machine.PWM = machine.PWM(machine.Pin(gpio_motor2))
-    M3:machine.PWM = machine.PWM(machine.Pin(gpio_motor3))
-    M4:machine.PWM = machine.PWM(machine.Pin(gpio_motor4))
-    M1.freq(250)
-    M2.freq(250)
-    M3.freq(250)
-    M4.freq(250)
-    print("Motor PWM's set up @ 250 hz")
+    # Set up the mixer (turns throttle + PID outputs into every motor's duty cycle in one call)
+    motor_mixer:mixer.Mixer = mixer.Mixer(frame_layout, saturation_scaling = motor_saturation_scaling)
+    if len(gpio_motors) != motor_mixer.motors:
+        FATAL_ERROR("Frame layout '" + frame_layout + "' has " + str(motor_mixer.motors) + " motors but " + str(len(gpio_motors)) + " motor GPIO's are set.")
+    motors:list[machine.PWM] = []
+    for gpio in gpio_motors:
+        m:machine.PWM = machine.PWM(machine.Pin(gpio))
+        m.freq(250)
+        motors.append(m)
+    motor_writers:list = [m.duty_ns for m in motors] # bound methods, saves an attribute lookup per motor every loop
+    motor_indexes = range(len(motors))
+    print(str(len(motors)) + " motor PWM's (" + frame_layout + ") set up @ 250 hz")
 
     # Constants calculations / state variables - no need to calculate these during the loop (save processor time)
     cycle_time_seconds:float = 1.0 / target_cycle_hz
@@ -167,150 +364,510 @@ def run() -> None:
     throttle_range:float = max_throttle - throttle_idle # used for adjusted throttle calculation
     i_limit:float = 150.0 # PID I-term limiter. The applied I-term cannot exceed or go below (negative) this value. (safety mechanism to prevent excessive spooling of the motors)
     last_mode:bool = False # the most recent mode the flight controller was in. False = Standby (props not spinning), True = Flight mode
+    imu_read = imu.read # bound method, saves an attribute lookup every loop
+
+    # the scheduler paces every cycle to an absolute deadline, cycle_time_us after the last one (in FIFO mode, it waits for the sensor's samples instead) and runs the other rate groups in each cycle's time to spare
+    loop_scheduler = scheduler.Scheduler(cycle_time_us, margin_us = scheduler_margin_us)
+    wait_for_cycle = loop_scheduler.wait
+    run_tasks = loop_scheduler.run_tasks
+
+    # the profiler: each stage writes its start time into the ring at stamps[pb + stage], pb being the current cycle's row (see profiler.py)
+    profiling:bool = profiler_enabled
+    if profiling:
+        loop_profiler = profiler.Profiler(profiler.STAGES, profiler_cycles)
+        stamps = loop_profiler.stamps
+        commit_profile = loop_profiler.commit
+        pb:int = 0
+        print("Profiler set up: " + str(loop_profiler.capacity) + " cycles of " + str(len(loop_profiler.stages)) + " stages")
     
-    # State variables - PID related
-    # required to be delcared outside of the loop because their state will be used in multiple loops (passed from loop to loop)
-    roll_last_integral:float = 0.0
-    roll_last_error:float = 0.0
-    pitch_last_integral:float = 0.0
-    pitch_last_error:float = 0.0
-    yaw_last_integral:float = 0.0
-    yaw_last_error:float = 0.0
+    # PID controllers - roll, pitch and yaw rate, updated together in one call
+    # their state (I term, last error) lives inside the PIDBank and carries over from loop to loop. ki * dt and kd / dt are precomputed here, not every loop.
+    pids:pid.PIDBank = pid.PIDBank(target_cycle_hz, i_limit, dterm_lpf_hz)
+    pids.set_gains(pid.ROLL, pid_roll_kp, pid_roll_ki, pid_roll_kd)
+    pids.set_gains(pid.PITCH, pid_pitch_kp, pid_pitch_ki, pid_pitch_kd)
+    pids.set_gains(pid.YAW, pid_yaw_kp, pid_yaw_ki, pid_yaw_kd)
+    pid_update = pids.update
+    pid_output = pids.output # [roll, pitch, yaw], written by every pid_update()
+
+    # Gyro filters - coefficients are worked out here, for target_cycle_hz, not every loop
+    gyro_filter:filters.GyroFilter = filters.GyroFilter(target_cycle_hz, gyro_lpf_hz, gyro_lpf_stages, gyro_notch_hz, gyro_notch_q)
+    gyro_filtering:bool = gyro_filter.stages > 0
+    filter_gyro = gyro_filter.apply
+    gyro_delay_ms:float = mpu6050.GYRO_DLPF_DELAY_MS[imu_dlpf] + (gyro_filter.delay_ms(20.0) if gyro_filtering else 0.0)
+    print("Gyro filters: DLPF " + str(imu_dlpf) + " (" + str(mpu6050.GYRO_DLPF_BANDWIDTH_HZ[imu_dlpf]) + " hz), " + str(gyro_filter.stages) + " biquads, D term low pass " + str(dterm_lpf_hz) + " hz. Gyro delay at 20 hz: " + str(round(gyro_delay_ms, 1)) + " ms")
+    mix = motor_mixer.mix
+    motor_duty = motor_mixer.duty # duty cycle (ns) of every motor, written by every mix()
+
+    # Heap policy and allocation counters (see heap.py). Collects once now, to measure how long a collection takes.
+    loop_heap = heap.Heap(gc_free_reserve, gc_free_critical, gc_count_allocations)
+    heap_cycle = loop_heap.cycle
+    print("Heap: a collection takes " + str(loop_heap.collect_us) + " us" + ((", " + str(loop_heap.free()) + " bytes free") if loop_heap.counting else "") + ((", counting allocations costs " + str(loop_heap.count_us) + " us per cycle") if loop_heap.tracking else ""))
+
+    # Stick response tables - the sticks map straight to the roll, pitch and yaw setpoints: rates (deg/s), or in angle mode, roll and pitch angles (deg)
+    stick_map:sticks.StickMap = sticks.StickMap(max_angle if angle_mode else max_rate_roll, max_angle if angle_mode else max_rate_pitch, max_rate_yaw, stick_dead_zone, stick_expo_roll, stick_expo_pitch, stick_expo_yaw, stick_table_points)
+
+    # the latest stick command, [throttle (0.0 to 1.0), roll, pitch, yaw setpoints, mode switch] (see sticks.StickMap)
+    command = array.array("f", [0.0] * COMMAND_SIZE)
+    stick_map.process(rc.read(), command)
+    start_throttle_limit = 0.05 # the throttle stick must be below 5% when flight mode is entered
+
+    # Fixed point control path: the same PIDs, mixer and stick tables, converted to integers (see fixedpoint.py)
+    fixed_point:bool = fixed_point_control
+    controller:fixedpoint.FixedController = None
+    if fixed_point:
+        if angle_mode or dual_core or imu_fifo_mode or gyro_filtering:
+            FATAL_ERROR("Fixed point control only supports rate mode, single-core, without FIFO mode or software gyro filters.")
+        controller = fixedpoint.FixedController(imu, pids, motor_mixer, stick_map, throttle_idle, throttle_range)
+        controller.sticks(rc.read())
+        fixed_step = controller.step
+        fixed_reset = controller.reset
+        command = controller.command # [throttle stick (Q20), roll, pitch, yaw setpoints (Q6 gyro counts), mode switch, adjusted throttle (Q20)]
+        start_throttle_limit = int(start_throttle_limit * fixedpoint.ONE)
+        imu_read = imu.read_raw # the controller decodes the gyro from the raw burst itself
+        print("Fixed point control path set up")
+        if controller.i_limit_clamped():
+            print("WARNING: i_limit (" + str(i_limit) + ") is above the largest I term the fixed point control path can hold, so it is limited to +/- " + str(fixedpoint.I_LIMIT_MAX) + " there")
+
+    # Timer control: the control step runs in a hard interrupt, which can't allocate (see timer_control)
+    timer:bool = timer_control
+    if timer and (not fixed_point or profiling):
+        FATAL_ERROR("Timer control needs the fixed point control path (fixed_point_control), and the profiler off.")
+
+    # Loop rate (see looprate.py): time the critical path as the loop runs it, with the motors held off, and run at the highest rate it fits
+    if adaptive_loop_rate:
+        rate_chooser:looprate.LoopRate = looprate.LoopRate(rates, loop_rate_load, loop_rate_benchmark_cycles, loop_rate_window, loop_rate_max_late)
+        rate_watch = rate_chooser.watch
+
+        def set_loop_rate(hz:float, pids = pids, gyro_filter = gyro_filter, estimator = estimator, controller = controller, imu = imu) -> None:
+            """Sets everything that depends on the loop rate up for hz (between two cycles)."""
+            global target_cycle_hz
+            target_cycle_hz = hz
+            pids.set_rate(hz) # ki * dt, kd / dt and the D term low pass
+            if controller is not None:
+                controller.set_gains() # the same, in fixed point
+            gyro_filter.set_rate(hz)
+            estimator.set_rate(hz)
+            loop_scheduler.set_period(int(round(1000000.0 / hz))) # the rate groups keep their rates
+            if control_timer is not None:
+                control_timer.set_rate(hz)
+            if imu.fifo_buf is not None: # FIFO mode: the samples every cycle waits for
+                imu.fifo_min_samples = max(1, int(round(imu.sample_rate_hz / hz)))
+
+        print("Timing the critical path over " + str(loop_rate_benchmark_cycles) + " cycles...")
+        duty_0_percent:int = calculate_duty_cycle(0.0)
+        while rate_chooser.measuring():
+            began:int = time.ticks_us()
+            if imu_fifo_mode:
+                imu.fifo_count() # a FIFO mode read checks how much is queued first
+            imu_read()
+            if gyro_filtering:
+                filter_gyro(imu_data)
+            rc_data = rc.read()
+            if fixed_point:
+                controller.sticks(rc_data)
+                fixed_step()
+            else:
+                stick_map.process(rc_data, command)
+                if angle_mode:
+                    estimate(imu_data[4], imu_data[5], imu_data[6], imu_data[0], imu_data[1], imu_data[2])
+                    estimate_angles()
+                pid_update(command[1] - imu_data[4], command[2] - imu_data[5], command[3] - imu_data[6])
+                mix(throttle_idle, pid_output[0], pid_output[1], pid_output[2])
+            for i in motor_indexes:
+                motor_writers[i](duty_0_percent)
+            rate_chooser.add(time.ticks_diff(time.ticks_us(), began))
+
+        # forget what the timed cycles left behind (they ran faster than any loop rate), and switch to the chosen rate
+        pids.reset()
+        gyro_filter.reset()
+        estimator.reset()
+        estimator.level(gyro_calibration.accel[0], gyro_calibration.accel[1], gyro_calibration.accel[2])
+        if fixed_point:
+            fixed_reset()
+        set_loop_rate(rate_chooser.choose())
+        print(rate_chooser.report())
+
+    # Set up the blackbox
+    if blackbox_enabled:
+        recorder = blackbox.Blackbox(pids, motor_mixer, target_cycle_hz if dual_core else loop_scheduler.actual_hz(blackbox_hz), blackbox_seconds, heap_counts = loop_heap.counts)
+        print("Blackbox set up: " + str(recorder.capacity) + " records of " + str(recorder.record_size) + " bytes")
+
+    # start queueing IMU samples (FIFO mode). This is done as late as possible so the FIFO isn't already full when the loop begins.
+    if imu_fifo_mode:
+        actual_sample_hz:float = imu.enable_fifo(imu_sample_hz, min_samples = max(1, int(round(imu_sample_hz / target_cycle_hz))))
+        imu_read = imu.read_fifo
+        loop_scheduler.paced = False
+        loop_scheduler.pacer = imu.wait_fifo # every cycle starts once its samples are in: the time spent waiting for them is not taken out of the cycle's time to spare
+        print("MPU-6050 FIFO mode @ " + str(actual_sample_hz) + " hz, " + str(imu.fifo_min_samples) + " samples per cycle")
+
+    # Start the I/O core (core 1). From now on, only core 1 touches the RC receiver and the blackbox's flash file.
+    if dual_core:
+        import _thread
+        rc_mailbox = dualcore.Mailbox(COMMAND_SIZE)
+        if recorder is not None:
+            state_mailbox = dualcore.Mailbox(recorder.state_size)
+        io_core_running = True
+        io_core_stopped = False
+        _thread.start_new_thread(io_core, (rc, stick_map, recorder))
+        print("I/O core (core 1) started")
+
+    # Rate groups, run by the scheduler after each cycle's critical path, most important first
+    # the tasks read the cycle they follow from loop_state and flight_state, which the loop fills in place. Everything a task uses is bound as a default argument, so none of it becomes a closure (cell) variable of run(), which would be slower for the loop to access.
+    loop_state = array.array("i", [0, 0, 0]) # [cycle start (ticks_us), cycle time (us), 1 = flight mode / 0 = standby]
+    flight_state = array.array("f", [0.0, 0.0, 0.0, 0.0]) # [setpoint roll, setpoint pitch, setpoint yaw, adjusted throttle], in flight mode
+    controller_state = array.array("i", controller.state) if timer else None # timer control: a copy of the fixed point controller's state, taken after every step (see follow_steps)
+    if not dual_core: # in dual-core mode, the I/O core does these
+
+        if timer: # the control step reads the command from its interrupt: change it with interrupts disabled, so the step never sees half of one
+            def parse_rc(read = rc.read, process = controller.sticks, disable_irq = machine.disable_irq, enable_irq = machine.enable_irq) -> None:
+                rc_data = read()
+                irq:int = disable_irq()
+                process(rc_data)
+                enable_irq(irq)
+        elif fixed_point:
+            def parse_rc(read = rc.read, process = controller.sticks) -> None:
+                process(read())
+        else:
+            def parse_rc(read = rc.read, process = stick_map.process, command = command) -> None:
+                process(read(), command)
+        print("Task 'rc' @ " + str(round(loop_scheduler.add("rc", parse_rc, rc_hz, 0), 1)) + " hz")
+
+        if recorder is not None:
+
+            def record_cycle(recorder = recorder, loop_state = loop_state, flight_state = flight_state, imu_data = imu_data, controller = controller, controller_state = controller_state) -> None:
+                if loop_state[2]:
+                    if controller is not None: # the fixed point path's gyro, setpoints and PID terms, as floats
+                        controller.export(imu_data, flight_state, controller_state)
+                    recorder.record(loop_state[0], loop_state[1], imu_data[4], imu_data[5], imu_data[6], flight_state[0], flight_state[1], flight_state[2], flight_state[3])
+            print("Task 'blackbox' @ " + str(round(loop_scheduler.add("blackbox", record_cycle, blackbox_hz, 1), 1)) + " hz")
+
+            def write_flash(recorder = recorder, loop_state = loop_state, slack_us = loop_scheduler.slack_us) -> None:
+                recorder.service(slack_us(), loop_state[2] == 1)
+            # a block fills up every records_per_block records, so twice that rate leaves room for runs skipped for lack of time
+            flash_hz:float = min(target_cycle_hz, 2.0 * loop_scheduler.actual_hz(blackbox_hz) / recorder.records_per_block)
+            print("Task 'flash' @ " + str(round(loop_scheduler.add("flash", write_flash, flash_hz, 3), 1)) + " hz")
+
+    def show_status(led = led, loop_state = loop_state) -> None:
+        if loop_state[2]:
+            led.on()
+        else:
+            led.toggle()
+    if not timer: # with timer control, the LED is a task of its own
+        print("Task 'status' @ " + str(round(loop_scheduler.add("status", show_status, status_hz, 2), 1)) + " hz")
+
+    # in flight, garbage is only collected in a cycle's time to spare (see heap.Heap.service). Without an allocation counter (on a regular computer), there is no telling when the heap runs low, so there is no task.
+    if gc_flight_policy and loop_heap.counting:
+        def collect_garbage(memory = loop_heap, slack_us = loop_scheduler.slack_us) -> None:
+            memory.service(slack_us())
+        print("Task 'gc' @ " + str(round(loop_scheduler.add("gc", collect_garbage, target_cycle_hz, 4), 1)) + " hz")
+    invalid_mode_switch:int = 0 # the last invalid channel 5 input reported, so it is only printed when it changes
+    adapting:bool = adaptive_loop_rate
+
+    # everything the loop uses has been allocated by now: start it with a clean heap
+    loop_heap.collect()
 
     # INFINITE LOOP
-    led.on() # turn on the onboard LED to signal that the flight controller is now active
+    led.on() # turn on the onboard LED to signal that the flight controller is now active (it blinks in standby, see show_status)
+    print("Ready in " + str(time.ticks_diff(time.ticks_ms(), boot_began_ms)) + " ms (startup checks " + str(checks_ms) + " ms)")
     print("-- BEGINNING FLIGHT CONTROL LOOP NOW --")
-    try:
-        while True:
-            
-            # mark start time
-            loop_begin_us:int = time.ticks_us()
 
-            # Capture raw IMU data
-            # we divide by 65.5 here because that is the modifier to use at a gyro range scale of 1, which we are using.
-            gyro_data = i2c.readfrom_mem(mpu6050_address, 0x43, 6) # read 6 bytes (2 for each axis)
-            gyro_x = ((translate_pair(gyro_data[0], gyro_data[1]) / 65.5) - gyro_bias_x) * -1 # Roll rate. we multiply by -1 here because of the way I have it mounted. it should be rotated 180 degrees I believe, but it's okay, I can flip it here. 
-            gyro_y = (translate_pair(gyro_data[2], gyro_data[3]) / 65.5) - gyro_bias_y # Pitch rate.
-            gyro_z = ((translate_pair(gyro_data[4], gyro_data[5]) / 65.5) * -1) - gyro_bias_z # Yaw rate. multiply by -1 because of the way I have it mounted - it may be upside down. I want a "yaw to the right" to be positive and a "yaw to the left" to be negative.
+    # TIMER CONTROL: the control step runs in a timer interrupt, everything else in uasyncio tasks, and neither returns (see timer_control)
+    if timer:
+        try:
+            import uasyncio as asyncio
+        except ImportError:
+            import asyncio
+        stepped = asyncio.ThreadSafeFlag() # set by the interrupt after every step
+        duty_0_percent:int = calculate_duty_cycle(0.0)
 
-            # Read control commands from RC
-            rc_data = rc.read()
+        # the control step, in a hard interrupt: nothing here may allocate. Besides the command (see parse_rc), loop_state[2] (flight mode) is all it reads that the tasks write.
+        def control_step(read = imu_read, step = fixed_step, loop_state = loop_state, motor_writers = motor_writers, motor_duty = motor_duty, motor_indexes = motor_indexes, duty_0_percent = duty_0_percent) -> None:
+            read()
+            if loop_state[2]:
+                step()
+                for i in motor_indexes:
+                    motor_writers[i](motor_duty[i])
+            else:
+                for i in motor_indexes:
+                    motor_writers[i](duty_0_percent)
+
+        def motors_off(motor_writers = motor_writers, duty_0_percent = duty_0_percent) -> None:
+            for write_duty in motor_writers:
+                write_duty(duty_0_percent)
+
+        control_timer = controltimer.ControlTimer(target_cycle_hz, control_step, motors_off, stepped, timer_late_us)
+
+        # after every step: its timing and the controller's state, copied out together with interrupts disabled (so both are from the same step), then the rate groups, in what is left until the next step
+        async def follow_steps(stepped = stepped, timer_state = control_timer.state, loop_state = loop_state, state = controller.state, controller_state = controller_state, heap_cycle = heap_cycle, mark = loop_scheduler.mark, run_tasks = run_tasks, adapting = adapting, rate_watch = rate_watch if adaptive_loop_rate else None, set_loop_rate = set_loop_rate if adaptive_loop_rate else None, rate_chooser = rate_chooser if adaptive_loop_rate else None, disable_irq = machine.disable_irq, enable_irq = machine.enable_irq) -> None:
+            while True:
+                await stepped.wait()
+                irq:int = disable_irq()
+                loop_state[0] = timer_state[controltimer.STEP_START]
+                loop_state[1] = timer_state[controltimer.STEP_US]
+                controller_state[:] = state
+                enable_irq(irq)
+                heap_cycle()
+                if adapting and loop_state[2] and rate_watch(timer_state[controltimer.LATE]): # too many late steps in flight: step the rate down (see looprate.py)
+                    set_loop_rate(rate_chooser.step_down())
+                    print("Loop rate stepped down to " + str(rate_chooser.hz) + " hz (" + str(timer_state[controltimer.LATE]) + " late steps so far)")
+                mark(loop_state[0])
+                run_tasks()
+
+        # the arming and safety checks, at rc_hz. The control step only flies while loop_state[2] is 1.
+        async def flight_mode(sleep_ms = asyncio.sleep_ms, period_ms = max(1, int(1000 / rc_hz)), loop_state = loop_state, command = command, start_throttle_limit = start_throttle_limit, fixed_reset = fixed_reset, adapting = adapting, rate_chooser = rate_chooser if adaptive_loop_rate else None) -> None:
+            last_mode:bool = False
+            invalid_mode_switch:int = 0 # the last invalid channel 5 input reported, so it is only printed when it changes
+            while True:
+                if control_timer.error is not None:
+                    raise Exception("Control step failed: " + str(control_timer.error))
+                mode_switch = command[4] # channel 5
+                if mode_switch == 1000: # standby
+                    if last_mode: # just landed (or disarmed): motors off from the next step on, then report how the flight went
+                        loop_state[2] = 0
+                        last_mode = False
+                        fixed_reset()
+                        print(loop_scheduler.report())
+                        print(control_timer.report())
+                        if gc_flight_policy:
+                            loop_heap.disarm()
+                            print(loop_heap.report())
+                elif mode_switch == 2000: # flight mode
+                    if not last_mode: # just switched on: the throttle must be at 0% (safety check), then the step takes over from a clean state
+                        if command[0] > start_throttle_limit:
+                            raise Exception("Throttle was set to " + str(command[0] / fixedpoint.ONE) + " as soon as flight mode was entered. Throttle must be at 0% when flight mode begins (safety check).")
+                        if gc_flight_policy:
+                            loop_heap.arm()
+                        if adapting:
+                            rate_chooser.restart(control_timer.late())
+                        fixed_reset()
+                        last_mode = True
+                        loop_state[2] = 1
+                elif int(mode_switch) != invalid_mode_switch:
+                    invalid_mode_switch = int(mode_switch)
+                    print("Channel 5 input '" + str(invalid_mode_switch) + "' not valid. Is the transmitter turned on and connected?")
+                await sleep_ms(period_ms)
+
+        async def status(sleep_ms = asyncio.sleep_ms, period_ms = max(1, int(1000 / status_hz)), show_status = show_status) -> None:
+            while True:
+                show_status()
+                await sleep_ms(period_ms)
+
+        control_timer.start()
+        print("Control step on a timer interrupt @ " + str(control_timer.hz) + " hz, everything else in uasyncio tasks")
+        try:
+            asyncio.run(asyncio.gather(follow_steps(), flight_mode(), status()))
+        except Exception as e: # a task failed, or (see flight_mode) the control step did
+            control_timer.stop() # its safe() turns the motors off
+            for m in motors:
+                m.deinit()
+            FATAL_ERROR(str(e))
+        FATAL_ERROR("The background tasks ended")
 
-            # normalize all RC input values
-            input_throttle:float = normalize(rc_data[3], 1000.0, 2000.0, 0.0, 1.0) # between 0.0 and 1.0
-            input_pitch:float = (normalize(rc_data[2], 1000.0, 2000.0, -1.0, 1.0)) * -1 # between -1.0 and 1.0. We multiply by -1 because... If the pitch is "full forward" (i.e. 75), that means we want a NEGATIVE pitch (when a plane pitches it's nose down, that is negative, not positive. And when a place pitches it's nose up, pulling back on the stick, it's positive, not negative.) Thus, we need to flip it.
-            input_roll:float = normalize(rc_data[1], 1000.0, 2000.0, -1.0, 1.0) # between -1.0 and 1.0
-            input_yaw:float = normalize(rc_data[4], 1000.0, 2000.0, -1.0, 1.0) # between -1.0 and 1.0
+    try:
+        while True:
+            
+            # wait for this cycle's deadline, and mark start time
+            if profiling:
+                stamps[pb] = time.ticks_us() # wait
+            loop_begin_us:int = wait_for_cycle()
+            if profiling:
+                stamps[pb + 1] = time.ticks_us() # imu
+
+            # Capture IMU data
+            # one 14-byte burst read (accel, temperature, gyro) into a preallocated buffer, or in FIFO mode, one bulk read of every queued sample. Scale, axis flips and bias are applied as part of the read.
+            imu_read()
+
+            # filter the gyro in place (see filters.py), before anything uses it
+            if profiling:
+                stamps[pb + 2] = time.ticks_us() # filter
+            if gyro_filtering:
+                filter_gyro(imu_data)
+            if not fixed_point:
+                gyro_x = imu_data[4] # Roll rate
+                gyro_y = imu_data[5] # Pitch rate
+                gyro_z = imu_data[6] # Yaw rate
+
+            # update the attitude estimate with the same reading (the accelerometer is imu_data[0] to [2]), in angle mode
+            if profiling:
+                stamps[pb + 3] = time.ticks_us() # attitude
+            if angle_mode:
+                estimate(gyro_x, gyro_y, gyro_z, imu_data[0], imu_data[1], imu_data[2])
+            if profiling:
+                stamps[pb + 4] = time.ticks_us() # rc
+
+            # Read control commands from RC (already mapped to setpoints)
+            if dual_core:
+                rc_mailbox.read_into(command) # the latest command from the I/O core. Stays the same if no new RC frame arrived since the last cycle.
+                if io_core_error is not None:
+                    raise Exception("I/O core (core 1) failed: " + io_core_error)
+            input_throttle = command[0] # between 0.0 and 1.0 (fixed point: 0 to fixedpoint.ONE)
+            mode_switch = command[4] # channel 5
+            if profiling:
+                stamps[pb + 5] = time.ticks_us() # normalize
 
             # ADJUST MOTOR OUTPUTS!
             # based on channel 5. Channel 5 I have assigned to the switch that determines flight mode (standby/flight)
-            if rc_data[5] == 1000: # standby mode - switch in "up" or OFF position
+            if mode_switch == 1000: # standby mode - switch in "up" or OFF position
             
                 # turn motors off completely
                 duty_0_percent:int = calculate_duty_cycle(0.0)
-                M1.duty_ns(duty_0_percent)
-                M2.duty_ns(duty_0_percent)
-                M3.duty_ns(duty_0_percent)
-                M4.duty_ns(duty_0_percent)
+                for write_duty in motor_writers:
+                    write_duty(duty_0_percent)
 
                 # reset PID's
-                roll_last_integral = 0.0
-                roll_last_error = 0.0
-                pitch_last_integral = 0.0
-                pitch_last_error = 0.0
-                yaw_last_integral = 0.0
-                yaw_last_error = 0.0
+                pids.reset()
+                if fixed_point:
+                    fixed_reset()
+
+                # just landed (or disarmed): turn the garbage collector back on, and report how the flight's cycles kept to schedule, where their time went and what they allocated
+                if last_mode:
+                    print(loop_scheduler.report())
+                    if gc_flight_policy:
+                        loop_heap.disarm()
+                        print(loop_heap.report())
+                    if profiling:
+                        print(loop_profiler.report())
+                        loop_profiler.save()
+                elif profiling and loop_profiler.requested(): # "p" over USB serial
+                    loop_profiler.send()
 
                 # set last mode
                 last_mode = False # False means standby mode
+                loop_state[2] = 0
 
-            elif rc_data[5] == 2000: # flight mode (idle props at least) - swith in "down" or ON position
+            elif mode_switch == 2000: # flight mode (idle props at least) - swith in "down" or ON position
 
                 # if last mode was standby (we JUST were turned onto flight mode), perform a check that the throttle isn't high. This is a safety mechanism
                 # this prevents an accident where the flight mode switch is turned on but the throttle position is high, which would immediately apply heavy throttle to each motor, shooting it into the air.
                 if last_mode == False: # last mode we were in was standby mode. So, this is the first frame we are going into flight mode
-                    if input_throttle > 0.05: # if throttle is > 5%
-                        FATAL_ERROR("Throttle was set to " + str(input_throttle) + " as soon as flight mode was entered. Throttle must be at 0% when flight mode begins (safety check).")
-                
-                # calculate the adjusted desired throttle (above idle throttle, below governor throttle, scaled linearly)
-                adj_throttle:float = throttle_idle + (throttle_range * input_throttle)
-
-                # calculate errors - diff between the actual rates and the desired rates
-                # "error" is calculated as setpoint (the goal) - actual
-                error_rate_roll:float = (input_roll * max_rate_roll) - gyro_x
-                error_rate_pitch:float = (input_pitch * max_rate_pitch) - gyro_y
-                error_rate_yaw:float = (input_yaw * max_rate_yaw) - gyro_z
-
-                # roll PID calc
-                roll_p:float = error_rate_roll * pid_roll_kp
-                roll_i:float = roll_last_integral + (error_rate_roll * pid_roll_ki * cycle_time_seconds)
-                roll_i = max(min(roll_i, i_limit), -i_limit) # constrain within I-term limits
-                roll_d:float = pid_roll_kd * (error_rate_roll - roll_last_error) / cycle_time_seconds
-                pid_roll:float = roll_p + roll_i + roll_d
-
-                # pitch PID calc
-                pitch_p:float = error_rate_pitch * pid_pitch_kp
-                pitch_i:float = pitch_last_integral + (error_rate_pitch * pid_pitch_ki * cycle_time_seconds)
-                pitch_i = max(min(pitch_i, i_limit), -i_limit) # constrain within I-term limits
-                pitch_d:float = pid_pitch_kd * (error_rate_pitch - pitch_last_error) / cycle_time_seconds
-                pid_pitch = pitch_p + pitch_i + pitch_d
-
-                # yaw PID calc
-                yaw_p:float = error_rate_yaw * pid_yaw_kp
-                yaw_i:float = yaw_last_integral + (error_rate_yaw * pid_yaw_ki * cycle_time_seconds)
-                yaw_i = max(min(yaw_i, i_limit), -i_limit) # constrain within I-term limits
-                yaw_d:float = pid_yaw_kd * (error_rate_yaw - yaw_last_error) / cycle_time_seconds
-                pid_yaw = yaw_p + yaw_i + yaw_d
-
-                # calculate throttle values
-                t1:float = adj_throttle + pid_pitch + pid_roll - pid_yaw
-                t2:float = adj_throttle + pid_pitch - pid_roll + pid_yaw
-                t3:float = adj_throttle - pid_pitch + pid_roll + pid_yaw
-                t4:float = adj_throttle - pid_pitch - pid_roll - pid_yaw
-
-                # Adjust throttle according to input
-                M1.duty_ns(calculate_duty_cycle(t1))
-                M2.duty_ns(calculate_duty_cycle(t2))
-                M3.duty_ns(calculate_duty_cycle(t3))
-                M4.duty_ns(calculate_duty_cycle(t4))
-
-                # Save state values for next loop
-                roll_last_error = error_rate_roll
-                pitch_last_error = error_rate_pitch
-                yaw_last_error = error_rate_yaw
-                roll_last_integral = roll_i
-                pitch_last_integral = pitch_i
-                yaw_last_integral = yaw_i
+                    if input_throttle > start_throttle_limit: # if throttle is > 5%
+                        FATAL_ERROR("Throttle was set to " + str(input_throttle / fixedpoint.ONE if fixed_point else input_throttle) + " as soon as flight mode was entered. Throttle must be at 0% when flight mode begins (safety check).")
+                    if gc_flight_policy: # collect now, then no more automatic collections until standby
+                        loop_heap.arm()
+                    if adapting: # count late cycles from here on
+                        rate_chooser.restart(loop_scheduler.overruns)
+
+                # fixed point: gyro -> PIDs -> mixer in one viper call, straight into motor_duty. The setpoints and adjusted throttle were worked out with the RC command.
+                if fixed_point:
+                    if profiling:
+                        stamps[pb + 6] = time.ticks_us() # pid
+                    fixed_step()
+                    if profiling:
+                        stamps[pb + 7] = time.ticks_us() # mixer (part of the fixed point step)
+                        stamps[pb + 8] = time.ticks_us() # pwm
+                    for i in motor_indexes:
+                        motor_writers[i](motor_duty[i])
+                    if profiling:
+                        stamps[pb + 9] = time.ticks_us() # tasks
+
+                else:
+                    # the stick command (already mapped to setpoints)
+                    input_roll:float = command[1] # deg/s (deg in angle mode)
+                    input_pitch:float = command[2] # deg/s (deg in angle mode)
+                    input_yaw:float = command[3] # deg/s
+
+                    # calculate the adjusted desired throttle (above idle throttle, below governor throttle, scaled linearly)
+                    adj_throttle:float = throttle_idle + (throttle_range * input_throttle)
+
+                    # calculate errors - diff between the actual rates and the desired rates
+                    # "error" is calculated as setpoint (the goal) - actual
+                    if angle_mode: # the roll and pitch sticks set an angle. The rate setpoint turns toward it, faster the further off it is.
+                        estimate_angles()
+                        setpoint_roll:float = (input_roll - attitude_angles[0]) * angle_gain
+                        setpoint_pitch:float = (input_pitch - attitude_angles[1]) * angle_gain
+                        if setpoint_roll > max_rate_roll:
+                            setpoint_roll = max_rate_roll
+                        elif setpoint_roll < -max_rate_roll:
+                            setpoint_roll = -max_rate_roll
+                        if setpoint_pitch > max_rate_pitch:
+                            setpoint_pitch = max_rate_pitch
+                        elif setpoint_pitch < -max_rate_pitch:
+                            setpoint_pitch = -max_rate_pitch
+                    else:
+                        setpoint_roll:float = input_roll
+                        setpoint_pitch:float = input_pitch
+                    setpoint_yaw:float = input_yaw
+                    error_rate_roll:float = setpoint_roll - gyro_x
+                    error_rate_pitch:float = setpoint_pitch - gyro_y
+                    error_rate_yaw:float = setpoint_yaw - gyro_z
+
+                    # PID calc - all three axes at once (I-term constrained within +/- i_limit)
+                    if profiling:
+                        stamps[pb + 6] = time.ticks_us() # pid
+                    pid_update(error_rate_roll, error_rate_pitch, error_rate_yaw)
+                    pid_roll:float = pid_output[0]
+                    pid_pitch:float = pid_output[1]
+                    pid_yaw:float = pid_output[2]
+
+                    # calculate throttle values and duty cycles for every motor (mixing table for the frame layout, with saturation handling)
+                    if profiling:
+                        stamps[pb + 7] = time.ticks_us() # mixer
+                    mix(adj_throttle, pid_roll, pid_pitch, pid_yaw)
+
+                    # Adjust throttle according to input
+                    if profiling:
+                        stamps[pb + 8] = time.ticks_us() # pwm
+                    for i in motor_indexes:
+                        motor_writers[i](motor_duty[i])
+                    if profiling:
+                        stamps[pb + 9] = time.ticks_us() # tasks
+
+                    # hand the cycle to the blackbox task
+                    flight_state[0] = setpoint_roll
+                    flight_state[1] = setpoint_pitch
+                    flight_state[2] = setpoint_yaw
+                    flight_state[3] = adj_throttle
 
                 # set last mode
                 last_mode = True # True = flight mode (props spinning, pid active, motors receiving power commands, etc)
+                loop_state[2] = 1
 
-            else: # the input from channel 5 is unexpected
-                print("Channel 5 input '" + str(rc_data[5]) + "' not valid. Is the transmitter turned on and connected?")
+            elif not dual_core: # the input from channel 5 is unexpected (in dual-core mode, the I/O core reports this). Only reported when it changes, as the message allocates.
+                if int(mode_switch) != invalid_mode_switch:
+                    invalid_mode_switch = int(mode_switch)
+                    print("Channel 5 input '" + str(invalid_mode_switch) + "' not valid. Is the transmitter turned on and connected?")
 
             # mark end time
-            loop_end_us:int = time.ticks_us()
-
-            # wait to make the hz correct
-            elapsed_us:int = loop_end_us - loop_begin_us
-            if elapsed_us < cycle_time_us:
-                time.sleep_us(cycle_time_us - elapsed_us)
+            elapsed_us:int = time.ticks_diff(time.ticks_us(), loop_begin_us)
+
+            # close the cycle's heap accounting (bytes allocated, time spent collecting since the last cycle), before it is recorded
+            heap_cycle()
+
+            # too many late cycles in flight: step the loop rate down (see looprate.py)
+            if adapting and last_mode and rate_watch(loop_scheduler.overruns):
+                set_loop_rate(rate_chooser.step_down())
+                print("Loop rate stepped down to " + str(target_cycle_hz) + " hz (" + str(loop_scheduler.overruns) + " late cycles so far)")
+
+            # in dual-core mode, the I/O core does the recording and the flash writes. This core only hands it the cycle's state.
+            if state_mailbox is not None:
+                if last_mode:
+                    recorder.capture(state_mailbox.back(), True, elapsed_us, gyro_x, gyro_y, gyro_z, setpoint_roll, setpoint_pitch, setpoint_yaw, adj_throttle)
+                else:
+                    recorder.capture(state_mailbox.back(), False, elapsed_us, gyro_x, gyro_y, gyro_z, 0.0, 0.0, 0.0, 0.0)
+                state_mailbox.publish(loop_begin_us)
+            else:
+                loop_state[0] = loop_begin_us
+                loop_state[1] = elapsed_us
+
+            # the other rate groups (RC, blackbox, flash, status), if due and if there is time to spare
+            run_tasks()
+
+            # keep the profile of flight mode cycles (any other cycle is overwritten by the next)
+            if profiling:
+                stamps[pb + 10] = time.ticks_us() # end of the cycle
+                pb = commit_profile(mode_switch == 2000)
         
 
     except Exception as e: # something went wrong. Flash the LED so the pilot sees it
 
         # before we do anything, turn the motors OFF
         duty_0_percent:int = calculate_duty_cycle(0.0)
-        M1.duty_ns(duty_0_percent)
-        M2.duty_ns(duty_0_percent)
-        M3.duty_ns(duty_0_percent)
-        M4.duty_ns(duty_0_percent)
+        for m in motors:
+            m.duty_ns(duty_0_percent)
 
         # deinit
-        M1.deinit()
-        M2.deinit()
-        M3.deinit()
-        M4.deinit()
+        for m in motors:
+            m.deinit()
         
         FATAL_ERROR(str(e))
 
@@ -349,27 +906,73 @@ def calculate_duty_cycle(throttle:float, dead_zone:float = 0.03) -> int:
 
     return int(dutyns)
 
-def normalize(value:float, original_min:float, original_max:float, new_min:float, new_max:float) -> float:
-    """Normalizes (scales) a value to within a specific range."""
-    return new_min + ((new_max - new_min) * ((value - original_min) / (original_max - original_min)))
+def io_core(rc:ibus.IBus, stick_map:sticks.StickMap, recorder:blackbox.Blackbox) -> None:
+    """
+    The I/O core's (core 1) loop in dual-core mode: RC receiver -> rc_mailbox, state_mailbox -> blackbox (and flash), console messages.
+    Runs until core 0 sets io_core_running to False. Note that a garbage collection pauses both cores, so this loop should allocate as little as the flight loop.
+    """
+    global io_core_stopped, io_core_error
+    state = array.array("f", [0.0] * state_mailbox.size) if state_mailbox is not None else None
+    try:
+        while io_core_running:
 
-def translate_pair(high:int, low:int) -> int:
-        """Converts a byte pair to a usable value. Borrowed from https://github.com/m-rtijn/mpu6050/blob/0626053a5e1182f4951b78b8326691a9223a5f7d/mpu6050/mpu6050.py#L76C39-L76C39."""
-        value = (high << 8) + low
-        if value >= 0x8000:
-            value = -((65535 - value) + 1)
-        return value   
+            # parse whatever the receiver has sent. A new frame becomes the control core's next command.
+            rc_data = rc.read()
+            if rc_data[0] == 1:
+                stick_map.process(rc_data, rc_mailbox.back())
+                rc_mailbox.publish(rc.frame_ticks_us)
+                if rc_data[5] != 1000 and rc_data[5] != 2000:
+                    print("Channel 5 input '" + str(rc_data[5]) + "' not valid. Is the transmitter turned on and connected?")
+
+            # record the control core's latest cycle, and write to flash if that cycle left time to spare (or it is in standby). Flash writes stall both cores, so they still have to fit in core 0's slack.
+            if state is not None and state_mailbox.read_into(state):
+                flying:bool = (int(state[1]) & blackbox.FLAG_FLYING) != 0
+                if flying:
+                    recorder.record_state(state_mailbox.stamp_us, state)
+                recorder.service(loop_scheduler.period_us - time.ticks_diff(time.ticks_us(), state_mailbox.stamp_us), flying)
+
+            time.sleep_us(io_core_poll_us)
+    except Exception as e:
+        io_core_error = str(e)
+    io_core_stopped = True
 
 def FATAL_ERROR(msg:str) -> None:
+    global io_core_running
+    if control_timer is not None and control_timer.running: # stop the control step first (its safe() turns the motors off)
+        control_timer.stop()
+
+    # flash the LED from a timer, starting now, so the pilot sees something went wrong while the rest of this runs (saving the last flight's data takes a while)
+    led = machine.Pin(25, machine.Pin.OUT)
+    led.off()
+    def blink(timer, led = led) -> None:
+        led.toggle()
+    blinker = machine.Timer(-1)
+    blinker.init(mode = machine.Timer.PERIODIC, period = 1000, callback = blink)
+
+    if loop_heap is not None and loop_heap.armed: # everything below allocates: turn the garbage collector back on first
+        loop_heap.disarm()
     em:str = "Fatal error @ " + str(time.ticks_ms()) + " ms: " + msg
     print(em)
     toolkit.log(em)
-    led = machine.Pin(25, machine.Pin.OUT)
-    while True:
-            led.off()
-            time.sleep(1.0)
-            led.on()
-            time.sleep(1.0)
+    if io_core_running: # stop the I/O core first, so it is not writing to the blackbox while it is dumped
+        io_core_running = False
+        stop_began_ms:int = time.ticks_ms()
+        while not io_core_stopped and time.ticks_diff(time.ticks_ms(), stop_began_ms) < 500:
+            time.sleep_ms(1)
+    if loop_scheduler is not None:
+        print(loop_scheduler.report())
+    if loop_profiler is not None: # save where the last cycles' time went
+        try:
+            loop_profiler.save()
+        except Exception as e:
+            print("Unable to save profile: " + str(e))
+    if recorder is not None: # save the last seconds of flight data
+        try:
+            recorder.dump()
+        except Exception as e:
+            print("Unable to dump blackbox: " + str(e))
+    while True: # nothing left to do but blink: sleep until the next interrupt
+        machine.idle()
 
 
 
@@ -0,0 +1,113 @@
+import array
+import math
+import emit
+import micropython
+
+# Frame layouts: the angle of each motor (degrees, clockwise from the nose) and its spin direction (1 = clockwise, -1 = counter clockwise), in motor order.
+# "quad-x" is Scout's own layout: motor 1 front left CW, motor 2 front right CCW, motor 3 rear left CCW, motor 4 rear right CW.
+LAYOUTS:dict = {
+    "quad-x": ((315.0, 1), (45.0, -1), (225.0, -1), (135.0, 1)),
+    "quad-+": ((0.0, 1), (90.0, -1), (180.0, 1), (270.0, -1)), # front, right, rear, left
+    "hex-x": ((30.0, -1), (90.0, 1), (150.0, -1), (210.0, 1), (270.0, -1), (330.0, 1)), # clockwise from front right
+    "octo-x": ((22.5, -1), (67.5, 1), (112.5, -1), (157.5, 1), (202.5, -1), (247.5, 1), (292.5, -1), (337.5, 1)), # clockwise from front right
+}
+
+def mixing_table(layout:str) -> tuple:
+    """
+    Builds the (roll, pitch, yaw) factor of every motor for a frame layout, in Scout's sign conventions:
+    a positive roll output speeds up the motors on the left, a positive pitch output speeds up the front motors and a positive yaw output speeds up the counter clockwise motors.
+    Roll and pitch factors share one normalization (so the frame's geometry is kept) that makes the largest 1.0. For "quad-x" this gives exactly the +/- 1 of the original hand-written mix.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError("Unknown frame layout '" + str(layout) + "'. Options: " + ", ".join(LAYOUTS.keys()))
+    motors = LAYOUTS[layout]
+    roll:list[float] = []
+    pitch:list[float] = []
+    yaw:list[float] = []
+    for angle, spin in motors:
+        rad:float = math.radians(angle)
+        roll.append(-math.sin(rad))
+        pitch.append(math.cos(rad))
+        yaw.append(-float(spin))
+    largest:float = max([abs(v) for v in roll + pitch])
+    roll = [round(v / largest, 6) + 0.0 for v in roll] # + 0.0 turns -0.0 into 0.0
+    pitch = [round(v / largest, 6) + 0.0 for v in pitch]
+    return (roll, pitch, yaw)
+
+@micropython.native
+def _mix(n, roll_f, pitch_f, yaw_f, throttle, r, p, y, lo, hi, scaling, a, b, dmin, dmax, out, duty, scale):
+    # PID contribution of every motor, and the extremes
+    cmax = 0.0
+    cmin = 0.0
+    i = 0
+    while i < n:
+        c = r * roll_f[i] + p * pitch_f[i] + y * yaw_f[i]
+        out[i] = c
+        if c > cmax:
+            cmax = c
+        if c < cmin:
+            cmin = c
+        i += 1
+
+    # if any motor would clip, scale the PID contributions (not the throttle) down just enough that none do. This keeps the ratio between axes, so the craft still rotates the way the PIDs asked, only less.
+    k = 1.0
+    if scaling:
+        if cmax > 0.0 and throttle + cmax > hi:
+            k = (hi - throttle) / cmax
+        if cmin < 0.0 and throttle + cmin < lo:
+            k2 = (throttle - lo) / (0.0 - cmin)
+            if k2 < k:
+                k = k2
+        if k < 0.0:
+            k = 0.0
+    scale[0] = k
+
+    # motor throttle, then duty cycle (a straight line, clamped)
+    i = 0
+    while i < n:
+        t = throttle + (k * out[i])
+        out[i] = t
+        d = int(a * t + b)
+        if d < dmin:
+            d = dmin
+        elif d > dmax:
+            d = dmax
+        duty[i] = d
+        i += 1
+
+class Mixer:
+    """
+    Turns throttle and the roll/pitch/yaw PID outputs into an ESC duty cycle (nanoseconds) for every motor, in one call, using a precomputed mixing table.
+    After mix(), the motor throttles (0.0-1.0) are in output, the duty cycles in duty and the factor the PID outputs were scaled by to avoid clipping (1.0 = not scaled) in scale[0].
+    """
+
+    def __init__(self, layout:str = "quad-x", dead_zone:float = 0.03, duty_floor_ns:int = 1000000, duty_ceiling_ns:int = 2000000, saturation_scaling:bool = True) -> None:
+        """
+        :param layout: a key of LAYOUTS.
+        :param dead_zone: throttle below dead_zone (and above 1 - dead_zone) is clipped, as in calculate_duty_cycle() in main.py.
+        :param duty_floor_ns: duty cycle at 0% throttle.
+        :param duty_ceiling_ns: duty cycle at 100% throttle.
+        :param saturation_scaling: if True, PID outputs are scaled down when a motor would otherwise clip. If False, each motor simply clips.
+        """
+        roll, pitch, yaw = mixing_table(layout)
+        self.layout:str = layout
+        self.motors:int = len(roll)
+        self._roll = array.array("f", roll)
+        self._pitch = array.array("f", pitch)
+        self._yaw = array.array("f", yaw)
+        self.output = array.array("f", [0.0] * self.motors)
+        self.duty = array.array("i", [0] * self.motors)
+        self.scale = array.array("f", [1.0])
+        self.saturation_scaling:bool = saturation_scaling
+
+        # the throttle range that does not clip, and the throttle -> duty line (same result as calculate_duty_cycle())
+        self._lo:float = dead_zone
+        self._hi:float = 1.0 - dead_zone
+        self._a:float = (duty_ceiling_ns - duty_floor_ns) / (1.0 - dead_zone - dead_zone)
+        self._b:float = duty_floor_ns - (self._a * dead_zone)
+        self._dmin:int = duty_floor_ns
+        self._dmax:int = duty_ceiling_ns
+
+    def mix(self, throttle:float, roll:float, pitch:float, yaw:float) -> None:
+        """Computes every motor's throttle and duty cycle (see class description)."""
+        _mix(self.motors, self._roll, self._pitch, self._yaw, throttle, roll, pitch, yaw, self._lo, self._hi, self.saturation_scaling, self._a, self._b, self._dmin, self._dmax, self.output, self.duty, self.scale)
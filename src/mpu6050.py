@@ -0,0 +1,248 @@
+import array
+import time
+import emit
+import micropython
+
+# registers
+REG_SMPLRT_DIV:int = 0x19
+REG_CONFIG:int = 0x1A # DLPF
+REG_GYRO_CONFIG:int = 0x1B
+REG_ACCEL_CONFIG:int = 0x1C
+REG_FIFO_EN:int = 0x23
+REG_INT_STATUS:int = 0x3A
+REG_ACCEL_XOUT_H:int = 0x3B # start of the 14-byte accel (6), temp (2), gyro (6) block
+REG_USER_CTRL:int = 0x6A
+REG_PWR_MGMT_1:int = 0x6B
+REG_FIFO_COUNT_H:int = 0x72
+REG_FIFO_R_W:int = 0x74
+REG_WHO_AM_I:int = 0x75
+
+FIFO_SIZE:int = 1024 # bytes
+SAMPLE_SIZE:int = 14 # bytes per sample, in the FIFO as well as in a burst read (accel, temp, gyro)
+
+GYRO_LSB_PER_DPS:tuple = (131.0, 65.5, 32.8, 16.4) # by gyro range setting (0-3) = +/- 250, 500, 1000, 2000 deg/s
+ACCEL_LSB_PER_G:tuple = (16384.0, 8192.0, 4096.0, 2048.0) # by accel range setting (0-3) = +/- 2, 4, 8, 16 g
+GYRO_DLPF_BANDWIDTH_HZ:tuple = (256.0, 188.0, 98.0, 42.0, 20.0, 10.0, 5.0) # by DLPF setting (0-6), from the datasheet
+GYRO_DLPF_DELAY_MS:tuple = (0.98, 1.9, 2.8, 4.8, 8.3, 13.4, 18.6) # by DLPF setting (0-6), from the datasheet
+
+@micropython.native
+def _decode(buf, gain, offset, out):
+    """Converts the raw 14-byte burst (7 big-endian signed 16-bit values) to scaled, flipped, bias-corrected values in out. ((v ^ 0x8000) - 0x8000) sign-extends a 16-bit value without branching."""
+    out[0] = ((((buf[0] << 8) | buf[1]) ^ 0x8000) - 0x8000) * gain[0] - offset[0] # accel x
+    out[1] = ((((buf[2] << 8) | buf[3]) ^ 0x8000) - 0x8000) * gain[1] - offset[1] # accel y
+    out[2] = ((((buf[4] << 8) | buf[5]) ^ 0x8000) - 0x8000) * gain[2] - offset[2] # accel z
+    out[3] = ((((buf[6] << 8) | buf[7]) ^ 0x8000) - 0x8000) * gain[3] - offset[3] # temperature
+    out[4] = ((((buf[8] << 8) | buf[9]) ^ 0x8000) - 0x8000) * gain[4] - offset[4] # gyro x (roll rate)
+    out[5] = ((((buf[10] << 8) | buf[11]) ^ 0x8000) - 0x8000) * gain[5] - offset[5] # gyro y (pitch rate)
+    out[6] = ((((buf[12] << 8) | buf[13]) ^ 0x8000) - 0x8000) * gain[6] - offset[6] # gyro z (yaw rate)
+
+@micropython.native
+def _sum_samples(buf, n, sums):
+    """Adds up each of the 7 channels across n consecutive 14-byte samples in buf (integer math only) and stores the totals in sums."""
+    s0 = 0
+    s1 = 0
+    s2 = 0
+    s3 = 0
+    s4 = 0
+    s5 = 0
+    s6 = 0
+    i = 0
+    end = n * 14
+    while i < end:
+        s0 += (((buf[i] << 8) | buf[i + 1]) ^ 0x8000) - 0x8000
+        s1 += (((buf[i + 2] << 8) | buf[i + 3]) ^ 0x8000) - 0x8000
+        s2 += (((buf[i + 4] << 8) | buf[i + 5]) ^ 0x8000) - 0x8000
+        s3 += (((buf[i + 6] << 8) | buf[i + 7]) ^ 0x8000) - 0x8000
+        s4 += (((buf[i + 8] << 8) | buf[i + 9]) ^ 0x8000) - 0x8000
+        s5 += (((buf[i + 10] << 8) | buf[i + 11]) ^ 0x8000) - 0x8000
+        s6 += (((buf[i + 12] << 8) | buf[i + 13]) ^ 0x8000) - 0x8000
+        i += 14
+    sums[0] = s0
+    sums[1] = s1
+    sums[2] = s2
+    sums[3] = s3
+    sums[4] = s4
+    sums[5] = s5
+    sums[6] = s6
+
+class MPU6050:
+    """
+    Reads the MPU-6050 with a single 14-byte burst (accel, temperature and gyro) into a preallocated buffer.
+    Nothing is allocated per read: the bytes land in self.buf via readfrom_mem_into and the decoded values are written into self.data, an array('f') laid out as:
+    [accel_x, accel_y, accel_z (g), temperature (celsius), gyro_x, gyro_y, gyro_z (degrees per second)]
+    Scale, axis flips (for how the sensor is mounted) and bias are folded into a precomputed per-channel gain/offset table, so each value costs one multiply and one subtract.
+    """
+
+    def __init__(self, i2c, address:int = 0x68, gyro_flip:tuple = (1, 1, 1), accel_flip:tuple = (1, 1, 1)) -> None:
+        """
+        Creates a new MPU6050 reader. Call configure() before reading.
+        :param i2c: the machine.I2C bus the sensor is on.
+        :param address: I2C address of the sensor.
+        :param gyro_flip: +1 or -1 for each gyro axis (x, y, z), applied to account for the sensor's mounting orientation.
+        :param accel_flip: +1 or -1 for each accelerometer axis (x, y, z).
+        """
+        self.i2c = i2c
+        self.address:int = address
+        self.gyro_flip:tuple = gyro_flip
+        self.accel_flip:tuple = accel_flip
+
+        self.buf:bytearray = bytearray(14) # raw burst
+        self.data = array.array("f", [0.0] * 7) # decoded values (see class description)
+        self._gain = array.array("f", [0.0] * 7)
+        self._offset = array.array("f", [0.0] * 7)
+        self._gyro_bias:list[float] = [0.0, 0.0, 0.0]
+
+        self.gyro_range:int = 0
+        self.accel_range:int = 0
+        self.lpf:int = 0
+        self._rebuild_table()
+
+        # sample rate (see set_sample_rate) and FIFO mode (see enable_fifo)
+        self.sample_rate_hz:float = 0.0
+        self.sample_period_us:int = 0
+        self.fifo_min_samples:int = 1
+        self.fifo_samples:int = 0 # how many samples the last read_fifo() drained
+        self.fifo_overflows:int = 0 # times the FIFO filled up (or lost alignment) and had to be reset
+        self.fifo_buf:bytearray = None
+        self._fifo_views:list = None
+        self._count_buf:bytearray = bytearray(2)
+        self._queued:int = 0 # bytes wait_fifo() last saw queued, for the read_fifo() that follows it
+        self._sums = array.array("i", [0] * 7)
+
+    def configure(self, lpf:int = 5, gyro_range:int = 1, accel_range:int = 0) -> None:
+        """
+        Wakes the sensor and sets the digital low pass filter and measurement ranges.
+        :param lpf: DLPF setting (0-6).
+        :param gyro_range: 0-3, for +/- 250, 500, 1000 or 2000 degrees per second.
+        :param accel_range: 0-3, for +/- 2, 4, 8 or 16 g.
+        """
+        self.i2c.writeto_mem(self.address, REG_PWR_MGMT_1, bytes([0x01])) # wake it up (and use the gyro X PLL as clock source)
+        self.i2c.writeto_mem(self.address, REG_CONFIG, bytes([lpf]))
+        self.i2c.writeto_mem(self.address, REG_GYRO_CONFIG, bytes([gyro_range << 3]))
+        self.i2c.writeto_mem(self.address, REG_ACCEL_CONFIG, bytes([accel_range << 3]))
+        self.gyro_range = gyro_range
+        self.accel_range = accel_range
+        self.lpf = lpf
+        self._rebuild_table()
+
+    def set_gyro_bias(self, x:float, y:float, z:float) -> None:
+        """Sets the gyro bias (degrees per second, AFTER axis flips) that is subtracted from every reading."""
+        self._gyro_bias[0] = x
+        self._gyro_bias[1] = y
+        self._gyro_bias[2] = z
+        self._rebuild_table()
+
+    def _rebuild_table(self) -> None:
+        accel_gain:float = 1.0 / ACCEL_LSB_PER_G[self.accel_range]
+        gyro_gain:float = 1.0 / GYRO_LSB_PER_DPS[self.gyro_range]
+        for i in range(3):
+            self._gain[i] = accel_gain * self.accel_flip[i]
+            self._offset[i] = 0.0
+            self._gain[4 + i] = gyro_gain * self.gyro_flip[i]
+            self._offset[4 + i] = self._gyro_bias[i]
+        self._gain[3] = 1.0 / 340.0 # temperature, per the MPU-6050 register map: raw / 340 + 36.53
+        self._offset[3] = -36.53
+
+    def set_sample_rate(self, sample_rate_hz:float) -> float:
+        """
+        Sets the sample rate divider: how often the sensor refreshes its output registers (and, in FIFO mode, queues a sample). Call after configure().
+        :param sample_rate_hz: desired sample rate. The gyro output rate (1 kHz with the DLPF on, 8 kHz with it off) is divided down to the nearest achievable rate.
+        :returns: the actual sample rate, in hz.
+        """
+        output_rate:float = 8000.0 if (self.lpf == 0 or self.lpf == 7) else 1000.0
+        divider:int = max(0, min(255, int(round(output_rate / sample_rate_hz)) - 1))
+        self.sample_rate_hz = output_rate / (divider + 1)
+        self.sample_period_us = int(round(1000000.0 / self.sample_rate_hz))
+        self.i2c.writeto_mem(self.address, REG_SMPLRT_DIV, bytes([divider]))
+        return self.sample_rate_hz
+
+    def read_register(self, reg:int) -> int:
+        """Reads a single register (for setup/validation; this allocates, do not use it in the flight loop)."""
+        return self.i2c.readfrom_mem(self.address, reg, 1)[0]
+
+    def read(self) -> None:
+        """Burst-reads accel, temperature and gyro and decodes into self.data."""
+        self.i2c.readfrom_mem_into(self.address, REG_ACCEL_XOUT_H, self.buf)
+        _decode(self.buf, self._gain, self._offset, self.data)
+
+    def read_raw(self) -> None:
+        """Burst-reads accel, temperature and gyro into self.buf only, without decoding (for fixedpoint.FixedController, which decodes the gyro itself)."""
+        self.i2c.readfrom_mem_into(self.address, REG_ACCEL_XOUT_H, self.buf)
+
+    ##### FIFO MODE #####
+    # The sensor samples on its own clock at a fixed rate (set by the sample rate divider) and queues every sample in its 1024-byte FIFO.
+    # Each flight loop cycle then drains everything that is queued with one bulk read, so no samples are missed, and the loop can be paced by the sensor's clock instead of time.sleep_us.
+
+    def enable_fifo(self, sample_rate_hz:float, min_samples:int = 1, max_samples:int = 16) -> float:
+        """
+        Sets the sample rate divider and starts queueing accel, temperature and gyro samples (14 bytes each, same layout as a burst read) in the FIFO. Call after configure().
+        :param sample_rate_hz: desired sample rate. The gyro output rate (1 kHz with the DLPF on, 8 kHz with it off) is divided down to the nearest achievable rate.
+        :param min_samples: read_fifo() waits until at least this many samples are queued (e.g. samples per flight loop cycle), so the caller is paced by the sensor.
+        :param max_samples: the most samples a single read_fifo() call will drain (sizes the preallocated buffer).
+        :returns: the actual sample rate, in hz.
+        """
+        self.set_sample_rate(sample_rate_hz)
+        self.fifo_min_samples = min_samples
+
+        # preallocate the bulk read buffer, and one memoryview per possible sample count, so draining never allocates
+        self.fifo_buf = bytearray(max_samples * SAMPLE_SIZE)
+        mv:memoryview = memoryview(self.fifo_buf)
+        self._fifo_views = [None]
+        for n in range(1, max_samples + 1):
+            self._fifo_views.append(mv[0:n * SAMPLE_SIZE])
+
+        self.i2c.writeto_mem(self.address, REG_FIFO_EN, bytes([0xF8])) # TEMP, XG, YG, ZG and ACCEL into the FIFO
+        self.reset_fifo()
+        return self.sample_rate_hz
+
+    def reset_fifo(self) -> None:
+        """Empties the FIFO and (re)starts queueing samples."""
+        self.i2c.writeto_mem(self.address, REG_USER_CTRL, bytes([0x04])) # FIFO_RESET
+        self.i2c.writeto_mem(self.address, REG_USER_CTRL, bytes([0x40])) # FIFO_EN
+
+    def fifo_count(self) -> int:
+        """The number of bytes waiting in the FIFO."""
+        self.i2c.readfrom_mem_into(self.address, REG_FIFO_COUNT_H, self._count_buf)
+        return (self._count_buf[0] << 8) | self._count_buf[1]
+
+    def wait_fifo(self) -> None:
+        """Waits until at least fifo_min_samples are queued. The read_fifo() that follows drains them without checking again."""
+        need:int = self.fifo_min_samples * SAMPLE_SIZE
+        count:int = self.fifo_count()
+        while count < need:
+            # sleep until all but the last missing sample should be ready, then poll in steps of 1/8th of a sample period (we don't know where the sensor is within its current period)
+            time.sleep_us((((need - count) // SAMPLE_SIZE) - 1) * self.sample_period_us + (self.sample_period_us >> 3))
+            count = self.fifo_count()
+        self._queued = count
+
+    def read_fifo(self) -> int:
+        """
+        Waits until at least fifo_min_samples are queued (unless wait_fifo() just did), then drains every queued sample (up to max_samples) with one bulk read.
+        The raw samples are left in fifo_buf, and their mean (scaled, flipped and bias-corrected) is written to self.data, so every sample contributes to the reading.
+        :returns: the number of samples drained (0 if the FIFO overflowed and was reset, in which case self.data is left unchanged).
+        """
+        max_samples:int = len(self._fifo_views) - 1
+        if self._queued == 0:
+            self.wait_fifo()
+        count:int = self._queued
+        self._queued = 0
+
+        # a full FIFO has dropped its oldest bytes, so it is no longer aligned to sample boundaries
+        if count > FIFO_SIZE - SAMPLE_SIZE or count % SAMPLE_SIZE != 0:
+            self.fifo_overflows = self.fifo_overflows + 1
+            self.reset_fifo()
+            self.fifo_samples = 0
+            return 0
+
+        n:int = min(count // SAMPLE_SIZE, max_samples)
+        self.i2c.readfrom_mem_into(self.address, REG_FIFO_R_W, self._fifo_views[n])
+        _sum_samples(self.fifo_buf, n, self._sums)
+        sums = self._sums
+        gain = self._gain
+        offset = self._offset
+        out = self.data
+        inv:float = 1.0 / n
+        for i in range(7):
+            out[i] = sums[i] * gain[i] * inv - offset[i]
+        self.fifo_samples = n
+        return n
@@ -0,0 +1,127 @@
+import array
+import filters
+import emit
+import micropython
+
+ROLL:int = 0
+PITCH:int = 1
+YAW:int = 2
+
+@micropython.native
+def _update(kp, ki_dt, kd_dt, i_limit, d_k, integral, last_error, p, d, output, e0, e1, e2):
+    """One PID step for all three axes. Unrolled, so there is no per-axis loop overhead. The D term is PT1 filtered with gain d_k[0] (1.0 for none, which skips the filter), with d (the last D term) as the filter's state."""
+    lim = i_limit[0]
+    k = d_k[0]
+
+    # roll
+    p0 = e0 * kp[0]
+    i0 = integral[0] + (e0 * ki_dt[0])
+    if i0 > lim:
+        i0 = lim
+    elif i0 < -lim:
+        i0 = -lim
+    d0 = kd_dt[0] * (e0 - last_error[0])
+    if k < 1.0:
+        d0 = d[0] + (k * (d0 - d[0]))
+
+    # pitch
+    p1 = e1 * kp[1]
+    i1 = integral[1] + (e1 * ki_dt[1])
+    if i1 > lim:
+        i1 = lim
+    elif i1 < -lim:
+        i1 = -lim
+    d1 = kd_dt[1] * (e1 - last_error[1])
+    if k < 1.0:
+        d1 = d[1] + (k * (d1 - d[1]))
+
+    # yaw
+    p2 = e2 * kp[2]
+    i2 = integral[2] + (e2 * ki_dt[2])
+    if i2 > lim:
+        i2 = lim
+    elif i2 < -lim:
+        i2 = -lim
+    d2 = kd_dt[2] * (e2 - last_error[2])
+    if k < 1.0:
+        d2 = d[2] + (k * (d2 - d[2]))
+
+    output[0] = p0 + i0 + d0
+    output[1] = p1 + i1 + d1
+    output[2] = p2 + i2 + d2
+    integral[0] = i0
+    integral[1] = i1
+    integral[2] = i2
+    last_error[0] = e0
+    last_error[1] = e1
+    last_error[2] = e2
+    p[0] = p0
+    p[1] = p1
+    p[2] = p2
+    d[0] = d0
+    d[1] = d1
+    d[2] = d2
+
+class PIDBank:
+    """
+    Three PID controllers (roll, pitch, yaw rate) updated together in one call.
+    Gains, precomputed coefficients (ki * dt and kd / dt) and state live in array('f') storage, so nothing is recomputed or allocated per cycle beyond the floats themselves.
+    After update(), the results are in output, and the individual terms in p, integral (the I term) and d, all indexed by ROLL, PITCH, YAW.
+    """
+
+    def __init__(self, cycle_hz:float, i_limit:float = 150.0, d_lpf_hz:float = 0.0) -> None:
+        """
+        :param cycle_hz: the rate update() will be called at (sets dt for the I and D terms).
+        :param i_limit: the I term is constrained to within +/- this value.
+        :param d_lpf_hz: cutoff of the D term's first order low pass, 0.0 for none. Differentiating amplifies gyro noise, this takes the edge off it before it reaches the motors.
+        """
+        self.kp = array.array("f", [0.0, 0.0, 0.0])
+        self.ki = array.array("f", [0.0, 0.0, 0.0])
+        self.kd = array.array("f", [0.0, 0.0, 0.0])
+        self._ki_dt = array.array("f", [0.0, 0.0, 0.0])
+        self._kd_dt = array.array("f", [0.0, 0.0, 0.0])
+        self._i_limit = array.array("f", [i_limit])
+        self._d_k = array.array("f", [1.0])
+        self.d_lpf_hz:float = d_lpf_hz
+        self.integral = array.array("f", [0.0, 0.0, 0.0])
+        self.last_error = array.array("f", [0.0, 0.0, 0.0])
+        self.p = array.array("f", [0.0, 0.0, 0.0])
+        self.d = array.array("f", [0.0, 0.0, 0.0])
+        self.output = array.array("f", [0.0, 0.0, 0.0])
+        self.cycle_hz:float = cycle_hz
+        self._precompute()
+
+    def set_gains(self, axis:int, kp:float, ki:float, kd:float) -> None:
+        """Sets the gains for one axis (ROLL, PITCH or YAW)."""
+        self.kp[axis] = kp
+        self.ki[axis] = ki
+        self.kd[axis] = kd
+        self._precompute()
+
+    def set_rate(self, cycle_hz:float) -> None:
+        """Changes the rate update() is called at."""
+        self.cycle_hz = cycle_hz
+        self._precompute()
+
+    def set_d_filter(self, d_lpf_hz:float) -> None:
+        """Changes the cutoff of the D term's low pass (0.0 for none)."""
+        self.d_lpf_hz = d_lpf_hz
+        self._precompute()
+
+    def _precompute(self) -> None:
+        dt:float = 1.0 / self.cycle_hz
+        for axis in range(3):
+            self._ki_dt[axis] = self.ki[axis] * dt
+            self._kd_dt[axis] = self.kd[axis] / dt
+        self._d_k[0] = filters.pt1_gain(self.cycle_hz, self.d_lpf_hz)
+
+    def reset(self) -> None:
+        """Clears the I term, the last error and the D term's filter (e.g. when switching into standby)."""
+        for axis in range(3):
+            self.integral[axis] = 0.0
+            self.last_error[axis] = 0.0
+            self.d[axis] = 0.0
+
+    def update(self, error_roll:float, error_pitch:float, error_yaw:float) -> None:
+        """Runs one PID step for all three axes. Errors are setpoint - measured, in degrees per second. Results are written to output."""
+        _update(self.kp, self._ki_dt, self._kd_dt, self._i_limit, self._d_k, self.integral, self.last_error, self.p, self.d, self.output, error_roll, error_pitch, error_yaw)
@@ -0,0 +1,121 @@
+import array
+import sys
+import select
+import time
+
+# Profile dump format (text, so the same dump can be saved to flash or printed over USB serial)
+#   "PROFILE <version> <comma separated stage names>"
+#   one line per cycle, oldest first: the cycle's stamps (ticks_us), comma separated. Stage k ran from stamp k to stamp k + 1.
+#   "END"
+HEADER:str = "PROFILE"
+VERSION:int = 1
+FOOTER:str = "END"
+
+# the stages of a flight loop cycle, in order (see main.run())
+STAGES:tuple = ("wait", "imu", "filter", "attitude", "rc", "normalize", "pid", "mixer", "pwm", "tasks")
+
+class Profiler:
+    """
+    Times the stages of the flight loop into a preallocated ring of ticks_us stamps, holding the most recent `cycles` flight cycles.
+    To keep the cost to one ticks_us() call and one array store per stage, the loop writes the stamps itself: stamps[base + k] = time.ticks_us() when stage k begins, and stamps[base + len(stages)] when the last one ends. commit() then returns the next cycle's base.
+    Nothing here allocates until the profile is reported or dumped (in standby, or on request over USB serial).
+    """
+
+    def __init__(self, stages:tuple = STAGES, cycles:int = 250) -> None:
+        """
+        :param stages: stage names, in the order they run.
+        :param cycles: how many cycles the ring holds.
+        """
+        self.stages:tuple = stages
+        self.width:int = len(stages) + 1 # stamps per cycle
+        self.capacity:int = max(1, cycles)
+        self._slots:int = self.capacity + 1 # one more row than capacity: the row being stamped is never one of the complete ones
+        self.stamps = array.array("i", [0] * (self._slots * self.width))
+        self._head:int = 0 # row the current cycle is stamped into
+        self.count:int = 0 # complete rows in the ring
+        self.cycles:int = 0 # cycles committed since power on
+        self._poll = None # USB serial (stdin) poller, see requested()
+
+    def commit(self, keep:bool) -> int:
+        """
+        Ends the current cycle and returns the stamps base of the next one.
+        :param keep: True to keep the cycle in the ring (e.g. flight mode), False to let the next cycle overwrite it.
+        """
+        if keep:
+            self._head = self._head + 1
+            if self._head == self._slots:
+                self._head = 0
+            if self.count < self.capacity:
+                self.count = self.count + 1
+            self.cycles = self.cycles + 1
+        return self._head * self.width
+
+    def rows(self):
+        """The stamps base of every complete cycle in the ring, oldest first."""
+        oldest:int = (self._head - self.count) % self._slots
+        for r in range(self.count):
+            yield ((oldest + r) % self._slots) * self.width
+
+    def statistics(self) -> list:
+        """Per stage, then the whole cycle: (name, min, mean, p99, max) in microseconds, over the cycles in the ring."""
+        ToReturn:list = []
+        if self.count == 0:
+            return ToReturn
+        s = self.stamps
+        bases:list[int] = list(self.rows())
+        for k in range(self.width):
+            if k < len(self.stages):
+                name:str = self.stages[k]
+                took:list[int] = sorted([time.ticks_diff(s[b + k + 1], s[b + k]) for b in bases])
+            else:
+                name = "cycle"
+                took = sorted([time.ticks_diff(s[b + k], s[b]) for b in bases])
+            n:int = len(took)
+            ToReturn.append((name, took[0], sum(took) / n, took[min(n - 1, (n * 99) // 100)], took[n - 1]))
+        return ToReturn
+
+    def report(self) -> str:
+        """The statistics as text, one line per stage."""
+        lines:list[str] = ["Profile of the last " + str(self.count) + " flight cycles (us): min / mean / p99 / max"]
+        for name, lo, mean, p99, hi in self.statistics():
+            lines.append("  " + name + ": " + str(lo) + " / " + str(round(mean, 1)) + " / " + str(p99) + " / " + str(hi))
+        return "\n".join(lines)
+
+    def write(self, stream) -> None:
+        """Writes the ring in the dump format (see HEADER) to a file or console stream, oldest cycle first."""
+        s = self.stamps
+        w:int = self.width
+        stream.write(HEADER + " " + str(VERSION) + " " + ",".join(self.stages) + "\n")
+        for b in self.rows():
+            stream.write(",".join([str(s[b + k]) for k in range(w)]) + "\n")
+        stream.write(FOOTER + "\n")
+
+    def save(self, path:str = "profile") -> None:
+        """Writes the ring (see write()) to a flash file, replacing the last one."""
+        f = open(path, "w")
+        self.write(f)
+        f.close()
+
+    def send(self) -> None:
+        """Prints the ring (see write()) to the console, i.e. over USB serial."""
+        self.write(sys.stdout)
+
+    def requested(self) -> bool:
+        """True if a "p" arrived over USB serial (stdin) since the last call. Never waits for input."""
+        if self._poll is None:
+            try:
+                self._poll = select.poll()
+                self._poll.register(sys.stdin, select.POLLIN)
+            except Exception: # no stdin to poll on this port (or host)
+                self._poll = False
+        if self._poll is False:
+            return False
+        ToReturn:bool = False
+        while self._poll.poll(0):
+            c:str = sys.stdin.read(1)
+            if c == "": # end of input: nothing will ever arrive, stop polling
+                self._poll = False
+                break
+            if c == "p":
+                ToReturn = True
+        return ToReturn
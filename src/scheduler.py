@@ -0,0 +1,179 @@
+import time
+
+class Scheduler:
+    """
+    Paces the flight loop on absolute deadlines and runs slower rate groups (tasks) in the time each cycle leaves over.
+
+    The critical path (IMU -> PID -> mixer -> PWM) is not a task: it is the loop body itself, run once per cycle after wait().
+    Deadlines are ticks_us values advanced with ticks_add and compared with ticks_diff, so tick wraparound (every 2^30 us) does not disturb the pacing. A cycle that ends late is followed immediately by the next one, without sleeping, to get back on schedule. If a cycle ends more than a whole period late, the schedule restarts from now, rather than running a burst of cycles to catch up.
+
+    Every task has a rate (rounded up to a whole divisor of the critical path's rate) and a priority (0 = most important; equal priorities run in the order they were added). After the critical path, run_tasks() runs the tasks that are due, in priority order:
+    - priority 0 tasks always run when due (they feed the critical path, e.g. RC parsing).
+    - other tasks only run if their expected time (the longest they have recently taken) fits in what is left of the cycle. If not, they are skipped and tried again next cycle. A task that has been skipped for as long as its own period runs anyway, so under a sustained overload every task degrades to (at worst) half its rate rather than stopping. Its expected time also decays while it is skipped, so one slow run doesn't hold it back for long.
+    A task that runs past the cycle's deadline counts an overrun against itself. A cycle that starts late counts an overrun against the critical path.
+    """
+
+    def __init__(self, period_us:int, paced:bool = True, margin_us:int = 100, pacer = None) -> None:
+        """
+        :param period_us: the critical path's period.
+        :param paced: if True, wait() sleeps until each cycle's deadline. If False, something else paces the loop and wait() only marks the cycle start.
+        :param margin_us: time kept free at the end of every cycle, as a safety margin for the critical path.
+        :param pacer: if not paced, a function (no arguments) wait() calls first, that returns once the next cycle may start (e.g. once the IMU's FIFO holds a cycle's samples). The cycle starts when it returns, so the time spent waiting in it is not taken out of the cycle.
+        """
+        self.period_us:int = period_us
+        self.paced:bool = paced
+        self.pacer = pacer
+        self.margin_us:int = margin_us
+        self.deadline:int = None # ticks_us at which the current cycle must be done (the next cycle starts)
+        self.cycle_start_us:int = 0 # ticks_us the current cycle started at
+
+        # critical path statistics
+        self.cycles:int = 0
+        self.overruns:int = 0 # cycles that started late
+        self.missed:int = 0 # whole cycles lost (more than a period late)
+
+        # tasks, in priority order
+        self.names:list[str] = []
+        self.functions:list = []
+        self.priorities:list[int] = []
+        self.rates:list[float] = [] # as added (hz)
+        self.intervals:list[int] = [] # critical path cycles between runs
+        self.countdowns:list[int] = [] # cycles until due
+        self.expected_us:list[int] = [] # decaying maximum of run time
+        self.runs:list[int] = []
+        self.skips:list[int] = []
+        self.skipped:list[int] = [] # cycles skipped in a row
+        self.task_overruns:list[int] = []
+        self.max_us:list[int] = []
+        self.total_us:list[int] = []
+
+    def interval(self, hz:float) -> int:
+        """How many critical path cycles apart a task at hz runs (at least as often as hz, at most every cycle)."""
+        return max(1, int(1000000.0 / (hz * self.period_us)))
+
+    def actual_hz(self, hz:float) -> float:
+        """The rate a task added at hz actually runs at."""
+        return 1000000.0 / (self.interval(hz) * self.period_us)
+
+    def add(self, name:str, function, hz:float, priority:int) -> float:
+        """Adds a task, function() (no arguments), and returns the rate it will actually run at (see actual_hz())."""
+        interval:int = self.interval(hz)
+        i:int = 0
+        while i < len(self.priorities) and self.priorities[i] <= priority:
+            i += 1
+        self.names.insert(i, name)
+        self.functions.insert(i, function)
+        self.priorities.insert(i, priority)
+        self.rates.insert(i, hz)
+        self.intervals.insert(i, interval)
+        self.countdowns.insert(i, 1)
+        for stats in (self.expected_us, self.runs, self.skips, self.skipped, self.task_overruns, self.max_us, self.total_us):
+            stats.insert(i, 0)
+        return self.actual_hz(hz)
+
+    def wait(self) -> int:
+        """Waits for the next cycle's deadline (if paced, otherwise for the pacer) and returns the cycle's start (ticks_us)."""
+        if self.pacer is not None and not self.paced:
+            self.pacer()
+        now:int = time.ticks_us()
+        if self.deadline is None:
+            self.deadline = now
+        late:int = time.ticks_diff(now, self.deadline)
+        if not self.paced:
+            # the loop is paced elsewhere, so every cycle's deadline is a period after it started. Starts a little late are sensor jitter; over half a period late, the previous cycle overran.
+            if late > self.period_us >> 1:
+                self.overruns += 1
+                self.missed += late // self.period_us
+            self.deadline = now
+        elif late < 0:
+            time.sleep_us(-late)
+            now = self.deadline
+        elif late > 0 and self.cycles > 0:
+            self.overruns += 1
+            if late > self.period_us:
+                self.missed += late // self.period_us
+                self.deadline = now # restart the schedule rather than bursting to catch up
+        self.cycle_start_us = now
+        self.deadline = time.ticks_add(self.deadline, self.period_us)
+        self.cycles += 1
+        return now
+
+    def mark(self, start_us:int) -> int:
+        """
+        In place of wait(), when something else runs the critical path (e.g. a timer interrupt, see controltimer.py): starts the cycle it started at start_us (ticks_us), so the tasks get what is left of the period from then.
+        A cycle that starts over half a period after the last one's deadline means the tasks fell behind the critical path, and counts as an overrun.
+        """
+        if self.deadline is not None:
+            late:int = time.ticks_diff(start_us, self.deadline)
+            if late > self.period_us >> 1:
+                self.overruns += 1
+                self.missed += (late + (self.period_us >> 1)) // self.period_us
+        self.cycle_start_us = start_us
+        self.deadline = time.ticks_add(start_us, self.period_us)
+        self.cycles += 1
+        return start_us
+
+    def set_period(self, period_us:int) -> None:
+        """Changes the critical path's period (between two cycles). Every task keeps its rate as closely as the new period allows (see actual_hz())."""
+        self.period_us = period_us
+        for i in range(len(self.functions)):
+            self.intervals[i] = self.interval(self.rates[i])
+            if self.countdowns[i] > self.intervals[i]:
+                self.countdowns[i] = self.intervals[i]
+        if self.deadline is not None:
+            self.deadline = time.ticks_add(self.cycle_start_us, period_us)
+
+    def slack_us(self) -> int:
+        """Microseconds left until this cycle's deadline (negative if it has passed)."""
+        return time.ticks_diff(self.deadline, time.ticks_us())
+
+    def run_tasks(self) -> None:
+        """Runs the tasks that are due, in priority order, within what is left of the cycle. Call once per cycle, after the critical path."""
+        countdowns:list = self.countdowns
+        now:int = None # ticks_us, read only once a task is due, and then carried from one task's end to the next one's start
+        for i in range(len(countdowns)):
+            c:int = countdowns[i] - 1
+            if c > 0:
+                countdowns[i] = c
+                continue
+            if now is None:
+                now = time.ticks_us()
+                left:int = time.ticks_diff(self.deadline, now) # until the deadline, kept up to date from each task's run time (rather than read from the clock again)
+                expected_us:list = self.expected_us
+                runs:list = self.runs
+                total_us:list = self.total_us
+            expected:int = expected_us[i]
+            if self.priorities[i] > 0:
+                if self.skipped[i] < self.intervals[i] and expected > left - self.margin_us:
+                    # doesn't fit: skip it this cycle (it stays due), and expect a little less of it next time
+                    countdowns[i] = 1
+                    self.skips[i] += 1
+                    self.skipped[i] += 1
+                    expected_us[i] = expected - (expected >> 4)
+                    continue
+                self.skipped[i] = 0
+            self.functions[i]()
+            ended:int = time.ticks_us()
+            took:int = time.ticks_diff(ended, now)
+            now = ended
+            left -= took
+            countdowns[i] = self.intervals[i]
+            runs[i] += 1
+            total_us[i] += took
+            if took > expected:
+                expected_us[i] = took
+                if took > self.max_us[i]:
+                    self.max_us[i] = took
+            else:
+                expected_us[i] = expected - ((expected - took) >> 4)
+            if left < 0:
+                self.task_overruns[i] += 1
+
+    def report(self) -> str:
+        """A summary of the critical path and every task: rate, runs, skips, overruns and run times."""
+        lines:list[str] = []
+        lines.append("Critical path: " + str(self.cycles) + " cycles @ " + str(round(1000000.0 / self.period_us, 1)) + " hz, " + str(self.overruns) + " late, " + str(self.missed) + " missed")
+        for i in range(len(self.names)):
+            mean:float = self.total_us[i] / self.runs[i] if self.runs[i] > 0 else 0.0
+            lines.append("Task '" + self.names[i] + "' (priority " + str(self.priorities[i]) + ", " + str(round(1000000.0 / (self.intervals[i] * self.period_us), 1)) + " hz): " + str(self.runs[i]) + " runs, " + str(self.skips[i]) + " skipped, " + str(self.task_overruns[i]) + " overruns, mean " + str(int(mean)) + " us, max " + str(self.max_us[i]) + " us")
+        return "\n".join(lines)
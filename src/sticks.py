@@ -0,0 +1,87 @@
+import array
+import toolkit
+import emit
+import micropython
+
+# a command is [throttle (0.0 to 1.0), roll, pitch, yaw (setpoints, see StickMap), mode switch (channel 5: 1000 = standby, 2000 = flight)]
+COMMAND_SIZE:int = 5
+
+# the iBUS channel (index into ibus.IBus.read()'s list) of every command entry: throttle, roll, pitch, yaw, mode switch
+CHANNELS:tuple = (3, 1, 2, 4, 5)
+
+@micropython.native
+def _process(tables, points, channels, scale, rc_data, command):
+    """Looks up all four sticks in their tables (one table of `points` entries after another) with linear interpolation, and copies the mode switch."""
+    last = points - 1
+    base = 0
+    for k in range(4):
+        x = (rc_data[channels[k]] - 1000) * scale
+        if x <= 0.0:
+            v = tables[base]
+        elif x >= last:
+            v = tables[base + last]
+        else:
+            i = int(x)
+            lo = tables[base + i]
+            v = lo + ((x - i) * (tables[base + i + 1] - lo))
+        command[k] = v
+        base = base + points
+    command[4] = rc_data[channels[4]]
+
+class StickMap:
+    """
+    Turns the RC receiver's raw channels (1000 to 2000) straight into a command: throttle from 0.0 to 1.0, and the roll, pitch and yaw setpoints.
+    Every stick's response (dead zone, expo, its max rate) is worked out once, into a table of evenly spaced points across the stick's travel. process() only looks the four sticks up, interpolating between the nearest two points, in one native-emitter call.
+    """
+
+    def __init__(self, max_roll:float, max_pitch:float, max_yaw:float, dead_zone:float = 0.0, expo_roll:float = 0.0, expo_pitch:float = 0.0, expo_yaw:float = 0.0, points:int = 65) -> None:
+        """
+        :param max_roll: the roll setpoint at full stick (e.g. degrees per second, or degrees in angle mode).
+        :param max_pitch: the pitch setpoint at full stick. Stick forward (nose down) is negative.
+        :param max_yaw: the yaw setpoint at full stick.
+        :param dead_zone: fraction (0.0 to 1.0) of each half of the roll, pitch and yaw sticks' travel, around center, that commands 0.
+        :param expo_roll: how much softer the stick is around center (toolkit.NonlinearTransformer's nonlinearity strength): 0.0 = linear, 1.5-2.5 = noticeably softer.
+        :param expo_pitch: the same for pitch.
+        :param expo_yaw: the same for yaw.
+        :param points: table points per stick, spread evenly from 1000 to 2000. More points follow a strong expo curve more closely.
+        """
+        self.points:int = points
+        self.tables = array.array("f", [0.0] * (4 * points))
+        self._channels = array.array("b", CHANNELS)
+        self._scale:float = (points - 1) / 1000.0
+        self._fill(0, 1.0, 1.0, 0.0, 0.0, False) # throttle: linear, 0.0 at the bottom
+        self._fill(1, max_roll, max_roll, dead_zone, expo_roll, True)
+        self._fill(2, -max_pitch, max_pitch, dead_zone, expo_pitch, True) # stick forward (2000) = nose down = negative pitch
+        self._fill(3, max_yaw, max_yaw, dead_zone, expo_yaw, True)
+
+    def _fill(self, k:int, at_full:float, limit:float, dead_zone:float, expo:float, centered:bool) -> None:
+        """
+        Fills stick k's table.
+        :param at_full: the value at 2000.
+        :param limit: the largest magnitude the table holds (the value at 2000, without its sign).
+        :param centered: True for a stick centered at 1500 (-at_full at 1000, at_full at 2000), False for 0.0 at 1000.
+        """
+        curve:toolkit.NonlinearTransformer = toolkit.NonlinearTransformer(expo, dead_zone) if expo > 0.0 else None
+        for i in range(self.points):
+            x:float = i / (self.points - 1) # 0.0 to 1.0 across the stick's travel
+            if centered:
+                x = (2.0 * x) - 1.0
+                if curve is not None:
+                    x = curve.transform(x)
+                elif abs(x) <= dead_zone:
+                    x = 0.0
+                else:
+                    x = (abs(x) - dead_zone) / (1.0 - dead_zone) * (1.0 if x > 0.0 else -1.0)
+            self.tables[(k * self.points) + i] = max(-limit, min(limit, x * at_full))
+
+    def process(self, rc_data, command) -> None:
+        """Writes the command (see COMMAND_SIZE) for the receiver's latest channels (ibus.IBus.read()) into command. Channels outside 1000 to 2000 read as the nearest end."""
+        _process(self.tables, self.points, self._channels, self._scale, rc_data, command)
+
+    def lookup(self, k:int, value:float) -> float:
+        """What process() gives command entry k (0 to 3) for a raw channel value, e.g. to check the tables."""
+        rc_data:list = [0, 1500, 1500, 1000, 1500, 1000]
+        rc_data[CHANNELS[k]] = value
+        command:list[float] = [0.0] * COMMAND_SIZE
+        self.process(rc_data, command)
+        return command[k]
@@ -1,7 +1,14 @@
 import struct
-import sys
 import math
 import io
+import array
+import emit
+import micropython
+
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
 
 def float_to_bytes(f:float) -> bytes:
     b = struct.pack("f", f)
@@ -10,8 +17,42 @@ def float_to_bytes(f:float) -> bytes:
 def bytes_to_float(bs:bytes) -> float:
     return struct.unpack("f", bs)[0]
 
+class _Format:
+    """Stand-in for struct.Struct, which MicroPython does not have: the format string and its size, with the same pack_into/unpack_from methods."""
+
+    def __init__(self, format:str) -> None:
+        self.format:str = format
+        self.size:int = struct.calcsize(format)
+
+    def pack_into(self, buffer, offset:int, *values) -> None:
+        struct.pack_into(self.format, buffer, offset, *values)
+
+    def unpack_from(self, buffer, offset:int = 0) -> tuple:
+        return struct.unpack_from(self.format, buffer, offset)
+
+# precompiled where the platform can (CPython), otherwise the format string and size are at least only worked out once
+_Struct = getattr(struct, "Struct", _Format)
+
+# Encoded formats. Frame numbers and time stamps are big endian 4-byte integers, floats are little endian (what struct.pack("f") gives on the Pico and on x86/ARM computers).
+_FRAME_NUMBER = _Struct(">I")
+_CONTROL_COMMAND_VALUES = _Struct("<5f") # throttle, roll, pitch, yaw, checksum
+_PID_COMMAND = _Struct("<B3f") # axis, kp, ki, kd
+_TELEMETRY_VALUES = _Struct("<8f") # accel x/y/z, gyro x/y/z, pitch angle, roll angle
+
 class ControlCommand:
 
+    __slots__ = ("frame", "throttle", "roll", "pitch", "yaw", "checksum")
+
+    # Encoded format (in bytes)
+    # frame:int (4 bytes)
+    # throttle:float (4 bytes)
+    # roll:float (4 bytes)
+    # pitch:float (4 bytes)
+    # yaw:float (4 bytes)
+    # checksum:float (4 bytes)
+    # total bytes: 24
+    SIZE:int = 24
+
     def __init__(self) -> None:
 
         # variables
@@ -42,57 +83,30 @@ class ControlCommand:
         diff:float = abs(self.checksum - self.calculate_checksum())
         return diff < tolerance
 
-    def encode(self) -> bytes:
-
-        # Encoded format (in bytes)
-        # frame:int (4 bytes)
-        # throttle:float (4 bytes)
-        # roll:float (4 bytes)
-        # pitch:float (4 bytes)
-        # yaw:float (4 bytes)
-        # checksum:float (4 bytes)
-        # total bytes: 24
-
-        ToReturn:bytearray = bytearray()
-        
-        # frame (int to 4 bytes)
-        # we have to do it differetnly by platform because micropython on the raspberry pi handles it differently
-        if sys.platform == "rp2":
-            frame_bytes = self.frame.to_bytes(4, 0)
-        else:
-            frame_bytes = self.frame.to_bytes(4, byteorder='big')
-        for b in frame_bytes:
-            ToReturn.append(b)
-
-        # throttle, roll, pitch
-        ToReturn.extend(float_to_bytes(self.throttle))
-        ToReturn.extend(float_to_bytes(self.roll))
-        ToReturn.extend(float_to_bytes(self.pitch))
-        ToReturn.extend(float_to_bytes(self.yaw))
+    def pack_into(self, buffer, offset:int = 0) -> None:
+        """Encodes the command (with a freshly calculated checksum) into SIZE bytes of buffer, starting at offset."""
+        _FRAME_NUMBER.pack_into(buffer, offset, self.frame)
+        _CONTROL_COMMAND_VALUES.pack_into(buffer, offset + 4, self.throttle, self.roll, self.pitch, self.yaw, self.calculate_checksum())
 
-        # check sum
-        ToReturn.extend(float_to_bytes(self.calculate_checksum()))
+    def unpack_from(self, buffer, offset:int = 0) -> None:
+        """Decodes the command from SIZE bytes of buffer, starting at offset."""
+        self.frame = _FRAME_NUMBER.unpack_from(buffer, offset)[0]
+        self.throttle, self.roll, self.pitch, self.yaw, self.checksum = _CONTROL_COMMAND_VALUES.unpack_from(buffer, offset + 4)
 
+    def encode(self) -> bytes:
+        ToReturn:bytearray = bytearray(ControlCommand.SIZE)
+        self.pack_into(ToReturn, 0)
         return bytes(ToReturn)
 
     def decode(self, bs:bytes) -> None:
+        self.unpack_from(bs, 0)
 
-        # frame
-        if sys.platform == "rp2":
-            self.frame = int.from_bytes(bs[0:4], 0)
-        else:
-            self.frame = int.from_bytes(bs[:4], byteorder='big')
-
-        # roll and pitch
-        self.throttle = bytes_to_float(bs[4:8])
-        self.roll = bytes_to_float(bs[8:12])
-        self.pitch = bytes_to_float(bs[12:16])
-        self.yaw = bytes_to_float(bs[16:20])
+class PIDCommand:
 
-        # check sunm
-        self.checksum = bytes_to_float(bs[20:24])
+    __slots__ = ("axis", "kp", "ki", "kd")
 
-class PIDCommand:
+    # Encoded format: axis (1 byte), kp, ki, kd (4 byte floats). 13 bytes.
+    SIZE:int = 13
 
     def __init__(self) -> None:
         
@@ -101,22 +115,29 @@ class PIDCommand:
         self.ki:float = 0.0
         self.kd:float = 0.0
 
+    def pack_into(self, buffer, offset:int = 0) -> None:
+        """Encodes the command into SIZE bytes of buffer, starting at offset."""
+        _PID_COMMAND.pack_into(buffer, offset, self.axis, self.kp, self.ki, self.kd)
+
+    def unpack_from(self, buffer, offset:int = 0) -> None:
+        """Decodes the command from SIZE bytes of buffer, starting at offset."""
+        self.axis, self.kp, self.ki, self.kd = _PID_COMMAND.unpack_from(buffer, offset)
+
     def encode(self) -> bytes:
-        ToReturn = bytearray()
-        ToReturn.append(self.axis)
-        ToReturn.extend(float_to_bytes(self.kp))
-        ToReturn.extend(float_to_bytes(self.ki))
-        ToReturn.extend(float_to_bytes(self.kd))
+        ToReturn:bytearray = bytearray(PIDCommand.SIZE)
+        self.pack_into(ToReturn, 0)
         return bytes(ToReturn)
     
     def decode(self, bs:bytes) -> None:
-        self.axis = bs[0]
-        self.kp = bytes_to_float(bs[1:5])
-        self.ki = bytes_to_float(bs[5:9])
-        self.kd = bytes_to_float(bs[9:13])
+        self.unpack_from(bs, 0)
 
 class TelemetryFrame:
 
+    __slots__ = ("time", "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z", "pitch_angle", "roll_angle")
+
+    # Encoded format: time (4 byte integer), then accel x/y/z, gyro x/y/z, pitch angle and roll angle (4 byte floats). 36 bytes.
+    SIZE:int = 36
+
     def __init__(self) -> None:
 
         self.time:int = 0 # the time stamp (ticks), in milliseconds
@@ -133,53 +154,42 @@ class TelemetryFrame:
         self.pitch_angle:float = 0.0
         self.roll_angle:float = 0.0
 
-
+    def fill(self, time_ms:int, imu_data, angles) -> None:
+        """
+        Sets the frame from one reading and its attitude estimate.
+        :param imu_data: an MPU6050's data ([accel x, y, z, temperature, gyro x, y, z]).
+        :param angles: an attitude.AttitudeEstimator's angles ([roll, pitch, yaw], degrees).
+        """
+        self.time = time_ms
+        self.accel_x = imu_data[0]
+        self.accel_y = imu_data[1]
+        self.accel_z = imu_data[2]
+        self.gyro_x = imu_data[4]
+        self.gyro_y = imu_data[5]
+        self.gyro_z = imu_data[6]
+        self.roll_angle = angles[0]
+        self.pitch_angle = angles[1]
+
+    def pack_into(self, buffer, offset:int = 0) -> None:
+        """Encodes the frame into SIZE bytes of buffer, starting at offset."""
+        _FRAME_NUMBER.pack_into(buffer, offset, self.time)
+        _TELEMETRY_VALUES.pack_into(buffer, offset + 4, self.accel_x, self.accel_y, self.accel_z, self.gyro_x, self.gyro_y, self.gyro_z, self.pitch_angle, self.roll_angle)
+
+    def unpack_from(self, buffer, offset:int = 0) -> None:
+        """Decodes the frame from SIZE bytes of buffer, starting at offset."""
+        self.time = _FRAME_NUMBER.unpack_from(buffer, offset)[0]
+        self.accel_x, self.accel_y, self.accel_z, self.gyro_x, self.gyro_y, self.gyro_z, self.pitch_angle, self.roll_angle = _TELEMETRY_VALUES.unpack_from(buffer, offset + 4)
 
     def encode(self) -> bytes:
-
-        ToReturn:bytearray = bytearray()
-
-        # add the time (int)
-        if sys.platform == "rp2":
-            for b in self.time.to_bytes(4, 0):
-                ToReturn.append(b)
-        else:
-            for b in self.time.to_bytes(4, byteorder='big'):
-                ToReturn.append(b)
-
-        # add the readings
-        ToReturn.extend(float_to_bytes(self.accel_x))
-        ToReturn.extend(float_to_bytes(self.accel_y))
-        ToReturn.extend(float_to_bytes(self.accel_z))
-        ToReturn.extend(float_to_bytes(self.gyro_x))
-        ToReturn.extend(float_to_bytes(self.gyro_y))
-        ToReturn.extend(float_to_bytes(self.gyro_z))
-        ToReturn.extend(float_to_bytes(self.pitch_angle))
-        ToReturn.extend(float_to_bytes(self.roll_angle))
-
+        ToReturn:bytearray = bytearray(TelemetryFrame.SIZE)
+        self.pack_into(ToReturn, 0)
         return bytes(ToReturn)
     
-    def decode(self, data:bytes) -> bytes:
+    def decode(self, data:bytes) -> None:
 
-        if len(data) != len(self.encode()):
+        if len(data) != TelemetryFrame.SIZE:
             raise Exception("Unable to decode: the input data was not correct.")
-        
-
-        # time (first 4 bytes)
-        if sys.platform == "rp2":
-            self.time = int.from_bytes(data[0:4], 0)
-        else:
-            self.time = int.from_bytes(data[0:4], byteorder='big')
-
-        self.accel_x = bytes_to_float(data[4:8])
-        self.accel_y = bytes_to_float(data[8:12])
-        self.accel_z = bytes_to_float(data[12:16])
-        self.gyro_x = bytes_to_float(data[16:20])
-        self.gyro_y = bytes_to_float(data[20:24])
-        self.gyro_z = bytes_to_float(data[24:28])
-        self.pitch_angle = bytes_to_float(data[28:32])
-        self.roll_angle = bytes_to_float(data[32:36])
-        
+        self.unpack_from(data, 0)
 
     def save(self, opened_file:io.BufferedWriter = None) -> None:
         """Appends the frame, in bytes, to the 'telemetry' file in the root directory."""
@@ -193,37 +203,203 @@ class TelemetryFrame:
 
     
     @staticmethod
-    def encode_frames(frames:list["TelemetryFrame"]) -> bytes:
-        ToReturn:bytearray = bytearray()
+    def encode_frames(frames:list["TelemetryFrame"], buffer = None, offset:int = 0) -> bytes:
+        """
+        Encodes every frame, back to back.
+        :param buffer: if given, the frames are packed into it (starting at offset) and nothing is allocated. Otherwise, a new bytes object is returned.
+        """
+        if buffer is None:
+            ToReturn:bytearray = bytearray(len(frames) * TelemetryFrame.SIZE)
+            TelemetryFrame.encode_frames(frames, ToReturn, 0)
+            return bytes(ToReturn)
+        mv:memoryview = memoryview(buffer)
         for frame in frames:
-            for b in frame.encode():
-                ToReturn.append(b)
-        return bytes(ToReturn)
+            frame.pack_into(mv, offset)
+            offset = offset + TelemetryFrame.SIZE
+        return None
     
     @staticmethod
-    def decode_frames(data:bytes) -> list["TelemetryFrame"]:
-
-        frame_length:int = len(TelemetryFrame().encode()) # the length, in bytes, of a telemtry frame
-
-        begin:int = 0
-        end:int = frame_length
-
-        ToReturn:list[TelemetryFrame] = []
-        while end <= len(data):
-            tf = TelemetryFrame()
-            tf.decode(data[begin:end])
-            ToReturn.append(tf)
-            begin = begin + frame_length
-            end = end + frame_length
-
+    def decode_frames(data:bytes, frames:list["TelemetryFrame"] = None) -> list["TelemetryFrame"]:
+        """
+        Decodes every complete frame in data (a trailing partial frame is ignored).
+        :param frames: if given, these frame objects are reused (and more are appended as needed) instead of new ones being created.
+        """
+        mv:memoryview = memoryview(data)
+        count:int = len(mv) // TelemetryFrame.SIZE
+        ToReturn:list[TelemetryFrame] = frames if frames is not None else []
+        if len(ToReturn) > count:
+            del ToReturn[count:]
+        offset:int = 0
+        for i in range(count):
+            if i == len(ToReturn):
+                ToReturn.append(TelemetryFrame())
+            ToReturn[i].unpack_from(mv, offset)
+            offset = offset + TelemetryFrame.SIZE
         return ToReturn
 
 
 
 
     def add_float_bytes(self, ba:bytearray, f:float) -> None:
-        for b in struct.pack("f", f):
-            ba.append(b)
+        ba.extend(struct.pack("f", f))
+
+
+##### Telemetry file format v2 #####
+# The v1 "telemetry" file is TelemetryFrame records back to back. v2 is self-describing and much smaller:
+# - The file is a sequence of fixed-size blocks (block_size bytes, 512 by default). Block i starts at byte i * block_size, so the blocks' first time stamps are a seekable index.
+# - A header block starts every recording (every power cycle appends a new one): "SCTL", version, block size, header length, CRC32 of what follows, then the loop rate (float32),
+#   the field count and, for every field, its encoding mode, scale, name and unit. Zero padded to block_size.
+# - A data block: "SB", sequence number (u16), record count (u16), time of its first record (u32, ticks_us), payload length (u16), CRC32 of the payload (u32), then the payload, zero padded.
+# - The payload is records back to back. A record is one varint per column: the time (us) and then every field, as an integer (value * scale, rounded).
+#   A DELTA column stores the (zigzag encoded) difference from the previous record, an ABSOLUTE column the zigzag encoded value. The first record of a block is relative to 0, so every block decodes on its own.
+# All integers are little endian. tools/telemetry.py decodes v2 (and v1) files on a computer.
+TELEMETRY_MAGIC:bytes = b"SCTL"
+TELEMETRY_VERSION:int = 2
+TELEMETRY_BLOCK_MAGIC:bytes = b"SB"
+TELEMETRY_BLOCK_HEADER:str = "<2sHHIHI" # magic, sequence, records, first time (us), payload length, payload CRC32
+TELEMETRY_BLOCK_HEADER_SIZE:int = 16
+ABSOLUTE:int = 0
+DELTA:int = 1
+
+def telemetry_fields(motors:int = 4) -> list:
+    """The default v2 telemetry fields: (name, unit, scale, mode). Scale is the integer steps per unit that are stored (100 = 0.01 resolution)."""
+    ToReturn:list = []
+    for axis in ("x", "y", "z"):
+        ToReturn.append(("accel_" + axis, "g", 1000.0, DELTA))
+    for axis in ("x", "y", "z"):
+        ToReturn.append(("gyro_" + axis, "deg/s", 100.0, DELTA))
+    ToReturn.append(("pitch_angle", "deg", 100.0, DELTA))
+    ToReturn.append(("roll_angle", "deg", 100.0, DELTA))
+    for m in range(motors):
+        ToReturn.append(("motor" + str(m + 1), "us", 1.0, DELTA))
+    return ToReturn
+
+def _crc32(data) -> int:
+    if crc32 is not None:
+        return crc32(data) & 0xFFFFFFFF
+    # bitwise fallback, for MicroPython builds without binascii.crc32
+    crc:int = 0xFFFFFFFF
+    for b in data:
+        crc = crc ^ b
+        for k in range(8):
+            crc = (crc >> 1) ^ (0xEDB88320 & -(crc & 1))
+    return crc ^ 0xFFFFFFFF
+
+@micropython.native
+def _put_varint(buf, pos, v):
+    """Writes the zigzag varint of v at pos and returns the position after it."""
+    if v < 0:
+        u = ((0 - v) << 1) - 1
+    else:
+        u = v << 1
+    while u >= 0x80:
+        buf[pos] = (u & 0x7F) | 0x80
+        u = u >> 7
+        pos += 1
+    buf[pos] = u
+    return pos + 1
+
+class TelemetryWriter:
+    """
+    Writes telemetry in the v2 format (see above): add() encodes one record into a preallocated block, and a full block is written to flash in one go.
+    """
+
+    def __init__(self, fields:list, loop_hz:float, path:str = "telemetry2", block_size:int = 512) -> None:
+        """
+        :param fields: (name, unit, scale, mode) of every field, e.g. telemetry_fields().
+        :param loop_hz: the rate records are added at (recorded in the header).
+        :param path: the file the blocks are appended to.
+        :param block_size: bytes per block.
+        """
+        self.fields:list = fields
+        self.loop_hz:float = loop_hz
+        self.path:str = path
+        self.block_size:int = block_size
+        self._n:int = len(fields)
+        self._scales = array.array("f", [f[2] for f in fields])
+        self._modes = array.array("b", [f[3] for f in fields])
+        self._prev = array.array("i", [0] * self._n) # last stored integer of every field, in this block
+        self._prev_time:int = 0
+        self._block:bytearray = bytearray(block_size)
+        self._mv:memoryview = memoryview(self._block)
+        self._pos:int = TELEMETRY_BLOCK_HEADER_SIZE
+        self._max_record:int = 5 * (self._n + 1) # a 32-bit zigzag varint is at most 5 bytes
+        self._first_time:int = 0
+        self.records:int = 0 # in the current block
+        self.sequence:int = 0
+        self.bytes_written:int = 0
+        self._file = None
+        if block_size < TELEMETRY_BLOCK_HEADER_SIZE + self._max_record or len(self.header()) > block_size:
+            raise ValueError("A block of " + str(block_size) + " bytes is too small for " + str(self._n) + " fields.")
+
+    def header(self) -> bytes:
+        """The header block's contents (before padding)."""
+        content:bytearray = bytearray(struct.pack("<fB", self.loop_hz, self._n))
+        for name, unit, scale, mode in self.fields:
+            content.extend(struct.pack("<Bf", mode, scale))
+            for text in (name, unit):
+                t:bytes = text.encode()
+                content.append(len(t))
+                content.extend(t)
+        return TELEMETRY_MAGIC + struct.pack("<BHHI", TELEMETRY_VERSION, self.block_size, 13 + len(content), _crc32(content)) + bytes(content)
+
+    def add(self, time_us:int, values) -> None:
+        """Encodes one record. values holds every field's value, in field order."""
+        if self.records == 0:
+            self._first_time = time_us
+            self._prev_time = 0
+            for i in range(self._n):
+                self._prev[i] = 0
+            delta_t:int = time_us
+        else:
+            delta_t:int = ((time_us - self._prev_time + 0x20000000) & 0x3FFFFFFF) - 0x20000000 # ticks_diff (ticks wrap at 2^30)
+        self._prev_time = time_us
+        self._pos = _put_varint(self._block, self._pos, delta_t)
+        self._pos = self._encode_values(values)
+        self.records = self.records + 1
+        if self._pos + self._max_record > self.block_size:
+            self.flush()
+
+    def _encode_values(self, values) -> int:
+        pos:int = self._pos
+        buf = self._block
+        scales = self._scales
+        modes = self._modes
+        prev = self._prev
+        for i in range(self._n):
+            v:float = values[i] * scales[i]
+            q:int = int(v + 0.5) if v >= 0 else int(v - 0.5)
+            if modes[i] == DELTA:
+                pos = _put_varint(buf, pos, q - prev[i])
+                prev[i] = q
+            else:
+                pos = _put_varint(buf, pos, q)
+        return pos
+
+    def flush(self) -> None:
+        """Writes the current block (if it has any records) to the file."""
+        if self.records == 0:
+            return
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            h:bytes = self.header()
+            self._file.write(h + bytes(self.block_size - len(h)))
+        length:int = self._pos - TELEMETRY_BLOCK_HEADER_SIZE
+        for i in range(self._pos, self.block_size): # zero padding
+            self._block[i] = 0
+        struct.pack_into(TELEMETRY_BLOCK_HEADER, self._block, 0, TELEMETRY_BLOCK_MAGIC, self.sequence, self.records, self._first_time & 0xFFFFFFFF, length, _crc32(self._mv[TELEMETRY_BLOCK_HEADER_SIZE:self._pos]))
+        self._file.write(self._block)
+        self._file.flush()
+        self.bytes_written = self.bytes_written + self.block_size
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.records = 0
+        self._pos = TELEMETRY_BLOCK_HEADER_SIZE
+
+    def close(self) -> None:
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
 
 class NonlinearTransformer:
@@ -0,0 +1,4 @@
+"""
+Host-side tools for the Scout Flight Controller: reading and analyzing the data Scout records, on a regular computer.
+Unlike the firmware in src/, these need regular Python 3 and NumPy.
+"""
@@ -0,0 +1,376 @@
+"""
+Allocation and cost regression suite for the code that runs every cycle: a flight mode iteration of main.run()'s loop (run unmodified in the simulator), ibus.IBus.read() on the simulated receiver, and the toolkit codecs.
+Every iteration is measured opcode by opcode while firmware code (the modules in src/) runs, and nothing is counted while the simulated hardware runs (on the Pico, that is the C of the MicroPython port):
+- bytes: allocated by the firmware code (tracemalloc), per iteration, and max_bytes, the most in one iteration. CPython recycles small tuples and floats through free lists it does not report to tracemalloc, so it sees less than MicroPython would (every float result is a heap object there). It also boxes every int above 256 where MicroPython boxes none below 2^30: instructions that allocated one or two ints are left out (see INT_SIZES).
+- opcodes: bytecode instructions executed, per iteration (the cost).
+- allocating: of those, the instructions that always allocate on MicroPython (building tuples, lists, dicts, strings and slices, formatting, making functions, calls with *args).
+With --micropython, the same components (the control path in place of the whole loop, which needs the simulator) also run on the MicroPython unix port (bench/alloc_bench.py), which counts exactly what its heap allocates.
+The results are compared to a stored baseline (tools/allocations_baseline.json, one section per interpreter and version, as the instruction counts and CPython's allocations differ from one version to the next; it ships sections for CPython 3.9 to 3.13). Exits with status 1 if any of them rose above it (plus --bytes-tolerance, or --tolerance for the instruction counts), so a change that adds an allocation or cost to the hot path fails the build.
+An interpreter the baseline has no section for is skipped (exit status 0, with a message saying so), rather than failed. To regenerate the baseline, after a deliberate change or for another interpreter, run `python -m tools.allocations --update` with each interpreter to store (and `--micropython micropython` for the MicroPython section). It only replaces the sections it measured.
+
+Usage:
+    python -m tools.allocations
+    python -m tools.allocations --micropython micropython
+    python -m tools.allocations --update
+"""
+
+import argparse
+import array
+import dis
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+import sitl
+from sitl.board import Board
+from sitl.clock import SimClock
+from sitl.harness import Firmware, SRC_DIR
+
+BASELINE_PATH:str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "allocations_baseline.json")
+BENCH_PATH:str = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench", "alloc_bench.py"))
+METRICS:tuple = ("bytes", "max_bytes", "opcodes", "allocating")
+
+# instructions that allocate on MicroPython whatever their operands (those that exist in this Python version)
+ALLOCATING_OPCODES:tuple = tuple(sorted(dis.opmap[name] for name in ("BUILD_TUPLE", "BUILD_LIST", "BUILD_SET", "BUILD_MAP", "BUILD_CONST_KEY_MAP", "BUILD_STRING", "BUILD_SLICE", "BINARY_SLICE", "FORMAT_VALUE", "FORMAT_SIMPLE", "FORMAT_WITH_SPEC", "MAKE_FUNCTION", "CALL_FUNCTION_EX", "LIST_APPEND", "LIST_EXTEND", "SET_ADD", "SET_UPDATE", "MAP_ADD", "DICT_UPDATE", "DICT_MERGE") if name in dis.opmap))
+
+# an instruction that allocated exactly this much (tracemalloc counts the requested sizes) made one or two int objects of 1 or 2 digits (below 2^60). CPython boxes every int above 256, MicroPython none below 2^30, so these are counted apart (ints), not as bytes
+INT_SIZES:tuple = (28, 32, 56, 60, 64)
+
+
+class Meter:
+    """
+    Counts what firmware code does, one iteration at a time: the bytes it allocates (tracemalloc's peak, reset at every instruction) and the instructions it executes.
+    Firmware frames are traced opcode by opcode. Everything else (the simulated hardware, this tool) is not: from the moment firmware calls out until it executes its next instruction, nothing is counted.
+    The tracing functions hold their state in preallocated arrays, so the tracing itself adds nothing to the counts.
+    """
+
+    def __init__(self, src_dir:str = SRC_DIR) -> None:
+        self.src_dir:str = os.path.normpath(src_dir) + os.sep
+        self.samples:list = [] # (bytes, opcodes, allocating, ints left out) of every iteration closed so far
+        self.running:bool = False
+        state = array.array("q", [0, 0, 1, 0]) # [bytes counted, traced memory after the last instruction, 1 = outside firmware, ints boxed]
+        ops = array.array("q", [0] * 256) # instructions executed, by opcode
+        code:dict = {} # firmware code object -> its bytecode
+        self._state = state
+        self._ops = ops
+        traced = tracemalloc.get_traced_memory
+        reset_peak = tracemalloc.reset_peak
+        src:str = self.src_dir
+
+        def opcode(frame, event, arg, state = state, ops = ops, code = code, traced = traced, reset_peak = reset_peak, src = src):
+            used, peak = traced() # first: the tracer's own ints (e.g. the counts) would show up in the peak
+            if event == "opcode":
+                ops[code[frame.f_code][frame.f_lasti]] += 1
+                if state[2]: # back from outside firmware: count from here on
+                    state[2] = 0
+                elif peak > state[1]:
+                    if peak - state[1] in INT_SIZES:
+                        state[3] += 1
+                    else:
+                        state[0] += peak - state[1]
+                state[1] = used
+                del used, peak
+                reset_peak()
+            elif event == "return":
+                if not state[2] and peak > state[1]:
+                    if peak - state[1] in INT_SIZES:
+                        state[3] += 1
+                    else:
+                        state[0] += peak - state[1]
+                state[1] = used
+                del used, peak
+                caller = frame.f_back
+                if caller is None or not caller.f_code.co_filename.startswith(src): # returning out of firmware
+                    state[2] = 1
+                del caller
+                reset_peak()
+            else:
+                del used, peak
+            return opcode
+
+        def call(frame, event, arg, state = state, code = code, src = src):
+            state[2] = 1 # from the call on (including the frame object tracing makes for the callee), nothing is counted until firmware runs its next instruction
+            if not frame.f_code.co_filename.startswith(src):
+                return None
+            if frame.f_code not in code:
+                code[frame.f_code] = frame.f_code.co_code
+            frame.f_trace_opcodes = True
+            frame.f_trace_lines = False
+            return opcode
+
+        self._opcode = opcode
+        self._call = call
+        self._code:dict = code
+
+    def start(self, frame = None) -> None:
+        """Starts tracing. Firmware frames already running (from frame up the stack) are traced too, from their next instruction."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        while frame is not None:
+            if frame.f_code.co_filename.startswith(self.src_dir):
+                self._code[frame.f_code] = frame.f_code.co_code
+                frame.f_trace = self._opcode
+                frame.f_trace_opcodes = True
+                frame.f_trace_lines = False
+            frame = frame.f_back
+        self._state[2] = 1
+        self.close(False)
+        self.running = True
+        sys.settrace(self._call)
+
+    def stop(self) -> None:
+        sys.settrace(None)
+        self.running = False
+        tracemalloc.stop()
+
+    def close(self, keep:bool = True) -> None:
+        """Ends an iteration (from outside firmware code) and starts the next one. keep = False discards it."""
+        ops = self._ops
+        if keep:
+            self.samples.append((self._state[0], sum(ops), sum(ops[o] for o in ALLOCATING_OPCODES), self._state[3]))
+        self._state[0] = 0
+        self._state[3] = 0
+        for i in range(len(ops)):
+            ops[i] = 0
+
+    def result(self) -> dict:
+        """The mean (and for bytes, the largest) of every metric over the iterations kept."""
+        n:int = max(1, len(self.samples))
+        return {"iterations": len(self.samples), "bytes": sum(s[0] for s in self.samples) / n, "max_bytes": max([s[0] for s in self.samples] + [0]), "opcodes": sum(s[1] for s in self.samples) / n, "allocating": sum(s[2] for s in self.samples) / n, "ints": sum(s[3] for s in self.samples) / n}
+
+
+##### cases #####
+
+def measure_loop(overrides:dict, warmup:int = 300, iterations:int = 200) -> dict:
+    """
+    Flight mode iterations of main.run()'s loop: the simulator's default flight (armed 0.25 s into the loop, throttle up 0.25 s later), measured after warmup cycles, from one IMU read to the next.
+    The first iteration traced is left out: the first opcode CPython traces in a function copies its bytecode (17 KB for main.run()), which would count as an allocation of the loop.
+    """
+    sim:sitl.Simulation = sitl.Simulation(max_cycles = warmup + iterations + 3, clock_mode = "lockstep", overrides = dict(overrides, profiler_enabled = False))
+    meter:Meter = Meter()
+    cycles:list = [0]
+
+    def sampled(meter = meter, cycles = cycles, board = sim.board) -> None:
+        if board.loop_started_at_us is None:
+            return
+        cycles[0] = cycles[0] + 1
+        if cycles[0] == warmup:
+            meter.start(sys._getframe(1))
+        elif meter.running:
+            meter.close(cycles[0] > warmup + 1)
+            if len(meter.samples) == iterations:
+                meter.stop()
+    sim.board.imu.on_data_read.append(sampled)
+    try:
+        result = sim.run()
+    finally:
+        if meter.running:
+            meter.stop()
+    if result.fatal is not None:
+        raise Exception("The flight controller failed: " + result.fatal.strip())
+    return meter.result()
+
+def measure_calls(iterations:int, setup) -> dict:
+    """Iterations of one call, under the simulated hardware. setup(board) loads the firmware modules it needs and returns (call, between): call() is measured, between() (or None) runs before every call, unmeasured."""
+    with tempfile.TemporaryDirectory(prefix = "scout_alloc_") as fs_root:
+        return _measure_calls(iterations, setup, Board(SimClock("lockstep"), fs_root, channels = _moving_sticks))
+
+def _measure_calls(iterations:int, setup, board:Board) -> dict:
+    meter:Meter = Meter()
+    with Firmware(board):
+        call, between = setup(board)
+        for i in range(10): # first calls (caches, lazily created buffers) are not what the flight loop sees
+            if between is not None:
+                between()
+            call()
+        meter.start()
+        try:
+            for i in range(iterations):
+                if between is not None:
+                    between()
+                call()
+                meter.close()
+        finally:
+            meter.stop()
+    return meter.result()
+
+def _moving_sticks(t:float) -> list:
+    ToReturn:list = [1500] * 14
+    ToReturn[0] = int(1500 + 300 * math.sin(t * 2.1))
+    ToReturn[1] = int(1500 + 300 * math.sin(t * 1.7))
+    ToReturn[2] = 1400
+    ToReturn[4] = 2000
+    return ToReturn
+
+def _ibus_read(board:Board) -> tuple:
+    import ibus
+    rc = ibus.IBus(1)
+    def between(clock = board.clock) -> None:
+        clock.advance(4000.0) # a 250 hz cycle's worth of bytes arrives between reads (a frame every 7 ms)
+    return (rc.read, between)
+
+def _codec(name:str):
+    def setup(board:Board) -> tuple:
+        import toolkit
+        buf:bytearray = bytearray(64)
+        if name == "control":
+            c = toolkit.ControlCommand()
+            c.frame, c.throttle, c.roll, c.pitch, c.yaw = 1234567, 0.5, -0.25, 0.125, 0.75
+            d = toolkit.ControlCommand()
+            def call() -> None:
+                c.pack_into(buf, 0)
+                d.unpack_from(buf, 0)
+        elif name == "pid":
+            c = toolkit.PIDCommand()
+            c.axis, c.kp, c.ki, c.kd = 1, 0.00043714285, 0.00255, 0.00002571429
+            d = toolkit.PIDCommand()
+            def call() -> None:
+                c.pack_into(buf, 0)
+                d.unpack_from(buf, 0)
+        else:
+            c = toolkit.TelemetryFrame()
+            d = toolkit.TelemetryFrame()
+            imu_data = [0.01, -0.02, 0.98, 25.0, 1.5, -2.5, 0.25]
+            angles = [1.25, -0.5, 0.0]
+            def call() -> None:
+                c.fill(1234567, imu_data, angles)
+                c.pack_into(buf, 0)
+                d.unpack_from(buf, 0)
+        return (call, None)
+    return setup
+
+def _telemetry_writer(board:Board) -> tuple:
+    import toolkit
+    writer = toolkit.TelemetryWriter(toolkit.telemetry_fields(4), 250.0, "telemetry2")
+    values:list = [0.01, -0.02, 0.98, 1.5, -2.5, 0.25, 1.25, -0.5, 1200.0, 1210.0, 1190.0, 1205.0]
+    t:list = [0]
+    def call(writer = writer, values = values, t = t) -> None:
+        t[0] = t[0] + 4000
+        writer.add(t[0], values)
+    return (call, None)
+
+# case name -> what it measures
+CASES:dict = {
+    "loop_rate": lambda: measure_loop({}),
+    "loop_angle": lambda: measure_loop({"angle_mode": True}),
+    "loop_fixed": lambda: measure_loop({"fixed_point_control": True}),
+    "ibus_read": lambda: measure_calls(500, _ibus_read),
+    "codec_control": lambda: measure_calls(200, _codec("control")),
+    "codec_pid": lambda: measure_calls(200, _codec("pid")),
+    "codec_telemetry": lambda: measure_calls(200, _codec("telemetry")),
+    "telemetry_writer": lambda: measure_calls(500, _telemetry_writer),
+}
+
+
+##### the MicroPython unix port #####
+
+def run_micropython(binary:str) -> dict:
+    """Runs bench/alloc_bench.py on the MicroPython unix port and returns {case: {"bytes": per call}}."""
+    out:str = subprocess.run([binary, BENCH_PATH], capture_output = True, text = True, check = True).stdout
+    ToReturn:dict = {}
+    for line in out.splitlines():
+        m = re.match(r"^(\w+): ([0-9.]+) bytes per call", line)
+        if m is not None:
+            ToReturn[m.group(1)] = {"bytes": float(m.group(2))}
+    if len(ToReturn) == 0:
+        raise Exception(binary + " reported no allocation counts:\n" + out)
+    return ToReturn
+
+
+##### baseline #####
+
+def section_name() -> str:
+    """The baseline section for this interpreter: opcode counts differ from one CPython version to the next."""
+    return sys.implementation.name + "-" + str(sys.version_info[0]) + "." + str(sys.version_info[1])
+
+def compare(results:dict, baseline:dict, tolerance:float, bytes_tolerance:float) -> list:
+    """Every (case, metric, value, baseline) that rose above its baseline: the byte counts by more than bytes_tolerance bytes, the instruction counts by more than tolerance (a fraction, plus half an instruction)."""
+    ToReturn:list = []
+    for case, r in results.items():
+        if case not in baseline:
+            continue
+        for metric, value in r.items():
+            if metric not in METRICS or metric not in baseline[case]:
+                continue
+            if metric in ("bytes", "max_bytes"):
+                limit:float = baseline[case][metric] + bytes_tolerance
+            else:
+                limit:float = (baseline[case][metric] * (1.0 + tolerance)) + 0.5
+            if value > limit:
+                ToReturn.append((case, metric, value, baseline[case][metric]))
+    return ToReturn
+
+def format_results(title:str, results:dict, baseline:dict) -> str:
+    lines:list[str] = [title]
+    lines.append("case | " + " | ".join(m + " (baseline)" for m in METRICS))
+    for case, r in results.items():
+        cells:list[str] = []
+        for m in METRICS:
+            if m not in r:
+                cells.append("-")
+                continue
+            b = baseline.get(case, {}).get(m)
+            cells.append(str(round(r[m], 1)) + " (" + (str(round(b, 1)) if b is not None else "none") + ")")
+        lines.append(case + " | " + " | ".join(cells))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.allocations", description = "Measure the allocations and bytecode cost of Scout's per-cycle code, and fail if they rose above the stored baseline.")
+    parser.add_argument("--case", action = "append", default = [], choices = list(CASES), help = "run only this case (repeatable)")
+    parser.add_argument("--micropython", default = None, metavar = "BINARY", help = "also run bench/alloc_bench.py on the MicroPython unix port")
+    parser.add_argument("--tolerance", type = float, default = 0.02, help = "how far (fraction) opcodes and allocating may rise above their baseline")
+    parser.add_argument("--bytes-tolerance", type = float, default = 4.0, help = "how far (bytes) bytes and max_bytes may rise above their baseline")
+    parser.add_argument("--baseline", default = BASELINE_PATH)
+    parser.add_argument("--update", action = "store_true", help = "store the results as the new baseline instead of comparing")
+    args = parser.parse_args()
+
+    stored:dict = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            stored = json.load(f)
+
+    sections:dict = {}
+    sections[section_name()] = {name: CASES[name]() for name in (args.case if len(args.case) > 0 else CASES)}
+    if args.micropython is not None:
+        sections["micropython"] = run_micropython(args.micropython)
+
+    if args.update:
+        for name, results in sections.items():
+            stored.setdefault(name, {}).update({case: {m: round(v, 2) for m, v in r.items() if m in METRICS} for case, r in results.items()})
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent = 2, sort_keys = True)
+            f.write("\n")
+        for name, results in sections.items():
+            print(format_results(name + " (stored as the new baseline)", results, stored[name]))
+        return
+
+    failed:bool = False
+    compared:int = 0
+    for name, results in sections.items():
+        if name not in stored:
+            print("SKIP: " + args.baseline + " has no " + name + " section, so there is nothing to compare " + name + " with. Store one with: python -m tools.allocations --update" + (" --micropython " + args.micropython if name == "micropython" else ""))
+            continue
+        baseline:dict = stored[name]
+        compared = compared + 1
+        print(format_results(name, results, baseline))
+        missing:list[str] = [case for case in results if case not in baseline]
+        if len(missing) > 0:
+            failed = True
+            print("  FAIL: no baseline for " + ", ".join(missing) + " (run with --update to store one)")
+        for case, metric, value, base in compare(results, baseline, args.tolerance, args.bytes_tolerance):
+            failed = True
+            print("  FAIL: " + case + " " + metric + " rose to " + str(round(value, 1)) + " from " + str(round(base, 1)))
+    if failed:
+        print("FAIL")
+    elif compared > 0:
+        print("OK: nothing rose above the baseline")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
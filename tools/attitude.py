@@ -0,0 +1,172 @@
+"""
+Accuracy check of the onboard attitude estimator (src/attitude.py) against a double precision reference and the simulator's true attitude.
+Flies the flight controller closed loop on the simulator's physics model (sitl.physics.Multirotor) and records every IMU sample along with the model's true roll and pitch. Then both estimators are run over the same samples:
+- the firmware's AttitudeEstimator, exactly as the Pico runs it (float32 state, the native-emitter code running as plain Python)
+- Reference, the same filter written independently in double precision with quaternion algebra, as the yardstick for the firmware's arithmetic
+and their errors against the true attitude, and against each other, are printed.
+Note that the model has air drag, so in steady flight the accelerometer measures the thrust (tilted against the drag) rather than gravity alone, just like a real multirotor's. This is why a higher P gain is not always more accurate.
+
+Usage:
+    python -m tools.attitude --cycles 5000
+    python -m tools.attitude --kp 2.0 --set angle_mode=true
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+
+ROOT_DIR:str = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+SRC_DIR:str = os.path.join(ROOT_DIR, "src")
+for d in (ROOT_DIR, SRC_DIR):
+    if d not in sys.path:
+        sys.path.append(d)
+import attitude
+
+def _multiply(a:tuple, b:tuple) -> tuple:
+    """Quaternion product a * b (w, x, y, z)."""
+    return (
+        a[0] * b[0] - a[1] * b[1] - a[2] * b[2] - a[3] * b[3],
+        a[0] * b[1] + a[1] * b[0] + a[2] * b[3] - a[3] * b[2],
+        a[0] * b[2] - a[1] * b[3] + a[2] * b[0] + a[3] * b[1],
+        a[0] * b[3] + a[1] * b[2] - a[2] * b[1] + a[3] * b[0],
+    )
+
+def _rotate_into_body(q:tuple, v:tuple) -> tuple:
+    """A world frame vector, expressed in the body frame of the body to world quaternion q: conj(q) * v * q."""
+    c:tuple = (q[0], -q[1], -q[2], -q[3])
+    r:tuple = _multiply(_multiply(c, (0.0, v[0], v[1], v[2])), q)
+    return (r[1], r[2], r[3])
+
+class Reference:
+    """The Mahony filter of attitude.AttitudeEstimator, in double precision and written with quaternion algebra rather than expanded by hand."""
+
+    def __init__(self, cycle_hz:float, kp:float = 0.25, ki:float = 0.0, accel_window_g:float = 0.25) -> None:
+        self.dt:float = 1.0 / cycle_hz
+        self.kp:float = kp
+        self.ki:float = ki
+        self.accel_window_g:float = accel_window_g
+        self.q:tuple = (1.0, 0.0, 0.0, 0.0)
+        self.integral:list[float] = [0.0, 0.0, 0.0]
+
+    def level(self, accel_x:float, accel_y:float, accel_z:float) -> None:
+        roll:float = math.atan2(-accel_y, -accel_z)
+        pitch:float = math.atan2(accel_x, math.hypot(accel_y, accel_z))
+        qx:tuple = (math.cos(roll / 2.0), math.sin(roll / 2.0), 0.0, 0.0)
+        qy:tuple = (math.cos(pitch / 2.0), 0.0, math.sin(pitch / 2.0), 0.0)
+        self.q = _multiply(qy, qx)
+
+    def update(self, gyro_x:float, gyro_y:float, gyro_z:float, accel_x:float, accel_y:float, accel_z:float) -> None:
+        w:list[float] = [math.radians(gyro_x), math.radians(gyro_y), math.radians(gyro_z)]
+        norm:float = math.sqrt(accel_x * accel_x + accel_y * accel_y + accel_z * accel_z)
+        if abs(norm - 1.0) < self.accel_window_g:
+            measured:tuple = (-accel_x / norm, -accel_y / norm, -accel_z / norm)
+            estimated:tuple = _rotate_into_body(self.q, (0.0, 0.0, 1.0))
+            e:tuple = (
+                measured[1] * estimated[2] - measured[2] * estimated[1],
+                measured[2] * estimated[0] - measured[0] * estimated[2],
+                measured[0] * estimated[1] - measured[1] * estimated[0],
+            )
+            for i in range(3):
+                self.integral[i] = self.integral[i] + self.ki * self.dt * e[i]
+                w[i] = w[i] + self.kp * e[i]
+        for i in range(3):
+            w[i] = w[i] + self.integral[i]
+        dq:tuple = _multiply(self.q, (0.0, w[0], w[1], w[2]))
+        q:list[float] = [self.q[i] + 0.5 * self.dt * dq[i] for i in range(4)]
+        n:float = math.sqrt(sum([v * v for v in q]))
+        self.q = tuple([v / n for v in q])
+
+    def euler(self) -> tuple:
+        """(roll, pitch, yaw) in degrees."""
+        qw, qx, qy, qz = self.q
+        roll:float = math.atan2(2.0 * (qw * qx + qy * qz), 1.0 - 2.0 * (qx * qx + qy * qy))
+        pitch:float = math.asin(max(-1.0, min(1.0, 2.0 * (qw * qy - qz * qx))))
+        yaw:float = math.atan2(2.0 * (qw * qz + qx * qy), 1.0 - 2.0 * (qy * qy + qz * qz))
+        return (math.degrees(roll), math.degrees(pitch), math.degrees(yaw))
+
+
+def record(cycles:int, overrides:dict = None) -> tuple:
+    """
+    Flies main.run() closed loop on the physics model (lockstep, the default FlightScript pilot) for this many cycles.
+    :returns: (cycle_hz, samples before the flight loop began, samples of the flight loop). A sample is (gyro x, y, z, accel x, y, z, true roll, true pitch), in the body frame.
+    """
+    from sitl.harness import Simulation
+    from sitl.physics import Multirotor
+    vehicle:Multirotor = Multirotor()
+    sim:Simulation = Simulation(max_cycles = cycles, clock_mode = "lockstep", vehicle = vehicle, overrides = overrides)
+    before:list[tuple] = []
+    during:list[tuple] = []
+    sample = vehicle.sample
+    def recorded(t:float) -> tuple:
+        ax, ay, az, temperature, gx, gy, gz = sample(t)
+        roll, pitch, yaw = vehicle.euler_deg()
+        s:tuple = (-gx, gy, -gz, -ax, ay, -az, roll, pitch) # main.py's gyro_flip and accel_flip: sensor to body frame
+        (before if sim.board.loop_started_at_us is None else during).append(s)
+        return (ax, ay, az, temperature, gx, gy, gz)
+    vehicle.sample = recorded
+    sim.run()
+    return (float(sim.main.target_cycle_hz), before, during)
+
+def check(cycle_hz:float, before:list[tuple], during:list[tuple], kp:float = 0.25, ki:float = 0.0, accel_window_g:float = 0.25) -> dict:
+    """Runs the firmware estimator and the reference over the flight's samples, after calibrating the gyro bias and leveling both on the samples taken before the loop began (as main.run() does)."""
+    n:int = len(before)
+    bias:list[float] = [sum([s[i] for s in before]) / n for i in range(3)]
+    accel:list[float] = [sum([s[3 + i] for s in before]) / n for i in range(3)]
+    firmware = attitude.AttitudeEstimator(cycle_hz, kp, ki, accel_window_g)
+    reference:Reference = Reference(cycle_hz, kp, ki, accel_window_g)
+    firmware.level(accel[0], accel[1], accel[2])
+    reference.level(accel[0], accel[1], accel[2])
+    errors:dict = {"firmware": ([], []), "reference": ([], []), "firmware_vs_reference": ([], [])}
+    for s in during:
+        gx:float = s[0] - bias[0]
+        gy:float = s[1] - bias[1]
+        gz:float = s[2] - bias[2]
+        firmware.update(gx, gy, gz, s[3], s[4], s[5])
+        firmware.euler()
+        reference.update(gx, gy, gz, s[3], s[4], s[5])
+        r:tuple = reference.euler()
+        f = firmware.angles
+        for axis in range(2):
+            errors["firmware"][axis].append(f[axis] - s[6 + axis])
+            errors["reference"][axis].append(r[axis] - s[6 + axis])
+            errors["firmware_vs_reference"][axis].append(f[axis] - r[axis])
+    ToReturn:dict = {"cycles": len(during), "cycle_hz": cycle_hz, "max_tilt_deg": max([max(abs(s[6]), abs(s[7])) for s in during])}
+    for name, (roll, pitch) in errors.items():
+        ToReturn[name] = {
+            "roll_rms_deg": math.sqrt(sum([e * e for e in roll]) / len(roll)),
+            "roll_max_deg": max([abs(e) for e in roll]),
+            "pitch_rms_deg": math.sqrt(sum([e * e for e in pitch]) / len(pitch)),
+            "pitch_max_deg": max([abs(e) for e in pitch]),
+        }
+    return ToReturn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.attitude", description = "Check the accuracy of Scout's attitude estimator on a simulated closed-loop flight.")
+    parser.add_argument("--cycles", type = int, default = 5000, help = "flight loop cycles to fly")
+    parser.add_argument("--kp", type = float, default = None, help = "estimator P gain (default: main.py's attitude_kp)")
+    parser.add_argument("--ki", type = float, default = None, help = "estimator I gain (default: main.py's attitude_ki)")
+    parser.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE", help = "override a main.py setting for the flight, e.g. --set angle_mode=true")
+    args = parser.parse_args()
+
+    overrides:dict = {}
+    for item in args.set:
+        name, value = item.split("=", 1)
+        overrides[name] = json.loads(value)
+    cycle_hz, before, during = record(args.cycles, overrides)
+    from tools.replay import main_settings
+    settings:dict = main_settings()
+    settings.update(overrides)
+    kp:float = args.kp if args.kp is not None else settings.get("attitude_kp", 0.25)
+    ki:float = args.ki if args.ki is not None else settings.get("attitude_ki", 0.0)
+    r:dict = check(cycle_hz, before, during, kp, ki)
+    print(str(r["cycles"]) + " cycles @ " + str(cycle_hz) + " hz, largest true tilt " + str(round(r["max_tilt_deg"], 1)) + " deg, kp " + str(kp) + ", ki " + str(ki))
+    print("estimate | roll rms | roll max | pitch rms | pitch max (deg)")
+    for name in ("firmware", "reference", "firmware_vs_reference"):
+        e:dict = r[name]
+        print(name.replace("_", " ") + " | " + " | ".join(["%.3g" % e[k] for k in ("roll_rms_deg", "roll_max_deg", "pitch_rms_deg", "pitch_max_deg")]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Autotuner for the nine rate PID gains (pid_roll_*, pid_pitch_*, pid_yaw_*) of main.py.
+Every candidate gain set flies a handful of closed-loop scenarios (stick steps on each axis and a disturbance), on the SITL with its rigid-body model (sitl.physics.Multirotor), and gets one cost from how well it tracked.
+Candidates are proposed by CMA-ES (in log-gain space) and flown in parallel, one gain set per process, on every core.
+
+Each evaluated gain set is appended to a cache file, keyed by the gains and a fingerprint of the firmware, simulator and scenarios. The search is deterministic for a given seed, so running the same command again after an interruption replays the cached generations instantly and carries on where it stopped.
+
+Usage:
+    python -m tools.autotune --generations 30
+    python -m tools.autotune --generations 30 --cache autotune_cache.jsonl --top 10
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+
+ROOT_DIR:str = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+import sitl
+from sitl.physics import Multirotor
+from tools.replay import GAIN_NAMES, main_settings
+
+CRASH_COST:float = 1000.0
+CHANNEL_SIGN:tuple = (1, -1, 1) # roll, pitch, yaw: sticks.StickMap flips the pitch channel (stick forward = nose down)
+LINEAR_STICKS:dict = {"angle_mode": False, "stick_dead_zone": 0.0, "stick_expo_roll": 0.0, "stick_expo_pitch": 0.0, "stick_expo_yaw": 0.0} # the pilot's commands are fractions of the max rates, so the sticks must map to rates linearly
+
+
+##### scenarios #####
+
+class Scenario:
+    """
+    One scripted flight, timed from when the flight loop begins: standby, arm at 0.25 s, lift off at 0.5 s (climb_throttle), settle at hover_throttle from 1.5 s, then at event_s either hold the sticks at stick (the roll, pitch and yaw command main.py sees, -1.0 to 1.0) for hold_s, or push the body with torque (N m) for kick_s.
+    Tracking is scored from event_s until end_s: the setpoint main.py derives from the sticks against the model's true body rates.
+    """
+
+    def __init__(self, name:str, stick:tuple = (0.0, 0.0, 0.0), hold_s:float = 0.6, torque:tuple = (0.0, 0.0, 0.0), kick_s:float = 0.05, event_s:float = 2.0, end_s:float = 3.5, climb_throttle:float = 0.7, hover_throttle:float = 0.45) -> None:
+        self.name:str = name
+        self.stick:tuple = stick
+        self.hold_s:float = hold_s
+        self.torque:tuple = torque
+        self.kick_s:float = kick_s
+        self.event_s:float = event_s
+        self.end_s:float = end_s
+        self.climb_throttle:float = climb_throttle
+        self.hover_throttle:float = hover_throttle
+
+    def key(self) -> list:
+        return [self.name, list(self.stick), self.hold_s, list(self.torque), self.kick_s, self.event_s, self.end_s, self.climb_throttle, self.hover_throttle]
+
+SCENARIOS:tuple = (
+    Scenario("roll step", stick = (0.8, 0.0, 0.0)),
+    Scenario("pitch step", stick = (0.0, 0.8, 0.0)),
+    Scenario("yaw step", stick = (0.0, 0.0, 0.8)),
+    Scenario("gust", torque = (0.12, -0.08, 0.02)),
+)
+
+class _Pilot:
+    """Flies a Scenario: the transmitter's channels, the disturbance, and the tracking score (sampled every time the flight controller reads the IMU)."""
+
+    def __init__(self, scenario:Scenario, board, vehicle:Multirotor) -> None:
+        self.scenario:Scenario = scenario
+        self.board = board
+        self.vehicle:Multirotor = vehicle
+        self.max_rates:tuple = (1.0, 1.0, 1.0) # set from main.py once it is loaded
+        self.command:list[float] = [0.0, 0.0, 0.0] # roll, pitch, yaw stick command currently sent (-1.0 to 1.0)
+
+        # score
+        self.samples:int = 0
+        self.error_sum:float = 0.0 # sum of |setpoint - rate| / max rate, over the three axes
+        self.overshoot:float = 0.0 # largest rate beyond a held (non-zero) setpoint, as a fraction of it
+        self.motor_travel:float = 0.0 # sum of |change in ESC command| per sample, over the motors
+        self._last_command:list[float] = None
+
+    def since(self, t:float) -> float:
+        started:float = self.board.loop_started_at_us
+        if started is None:
+            return None
+        return t - (started / 1000000.0)
+
+    def channels(self, t:float) -> list[int]:
+        sc:Scenario = self.scenario
+        ToReturn:list[int] = [1500] * 14
+        ToReturn[2] = 1000 # throttle down
+        ToReturn[4] = 1000 # standby
+        ToReturn[5] = 1000
+        since:float = self.since(t)
+        self.command = [0.0, 0.0, 0.0]
+        if since is None or since < 0.25:
+            return ToReturn
+        ToReturn[4] = 2000 # flight mode
+        if since < 0.5:
+            return ToReturn
+        throttle:float = sc.climb_throttle if since < 1.5 else sc.hover_throttle
+        ToReturn[2] = int(1000 + (throttle * 1000.0))
+        if sc.event_s <= since < sc.event_s + sc.hold_s:
+            self.command = list(sc.stick)
+        ToReturn[0] = int(1500 + (CHANNEL_SIGN[0] * self.command[0] * 500.0))
+        ToReturn[1] = int(1500 + (CHANNEL_SIGN[1] * self.command[1] * 500.0))
+        ToReturn[3] = int(1500 + (CHANNEL_SIGN[2] * self.command[2] * 500.0))
+
+        # disturbance
+        if sc.event_s <= since < sc.event_s + sc.kick_s:
+            self.vehicle.external_torque = list(sc.torque)
+        else:
+            self.vehicle.external_torque = [0.0, 0.0, 0.0]
+        return ToReturn
+
+    def sampled(self) -> None:
+        """Called on every IMU read: scores the model's state against the setpoint of the sticks being sent."""
+        since:float = self.since(self.board.clock.now_us() / 1000000.0)
+        if since is None or since < self.scenario.event_s or since > self.scenario.end_s:
+            return
+        v:Multirotor = self.vehicle
+        for i in range(3):
+            setpoint:float = self.command[i] * self.max_rates[i]
+            rate:float = math.degrees(v.rates[i])
+            self.error_sum = self.error_sum + (abs(setpoint - rate) / self.max_rates[i])
+            if setpoint != 0.0:
+                over:float = (rate - setpoint) / setpoint
+                if over > self.overshoot:
+                    self.overshoot = over
+        if self._last_command is not None:
+            for i in range(len(v.command)):
+                self.motor_travel = self.motor_travel + abs(v.command[i] - self._last_command[i])
+        self._last_command = list(v.command)
+        self.samples = self.samples + 1
+
+
+def fly(scenario:Scenario, gains:dict, max_rates:tuple) -> dict:
+    """Flies one scenario with a set of gains (main.py setting name -> value) and returns its metrics. max_rates are main.py's max_rate_roll/pitch/yaw."""
+    vehicle:Multirotor = Multirotor()
+    sim:sitl.Simulation = sitl.Simulation(max_cycles = 10 ** 9, duration_s = 30.0 + scenario.end_s, clock_mode = "lockstep", overrides = dict(gains, blackbox_enabled = False, **LINEAR_STICKS), vehicle = vehicle)
+    pilot:_Pilot = _Pilot(scenario, sim.board, vehicle)
+    pilot.max_rates = max_rates
+    sim.board.receiver.channels = pilot.channels
+    sim.board.imu.on_data_read.append(pilot.sampled)
+
+    # stop once the scenario is over
+    def stop_after_scenario() -> None:
+        started:float = sim.board.loop_started_at_us
+        if started is not None and (sim.clock.now_us() - started) / 1000000.0 > scenario.end_s:
+            raise sitl.SimulationComplete("Scenario complete")
+    sim.board.imu.on_data_read.append(stop_after_scenario)
+    result = sim.run()
+    crashed:bool = vehicle.crashed_at_s is not None or result.fatal is not None
+    samples:int = max(1, pilot.samples)
+    return {
+        "tracking": pilot.error_sum / (3.0 * samples), # mean |error| / max rate, per axis
+        "overshoot": pilot.overshoot,
+        "motor_travel": pilot.motor_travel / samples, # mean ESC command change per cycle, summed over motors
+        "max_tilt_deg": vehicle.summary()["max_tilt_deg"],
+        "crashed": crashed,
+        "samples": pilot.samples,
+    }
+
+def cost(metrics:list[dict]) -> float:
+    """One number for a gain set's scenario metrics (lower is better)."""
+    ToReturn:float = 0.0
+    for m in metrics:
+        if m["crashed"] or m["samples"] == 0:
+            ToReturn = ToReturn + CRASH_COST
+            continue
+        ToReturn = ToReturn + m["tracking"] + (0.5 * m["overshoot"]) + (2.0 * m["motor_travel"])
+    return ToReturn / max(1, len(metrics))
+
+def evaluate(values:tuple) -> dict:
+    """Flies every scenario with one gain set (values in GAIN_NAMES order). Runs in a worker process."""
+    gains:dict = dict(zip(GAIN_NAMES, [float(v) for v in values]))
+    settings:dict = main_settings()
+    max_rates:tuple = (settings["max_rate_roll"], settings["max_rate_pitch"], settings["max_rate_yaw"])
+    metrics:list[dict] = [fly(sc, gains, max_rates) for sc in SCENARIOS]
+    return {"gains": list(values), "cost": cost(metrics), "scenarios": dict(zip([sc.name for sc in SCENARIOS], metrics))}
+
+
+##### cache #####
+
+def fingerprint() -> str:
+    """Changes whenever anything that affects a gain set's cost does: the firmware, the simulator, this tuner's scenarios and cost."""
+    h = hashlib.sha1()
+    for folder in ("src", "sitl", "tools"):
+        d:str = os.path.join(ROOT_DIR, folder)
+        for name in sorted(os.listdir(d)):
+            if name.endswith(".py") and (folder != "tools" or name == "autotune.py"):
+                with open(os.path.join(d, name), "rb") as f:
+                    h.update(name.encode())
+                    h.update(f.read())
+    h.update(json.dumps([sc.key() for sc in SCENARIOS]).encode())
+    return h.hexdigest()[0:16]
+
+def cache_key(values) -> str:
+    return ",".join(["%.6g" % v for v in values])
+
+class Cache:
+    """Evaluated gain sets, appended one JSON line per result, so a search that is stopped half way loses at most the gain sets being flown."""
+
+    def __init__(self, path:str, fingerprint:str) -> None:
+        self.path:str = path
+        self.fingerprint:str = fingerprint
+        self.results:dict = {} # cache_key -> result
+        self.stale:int = 0 # entries from a different firmware/simulator/scenario version, ignored
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 0:
+                        continue
+                    try:
+                        entry:dict = json.loads(line)
+                    except ValueError:
+                        continue # a line cut short by an interruption
+                    if entry.get("fingerprint") != fingerprint:
+                        self.stale = self.stale + 1
+                        continue
+                    self.results[cache_key(entry["gains"])] = entry
+
+    def get(self, values) -> dict:
+        return self.results.get(cache_key(values))
+
+    def put(self, result:dict) -> None:
+        result = dict(result, fingerprint = self.fingerprint)
+        self.results[cache_key(result["gains"])] = result
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+
+    def ranked(self) -> list[dict]:
+        return sorted(self.results.values(), key = lambda r: r["cost"])
+
+
+##### optimizer #####
+
+class CMAES:
+    """
+    Covariance matrix adaptation evolution strategy, (mu/mu_w, lambda), with the standard default parameters (Hansen, "The CMA Evolution Strategy: A Tutorial").
+    Minimizes over the unit box [0, 1]^n: candidates are clipped into the box, and the clipping distance is added to their cost so the search is pulled back inside.
+    """
+
+    def __init__(self, mean:np.ndarray, sigma:float = 0.2, population:int = None, seed:int = 0) -> None:
+        n:int = len(mean)
+        self.n:int = n
+        self.mean:np.ndarray = np.array(mean, dtype = np.float64)
+        self.sigma:float = sigma
+        self.lam:int = population if population is not None else 4 + int(3 * math.log(n))
+        self.mu:int = self.lam // 2
+        w:np.ndarray = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights:np.ndarray = w / w.sum()
+        self.mueff:float = 1.0 / float((self.weights ** 2).sum())
+        self.cc:float = (4.0 + self.mueff / n) / (n + 4.0 + 2.0 * self.mueff / n)
+        self.cs:float = (self.mueff + 2.0) / (n + self.mueff + 5.0)
+        self.c1:float = 2.0 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu:float = min(1.0 - self.c1, 2.0 * (self.mueff - 2.0 + 1.0 / self.mueff) / ((n + 2.0) ** 2 + self.mueff))
+        self.damps:float = 1.0 + 2.0 * max(0.0, math.sqrt((self.mueff - 1.0) / (n + 1.0)) - 1.0) + self.cs
+        self.chin:float = math.sqrt(n) * (1.0 - 1.0 / (4.0 * n) + 1.0 / (21.0 * n * n))
+        self.pc:np.ndarray = np.zeros(n)
+        self.ps:np.ndarray = np.zeros(n)
+        self.C:np.ndarray = np.eye(n)
+        self.B:np.ndarray = np.eye(n)
+        self.D:np.ndarray = np.ones(n)
+        self.generation:int = 0
+        self.rng = np.random.default_rng(seed)
+        self._z:np.ndarray = None
+        self._x:np.ndarray = None
+
+    def ask(self) -> np.ndarray:
+        """The next generation's candidates, (lambda, n), unclipped."""
+        self._z = self.rng.standard_normal((self.lam, self.n))
+        self._x = self.mean + self.sigma * ((self._z * self.D) @ self.B.T)
+        return self._x.copy()
+
+    def tell(self, costs:np.ndarray) -> None:
+        costs = np.asarray(costs, dtype = np.float64)
+        order:np.ndarray = np.argsort(costs, kind = "stable")[0:self.mu]
+        old:np.ndarray = self.mean
+        self.mean = self.weights @ self._x[order]
+        y:np.ndarray = (self.mean - old) / self.sigma
+        c_inv_sqrt:np.ndarray = self.B @ np.diag(1.0 / self.D) @ self.B.T
+        self.ps = (1.0 - self.cs) * self.ps + math.sqrt(self.cs * (2.0 - self.cs) * self.mueff) * (c_inv_sqrt @ y)
+        hsig:bool = np.linalg.norm(self.ps) / math.sqrt(1.0 - (1.0 - self.cs) ** (2 * (self.generation + 1))) / self.chin < 1.4 + 2.0 / (self.n + 1.0)
+        self.pc = (1.0 - self.cc) * self.pc + (math.sqrt(self.cc * (2.0 - self.cc) * self.mueff) * y if hsig else 0.0)
+        steps:np.ndarray = (self._x[order] - old) / self.sigma
+        self.C = ((1.0 - self.c1 - self.cmu) * self.C
+                  + self.c1 * (np.outer(self.pc, self.pc) + (0.0 if hsig else self.cc * (2.0 - self.cc)) * self.C)
+                  + self.cmu * (steps.T @ np.diag(self.weights) @ steps))
+        self.sigma = self.sigma * math.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chin - 1.0))
+        self.C = np.triu(self.C) + np.triu(self.C, 1).T
+        d2, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(d2, 1e-20))
+        self.generation = self.generation + 1
+
+
+class SearchSpace:
+    """Maps the unit box the optimizer works in to gains: each gain is searched log-uniformly within span times either side of its center."""
+
+    def __init__(self, base:np.ndarray, span:float = 10.0) -> None:
+        """:param base: main.py's gains, in GAIN_NAMES order. A gain of 0 (e.g. pid_yaw_kd) is centered on 1/100th of the same term on the roll axis instead."""
+        base = np.asarray(base, dtype = np.float64).copy()
+        for k in range(len(base)):
+            if base[k] <= 0.0:
+                base[k] = base[k % 3] / 100.0
+        self.center:np.ndarray = base
+        self.log_lo:np.ndarray = np.log(base / span)
+        self.log_hi:np.ndarray = np.log(base * span)
+
+    def to_gains(self, u:np.ndarray) -> np.ndarray:
+        u = np.clip(u, 0.0, 1.0)
+        return np.exp(self.log_lo + u * (self.log_hi - self.log_lo))
+
+    def to_unit(self, gains:np.ndarray) -> np.ndarray:
+        return (np.log(gains) - self.log_lo) / (self.log_hi - self.log_lo)
+
+
+def rounded(gains:np.ndarray) -> tuple:
+    """Gains to 6 significant digits: what is cached, printed and pasted into main.py."""
+    return tuple([float("%.6g" % g) for g in gains])
+
+
+##### output #####
+
+def settings_block(gains) -> str:
+    """The gains as lines for main.py's SETTINGS."""
+    return "\n".join([name + ":float = " + ("%.6g" % g) for name, g in zip(GAIN_NAMES, gains)])
+
+def format_table(ranked:list[dict], top:int) -> str:
+    lines:list[str] = []
+    lines.append("rank | cost | " + " | ".join([sc.name + " (tracking, overshoot)" for sc in SCENARIOS]) + " | " + " | ".join(GAIN_NAMES))
+    for rank, r in enumerate(ranked[0:top]):
+        cells:list[str] = []
+        for sc in SCENARIOS:
+            m:dict = r["scenarios"][sc.name]
+            cells.append("CRASHED" if m["crashed"] else (str(round(m["tracking"], 4)) + ", " + str(round(m["overshoot"], 3))))
+        lines.append(str(rank + 1) + " | " + str(round(r["cost"], 4)) + " | " + " | ".join(cells) + " | " + " | ".join(["%.6g" % g for g in r["gains"]]))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.autotune", description = "Tune main.py's rate PID gains with CMA-ES over closed-loop simulated flights, in parallel.")
+    parser.add_argument("--generations", type = int, default = 20)
+    parser.add_argument("--population", type = int, default = None, help = "gain sets per generation (default: CMA-ES's 4 + 3 ln 9 = 10, or the number of cores if that is more)")
+    parser.add_argument("--sigma", type = float, default = 0.15, help = "initial step size, as a fraction of the searched (log) range")
+    parser.add_argument("--span", type = float, default = 10.0, help = "search each gain from 1/span to span times main.py's value")
+    parser.add_argument("--workers", type = int, default = None, help = "processes to fly in (default: every core)")
+    parser.add_argument("--cache", default = "autotune_cache.jsonl", help = "file evaluated gain sets are kept in (resume by running again with the same file)")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--top", type = int, default = 10)
+    args = parser.parse_args()
+
+    settings:dict = main_settings()
+    base:np.ndarray = np.array([settings[name] for name in GAIN_NAMES], dtype = np.float64)
+    space:SearchSpace = SearchSpace(base, args.span)
+    workers:int = args.workers if args.workers is not None else (os.cpu_count() or 1)
+    cache:Cache = Cache(args.cache, fingerprint())
+    print(str(len(cache.results)) + " cached gain sets" + (" (" + str(cache.stale) + " from an older firmware/simulator ignored)" if cache.stale > 0 else "") + ", " + str(workers) + " worker processes")
+
+    es:CMAES = CMAES(space.to_unit(space.center), args.sigma, args.population, args.seed)
+    if args.population is None and workers > es.lam:
+        es = CMAES(space.to_unit(space.center), args.sigma, workers, args.seed)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        # main.py's own gains first, as the reference
+        reference:tuple = rounded(base)
+        if cache.get(reference) is None:
+            cache.put(evaluate(reference))
+        print("main.py's gains: cost " + str(round(cache.get(reference)["cost"], 4)))
+
+        for gen in range(args.generations):
+            began:float = time.perf_counter()
+            candidates:np.ndarray = es.ask()
+            gains:list[tuple] = [rounded(space.to_gains(u)) for u in candidates]
+            todo:list[tuple] = [g for g in dict.fromkeys(gains) if cache.get(g) is None]
+            for result in pool.map(evaluate, todo):
+                cache.put(result)
+            penalty:np.ndarray = np.sum((candidates - np.clip(candidates, 0.0, 1.0)) ** 2, axis = 1)
+            costs:np.ndarray = np.array([cache.get(g)["cost"] for g in gains]) + penalty
+            es.tell(costs)
+            best:dict = cache.ranked()[0]
+            print("generation " + str(gen + 1) + ": " + str(len(todo)) + " flown (" + str(len(gains) - len(todo)) + " cached) in " + str(round(time.perf_counter() - began, 1)) + " s, best this generation " + str(round(float(costs.min()), 4)) + ", best overall " + str(round(best["cost"], 4)) + ", sigma " + str(round(es.sigma, 4)))
+
+    ranked:list[dict] = cache.ranked()
+    print()
+    print(format_table(ranked, args.top))
+    print()
+    print("# best gains (cost " + str(round(ranked[0]["cost"], 4)) + "), for the SETTINGS in main.py:")
+    print(settings_block(ranked[0]["gains"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Equivalence check of the fixed point control path (src/fixedpoint.py) against the float path it replaces (mpu6050 decode, sticks.StickMap, pid.PIDBank, mixer.Mixer).
+Both are configured from main.py's settings and fed the same raw gyro counts and RC channels, cycle by cycle, over a set of repeatable scenarios (hover, maneuvering, motor saturation at both ends, full-scale sensor and stick readings).
+The largest difference of every stage is compared to a stated bound (BOUNDS). The fixed point code runs on 32-bit checked integers, so any intermediate result the Pico's viper code would overflow (wrap) on fails the check too.
+The "extremes" scenario (the sensor railing, channels out of range) is checked for overflow only: it drives the PID outputs past the fixed point path's +/- 4 throttle clamp, where the two paths are meant to differ (every motor is pinned at either end by then).
+Exits with status 1 if any bound is exceeded or any overflow is found.
+
+Usage:
+    python -m tools.fixedpoint
+    python -m tools.fixedpoint --cycles 5000 --set frame_layout=\"hex-x\" --set dterm_lpf_hz=40.0
+"""
+
+import argparse
+import array
+import json
+import math
+import os
+import random
+import sys
+
+SRC_DIR:str = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+import fixedpoint
+import mixer
+import mpu6050
+import pid
+import sticks
+
+GYRO_FLIP:tuple = (-1, 1, -1) # main.py's MPU-6050 mounting
+I_LIMIT:float = 150.0 # main.py's i_limit
+
+# the largest difference allowed between the fixed point and the float path, per stage, over the default 2,000 cycles (8 s at 250 hz)
+# gyro and setpoints: half a Q6 count of rounding (~0.00012 deg/s at +/- 500 deg/s), the Q12 stick table interpolation, and the float path's own float32 rounding
+# throttle: the Q12 interpolation of the throttle stick's table
+# PID output: the Q20 truncations of the P and D terms, plus the I term integrating the rate differences above. This is an open-loop comparison, so that part grows with time (about 3e-7 throttle per second at main.py's gains); in flight, the loop corrects it like any other rate error
+# duty: 1 ns per 2^-20 throttle of the above, amplified while the mixer scales the PID outputs down (a small difference in the largest contribution changes the scale), plus the Q16 mixing factors and the integer duty line, against a 1,000,000 ns range
+BOUNDS:dict = {"gyro_dps": 0.001, "setpoint_dps": 0.002, "throttle": 1e-5, "pid_output": 2e-5, "duty_ns": 50.0}
+OVERFLOW_ONLY:tuple = ("extremes",)
+
+##### 32-bit checked integers #####
+
+class Overflow(Exception):
+    pass
+
+class Int32(int):
+    """An int that fails (Overflow) as soon as any result leaves the signed 32-bit range, like the viper emitter's machine words would wrap."""
+
+    @staticmethod
+    def of(v:int) -> "Int32":
+        if v < -2147483648 or v > 2147483647:
+            raise Overflow(str(v) + " does not fit in 32 bits")
+        return Int32(v)
+
+    def __add__(self, o): return Int32.of(int(self) + int(o))
+    def __radd__(self, o): return Int32.of(int(o) + int(self))
+    def __sub__(self, o): return Int32.of(int(self) - int(o))
+    def __rsub__(self, o): return Int32.of(int(o) - int(self))
+    def __mul__(self, o): return Int32.of(int(self) * int(o))
+    def __rmul__(self, o): return Int32.of(int(o) * int(self))
+    def __lshift__(self, o): return Int32.of(int(self) << int(o))
+    def __rlshift__(self, o): return Int32.of(int(o) << int(self))
+    def __rshift__(self, o): return Int32.of(int(self) >> int(o))
+    def __rrshift__(self, o): return Int32.of(int(o) >> int(self))
+    def __and__(self, o): return Int32.of(int(self) & int(o))
+    def __rand__(self, o): return Int32.of(int(o) & int(self))
+    def __or__(self, o): return Int32.of(int(self) | int(o))
+    def __ror__(self, o): return Int32.of(int(o) | int(self))
+    def __xor__(self, o): return Int32.of(int(self) ^ int(o))
+    def __rxor__(self, o): return Int32.of(int(o) ^ int(self))
+    def __neg__(self): return Int32.of(-int(self))
+
+class Pointer:
+    """A viper pointer (ptr8, ptr32) over an array or bytearray: reads give Int32s, writes check the range."""
+
+    def __init__(self, data) -> None:
+        self.data = data
+
+    def __getitem__(self, i:int) -> Int32:
+        return Int32(self.data[i])
+
+    def __setitem__(self, i:int, v:int) -> None:
+        self.data[i] = int(Int32.of(int(v)))
+
+##### the two paths #####
+
+class Paths:
+    """The float path and the fixed point path, configured alike from main.py's settings."""
+
+    def __init__(self, settings:dict, bias_dps:tuple) -> None:
+        self.imu = mpu6050.MPU6050(None, gyro_flip = GYRO_FLIP)
+        self.imu.gyro_range = 1 # main.py configures +/- 500 deg/s
+        self.imu.set_gyro_bias(bias_dps[0], bias_dps[1], bias_dps[2])
+        self.pids = pid.PIDBank(settings["target_cycle_hz"], I_LIMIT, settings.get("dterm_lpf_hz", 0.0))
+        self.pids.set_gains(pid.ROLL, settings["pid_roll_kp"], settings["pid_roll_ki"], settings["pid_roll_kd"])
+        self.pids.set_gains(pid.PITCH, settings["pid_pitch_kp"], settings["pid_pitch_ki"], settings["pid_pitch_kd"])
+        self.pids.set_gains(pid.YAW, settings["pid_yaw_kp"], settings["pid_yaw_ki"], settings["pid_yaw_kd"])
+        self.mixer = mixer.Mixer(settings["frame_layout"], saturation_scaling = settings["motor_saturation_scaling"])
+        self.stick_map = sticks.StickMap(settings["max_rate_roll"], settings["max_rate_pitch"], settings["max_rate_yaw"], settings["stick_dead_zone"], settings["stick_expo_roll"], settings["stick_expo_pitch"], settings["stick_expo_yaw"], settings["stick_table_points"])
+        governor = settings["throttle_governor"]
+        self.throttle_idle:float = settings["throttle_idle"]
+        self.throttle_range:float = (governor if governor is not None else 1.0) - self.throttle_idle
+        self.command = array.array("f", [0.0] * sticks.COMMAND_SIZE)
+
+        # the fixed point path writes its duty cycles into a mixer of its own
+        self.fixed_mixer = mixer.Mixer(settings["frame_layout"], saturation_scaling = settings["motor_saturation_scaling"])
+        self.controller = fixedpoint.FixedController(self.imu, self.pids, self.fixed_mixer, self.stick_map, self.throttle_idle, self.throttle_range)
+        c = self.controller
+        self._state = Pointer(c.state)
+        self._buf = Pointer(c.buf)
+        self._duty = Pointer(c.duty)
+        self._tables = Pointer(c.tables)
+        self._params = Pointer(c.params)
+        self._raw = Pointer(c.raw)
+        self._command = Pointer(c.command)
+
+    def step(self, gyro_counts:tuple, rc_data:list) -> dict:
+        """Feeds both paths one cycle (raw gyro counts as the sensor reads them, and the RC receiver's channels) and returns the differences."""
+        buf = self.imu.buf
+        for axis in range(3):
+            v:int = gyro_counts[axis] & 0xFFFF
+            buf[8 + (axis * 2)] = v >> 8
+            buf[9 + (axis * 2)] = v & 0xFF
+
+        # float path, as main.run() does it
+        mpu6050._decode(buf, self.imu._gain, self.imu._offset, self.imu.data)
+        data = self.imu.data
+        self.stick_map.process(rc_data, self.command)
+        command = self.command
+        adj_throttle:float = self.throttle_idle + (self.throttle_range * command[0])
+        self.pids.update(command[1] - data[4], command[2] - data[5], command[3] - data[6])
+        out = self.pids.output
+        self.mixer.mix(adj_throttle, out[0], out[1], out[2])
+        float_output:list[float] = [out[0], out[1], out[2]]
+
+        # fixed point path, on checked integers (the same functions the Pico runs as viper code)
+        c = self.controller
+        raw = c.raw
+        raw[0] = rc_data[3]
+        raw[1] = rc_data[1]
+        raw[2] = rc_data[2]
+        raw[3] = rc_data[4]
+        raw[4] = rc_data[5]
+        fixedpoint._sticks(self._tables, self._params, self._raw, self._command)
+        fixedpoint._step(self._state, self._buf, self._command, self._duty)
+
+        s = c.state
+        per_dps:float = 1.0 / c.counts_per_dps
+        ToReturn:dict = {
+            "gyro_dps": max([abs((s[fixedpoint.S_GYRO + k] * per_dps) - data[4 + k]) for k in range(3)]),
+            "setpoint_dps": max([abs((s[fixedpoint.S_SETPOINT + k] * per_dps) - command[1 + k]) for k in range(3)]),
+            "throttle": abs((s[fixedpoint.S_THROTTLE] / fixedpoint.ONE) - adj_throttle),
+            "pid_output": max([abs((s[fixedpoint.S_OUTPUT + k] / fixedpoint.ONE) - float_output[k]) for k in range(3)]),
+            "duty_ns": max([abs(c.duty[k] - self.mixer.duty[k]) for k in range(self.mixer.motors)]),
+            "saturated": self.mixer.scale[0] < 1.0,
+        }
+        return ToReturn
+
+    def reset(self) -> None:
+        self.pids.reset()
+        self.controller.reset()
+
+##### scenarios #####
+
+def _counts(dps:float, axis:int) -> int:
+    """The raw reading (sensor frame, +/- 500 deg/s range) for a body rate, clamped to 16 bits like the sensor."""
+    v:int = int(round(dps * mpu6050.GYRO_LSB_PER_DPS[1] * GYRO_FLIP[axis]))
+    return max(-32768, min(32767, v))
+
+def _rc(throttle:int, roll:int, pitch:int, yaw:int) -> list:
+    """An RC frame (ibus.IBus.read()): status, channels 1-6, in flight mode."""
+    return [1, roll, pitch, throttle, yaw, 2000, 1000]
+
+def scenarios(cycles:int, seed:int) -> dict:
+    """Repeatable inputs, name -> list of (gyro counts, RC frame) per cycle."""
+    rng:random.Random = random.Random(seed)
+    ToReturn:dict = {}
+
+    # hover: sensor noise around zero, sticks near center, mid throttle
+    ToReturn["hover"] = [(tuple([_counts(rng.gauss(0.0, 0.5), k) for k in range(3)]), _rc(1500 + rng.randint(-3, 3), 1500 + rng.randint(-3, 3), 1500 + rng.randint(-3, 3), 1500 + rng.randint(-3, 3))) for i in range(cycles)]
+
+    # maneuvering: the sticks and the rates sweeping around, with vibration on top
+    ToReturn["maneuvering"] = [(tuple([_counts((60.0 * math.sin(i * (0.011 + 0.004 * k))) + (4.0 * math.sin(i * 2.1)) + rng.gauss(0.0, 0.5), k) for k in range(3)]),
+        _rc(int(1300 + 300 * math.sin(i * 0.003)), int(1500 + 450 * math.sin(i * 0.01)), int(1500 + 450 * math.sin(i * 0.013)), int(1500 + 400 * math.sin(i * 0.007)))) for i in range(cycles)]
+
+    # saturation: steps against the sticks at full and at zero throttle, so the mixer scales the PID outputs at both ends
+    def saturation(i:int) -> tuple:
+        phase:int = (i // 50) % 4
+        rate:float = (-150.0, 150.0, -80.0, 80.0)[phase]
+        throttle:int = 2000 if phase < 2 else 1000
+        stick:int = 2000 if rate < 0.0 else 1000
+        return (tuple([_counts(rate + rng.gauss(0.0, 2.0), k) for k in range(3)]), _rc(throttle, stick, 3000 - stick, stick))
+    ToReturn["saturation"] = [saturation(i) for i in range(cycles)]
+
+    # extremes: full-scale readings (the sensor railing at +/- 32768) and channels beyond 1000-2000, to check that nothing overflows
+    def extreme(i:int) -> tuple:
+        sign:int = 1 if (i // 25) % 2 == 0 else -1
+        counts:tuple = tuple([(32767 if sign > 0 else -32768) if rng.random() < 0.8 else rng.randint(-32768, 32767) for k in range(3)])
+        return (counts, _rc(rng.choice((900, 1000, 2000, 2100)), rng.choice((900, 1000, 2000, 2100)), rng.choice((900, 1000, 2000, 2100)), rng.choice((900, 1000, 2000, 2100))))
+    ToReturn["extremes"] = [extreme(i) for i in range(cycles)]
+    return ToReturn
+
+def check(settings:dict, cycles:int = 2000, seed:int = 0) -> dict:
+    """Runs every scenario through both paths and returns, per scenario, the largest difference of every stage (and the cycles that saturated), or the overflow that was found."""
+    rng:random.Random = random.Random(seed)
+    ToReturn:dict = {}
+    for name, inputs in scenarios(cycles, seed).items():
+        paths:Paths = Paths(settings, (rng.uniform(-3.0, 3.0), rng.uniform(-3.0, 3.0), rng.uniform(-3.0, 3.0)))
+        worst:dict = {k: 0.0 for k in BOUNDS}
+        saturated:int = 0
+        try:
+            for gyro_counts, rc_data in inputs:
+                d:dict = paths.step(gyro_counts, rc_data)
+                for k in BOUNDS:
+                    worst[k] = max(worst[k], d[k])
+                if d["saturated"]:
+                    saturated = saturated + 1
+        except Overflow as e:
+            worst["overflow"] = str(e)
+        worst["saturated"] = saturated
+        ToReturn[name] = worst
+    return ToReturn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.fixedpoint", description = "Check that Scout's fixed point control path tracks the float path within stated bounds, without overflowing 32 bits.")
+    parser.add_argument("--cycles", type = int, default = 2000, help = "cycles per scenario")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE", help = "override a main.py setting, e.g. --set dterm_lpf_hz=40.0")
+    args = parser.parse_args()
+
+    from tools.replay import main_settings
+    settings:dict = main_settings()
+    for item in args.set:
+        name, value = item.split("=", 1)
+        settings[name] = json.loads(value)
+    results:dict = check(settings, args.cycles, args.seed)
+
+    failed:bool = False
+    print("scenario | " + " | ".join([k + " (bound " + str(b) + ")" for k, b in BOUNDS.items()]) + " | saturated cycles")
+    for name, worst in results.items():
+        cells:list[str] = []
+        for k, bound in BOUNDS.items():
+            over:bool = worst[k] > bound and name not in OVERFLOW_ONLY
+            failed = failed or over
+            cells.append(("%.3g" % worst[k]) + (" FAIL" if over else ""))
+        print(name + " | " + " | ".join(cells) + " | " + str(worst["saturated"]) + (" (overflow check only)" if name in OVERFLOW_ONLY else ""))
+        if "overflow" in worst:
+            failed = True
+            print("  FAIL: overflow: " + worst["overflow"])
+    print("FAIL" if failed else "OK: the fixed point path is within every bound")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
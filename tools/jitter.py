@@ -0,0 +1,66 @@
+"""
+Timing check of timer control (timer_control in src/main.py): the control step has to start on time even when the code around it runs long.
+Flies the simulator's default flight (lockstep clock) twice, with the fixed point control path: once as one loop, once with the control step on a timer interrupt. In both, every --every-th read of the RC receiver in the flight loop stalls the main context for --stall-us (interrupts enabled), as a long garbage collection, console write or slow task would.
+Reports how the control steps kept to their period in both (the gaps between the IMU reads that start them) and exits with status 1 if, with timer control, any step started more than --max-jitter-us off its time.
+
+Usage:
+    python -m tools.jitter
+    python -m tools.jitter --stall-us 12000 --every 20 --set target_cycle_hz=500.0
+"""
+
+import argparse
+import json
+import sys
+import sitl
+
+def stall_rc(stall_us:float, every:int):
+    """A Simulation setup (see sitl.Simulation) that makes every every-th ibus.IBus.read() in the flight loop take stall_us longer."""
+    def setup(main, board) -> None:
+        read = main.ibus.IBus.read
+        calls:list = [0]
+        def slow_read(self, read = read, calls = calls, board = board):
+            if board.loop_started_at_us is not None:
+                calls[0] = calls[0] + 1
+                if calls[0] % every == 0:
+                    board.clock.advance(stall_us)
+            return read(self)
+        main.ibus.IBus.read = slow_read
+    return setup
+
+def fly(overrides:dict, cycles:int, stall_us:float, every:int) -> dict:
+    """One flight: the cycle statistics (see sitl.CycleStats.summary), plus the control timer's late steps if it ran."""
+    sim:sitl.Simulation = sitl.Simulation(max_cycles = cycles, clock_mode = "lockstep", overrides = overrides, setup = stall_rc(stall_us, every))
+    result = sim.run()
+    if result.fatal is not None:
+        raise Exception("The flight controller failed: " + result.fatal.strip())
+    ToReturn:dict = result.stats.summary()
+    ToReturn["late_steps"] = sim.main.control_timer.late() if sim.main.control_timer is not None else None
+    return ToReturn
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.jitter", description = "Check that with timer control, Scout's control step starts on time while the main context stalls.")
+    parser.add_argument("--cycles", type = int, default = 2000, help = "control steps per flight")
+    parser.add_argument("--stall-us", type = float, default = 6000.0, help = "how long every stall holds the main context")
+    parser.add_argument("--every", type = int, default = 50, help = "stall every this many RC reads")
+    parser.add_argument("--max-jitter-us", type = float, default = 50.0, help = "how far off its period a step may start, with timer control")
+    parser.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE", help = "override a main.py setting, e.g. --set target_cycle_hz=500.0")
+    args = parser.parse_args()
+
+    overrides:dict = {"fixed_point_control": True}
+    for item in args.set:
+        name, value = item.split("=", 1)
+        overrides[name] = json.loads(value)
+
+    print("Stalling the main context for " + str(args.stall_us) + " us every " + str(args.every) + " RC reads")
+    print("mode | cycles | overruns | jitter peak (us) | period max (us) | late steps")
+    failed:bool = False
+    for name, timer in (("loop", False), ("timer", True)):
+        s:dict = fly(dict(overrides, timer_control = timer), args.cycles, args.stall_us, args.every)
+        over:bool = timer and (s["overruns"] > 0 or s["jitter_peak_us"] > args.max_jitter_us)
+        failed = failed or over
+        print(name + " | " + str(s["cycles"]) + " | " + str(s["overruns"]) + " | " + str(round(s["jitter_peak_us"], 1)) + (" FAIL" if over else "") + " | " + str(round(s["period_us"]["max"], 1)) + " | " + ("-" if s["late_steps"] is None else str(s["late_steps"])))
+    print("FAIL" if failed else "OK: with timer control, every step started within " + str(args.max_jitter_us) + " us of its time")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
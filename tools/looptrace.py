@@ -0,0 +1,161 @@
+"""
+Turns a flight loop profile (written by profiler.Profiler: the `profile` file, or a console log of a profile sent over USB serial) into a Chrome/Perfetto trace.
+Each cycle becomes a span on the "cycle" track, with its stages (profiler.STAGES) as spans nested inside it, so the timeline shows where each cycle's time went and how the stages move around from cycle to cycle.
+The cycle period (start to start) and its deviation from the median period are added as counter tracks, to see jitter at a glance.
+Open the trace at https://ui.perfetto.dev or chrome://tracing.
+
+Usage:
+    python -m tools.looptrace profile --trace profile.json
+    python -m tools.looptrace console.log --trace profile.json
+    python -m tools.looptrace --port /dev/ttyACM0 --trace profile.json    (needs pyserial; Scout must be in standby)
+"""
+
+import argparse
+import json
+import os
+import sys
+
+SRC_DIR:str = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+import profiler
+
+TICKS_PERIOD:int = 1 << 30 # MicroPython's ticks_us() wraps at 2^30
+
+class Profile:
+    """One profile dump: the stage names and every cycle's stamps, unwrapped to monotonic microseconds."""
+
+    def __init__(self, stages:list[str], rows:list[list[int]]) -> None:
+        self.stages:list[str] = stages
+        self.rows:list[list[int]] = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def durations(self, k:int) -> list[int]:
+        """How long stage k took in every cycle (k = len(stages) for the whole cycle)."""
+        if k < len(self.stages):
+            return [r[k + 1] - r[k] for r in self.rows]
+        return [r[-1] - r[0] for r in self.rows]
+
+    def periods(self) -> list[int]:
+        """Start to start time of every cycle but the last, or None where the next cycle is not the next one in time (e.g. standby in between)."""
+        ToReturn:list[int] = []
+        for a, b in zip(self.rows, self.rows[1:]):
+            ToReturn.append(b[0] - a[0] if b[0] - a[-1] < a[-1] - a[0] else None)
+        return ToReturn
+
+    def statistics(self) -> list[tuple]:
+        """(name, min, mean, p99, max) per stage, then for the whole cycle, as profiler.Profiler.statistics() computes them on the Pico."""
+        ToReturn:list[tuple] = []
+        for k, name in enumerate(self.stages + ["cycle"]):
+            took:list[int] = sorted(self.durations(k))
+            n:int = len(took)
+            ToReturn.append((name, took[0], sum(took) / n, took[min(n - 1, (n * 99) // 100)], took[n - 1]))
+        return ToReturn
+
+
+def unwrap(stamps:list[int], previous:int = None) -> list[int]:
+    """ticks_us stamps (each within 2^29 us of the one before it) as monotonic microseconds."""
+    ToReturn:list[int] = []
+    last:int = stamps[0] if previous is None else previous
+    for s in stamps:
+        last = last + ((s - last + (TICKS_PERIOD >> 1)) % TICKS_PERIOD) - (TICKS_PERIOD >> 1)
+        ToReturn.append(last)
+    return ToReturn
+
+def parse(text:str) -> list[Profile]:
+    """Every profile dump in text (a profile file, or a console log with other output around the dumps)."""
+    ToReturn:list[Profile] = []
+    stages:list[str] = None
+    rows:list[list[int]] = []
+    previous:int = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(profiler.HEADER + " "):
+            parts:list[str] = line.split(" ")
+            if int(parts[1]) != profiler.VERSION:
+                raise Exception("Unsupported profile version " + parts[1])
+            stages = parts[2].split(",")
+            rows = []
+            previous = None
+        elif stages is not None and line == profiler.FOOTER:
+            ToReturn.append(Profile(stages, rows))
+            stages = None
+        elif stages is not None:
+            values:list[str] = line.split(",")
+            if len(values) != len(stages) + 1:
+                continue # console noise in the middle of a dump
+            row:list[int] = unwrap([int(v) for v in values], previous)
+            previous = row[-1]
+            rows.append(row)
+    return ToReturn
+
+def trace(p:Profile) -> dict:
+    """The profile as Chrome trace event JSON (an object with traceEvents), times relative to the first cycle."""
+    origin:int = p.rows[0][0]
+    events:list[dict] = [
+        {"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "Scout flight loop"}},
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "cycle"}},
+    ]
+    periods:list[int] = p.periods()
+    known:list[int] = sorted([x for x in periods if x is not None])
+    median:int = known[len(known) // 2] if len(known) > 0 else None
+    for i, r in enumerate(p.rows):
+        events.append({"name": "cycle", "cat": "cycle", "ph": "X", "pid": 1, "tid": 1, "ts": r[0] - origin, "dur": r[-1] - r[0], "args": {"cycle": i}})
+        for k, name in enumerate(p.stages):
+            events.append({"name": name, "cat": "stage", "ph": "X", "pid": 1, "tid": 1, "ts": r[k] - origin, "dur": r[k + 1] - r[k], "args": {"cycle": i}})
+        if i < len(periods) and periods[i] is not None:
+            events.append({"name": "period_us", "ph": "C", "pid": 1, "ts": r[0] - origin, "args": {"period_us": periods[i]}})
+            events.append({"name": "jitter_us", "ph": "C", "pid": 1, "ts": r[0] - origin, "args": {"jitter_us": periods[i] - median}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def request(port:str, timeout_s:float = 10.0) -> str:
+    """Asks Scout (in standby) for its profile over USB serial, and returns everything it printed until the dump ended."""
+    try:
+        import serial
+    except ImportError:
+        raise Exception("Reading over USB serial needs pyserial (pip install pyserial)")
+    import time
+    lines:list[str] = []
+    with serial.Serial(port, 115200, timeout = 0.5) as s:
+        s.reset_input_buffer()
+        s.write(b"p")
+        ends:float = time.monotonic() + timeout_s
+        while time.monotonic() < ends:
+            line:str = s.readline().decode("ascii", "replace")
+            lines.append(line)
+            if line.strip() == profiler.FOOTER:
+                return "".join(lines)
+    raise Exception("No profile received from " + port + " within " + str(timeout_s) + " s. Is Scout in standby?")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.looptrace", description = "Summarize a Scout flight loop profile and convert it to a Chrome/Perfetto trace.")
+    parser.add_argument("path", nargs = "?", default = None, help = "a profile file copied off the Pico, or a console log containing a profile dump")
+    parser.add_argument("--port", default = None, help = "request the profile over USB serial instead, e.g. /dev/ttyACM0 or COM3")
+    parser.add_argument("--trace", default = None, metavar = "JSON", help = "write the (last) profile as a Chrome/Perfetto trace to this file")
+    args = parser.parse_args()
+    if (args.path is None) == (args.port is None):
+        parser.error("give either a path or --port")
+
+    if args.port is not None:
+        text:str = request(args.port)
+    else:
+        with open(args.path, "r") as f:
+            text = f.read()
+    profiles:list[Profile] = [p for p in parse(text) if len(p) > 0]
+    if len(profiles) == 0:
+        raise SystemExit("No profile found")
+
+    p:Profile = profiles[-1]
+    print(str(len(p)) + " cycles, " + str(round((p.rows[-1][-1] - p.rows[0][0]) / 1000.0, 1)) + " ms (us): min | mean | p99 | max")
+    for name, lo, mean, p99, hi in p.statistics():
+        print(name + " | " + str(lo) + " | " + str(round(mean, 1)) + " | " + str(p99) + " | " + str(hi))
+    if args.trace is not None:
+        with open(args.trace, "w") as f:
+            json.dump(trace(p), f)
+        print("Trace written to " + args.trace + " (open it at https://ui.perfetto.dev)")
+
+if __name__ == "__main__":
+    main()
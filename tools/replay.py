@@ -0,0 +1,383 @@
+"""
+What-if replay of a recorded flight over many PID gain sets at once.
+Takes the gyro rates, rate setpoints and throttle of every recorded cycle (from a blackbox file) and re-runs main.run()'s control law on them:
+error = setpoint - gyro, the P, I (clamped at +/- i_limit) and D (low pass filtered at d_lpf_hz) terms, the motor mix (mixer.Mixer, including saturation scaling) and the duty cycle line of calculate_duty_cycle().
+All gain sets run together as NumPy arrays (one axis for the gain sets, stepped along the time axis), so tens of thousands of tunings replay in seconds: 20,000 gain sets over an 11.7 s recording (2,932 cycles at 250 hz) take about 4.5 s on the development machine, around 13 million gain-set cycles per second. The time grows linearly with both the number of gain sets and the length of the recording.
+
+The replay is open loop: the recorded gyro trace is what the craft did with the gains it flew with, so the scores describe how each tuning would have driven the motors on that trace (effort, noise, saturation, windup), not how the craft would have responded. Use the simulator for closed-loop what-ifs.
+The default score is effort and noise (saturation, I term windup, motor noise), which always favor lower gains, so the ranking is a shortlist of gain sets to try in the simulator, not a tuning recommendation. Next to it, every gain set's deviation_us says how far its PID output is from the one that was flown (the recorded P + I + D), in us of motor duty. That is not a tracking error: the gains the craft flew with score exactly 0 on it, so it is left out of the default score (pass --deviation-weight to add it).
+
+Usage:
+    python -m tools.replay blackbox --random 20000 --spread 0.5 --top 10
+"""
+
+import argparse
+import ast
+import os
+import sys
+import numpy as np
+
+SRC_DIR:str = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+import blackbox
+import filters
+import mixer
+
+GAIN_NAMES:tuple = ("pid_roll_kp", "pid_roll_ki", "pid_roll_kd", "pid_pitch_kp", "pid_pitch_ki", "pid_pitch_kd", "pid_yaw_kp", "pid_yaw_ki", "pid_yaw_kd")
+DEFAULT_WEIGHTS:dict = {"saturated_fraction": 100.0, "i_clamped_fraction": 100.0, "motor_noise_us": 1.0} # ReplayResult.score()'s: saturation, I term windup and motor noise
+
+def main_settings(path:str = os.path.join(SRC_DIR, "main.py")) -> dict:
+    """The SETTINGS of main.py (module level assignments of constants, or of earlier settings), without running it."""
+    with open(path, "r") as f:
+        tree:ast.Module = ast.parse(f.read(), path)
+    ToReturn:dict = {}
+    for node in tree.body:
+        if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name) and node.value is not None:
+            target, value = node.target.id, node.value
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            target, value = node.targets[0].id, node.value
+        else:
+            continue
+        if isinstance(value, ast.Name) and value.id in ToReturn:
+            ToReturn[target] = ToReturn[value.id]
+            continue
+        try:
+            ToReturn[target] = ast.literal_eval(value)
+        except ValueError:
+            pass # not a plain setting (e.g. a list built from other settings)
+    return ToReturn
+
+def gains_from_settings(settings:dict) -> np.ndarray:
+    """The (3, 3) gains [axis][kp, ki, kd] set in main.py."""
+    return np.array([settings[name] for name in GAIN_NAMES], dtype = np.float64).reshape(3, 3)
+
+
+##### inputs #####
+
+class Flight:
+    """The recorded inputs of a flight (and what the firmware did with them, for validation)."""
+
+    def __init__(self, time_us:np.ndarray, gyro:np.ndarray, setpoint:np.ndarray, throttle:np.ndarray, p:np.ndarray = None, i:np.ndarray = None, d:np.ndarray = None, motors_us:np.ndarray = None) -> None:
+        """
+        :param time_us: (T,) cycle time stamps; a gap of more than two cycles means the craft was in standby in between (the PIDs were reset).
+        :param gyro: (T, 3) roll, pitch and yaw rates (deg/s).
+        :param setpoint: (T, 3) rate setpoints (deg/s), i.e. stick input * max rate.
+        :param throttle: (T,) the adjusted throttle (idle to governor) handed to the mixer.
+        """
+        self.time_us:np.ndarray = np.asarray(time_us, dtype = np.int64)
+        self.gyro:np.ndarray = np.asarray(gyro, dtype = np.float64)
+        self.setpoint:np.ndarray = np.asarray(setpoint, dtype = np.float64)
+        self.throttle:np.ndarray = np.asarray(throttle, dtype = np.float64)
+        self.p:np.ndarray = p
+        self.i:np.ndarray = i
+        self.d:np.ndarray = d
+        self.motors_us:np.ndarray = motors_us
+
+    def __len__(self) -> int:
+        return len(self.time_us)
+
+    def resets(self, cycle_hz:float) -> np.ndarray:
+        """(T,) True where the PIDs start from a reset: the first cycle and after every standby gap."""
+        ToReturn:np.ndarray = np.zeros(len(self), dtype = bool)
+        if len(self) > 0:
+            ToReturn[0] = True
+            gaps:np.ndarray = ((np.diff(self.time_us) & ((1 << 30) - 1)) > 2.0 * 1000000.0 / cycle_hz) # ticks_us wraps at 2^30
+            ToReturn[1:] = gaps
+        return ToReturn
+
+def load_blackbox(path:str) -> Flight:
+    """Reads a blackbox (or blackbox_crash) file into a Flight."""
+    with open(path, "rb") as f:
+        fields, records = blackbox.decode(f.read())
+    if len(records) == 0:
+        raise ValueError(path + " holds no records")
+    data:np.ndarray = np.array(records, dtype = np.float64)
+    col = {name: data[:, k] for k, name in enumerate(fields)}
+    motors:list[str] = [name for name in fields if name.startswith("motor")]
+    stack = lambda prefix: np.column_stack([col[prefix + axis] for axis in ("roll", "pitch", "yaw")])
+    return Flight(data[:, 0].astype(np.int64), np.column_stack([col["gyro_x"], col["gyro_y"], col["gyro_z"]]), stack("setpoint_"), col["throttle"], stack("p_"), stack("i_"), stack("d_"), np.column_stack([col[m] for m in motors]))
+
+
+##### gain sets #####
+
+def random_gains(base:np.ndarray, n:int, spread:float = 0.5, seed:int = 0, include_base:bool = True) -> np.ndarray:
+    """n gain sets (n, 3, 3), every gain scaled independently by a log-uniform factor within [1 / (1 + spread), 1 + spread]. The first one is base itself."""
+    rng = np.random.default_rng(seed)
+    factors:np.ndarray = np.exp(rng.uniform(-np.log1p(spread), np.log1p(spread), size = (n, 3, 3)))
+    ToReturn:np.ndarray = base[None, :, :] * factors
+    if include_base and n > 0:
+        ToReturn[0] = base
+    return ToReturn
+
+
+##### replay #####
+
+class ReplayResult:
+    """Per gain set statistics of a replay. Arrays are indexed by gain set."""
+
+    def __init__(self, gains:np.ndarray, cycles:int) -> None:
+        n:int = len(gains)
+        self.gains:np.ndarray = gains
+        self.cycles:int = cycles
+        self.saturated:np.ndarray = np.zeros(n) # cycles where the mixer had to scale the PID outputs down
+        self.i_clamped:np.ndarray = np.zeros(n) # cycles where any I term was at the limit
+        self.output_sq:np.ndarray = np.zeros((n, 3)) # sum of squared PID outputs per axis
+        self.duty_step:np.ndarray = np.zeros(n) # sum over cycles and motors of |duty change| (us), i.e. how much noise reaches the motors
+        self.duty_sum:np.ndarray = np.zeros(n) # sum of motor duty (us), for the mean
+        self.deviation_sq:np.ndarray = np.zeros(n) # sum over cycles and axes of the squared difference between the PID output and the recorded one
+        self.us_per_output:float = 0.0 # the duty line's slope: us of motor duty per 1.0 of PID output
+        self.traces:dict = {} # gain set index -> {"p", "i", "d", "output", "motors_us"} for the sets asked to be traced
+        self.motors:int = 0
+
+    def metrics(self) -> dict:
+        c:float = float(max(1, self.cycles))
+        return {
+            "saturated_fraction": self.saturated / c,
+            "i_clamped_fraction": self.i_clamped / c,
+            "output_rms_roll": np.sqrt(self.output_sq[:, 0] / c),
+            "output_rms_pitch": np.sqrt(self.output_sq[:, 1] / c),
+            "output_rms_yaw": np.sqrt(self.output_sq[:, 2] / c),
+            "motor_noise_us": self.duty_step / (c * max(1, self.motors)),
+            "mean_duty_us": self.duty_sum / (c * max(1, self.motors)),
+            "deviation_us": np.sqrt(self.deviation_sq / (3.0 * c)) * self.us_per_output,
+        }
+
+    def score(self, weights:dict = None) -> np.ndarray:
+        """A single number per gain set (lower is better): a weighted sum of metrics(). By default, saturation, I term windup and motor noise."""
+        if weights is None:
+            weights = DEFAULT_WEIGHTS
+        m:dict = self.metrics()
+        ToReturn:np.ndarray = np.zeros(len(self.gains))
+        for name, w in weights.items():
+            ToReturn = ToReturn + (w * m[name])
+        return ToReturn
+
+    def ranked(self, weights:dict = None) -> np.ndarray:
+        """Gain set indexes, best score first."""
+        return np.argsort(self.score(weights), kind = "stable")
+
+
+def replay(flight:Flight, gains:np.ndarray, cycle_hz:float = 250.0, i_limit:float = 150.0, d_lpf_hz:float = 0.0, layout:str = "quad-x", saturation_scaling:bool = True, dead_zone:float = 0.03, duty_floor_ns:int = 1000000, duty_ceiling_ns:int = 2000000, trace:list = None, chunk:int = 10000) -> ReplayResult:
+    """
+    Re-runs the control law on a recorded flight for every gain set at once.
+    :param gains: (N, 3, 3) gain sets, [set][axis (roll, pitch, yaw)][kp, ki, kd].
+    :param cycle_hz: the loop rate the flight was recorded at (dt of the I and D terms).
+    :param d_lpf_hz: the cutoff of the D term's low pass the flight was flown with (main.py's dterm_lpf_hz).
+    :param trace: gain set indexes to keep full per-cycle traces of (P, I, D, outputs, motor duty in us).
+    :param chunk: gain sets replayed together. Each chunk runs the whole flight on arrays allocated once, so no time step allocates arrays the size of the chunk.
+    """
+    gains = np.asarray(gains, dtype = np.float64).reshape(-1, 3, 3)
+    m:mixer.Mixer = mixer.Mixer(layout, dead_zone, duty_floor_ns, duty_ceiling_ns, saturation_scaling)
+    result:ReplayResult = ReplayResult(gains, len(flight))
+    result.motors = m.motors
+    result.us_per_output = m._a / 1000.0
+    trace = list(trace) if trace is not None else []
+    for k in trace:
+        result.traces[k] = {"p": np.zeros((len(flight), 3)), "i": np.zeros((len(flight), 3)), "d": np.zeros((len(flight), 3)), "output": np.zeros((len(flight), 3)), "motors_us": np.zeros((len(flight), m.motors))}
+    errors:np.ndarray = flight.setpoint - flight.gyro # (T, 3), the same for every gain set
+    recorded:np.ndarray = (flight.p + flight.i + flight.d) if flight.p is not None else None # (T, 3), the response the craft was flown with
+    resets:np.ndarray = flight.resets(cycle_hz)
+    for first in range(0, len(gains), max(1, chunk)):
+        _replay_chunk(result, first, min(len(gains), first + max(1, chunk)), m, errors, recorded, resets, flight.throttle, cycle_hz, i_limit, d_lpf_hz, saturation_scaling, duty_floor_ns, duty_ceiling_ns, trace)
+    return result
+
+def _replay_chunk(result:ReplayResult, first:int, last:int, m:mixer.Mixer, errors:np.ndarray, recorded:np.ndarray, resets:np.ndarray, throttles:np.ndarray, cycle_hz:float, i_limit:float, d_lpf_hz:float, saturation_scaling:bool, duty_floor_ns:int, duty_ceiling_ns:int, trace:list) -> None:
+    """Replays gain sets first to last - 1 into result. Every array is (axis, gain set) or (motor, gain set), so each row is contiguous, and every operation writes into one of them (out=) rather than allocating a new array every cycle."""
+    n:int = last - first
+    dt:float = 1.0 / cycle_hz
+    gains:np.ndarray = result.gains[first:last]
+    kp:np.ndarray = np.ascontiguousarray(gains[:, :, 0].T) # (3, n)
+    ki_dt:np.ndarray = np.ascontiguousarray((gains[:, :, 1] * dt).T)
+    kd_dt:np.ndarray = np.ascontiguousarray((gains[:, :, 2] / dt).T)
+    d_k:float = filters.pt1_gain(cycle_hz, d_lpf_hz)
+    traced:list = [(k, k - first) for k in trace if first <= k < last]
+
+    # the mix, exactly as mixer.Mixer sets it up
+    motors:int = m.motors
+    roll_f, pitch_f, yaw_f = list(m._roll), list(m._pitch), list(m._yaw)
+    lo, hi, a, b = m._lo, m._hi, m._a, m._b
+
+    # state and scratch, allocated once
+    integral:np.ndarray = np.zeros((3, n))
+    d:np.ndarray = np.zeros((3, n))
+    p:np.ndarray = np.empty((3, n))
+    output:np.ndarray = np.empty((3, n))
+    work:np.ndarray = np.empty((3, n))
+    clamped:np.ndarray = np.empty((3, n), dtype = bool)
+    c:np.ndarray = np.empty((motors, n))
+    duty_us:np.ndarray = np.empty((motors, n))
+    last_duty:np.ndarray = np.empty((motors, n))
+    work_m:np.ndarray = np.empty((motors, n))
+    cmax:np.ndarray = np.empty(n)
+    cmin:np.ndarray = np.empty(n)
+    scale:np.ndarray = np.ones(n)
+    work_n:np.ndarray = np.empty(n)
+    over:np.ndarray = np.empty(n, dtype = bool)
+    under:np.ndarray = np.empty(n, dtype = bool)
+    mask:np.ndarray = np.empty(n, dtype = bool)
+
+    # statistics, per gain set of the chunk
+    saturated:np.ndarray = np.zeros(n)
+    i_clamped:np.ndarray = np.zeros(n)
+    output_sq:np.ndarray = np.zeros((3, n))
+    duty_step:np.ndarray = np.zeros(n)
+    duty_sum:np.ndarray = np.zeros(n)
+    deviation_sq:np.ndarray = np.zeros(n)
+
+    last_error:np.ndarray = np.zeros(3) # the same for every gain set
+    has_last_duty:bool = False
+    for t in range(len(errors)):
+        if resets[t]:
+            integral.fill(0.0)
+            d.fill(0.0)
+            last_error = np.zeros(3)
+            has_last_duty = False
+        e:np.ndarray = errors[t][:, None] # (3, 1)
+        de:np.ndarray = e - last_error[:, None]
+        last_error = errors[t]
+
+        # PID (pid.PIDBank)
+        np.multiply(kp, e, out = p)
+        np.multiply(ki_dt, e, out = work)
+        np.add(integral, work, out = integral)
+        np.clip(integral, -i_limit, i_limit, out = integral)
+        if d_k >= 1.0: # no D term filter
+            np.multiply(kd_dt, de, out = d)
+        else:
+            np.multiply(kd_dt, de, out = work)
+            np.subtract(work, d, out = work)
+            np.multiply(work, d_k, out = work)
+            np.add(d, work, out = d)
+        np.add(p, integral, out = output)
+        np.add(output, d, out = output)
+
+        # mix (mixer._mix): roll * roll factor + pitch * pitch factor + yaw * yaw factor, in that order
+        throttle:float = throttles[t]
+        for i in range(motors):
+            np.multiply(output[0], roll_f[i], out = c[i])
+            np.multiply(output[1], pitch_f[i], out = work_n)
+            np.add(c[i], work_n, out = c[i])
+            np.multiply(output[2], yaw_f[i], out = work_n)
+            np.add(c[i], work_n, out = c[i])
+        if saturation_scaling:
+            scale.fill(1.0)
+            c.max(axis = 0, out = cmax)
+            c.min(axis = 0, out = cmin)
+            np.add(cmax, throttle, out = work_n)
+            np.greater(work_n, hi, out = over)
+            np.greater(cmax, 0.0, out = mask)
+            np.logical_and(over, mask, out = over)
+            np.divide(hi - throttle, cmax, out = scale, where = over)
+            np.add(cmin, throttle, out = work_n)
+            np.less(work_n, lo, out = under)
+            np.less(cmin, 0.0, out = mask)
+            np.logical_and(under, mask, out = under)
+            np.negative(cmin, out = work_n)
+            np.divide(throttle - lo, work_n, out = work_n, where = under)
+            np.minimum(scale, work_n, out = scale, where = under)
+            np.maximum(scale, 0.0, out = scale)
+            np.multiply(c, scale, out = c)
+        np.add(c, throttle, out = c) # each motor's throttle
+        np.multiply(c, a, out = c)
+        np.add(c, b, out = c)
+        np.trunc(c, out = c)
+        np.clip(c, duty_floor_ns, duty_ceiling_ns, out = c)
+        np.divide(c, 1000.0, out = duty_us) # then floored: the same as floor_divide() on these whole numbers of ns, and many times faster
+        np.floor(duty_us, out = duty_us)
+
+        # statistics
+        np.less(scale, 1.0, out = mask)
+        saturated += mask
+        np.abs(integral, out = work)
+        np.greater_equal(work, i_limit, out = clamped)
+        np.logical_or(clamped[0], clamped[1], out = mask)
+        np.logical_or(mask, clamped[2], out = mask)
+        i_clamped += mask
+        np.multiply(output, output, out = work)
+        output_sq += work
+        if recorded is not None:
+            np.subtract(output, recorded[t][:, None], out = work)
+            np.multiply(work, work, out = work)
+            deviation_sq += work[0]
+            deviation_sq += work[1]
+            deviation_sq += work[2]
+        for i in range(motors):
+            duty_sum += duty_us[i]
+        if has_last_duty:
+            np.subtract(duty_us, last_duty, out = work_m)
+            np.abs(work_m, out = work_m)
+            for i in range(motors):
+                duty_step += work_m[i]
+        duty_us, last_duty = last_duty, duty_us
+        has_last_duty = True
+        for k, j in traced:
+            tr:dict = result.traces[k]
+            tr["p"][t] = p[:, j]
+            tr["i"][t] = integral[:, j]
+            tr["d"][t] = d[:, j]
+            tr["output"][t] = output[:, j]
+            tr["motors_us"][t] = last_duty[:, j]
+
+    result.saturated[first:last] = saturated
+    result.i_clamped[first:last] = i_clamped
+    result.output_sq[first:last] = output_sq.T
+    result.duty_step[first:last] = duty_step
+    result.duty_sum[first:last] = duty_sum
+    result.deviation_sq[first:last] = deviation_sq
+
+
+def validate(flight:Flight, gains:np.ndarray, **kwargs) -> dict:
+    """Replays the gains the flight was flown with and returns the largest difference from what the firmware recorded (P, I, D and motor duty)."""
+    r:ReplayResult = replay(flight, np.asarray(gains).reshape(1, 3, 3), trace = [0], **kwargs)
+    tr:dict = r.traces[0]
+    return {
+        "p": float(np.abs(tr["p"] - flight.p).max()),
+        "i": float(np.abs(tr["i"] - flight.i).max()),
+        "d": float(np.abs(tr["d"] - flight.d).max()),
+        "motors_us": float(np.abs(tr["motors_us"] - flight.motors_us).max()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.replay", description = "Replay a recorded flight (blackbox file) with many PID gain sets at once, and rank them.")
+    parser.add_argument("path", help = "a blackbox or blackbox_crash file")
+    parser.add_argument("--random", type = int, default = 10000, metavar = "N", help = "number of gain sets to try, randomly spread around main.py's gains")
+    parser.add_argument("--spread", type = float, default = 0.5, help = "each gain is scaled by up to 1 + spread (or 1 / (1 + spread))")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--top", type = int, default = 10, help = "how many of the best gain sets to print")
+    parser.add_argument("--hz", type = float, default = None, help = "loop rate the flight was recorded at (default: main.py's target_cycle_hz)")
+    parser.add_argument("--deviation-weight", type = float, default = 0.0, metavar = "W", help = "add W times the deviation from the recorded PID output (us) to the score. Off by default, as the gains that were flown always deviate by 0")
+    args = parser.parse_args()
+
+    settings:dict = main_settings()
+    hz:float = args.hz if args.hz is not None else settings["target_cycle_hz"]
+    kwargs:dict = {"cycle_hz": hz, "d_lpf_hz": settings.get("dterm_lpf_hz", 0.0), "layout": settings.get("frame_layout", "quad-x"), "saturation_scaling": settings.get("motor_saturation_scaling", True)}
+    flight:Flight = load_blackbox(args.path)
+    base:np.ndarray = gains_from_settings(settings)
+    print(str(len(flight)) + " recorded cycles @ " + str(hz) + " hz")
+    v:dict = validate(flight, base, **kwargs)
+    print("Replay of main.py's gains vs the recording, largest difference: P " + str(round(v["p"], 6)) + ", I " + str(round(v["i"], 6)) + ", D " + str(round(v["d"], 6)) + ", motors " + str(round(v["motors_us"], 2)) + " us")
+
+    import time
+    gains:np.ndarray = random_gains(base, args.random, args.spread, args.seed)
+    began:float = time.perf_counter()
+    r:ReplayResult = replay(flight, gains, **kwargs)
+    took:float = time.perf_counter() - began
+    print("Replayed " + str(len(gains)) + " gain sets in " + str(round(took, 2)) + " s (" + str(int(len(gains) * len(flight) / took)) + " gain-set cycles per second)")
+
+    m:dict = r.metrics()
+    weights:dict = dict(DEFAULT_WEIGHTS)
+    if args.deviation_weight != 0.0:
+        weights["deviation_us"] = args.deviation_weight
+    score:np.ndarray = r.score(weights)
+    ranked:np.ndarray = r.ranked(weights)
+    print("Ranked by effort and noise (saturation, I term windup, motor noise)" + ((" plus " + str(args.deviation_weight) + " x deviation from the recorded PID output") if args.deviation_weight != 0.0 else "") + ". Open loop: a shortlist to try in the simulator, not a tuning recommendation.")
+    print("rank | set | score | saturated | I clamped | motor noise (us) | deviation (us) | " + " | ".join(GAIN_NAMES))
+    for rank, k in enumerate(ranked[:args.top]):
+        print(str(rank + 1) + " | " + ("main.py" if k == 0 else str(k)) + " | " + str(round(float(score[k]), 4)) + " | " + str(round(100.0 * m["saturated_fraction"][k], 2)) + "% | " + str(round(100.0 * m["i_clamped_fraction"][k], 2)) + "% | " + str(round(float(m["motor_noise_us"][k]), 3)) + " | " + str(round(float(m["deviation_us"][k]), 3)) + " | " + " | ".join(["%.8g" % g for g in gains[k].reshape(-1)]))
+    base_rank:int = int(np.flatnonzero(ranked == 0)[0]) + 1
+    print("main.py's gains rank " + str(base_rank) + " of " + str(len(gains)) + " (score " + str(round(float(score[0]), 4)) + ")")
+
+if __name__ == "__main__":
+    main()
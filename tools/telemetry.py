@@ -0,0 +1,418 @@
+"""
+Memory-mapped readers for Scout's telemetry files.
+- v1 (the `telemetry` file written by toolkit.TelemetryFrame.save()): viewed, without copying, as a NumPy structured array. One 36-byte record per frame, a big endian 4-byte time stamp (ticks, ms) followed by eight little endian float32 values.
+- v2 (written by toolkit.TelemetryWriter, see the format description in toolkit.py): fixed-size blocks, viewed without copying as an array of blocks. Blocks are CRC checked and their varint payloads decoded with vectorized NumPy, many blocks at a time.
+Nothing is read until it is used, so opening a multi-gigabyte log is instant. Chunked iteration releases the pages it has finished with, so a full pass over a log uses constant memory.
+
+Usage:
+    python -m tools.telemetry telemetry
+    python -m tools.telemetry telemetry --start 60000 --end 90000 --csv climb.csv
+    python -m tools.telemetry telemetry2 --section 0
+"""
+
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+
+# one record, as encoded by toolkit.TelemetryFrame (SIZE = 36)
+DTYPE = np.dtype([
+    ("time", ">u4"),
+    ("accel_x", "<f4"),
+    ("accel_y", "<f4"),
+    ("accel_z", "<f4"),
+    ("gyro_x", "<f4"),
+    ("gyro_y", "<f4"),
+    ("gyro_z", "<f4"),
+    ("pitch_angle", "<f4"),
+    ("roll_angle", "<f4"),
+])
+FIELDS:tuple = DTYPE.names[1:] # the float fields
+
+class _Column:
+    """A read-only sequence over one column, that only touches the rows it is asked for (so bisect reads O(log n) records, without converting the whole column)."""
+
+    def __init__(self, records:np.ndarray, name:str) -> None:
+        self.records:np.ndarray = records
+        self.name:str = name
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, i:int) -> int:
+        return int(self.records[i][self.name])
+
+
+class TelemetryLog:
+    """
+    A telemetry file, memory-mapped and viewed as a structured array (records, see DTYPE).
+    A trailing partial record (e.g. from a power cut mid-write) is ignored.
+    Use as a context manager, or call close(), to unmap the file.
+    """
+
+    def __init__(self, path:str) -> None:
+        self.path:str = path
+        self._file = open(path, "rb")
+        size:int = os.fstat(self._file.fileno()).st_size
+        self.count:int = size // DTYPE.itemsize
+        self.trailing_bytes:int = size - (self.count * DTYPE.itemsize)
+        if self.count > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+            self.records:np.ndarray = np.frombuffer(self._mmap, dtype = DTYPE, count = self.count)
+        else:
+            self._mmap = None
+            self.records:np.ndarray = np.zeros(0, dtype = DTYPE)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> "TelemetryLog":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.records = np.zeros(0, dtype = DTYPE)
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass # a caller still holds a view of the records; the mapping is released when that view is
+            self._mmap = None
+        self._file.close()
+
+    ##### time range selection #####
+
+    def index_of(self, time_ms:int, side:str = "left") -> int:
+        """
+        Binary search on the time column: the index of the first record with time >= time_ms (side "left") or > time_ms (side "right").
+        Assumes time never decreases, i.e. one power cycle's log, shorter than the 2^30 ms ticks wraparound.
+        """
+        column:_Column = _Column(self.records, "time")
+        if side == "left":
+            return bisect.bisect_left(column, time_ms)
+        return bisect.bisect_right(column, time_ms)
+
+    def range(self, start_ms:int = None, end_ms:int = None) -> tuple:
+        """(first index, end index) of the records with start_ms <= time <= end_ms. Either bound may be None."""
+        begin:int = 0 if start_ms is None else self.index_of(start_ms, "left")
+        end:int = self.count if end_ms is None else self.index_of(end_ms, "right")
+        return (begin, max(begin, end))
+
+    def select(self, start_ms:int = None, end_ms:int = None) -> np.ndarray:
+        """The records with start_ms <= time <= end_ms (either bound may be None), as a zero-copy view."""
+        begin, end = self.range(start_ms, end_ms)
+        return self.records[begin:end]
+
+    ##### chunked iteration #####
+
+    def chunks(self, chunk_records:int = 1 << 20, start_ms:int = None, end_ms:int = None):
+        """
+        Yields the records (optionally only a time range) as zero-copy views of at most chunk_records each.
+        Pages of a chunk are released once the next chunk is requested, so memory use stays constant however long the log is. Copy anything from a chunk that you want to keep past that point.
+        """
+        first, end = self.range(start_ms, end_ms)
+        for begin in range(first, end, chunk_records):
+            chunk:np.ndarray = self.records[begin:min(end, begin + chunk_records)]
+            yield chunk
+            self._release(begin, len(chunk))
+
+    def _release(self, index:int, count:int) -> None:
+        # tell the OS the pages can be dropped (they are file-backed, so are read again if needed)
+        if self._mmap is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start:int = (index * DTYPE.itemsize) // mmap.PAGESIZE * mmap.PAGESIZE
+        end:int = (index + count) * DTYPE.itemsize
+        if end > start:
+            self._mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    ##### summaries #####
+
+    def summary(self, start_ms:int = None, end_ms:int = None, chunk_records:int = 1 << 20) -> dict:
+        """Count, time span and min/mean/max of every float field, computed one chunk at a time."""
+        return summarize(self.chunks(chunk_records, start_ms, end_ms))
+
+
+##### v2 #####
+
+V2_MAGIC:bytes = b"SCTL"
+V2_BLOCK_MAGIC:bytes = b"SB"
+V2_BLOCK_HEADER_SIZE:int = 16
+TICKS_PERIOD:int = 1 << 30 # ticks_us wraps around at 2^30 on the Pico
+
+def _block_dtype(block_size:int) -> np.dtype:
+    return np.dtype([("magic", "S2"), ("sequence", "<u2"), ("count", "<u2"), ("first_time", "<u4"), ("length", "<u2"), ("crc", "<u4"), ("payload", "u1", (block_size - V2_BLOCK_HEADER_SIZE,))])
+
+def _decode_varints(b:np.ndarray) -> np.ndarray:
+    """Decodes a stream of zigzag varints (uint8 array) into int64, all at once."""
+    ends:np.ndarray = np.flatnonzero(b < 0x80)
+    if len(ends) == 0:
+        return np.zeros(0, dtype = np.int64)
+    starts:np.ndarray = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths:np.ndarray = ends - starts + 1
+    u:np.ndarray = np.zeros(len(ends), dtype = np.int64)
+    for k in range(int(lengths.max())):
+        m:np.ndarray = lengths > k
+        u[m] |= (b[starts[m] + k].astype(np.int64) & 0x7F) << (7 * k)
+    return (u >> 1) ^ -(u & 1)
+
+
+class Section:
+    """One recording (power cycle) in a v2 file: a header block followed by data blocks."""
+
+    def __init__(self, log:"TelemetryLogV2", header_index:int, end_index:int) -> None:
+        self.log:"TelemetryLogV2" = log
+        bs:int = log.block_size
+        raw:bytes = bytes(log._mmap[header_index * bs:(header_index + 1) * bs])
+        version, block_size, header_length, crc = struct.unpack_from("<BHHI", raw, 4)
+        content:bytes = raw[13:header_length]
+        if version != 2 or block_size != bs or (zlib.crc32(content) & 0xFFFFFFFF) != crc:
+            raise ValueError("Corrupt or unsupported telemetry header in block " + str(header_index))
+        self.loop_hz, n = struct.unpack_from("<fB", content, 0)
+        self.fields:list[str] = []
+        self.units:list[str] = []
+        scales:list[float] = []
+        modes:list[int] = []
+        pos:int = 5
+        for i in range(n):
+            mode, scale = struct.unpack_from("<Bf", content, pos)
+            pos = pos + 5
+            texts:list[str] = []
+            for t in range(2):
+                length:int = content[pos]
+                texts.append(content[pos + 1:pos + 1 + length].decode())
+                pos = pos + 1 + length
+            self.fields.append(texts[0])
+            self.units.append(texts[1])
+            scales.append(scale)
+            modes.append(mode)
+        self.scales:np.ndarray = np.array(scales, dtype = np.float64)
+        self.modes:np.ndarray = np.array(modes)
+        self.dtype:np.dtype = np.dtype([("time_us", "<i8")] + [(name, "<f4") for name in self.fields])
+
+        # the data blocks, and their first time stamps unwrapped (ticks_us wraps every ~18 minutes): the timestamp index
+        blocks:np.ndarray = log.blocks[header_index + 1:end_index]
+        self.block_indexes:np.ndarray = header_index + 1 + np.flatnonzero(blocks["magic"] == V2_BLOCK_MAGIC)
+        first:np.ndarray = log.blocks["first_time"][self.block_indexes].astype(np.int64)
+        wraps:np.ndarray = np.concatenate([[0], np.cumsum(np.diff(first) < -(TICKS_PERIOD // 2))]) if len(first) > 0 else np.zeros(0, dtype = np.int64)
+        self.block_times:np.ndarray = first + (wraps * TICKS_PERIOD)
+        self.records:int = int(log.blocks["count"][self.block_indexes].sum())
+
+    def __len__(self) -> int:
+        return self.records
+
+    def chunks(self, chunk_records:int = 1 << 20, start_us:int = None, end_us:int = None):
+        """Yields the decoded records (optionally only start_us <= time_us <= end_us, in unwrapped ticks) as structured arrays of roughly chunk_records each."""
+        if len(self.block_indexes) == 0:
+            return
+        first:int = 0 if start_us is None else max(0, int(np.searchsorted(self.block_times, start_us, "right")) - 1)
+        end:int = len(self.block_indexes) if end_us is None else int(np.searchsorted(self.block_times, end_us, "right"))
+        per_block:float = max(1.0, self.records / len(self.block_indexes))
+        step:int = max(1, int(chunk_records / per_block))
+        for begin in range(first, end, step):
+            stop:int = min(end, begin + step)
+            records:np.ndarray = self._decode(begin, stop)
+            if start_us is not None or end_us is not None:
+                t:np.ndarray = records["time_us"]
+                keep:np.ndarray = np.ones(len(records), dtype = bool)
+                if start_us is not None:
+                    keep &= t >= start_us
+                if end_us is not None:
+                    keep &= t <= end_us
+                records = records[keep]
+            if len(records) > 0:
+                yield records
+            self.log._release(int(self.block_indexes[begin]), int(self.block_indexes[stop - 1]) + 1)
+
+    def read(self, start_us:int = None, end_us:int = None) -> np.ndarray:
+        """Every record (optionally only a time range) decoded into one structured array."""
+        parts:list = list(self.chunks(1 << 62, start_us, end_us))
+        return np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype = self.dtype)
+
+    def _decode(self, begin:int, end:int) -> np.ndarray:
+        """Decodes the section's data blocks begin:end (positions in block_indexes)."""
+        indexes:np.ndarray = self.block_indexes[begin:end]
+        blocks:np.ndarray = self.log.blocks[indexes]
+        times:np.ndarray = self.block_times[begin:end]
+
+        # CRC check, and drop corrupt blocks
+        good:np.ndarray = np.ones(len(blocks), dtype = bool)
+        for i in range(len(blocks)):
+            length:int = int(blocks["length"][i])
+            if length > blocks["payload"].shape[1] or (zlib.crc32(blocks["payload"][i, :length]) & 0xFFFFFFFF) != int(blocks["crc"][i]):
+                good[i] = False
+        if not good.all():
+            self.log.crc_errors = self.log.crc_errors + int((~good).sum())
+            blocks = blocks[good]
+            times = times[good]
+        if len(blocks) == 0:
+            return np.zeros(0, dtype = self.dtype)
+
+        # every block's payload, back to back, as one varint stream
+        lengths:np.ndarray = blocks["length"].astype(np.int64)
+        counts:np.ndarray = blocks["count"].astype(np.int64)
+        payload:np.ndarray = blocks["payload"]
+        stream:np.ndarray = payload[np.arange(payload.shape[1])[None, :] < lengths[:, None]]
+        columns:int = len(self.fields) + 1
+        values:np.ndarray = _decode_varints(stream)
+        if len(values) != int(counts.sum()) * columns:
+            raise ValueError("Telemetry blocks " + str(int(indexes[0])) + "-" + str(int(indexes[-1])) + " do not hold the records their headers say.")
+        values = values.reshape(-1, columns)
+
+        # delta columns: a running sum that restarts at every block (the first record of a block is relative to 0)
+        delta:np.ndarray = np.concatenate([[True], self.modes == 1])
+        sums:np.ndarray = np.cumsum(values[:, delta], axis = 0)
+        block_starts:np.ndarray = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        base:np.ndarray = np.zeros((len(counts), sums.shape[1]), dtype = np.int64)
+        base[1:] = sums[block_starts[1:] - 1]
+        values[:, delta] = sums - np.repeat(base, counts, axis = 0)
+
+        ToReturn:np.ndarray = np.zeros(len(values), dtype = self.dtype)
+        ToReturn["time_us"] = values[:, 0] + np.repeat(times - blocks["first_time"].astype(np.int64), counts) # unwrapped
+        for i, name in enumerate(self.fields):
+            ToReturn[name] = values[:, i + 1] / self.scales[i]
+        return ToReturn
+
+    def summary(self, start_us:int = None, end_us:int = None, chunk_records:int = 1 << 20) -> dict:
+        return summarize(self.chunks(chunk_records, start_us, end_us))
+
+
+class TelemetryLogV2:
+    """
+    A v2 telemetry file, memory-mapped and viewed as an array of fixed-size blocks. Every recording (power cycle) in it is a Section.
+    Use as a context manager, or call close(), to unmap the file.
+    """
+
+    def __init__(self, path:str) -> None:
+        self.path:str = path
+        self._file = open(path, "rb")
+        size:int = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        if self._mmap[0:4] != V2_MAGIC:
+            raise ValueError(path + " is not a v2 telemetry file")
+        self.block_size:int = struct.unpack_from("<H", self._mmap, 5)[0]
+        self.blocks:np.ndarray = np.frombuffer(self._mmap, dtype = _block_dtype(self.block_size), count = size // self.block_size)
+        self.trailing_bytes:int = size - (len(self.blocks) * self.block_size)
+        self.crc_errors:int = 0 # corrupt blocks skipped so far
+        headers:list[int] = [int(i) for i in np.flatnonzero(self.blocks["magic"] == V2_MAGIC[0:2])]
+        self.sections:list[Section] = [Section(self, h, headers[k + 1] if k + 1 < len(headers) else len(self.blocks)) for k, h in enumerate(headers)]
+
+    def __len__(self) -> int:
+        return sum([len(s) for s in self.sections])
+
+    def __enter__(self) -> "TelemetryLogV2":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.sections = []
+        self.blocks = np.zeros(0, dtype = _block_dtype(self.block_size))
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def chunks(self, chunk_records:int = 1 << 20, start_us:int = None, end_us:int = None):
+        """Every section's records, one section after another (see Section.chunks)."""
+        for section in self.sections:
+            for chunk in section.chunks(chunk_records, start_us, end_us):
+                yield chunk
+
+    def summary(self, start_us:int = None, end_us:int = None, chunk_records:int = 1 << 20) -> dict:
+        return summarize(self.chunks(chunk_records, start_us, end_us))
+
+    def _release(self, begin:int, end:int) -> None:
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start:int = (begin * self.block_size) // mmap.PAGESIZE * mmap.PAGESIZE
+        stop:int = end * self.block_size
+        if stop > start:
+            self._mmap.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+
+def open_log(path:str):
+    """Opens a telemetry file of either version: TelemetryLogV2 if it starts with the v2 header, otherwise (legacy v1) TelemetryLog."""
+    with open(path, "rb") as f:
+        magic:bytes = f.read(4)
+    if magic == V2_MAGIC:
+        return TelemetryLogV2(path)
+    return TelemetryLog(path)
+
+
+def summarize(chunks) -> dict:
+    """Count, time span and min/mean/max of every field, from chunks of records (the first field is the time)."""
+    count:int = 0
+    first_time:int = None
+    last_time:int = None
+    names:tuple = None
+    mins:dict = {}
+    maxs:dict = {}
+    sums:dict = {}
+    for chunk in chunks:
+        if names is None:
+            names = chunk.dtype.names
+            first_time = int(chunk[names[0]][0])
+        last_time = int(chunk[names[0]][-1])
+        count = count + len(chunk)
+        for name in names[1:]:
+            col:np.ndarray = chunk[name]
+            lo:float = float(col.min())
+            hi:float = float(col.max())
+            mins[name] = lo if name not in mins else min(mins[name], lo)
+            maxs[name] = hi if name not in maxs else max(maxs[name], hi)
+            sums[name] = sums.get(name, 0.0) + float(col.sum(dtype = np.float64))
+    fields:dict = {}
+    if count > 0:
+        for name in names[1:]:
+            fields[name] = {"min": mins[name], "mean": sums[name] / count, "max": maxs[name]}
+    return {"records": count, "time": None if names is None else names[0], "first_time": first_time, "last_time": last_time, "fields": fields}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m tools.telemetry", description = "Summarize or export a Scout telemetry file (v1 or v2) without loading it into memory.")
+    parser.add_argument("path", help = "the telemetry file copied off the Pico")
+    parser.add_argument("--start", type = int, default = None, help = "first time stamp to include (v1: ms ticks, v2: unwrapped us ticks)")
+    parser.add_argument("--end", type = int, default = None, help = "last time stamp to include")
+    parser.add_argument("--section", type = int, default = None, help = "v2 only: just this recording (0 = the first power cycle in the file)")
+    parser.add_argument("--csv", default = None, metavar = "OUT", help = "write the selected records to a CSV file")
+    parser.add_argument("--chunk", type = int, default = 1 << 20, help = "records per chunk")
+    args = parser.parse_args()
+
+    with open_log(args.path) as log:
+        source = log
+        if isinstance(log, TelemetryLogV2):
+            print("v2 telemetry, " + str(len(log.sections)) + " recording(s), " + str(log.block_size) + " byte blocks")
+            for i, section in enumerate(log.sections):
+                print("  recording " + str(i) + ": " + str(len(section)) + " records @ " + str(round(section.loop_hz, 1)) + " hz, fields: " + ", ".join([f + " (" + u + ")" for f, u in zip(section.fields, section.units)]))
+            if args.section is not None:
+                source = log.sections[args.section]
+        else:
+            print("v1 telemetry")
+        if args.csv is not None:
+            with open(args.csv, "w") as f:
+                header_written:bool = False
+                for chunk in source.chunks(args.chunk, args.start, args.end):
+                    if not header_written:
+                        f.write(",".join(chunk.dtype.names) + "\n")
+                        header_written = True
+                    np.savetxt(f, np.column_stack([chunk[name].astype(np.float64) for name in chunk.dtype.names]), fmt = ["%d"] + (["%.7g"] * (len(chunk.dtype.names) - 1)), delimiter = ",")
+        s:dict = source.summary(args.start, args.end, args.chunk)
+        print(str(s["records"]) + " records" + ("" if s["records"] == 0 else ", " + s["time"] + " " + str(s["first_time"]) + " to " + str(s["last_time"])))
+        if log.trailing_bytes > 0:
+            print("(ignored a partial record of " + str(log.trailing_bytes) + " bytes at the end of the file)")
+        if getattr(log, "crc_errors", 0) > 0:
+            print("(skipped " + str(log.crc_errors) + " corrupt blocks)")
+        for name, f in s["fields"].items():
+            print(name + ": min " + str(round(f["min"], 4)) + ", mean " + str(round(f["mean"], 4)) + ", max " + str(round(f["max"], 4)))
+
+if __name__ == "__main__":
+    main()